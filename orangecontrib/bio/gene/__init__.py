@@ -3,6 +3,8 @@ import sys
 import os
 import time
 
+import numpy
+
 from ..utils import serverfiles
 
 from .. import taxonomy as obiTaxonomy
@@ -12,6 +14,8 @@ from .. import dicty as obiDicty
 from .. import biomart as obiBioMart
 
 from . import homology
+from .alias_index import AliasIndex
+from .info_store import GeneInfoStore
 
 #python3
 try:
@@ -73,6 +77,15 @@ class GeneInfo(object):
     def __str__(self):
         return repr(self)
 
+    @classmethod
+    def from_values(cls, values):
+        """ Construct the object from a sequence of (parsed) tag values
+        """
+        info = cls.__new__(cls)
+        for attr, value in zip(cls.__slots__, values):
+            setattr(info, attr, value)
+        return info
+
 class GeneHistory(object):
     NCBI_GENE_HISTORY_TAGS = ("tax_id", "gene_id", "discontinued_gene_id", "discontinued_symbol", "discontinue_date")
     __slots__ = NCBI_GENE_HISTORY_TAGS
@@ -81,7 +94,7 @@ class GeneHistory(object):
             setattr(self, attr, value)
 
 
-class NCBIGeneInfo(dict):
+class NCBIGeneInfo(object):
     TAX_MAP = {
             "2104": "272634",  # Mycoplasma pneumoniae
             "4530": "39947",  # Oryza sativa
@@ -94,27 +107,38 @@ class NCBIGeneInfo(dict):
         Arguments::
                 - *organism*    Organism id
 
+        The gene info is kept in a memory mapped :class:`GeneInfoStore`
+        (built from the gene_info file on first use) and the entries are
+        parsed only when accessed. The gene matcher is initialized on
+        first use.
+
         Example::
             >>> info = NCBIGeneInfo("Homo sapiens")
         """
         
         self.taxid = self.organism_name_search(organism)
 
-
         fname = serverfiles.localpath_download("NCBI_geneinfo", "gene_info.%s.db" % self.taxid)
-        file = open(fname, "rt")
-        self.update(dict([(line.split("\t", 3)[1], line) for line in file.read().splitlines() if line.strip() and not line.startswith("#")]))
+        self.store = GeneInfoStore.open(fname)
+        self._genematcher = genematcher
+        self._matcher = None
 
-        self.matcher = genematcher
-        if self.matcher == None:
-            if self.taxid == '352472':
-                self.matcher = matcher([GMNCBI(self.taxid), GMDicty(), [GMNCBI(self.taxid), GMDicty()]])
-            else:
-                self.matcher = matcher([GMNCBI(self.taxid)])
+    @property
+    def matcher(self):
+        """ The gene matcher with gene ids as targets.
+        """
+        if self._matcher is None:
+            matcher_ = self._genematcher
+            if matcher_ == None:
+                if self.taxid == '352472':
+                    matcher_ = matcher([GMNCBI(self.taxid), GMDicty(), [GMNCBI(self.taxid), GMDicty()]])
+                else:
+                    matcher_ = matcher([GMNCBI(self.taxid)])
+            #if this is done with a gene matcher, pool target names
+            matcher_.set_targets(self.keys())
+            self._matcher = matcher_
+        return self._matcher
 
-        #if this is done with a gene matcher, pool target names
-        self.matcher.set_targets(self.keys())
-        
     def history(self):
         if getattr(self, "_history", None) is None:
             fname = serverfiles.localpath_download("NCBI_geneinfo", "gene_history.%s.db" % self.taxid)
@@ -152,13 +176,35 @@ class NCBIGeneInfo(dict):
         return cls.TAX_MAP.get(taxid, taxid)
 
     @classmethod    
-    def load(cls, file):
+    def load(cls, file, genematcher=None):
         """ A class method that loads gene info from file
         """
-        if type(file) in [str, unicode]:
-            file = open(file, "rb")
-        return cls((line.split("\t", 3)[1], line) for line in file.read().splitlines() if line.strip() and not line.startswith("#"))
-        
+        info = cls.__new__(cls)
+        info.taxid = None
+        info.store = GeneInfoStore.open(file)
+        info._genematcher = genematcher
+        info._matcher = None
+        return info
+
+    def _rows(self, names):
+        # Rows of genes with `names` (gene ids, unique symbols or names
+        # uniquely matched by the gene matcher), -1 if not found
+        names = list(names)
+        rows = self.store.find_ids(names)
+        missing = numpy.flatnonzero(rows < 0)
+        if len(missing):
+            rows[missing] = self.store.find_symbols(
+                [names[i] for i in missing])
+            missing = missing[rows[missing] < 0]
+        if len(missing):
+            # the matcher's targets are the gene ids in row order
+            rows[missing], _ = self.matcher.umatch_many(
+                [names[i] for i in missing])
+        return rows
+
+    def _info(self, row):
+        return GeneInfo.from_values(self.store.row(row))
+
     def get_info(self, gene_id, def_=None):
         """ Search and return the GeneInfo object for gene_id
         """
@@ -166,24 +212,43 @@ class NCBIGeneInfo(dict):
             return self(gene_id)
         except KeyError:
             return def_
-        
+
+    def get_info_many(self, names, def_=None):
+        """ Return a list of GeneInfo objects for names (gene ids,
+        symbols or their aliases), def_ for unknown genes.
+        """
+        rows = self._rows(names)
+        found = numpy.flatnonzero(rows >= 0)
+        infos = [def_] * len(rows)
+        for i, values in zip(found.tolist(), self.store.rows(rows[found])):
+            infos[i] = GeneInfo.from_values(values)
+        return infos
+
     def __call__(self, name):
         """ Search and return the GeneInfo object for gene_id
         """
-        #id = self.translate.get(name, name)
-        #print self.matcher.umatch(name), self.matcher.match(name)
-        id = self.matcher.umatch(name)
-        return self[id]
+        row = self._rows([name])[0]
+        if row < 0:
+            raise KeyError(name)
+        return self._info(row)
 
     def __getitem__(self, key):
-#        return self.get(gene_id, self.matcher[gene_id])
-        return GeneInfo(dict.__getitem__(self, key))
+        row = self.store.find_ids([key])[0]
+        if row < 0:
+            raise KeyError(key)
+        return self._info(row)
 
-    def __setitem__(self, key, value):
-        if type(value) == str:
-            dict.__setitem__(self, key, value)
-        else:
-            dict.__setitem__(self, key, repr(value))
+    def __contains__(self, key):
+        return self.store.find_ids([key])[0] >= 0
+
+    def __len__(self):
+        return len(self.store)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.store.gene_ids()
 
     def get(self, key, def_=None):
         try:
@@ -192,25 +257,18 @@ class NCBIGeneInfo(dict):
             return def_
 
     def itervalues(self):
-        for val in dict.itervalues(self):
-            yield GeneInfo(val)
+        for row in range(len(self)):
+            yield self._info(row)
 
     def iteritems(self):
-        for key, val in zip(self.iterkeys(), self.itervalues()):
+        for key, val in zip(self.keys(), self.itervalues()):
             yield key, val
 
-    if sys.version_info < (3, ):
-        def values(self):
-            return list(self.itervalues())
-
-        def items(self):
-            return list(self.iteritems())
-    else:
-        def values(self):
-            return map(GeneInfo, super().values())
+    def values(self):
+        return list(self.itervalues())
 
-        def items(self):
-            return ((key, GeneInfo(value)) for key, value in super().items())
+    def items(self):
+        return list(self.iteritems())
 
     @staticmethod
     def get_geneinfo_from_ncbi(file, progressCallback=None):
@@ -479,6 +537,29 @@ class Matcher(object):
         """
         notImplemented()
 
+    def match_many(self, genes):
+        """ Match all `genes` with the current targets (see :func:`Match.match_many`). """
+        return self.matcho.match_many(genes)
+
+    def umatch_many(self, genes):
+        """ Uniquely match all `genes` with the current targets (see :func:`Match.umatch_many`). """
+        return self.matcho.umatch_many(genes)
+
+    def _cached_match(self, targets, create):
+        """
+        Return the match object for `targets` created with `create`
+        (reuse the last one if the targets did not change).
+        """
+        targets = tuple(targets)
+        last = getattr(self, "_last_match", None)
+        if last is not None and last[0] == targets:
+            match = last[1]
+        else:
+            match = create(list(targets))
+            self._last_match = (targets, match)
+        self.matcho = match #backward compatibility - default match object
+        return match
+
 def buffer_path():
     """ Returns buffer path from Orange's setting folder if not 
     defined differently (in gene_matcher_path). """
@@ -548,21 +629,27 @@ class MatcherAliases(Matcher):
             gene = gene.lower()
         return self.mdict[gene]
 
+    def ids_many(self, genes):
+        """ Return a list of ids of sets of aliases for each of `genes`. """
+        get = self.mdict.get
+        if self.ignore_case:
+            genes = [gene.lower() for gene in genes]
+        return [list(get(gene, ())) for gene in genes]
+
     def set_targets(self, targets):
         """
         A reverse dictionary is made according to each target's membership
         in the sets of aliases.
         """
+        return self._cached_match(targets, self._create_match)
+
+    def _create_match(self, targets):
         d = defaultdict(list)
         #d = id: [ targets ], where id is index of the set of aliases
-        for target in targets:
-            ids = self.to_ids(target)
-            if ids != None:
-                for id in ids:
-                    d[id].append(target)
-        mo = MatchAliases(d, self)
-        self.matcho = mo #backward compatibility - default match object
-        return mo
+        for target, ids in zip(targets, self.ids_many(targets)):
+            for id in ids:
+                d[id].append(target)
+        return MatchAliases(d, self, targets)
 
     #this two functions are solely for backward compatibility
     def match(self, gene):
@@ -571,17 +658,82 @@ class MatcherAliases(Matcher):
         return self.matcho.explain(gene)
 
 class Match(object):
+    """
+    Matches genes to the target genes.
+
+    :param list targets: The target genes.
+
+    """
+    def __init__(self, targets):
+        self.targets = targets
+        self._target_index = None
+        self._cache = {}
+
+    @property
+    def target_index(self):
+        """ A dict mapping target genes to their (first) indices. """
+        if self._target_index is None:
+            self._target_index = {}
+            for i, target in enumerate(self.targets):
+                self._target_index.setdefault(target, i)
+        return self._target_index
 
     def umatch(self, gene):
         """Returns an unique (only one matching target) target or None"""
         mat = self.match(gene)
         return mat[0] if len(mat) == 1 else None
+
+    def match_indices(self, genes):
+        """
+        Return a list of (sorted) tuples of indices of matching targets
+        for each of `genes`. The results are cached.
+        """
+        cache = self._cache
+        missing = [gene for gene in dict.fromkeys(genes) if gene not in cache]
+        if missing:
+            cache.update(zip(missing, self._match_indices(missing)))
+        return [cache[gene] for gene in genes]
+
+    def _match_indices(self, genes):
+        index = self.target_index
+        return [tuple(sorted(set(index[t] for t in self.match(gene))))
+                for gene in genes]
+
+    def match_many(self, genes):
+        """
+        Match all `genes` and return the indices of the matching targets as
+        a CSR pair of arrays (`indptr`, `indices`); the matches of
+        ``genes[i]`` are ``indices[indptr[i]:indptr[i + 1]]``.
+        """
+        matches = self.match_indices(list(genes))
+        indptr = numpy.zeros(len(matches) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(m) for m in matches], out=indptr[1:])
+        indices = numpy.fromiter((i for m in matches for i in m),
+                                 dtype=numpy.int64, count=indptr[-1])
+        return indptr, indices
+
+    def umatch_many(self, genes):
+        """
+        Uniquely match all `genes`. Return a tuple of an array of target
+        indices (-1 where a gene has no or multiple matches) and a boolean
+        array marking the genes with multiple (ambiguous) matches.
+        """
+        indptr, indices = self.match_many(genes)
+        counts = numpy.diff(indptr)
+        unique = counts == 1
+        result = numpy.full(len(counts), -1, dtype=numpy.int64)
+        result[unique] = indices[indptr[:-1][unique]]
+        return result, counts > 1
  
 class MatchAliases(Match):
 
-    def __init__(self, to_targets, parent):
+    def __init__(self, to_targets, parent, targets=None):
+        if targets is None:
+            targets = sorted(set(t for ts in to_targets.values() for t in ts))
+        Match.__init__(self, targets)
         self.to_targets = to_targets
         self.parent = parent
+        self._id_targets = None
 
     def match(self, gene):
         """
@@ -591,9 +743,21 @@ class MatchAliases(Match):
         """
         inputgeneids = self.parent.to_ids(gene)
         #return target genes with same ids
-        return list(set( \
-            reduce(lambda x,y: x+y, 
-                [ self.to_targets[igid] for igid in inputgeneids ], [])))
+        return list(set(target for igid in inputgeneids
+                        for target in self.to_targets.get(igid, ())))
+
+    def _match_indices(self, genes):
+        if self._id_targets is None:
+            index = self.target_index
+            self._id_targets = dict(
+                (id, tuple(sorted(set(index[t] for t in targets))))
+                for id, targets in self.to_targets.items())
+        id_targets = self._id_targets
+        empty = ()
+        return [id_targets.get(ids[0], empty) if len(ids) == 1 else
+                tuple(sorted(set(i for id in ids
+                                 for i in id_targets.get(id, empty))))
+                for ids in self.parent.ids_many(genes)]
 
     def explain(self, gene):
         inputgeneids = self.parent.to_ids(gene)
@@ -606,6 +770,10 @@ class MatcherAliasesPickled(MatcherAliases):
     "create_aliases_version" and "create_aliases". Those are crucial for
     pickling of gene aliases to work.
 
+    The aliases are matched with an :class:`~.alias_index.AliasIndex`
+    which is saved to the buffer path (for each source version) and
+    memory mapped when loaded, so it is shared among processes.
+
     Loading of gene aliases is done lazily: they are loaded when they are
     needed. Loading of aliases for components of joined matchers is often 
     unnecessary and is therefore avoided. 
@@ -616,7 +784,7 @@ class MatcherAliasesPickled(MatcherAliases):
 
     def get_aliases(self):
         if not self.saved_aliases: #loads aliases if not loaded
-            self.aliases = self.load_aliases()
+            self.aliases = self.alias_index.alias_groups()
         #print "size of aliases ", len(self.saved_aliases)
         return self.saved_aliases
 
@@ -633,6 +801,20 @@ class MatcherAliasesPickled(MatcherAliases):
 
     mdict = property(get_mdict, set_mdict)
 
+    @property
+    def alias_index(self):
+        """ The :class:`~.alias_index.AliasIndex` (loaded if needed). """
+        if self._alias_index is None:
+            self._alias_index = self.load_alias_index()
+        return self._alias_index
+
+    def to_ids(self, gene):
+        return self.alias_index.lookup(gene)
+
+    def ids_many(self, genes):
+        index = self.alias_index
+        return index.groups_many(index.find(genes))
+
     def set_targets(self, targets):
         return MatcherAliases.set_targets(self, targets)
 
@@ -661,9 +843,34 @@ class MatcherAliasesPickled(MatcherAliases):
             #if either file version of version is None, do not pickle
             return self.create_aliases()
 
+    def load_alias_index(self):
+        """
+        Load the alias index from the buffer path or build (and save) it
+        if it does not exist for the current source version.
+        """
+        fn = self.filename()
+        ver = self.create_aliases_version()
+        if fn is None or isinstance(fn, tuple) or ver is None:
+            return AliasIndex.from_groups(self.load_aliases(),
+                                          self.ignore_case)
+        # matchers with different case settings use separate indices
+        suffix = ".index" if self.ignore_case else ".case.index"
+        path = os.path.join(buffer_path(), fn + suffix)
+        index = AliasIndex.load(path, ver, self.ignore_case)
+        if index is None:
+            index = AliasIndex.from_groups(self.load_aliases(),
+                                           self.ignore_case)
+            try:
+                index.save(path, ver)
+            except (IOError, OSError):
+                return index
+            index = AliasIndex.load(path, ver, self.ignore_case)
+        return index
+
     def __init__(self, ignore_case=True):
         self.aliases = []
         self.mdict = {}
+        self._alias_index = None
         self.ignore_case = ignore_case
         self.filename() # test if valid filename can be built
 
@@ -768,10 +975,7 @@ class MatcherAliasesNCBI(MatcherAliasesPickled):
 
     def create_aliases(self):
         ncbi = NCBIGeneInfo(self.organism, genematcher=GMDirect())
-        out = []
-        for k in ncbi.keys():
-            out.append(set(filter(None, [k, ncbi[k].symbol, ncbi[k].locus_tag] + [ s for s in ncbi[k].synonyms ] )))
-        return out
+        return ncbi.store.alias_groups()
 
     def filename(self):
         return "ncbi_" + self._organism_name(self.organism)
@@ -894,14 +1098,13 @@ class MatcherSequence(Matcher):
         self.matchers = matchers
 
     def set_targets(self, targets):
+        return self._cached_match(targets, self._create_match)
+
+    def _create_match(self, targets):
         ms = []
-        targets = list(targets) #copy targets as multiple use would
-                                #be problematic if a generator was passed
         for matcher in self.matchers:
             ms.append(matcher.set_targets(targets))
-        om = MatchSequence(ms)
-        self.matcho = om
-        return om
+        return MatchSequence(ms, targets)
 
     #this two functions are solely for backward compatibility
     def match(self, gene):
@@ -912,7 +1115,10 @@ class MatcherSequence(Matcher):
 
 class MatchSequence(Match):
 
-    def __init__(self, ms):
+    def __init__(self, ms, targets=None):
+        if targets is None:
+            targets = ms[0].targets if ms else []
+        Match.__init__(self, targets)
         self.ms = ms
 
     def match(self, gene):
@@ -922,6 +1128,23 @@ class MatchSequence(Match):
                 return m
         return []
 
+    def _match_indices(self, genes):
+        # one pass of each matcher over the still unmatched genes
+        result = [()] * len(genes)
+        remaining = list(range(len(genes)))
+        for match in self.ms:
+            if not remaining:
+                break
+            matches = match.match_indices([genes[i] for i in remaining])
+            unmatched = []
+            for i, m in zip(remaining, matches):
+                if m:
+                    result[i] = m
+                else:
+                    unmatched.append(i)
+            remaining = unmatched
+        return result
+
     def explain(self, gene):
         for match in self.ms:
             m = match.match(gene)
@@ -938,12 +1161,12 @@ class MatcherDirect(Matcher):
         self.ignore_case = ignore_case
 
     def set_targets(self, targets):
-        targets = list(targets) #would be problematic if generator was passed
-                                #as it is used twice
+        return self._cached_match(targets, self._create_match)
+
+    def _create_match(self, targets):
         aliases = [ set([a]) for a in targets]
         self.am = MatcherAliases(aliases, ignore_case=self.ignore_case)
-        self.matcho = self.am.set_targets(targets)
-        return self.matcho
+        return self.am.set_targets(targets)
 
     #this two functions are solely for backward compatibility
     def match(self, gene):
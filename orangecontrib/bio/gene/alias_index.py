@@ -0,0 +1,239 @@
+"""
+A compact (memory mapped) index of gene alias groups.
+
+The index maps aliases to the groups (sets of aliases of the same gene)
+that contain them. It is stored in a :mod:`~orangecontrib.bio.utils.colstore`
+store: the distinct aliases are kept in a single string column ordered by
+a 64 bit hash (so a lookup is a binary search over an integer array), the
+alias to group membership in a CSR (indptr, groups) pair of arrays, and
+the original group members in another string column. Nothing is loaded
+into Python objects until it is looked up.
+
+"""
+from __future__ import absolute_import
+
+import hashlib
+
+import numpy
+
+from orangecontrib.bio.utils import colstore
+
+#: Version of the on disk index format.
+INDEX_VERSION = 1
+
+
+def alias_hashes(keys):
+    """
+    Return a uint64 array of (stable) hashes of the strings in `keys`.
+    """
+    digests = b"".join(hashlib.md5(key.encode("utf-8")).digest()[:8]
+                       for key in keys)
+    return numpy.frombuffer(digests, dtype="<u8").astype(numpy.uint64)
+
+
+class AliasGroups(object):
+    """
+    A read only sequence of alias groups (sets) of an :class:`AliasIndex`
+    (a stand in for a list of sets of aliases).
+    """
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.n_groups
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return set(self.index.group(i % len(self)))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+
+class AliasIndex(object):
+    """
+    An index of alias groups.
+
+    :param aliases: Distinct (lower case if `ignore_case`) aliases ordered
+        by their hashes (a list or a :class:`~.colstore.StringColumn`).
+    :param numpy.ndarray hashes: Sorted :func:`alias_hashes` of `aliases`.
+    :param numpy.ndarray indptr: Group index pointers of each alias (CSR).
+    :param numpy.ndarray groups: Group indices (CSR).
+    :param members: Group members (a flat list or column of strings).
+    :param numpy.ndarray member_indptr: Member index pointers of each
+        group.
+    :param bool ignore_case: Are the aliases matched ignoring case.
+
+    """
+    def __init__(self, aliases, hashes, indptr, groups, members,
+                 member_indptr, ignore_case=True):
+        self.aliases = aliases
+        self.hashes = hashes
+        self.indptr = indptr
+        self.groups = groups
+        self.members = members
+        self.member_indptr = member_indptr
+        self.ignore_case = ignore_case
+
+    @classmethod
+    def from_groups(cls, groups, ignore_case=True):
+        """
+        Build the index from a sequence of alias groups (iterables of
+        strings).
+        """
+        keys = {}
+        members = []
+        member_indptr = [0]
+        for i, group in enumerate(groups):
+            group = sorted(set(group))
+            members.extend(group)
+            member_indptr.append(len(members))
+            for alias in group:
+                key = alias.lower() if ignore_case else alias
+                ids = keys.setdefault(key, [])
+                if not ids or ids[-1] != i:
+                    ids.append(i)
+
+        aliases = list(keys)
+        hashes = alias_hashes(aliases)
+        order = numpy.argsort(hashes, kind="mergesort")
+        aliases = [aliases[i] for i in order]
+        counts = numpy.fromiter((len(keys[a]) for a in aliases),
+                                dtype=numpy.int64, count=len(aliases))
+        indptr = numpy.zeros(len(aliases) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=indptr[1:])
+        group_ids = numpy.fromiter(
+            (i for a in aliases for i in keys[a]), dtype=numpy.int32,
+            count=int(indptr[-1]))
+        return cls(aliases, hashes[order], indptr, group_ids, members,
+                   numpy.array(member_indptr, dtype=numpy.int64),
+                   ignore_case=ignore_case)
+
+    @classmethod
+    def load(cls, path, version, ignore_case=True):
+        """
+        Open the index stored at `path` (for source `version`). Return
+        None if there is no such (valid) index.
+        """
+        store = colstore.Store.open(
+            path, INDEX_VERSION,
+            {"version": version, "ignore_case": ignore_case})
+        if store is None:
+            return None
+        # plain ndarray views of the memory maps are faster to index
+        array = lambda name: numpy.asarray(store.array(name))
+        return cls(store.strings("aliases"), array("hashes"),
+                   array("indptr"), array("groups"),
+                   store.strings("members"), array("member_indptr"),
+                   ignore_case=ignore_case)
+
+    def save(self, path, version):
+        """Save the index to `path` (for source `version`)."""
+        key = {"version": version, "ignore_case": self.ignore_case}
+        with colstore.StoreWriter(path, INDEX_VERSION, key) as writer:
+            writer.add_strings("aliases", list(self.aliases))
+            writer.add_array("hashes", self.hashes)
+            writer.add_array("indptr", self.indptr)
+            writer.add_array("groups", self.groups)
+            writer.add_strings("members", list(self.members))
+            writer.add_array("member_indptr", self.member_indptr)
+
+    @property
+    def n_groups(self):
+        """The number of alias groups."""
+        return len(self.member_indptr) - 1
+
+    def find(self, names):
+        """
+        Return an array of positions of `names` in :obj:`aliases` (-1 for
+        unknown names).
+        """
+        keys = [name.lower() if self.ignore_case else name for name in names]
+        hashes = alias_hashes(keys)
+        positions = numpy.searchsorted(self.hashes, hashes)
+        found = numpy.full(len(keys), -1, dtype=numpy.int64)
+        n = len(self.hashes)
+        candidates = numpy.flatnonzero(positions < n)
+        candidates = candidates[
+            self.hashes[positions[candidates]] == hashes[candidates]]
+        equal = self._equal(positions[candidates],
+                            [keys[i] for i in candidates])
+        found[candidates[equal]] = positions[candidates[equal]]
+        for i in candidates[~equal]:
+            # distinct aliases can share a hash
+            pos = positions[i] + 1
+            while pos < n and self.hashes[pos] == hashes[i]:
+                if self.aliases[pos] == keys[i]:
+                    found[i] = pos
+                    break
+                pos += 1
+        return found
+
+    def _equal(self, positions, keys):
+        # Compare the aliases at `positions` with `keys` (all at once if
+        # the aliases are a string column)
+        if not isinstance(self.aliases, colstore.StringColumn):
+            return numpy.array([self.aliases[p] == k
+                                for p, k in zip(positions, keys)], dtype=bool)
+        encoded = [key.encode("utf-8") for key in keys]
+        lengths = numpy.array([len(e) for e in encoded], dtype=numpy.int64)
+        offsets = self.aliases.offsets
+        starts = numpy.asarray(offsets[positions], dtype=numpy.int64)
+        equal = numpy.asarray(offsets[positions + 1], dtype=numpy.int64) \
+            - 1 - starts == lengths
+        same = numpy.flatnonzero(equal & (lengths > 0))
+        if len(same):
+            # gather the stored bytes of all candidates of equal length
+            ends = numpy.cumsum(lengths[same])
+            gather = numpy.repeat(starts[same] - (ends - lengths[same]),
+                                  lengths[same]) + numpy.arange(ends[-1])
+            stored = numpy.asarray(self.aliases.data)[gather]
+            query = numpy.frombuffer(
+                b"".join(encoded[i] for i in same), dtype=numpy.uint8)
+            mismatch = numpy.add.reduceat(
+                (stored != query).astype(numpy.int64), ends - lengths[same])
+            equal[same[mismatch > 0]] = False
+        return equal
+
+    def groups_at(self, position):
+        """Return the group indices of the alias at `position`."""
+        return self.groups[self.indptr[position]:self.indptr[position + 1]]
+
+    def groups_many(self, positions):
+        """
+        Return a list of lists of group indices of the aliases at
+        `positions` (an empty list for negative positions).
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        valid = positions >= 0
+        starts = numpy.where(valid, self.indptr[positions * valid], 0)
+        lengths = numpy.where(valid, self.indptr[positions * valid + 1], 0) \
+            - starts
+        ends = numpy.cumsum(lengths)
+        gather = numpy.repeat(starts - (ends - lengths), lengths) + \
+            numpy.arange(ends[-1] if len(ends) else 0)
+        flat = self.groups[gather].tolist()
+        bounds = numpy.concatenate([[0], ends]).tolist()
+        return [flat[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def lookup(self, name):
+        """Return a list of indices of the groups containing `name`."""
+        position = self.find([name])[0]
+        if position < 0:
+            return []
+        return self.groups_at(position).tolist()
+
+    def group(self, i):
+        """Return a list of the aliases in group `i`."""
+        start, end = self.member_indptr[i], self.member_indptr[i + 1]
+        return [self.members[j] for j in range(start, end)]
+
+    def alias_groups(self):
+        """Return all the groups as an :class:`AliasGroups` sequence."""
+        return AliasGroups(self)
@@ -0,0 +1,287 @@
+"""
+A columnar (memory mapped) store of an NCBI gene_info file.
+
+Each gene_info column is kept in a :mod:`~orangecontrib.bio.utils.colstore`
+string column (the multi valued columns, e.g. synonyms, flattened with an
+additional array of row offsets). Gene ids and (unique) symbols are
+indexed with open addressing hash tables, so looking up a gene does not
+require loading the ids or symbols of all genes into Python objects.
+
+"""
+from __future__ import absolute_import
+
+import io
+
+import numpy
+
+from orangecontrib.bio.utils import colstore
+from .alias_index import alias_hashes
+
+#: Version of the on disk store format.
+STORE_VERSION = 1
+
+#: gene_info columns.
+TAGS = ("tax_id", "gene_id", "symbol", "locus_tag", "synonyms",
+        "dbXrefs", "chromosome", "map_location", "description", "type",
+        "symbol_from_nomenclature_authority",
+        "full_name_from_nomenclature_authority",
+        "nomenclature_status", "other_designations", "modification_date")
+
+#: Columns with multiple ('|' separated) values.
+MULTIPLE_CARDINALITY_TAGS = ("synonyms", "dbXrefs", "other_designations")
+
+
+def _hash_slots(hashes):
+    # Build an open addressing (linear probing) hash table of `hashes`.
+    # Return an array of row indices (-1 for empty slots).
+    size = 8
+    while size < 2 * len(hashes):
+        size *= 2
+    mask = size - 1
+    slots = numpy.full(size, -1, dtype=numpy.int32)
+    pending = numpy.arange(len(hashes))
+    pos = (hashes & numpy.uint64(mask)).astype(numpy.int64)
+    while len(pending):
+        free = slots[pos] < 0
+        # the first pending row takes a free slot
+        candidates = numpy.flatnonzero(free)
+        _, first = numpy.unique(pos[candidates], return_index=True)
+        winners = candidates[first]
+        slots[pos[winners]] = pending[winners]
+        rest = numpy.ones(len(pending), dtype=bool)
+        rest[winners] = False
+        pending = pending[rest]
+        pos = numpy.where(free[rest], pos[rest], (pos[rest] + 1) & mask)
+    return slots
+
+
+def _find_slots(slots, column, keys):
+    # Return the rows whose `column` values equal `keys` (-1 if not found)
+    # in a hash table built by _hash_slots
+    mask = len(slots) - 1
+    found = numpy.full(len(keys), -1, dtype=numpy.int64)
+    active = numpy.arange(len(keys))
+    pos = (alias_hashes(keys) & numpy.uint64(mask)).astype(numpy.int64)
+    while len(active):
+        rows = slots[pos]
+        occupied = rows >= 0
+        match = numpy.zeros(len(active), dtype=bool)
+        match[occupied] = [column[r] == keys[i] for r, i in
+                           zip(rows[occupied].tolist(),
+                               active[occupied].tolist())]
+        found[active[match]] = rows[match]
+        probe = occupied & ~match
+        active = active[probe]
+        pos = (pos[probe] + 1) & mask
+    return found
+
+
+def _gather(starts, lengths):
+    # Indices of the concatenated ranges [starts[i], starts[i] + lengths[i])
+    ends = numpy.cumsum(lengths)
+    return numpy.repeat(starts - (ends - lengths), lengths) + \
+        numpy.arange(ends[-1] if len(ends) else 0)
+
+
+def _take_strings(column, indices):
+    # Return a list of the strings at `indices` of a StringColumn
+    if not len(indices):
+        return []
+    starts = column.offsets[indices]
+    # include the terminating zeros
+    lengths = column.offsets[indices + 1] - starts
+    text = column.data[_gather(starts, lengths)].tobytes().decode("utf-8")
+    return text.split("\0")[:-1]
+
+
+def parse_gene_info(filename):
+    """
+    Parse a gene_info file into a dictionary of columns (lists of strings
+    or, for multi valued columns, (flat values, offsets) pairs).
+    """
+    rows = []
+    with io.open(filename, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.strip() and not line.startswith("#"):
+                fields = line.split("\t")
+                fields += ["-"] * (len(TAGS) - len(fields))
+                rows.append(fields)
+
+    columns = {}
+    for i, tag in enumerate(TAGS):
+        values = [fields[i] for fields in rows]
+        if tag in MULTIPLE_CARDINALITY_TAGS:
+            values = [v.split("|") if v != "-" else [] for v in values]
+            offsets = numpy.zeros(len(values) + 1, dtype=numpy.int64)
+            numpy.cumsum([len(v) for v in values], out=offsets[1:])
+            values = ([s for v in values for s in v], offsets)
+        columns[tag] = values
+    return columns
+
+
+class GeneInfoStore(object):
+    """
+    Gene information (rows of a gene_info file) in a columnar store.
+
+    :param dict columns: A dictionary of string columns (for multi valued
+        tags, pairs of flat values and row offsets).
+    :param numpy.ndarray id_slots: Hash table of the gene ids.
+    :param numpy.ndarray symbol_slots: Hash table of the unique symbols.
+
+    """
+    def __init__(self, columns, id_slots, symbol_slots):
+        self.columns = columns
+        self.id_slots = id_slots
+        self.symbol_slots = symbol_slots
+
+    @classmethod
+    def from_file(cls, filename):
+        """Build an (in memory) store from a gene_info file."""
+        parsed = parse_gene_info(filename)
+        columns = {}
+        for tag, values in parsed.items():
+            if tag in MULTIPLE_CARDINALITY_TAGS:
+                values, offsets = values
+                columns[tag] = (colstore.StringColumn.from_list(values),
+                                offsets)
+            else:
+                columns[tag] = colstore.StringColumn.from_list(values)
+
+        gene_ids = parsed["gene_id"]
+        id_slots = _hash_slots(alias_hashes(gene_ids))
+        symbols = numpy.array(parsed["symbol"], dtype=object)
+        _, first, counts = numpy.unique(
+            symbols, return_index=True, return_counts=True)
+        unique = first[(counts == 1) & (symbols[first] != "-")]
+        symbol_slots = numpy.full(1, -1, dtype=numpy.int32)
+        if len(unique):
+            slots = _hash_slots(alias_hashes(symbols[unique].tolist()))
+            symbol_slots = numpy.where(slots >= 0, unique[slots], -1) \
+                .astype(numpy.int32)
+        return cls(columns, id_slots, symbol_slots)
+
+    @classmethod
+    def load(cls, path, key=None):
+        """
+        Open the store at `path` (for source file `key`). Return None if
+        there is no such (valid) store.
+        """
+        store = colstore.Store.open(path, STORE_VERSION, key)
+        if store is None:
+            return None
+        # plain ndarray views of the memory maps are faster to index
+        array = lambda name: numpy.asarray(store.array(name))
+        strings = lambda name: colstore.StringColumn(
+            array(name + ".data"), array(name + ".offsets"))
+        columns = {}
+        for tag in TAGS:
+            if tag in MULTIPLE_CARDINALITY_TAGS:
+                columns[tag] = (strings(tag), array(tag + ".indptr"))
+            else:
+                columns[tag] = strings(tag)
+        return cls(columns, array("id_slots"), array("symbol_slots"))
+
+    def save(self, path, key=None):
+        """Save the store to `path` (for source file `key`)."""
+        with colstore.StoreWriter(path, STORE_VERSION, key) as writer:
+            for tag in TAGS:
+                if tag in MULTIPLE_CARDINALITY_TAGS:
+                    values, offsets = self.columns[tag]
+                    writer.add_strings(tag, list(values))
+                    writer.add_array(tag + ".indptr", offsets)
+                else:
+                    writer.add_strings(tag, list(self.columns[tag]))
+            writer.add_array("id_slots", self.id_slots)
+            writer.add_array("symbol_slots", self.symbol_slots)
+
+    @classmethod
+    def open(cls, filename):
+        """
+        Return the store of a gene_info file. The store is cached (in
+        `filename` + ".store") and rebuilt if the file changes.
+        """
+        path = filename + ".store"
+        key = colstore.file_key(filename)
+        store = cls.load(path, key)
+        if store is None:
+            store = cls.from_file(filename)
+            try:
+                store.save(path, key)
+            except (IOError, OSError):
+                return store
+            store = cls.load(path, key)
+        return store
+
+    def __len__(self):
+        return len(self.columns["gene_id"])
+
+    def gene_ids(self):
+        """Return a list of all gene ids (in row order)."""
+        return self.columns["gene_id"].tolist()
+
+    def find_ids(self, gene_ids):
+        """Return an array of rows of `gene_ids` (-1 if not found)."""
+        return _find_slots(self.id_slots, self.columns["gene_id"],
+                           list(gene_ids))
+
+    def find_symbols(self, symbols):
+        """
+        Return an array of rows of the genes with `symbols` (-1 if not
+        found or if the symbol is not unique).
+        """
+        return _find_slots(self.symbol_slots, self.columns["symbol"],
+                           list(symbols))
+
+    def value(self, tag, row):
+        """
+        Return the value of `tag` in `row` (None for missing values, a list
+        for multi valued tags).
+        """
+        if tag in MULTIPLE_CARDINALITY_TAGS:
+            values, offsets = self.columns[tag]
+            return [values[i] for i in range(offsets[row], offsets[row + 1])]
+        value = self.columns[tag][row]
+        return None if value == "-" else value
+
+    def row(self, row):
+        """Return a tuple of all (parsed) values in `row`."""
+        return tuple(self.value(tag, row) for tag in TAGS)
+
+    def rows(self, rows):
+        """
+        Return a list of tuples of all (parsed) values in `rows` (read one
+        column at a time).
+        """
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        columns = []
+        for tag in TAGS:
+            if tag in MULTIPLE_CARDINALITY_TAGS:
+                values, indptr = self.columns[tag]
+                starts = indptr[rows]
+                lengths = indptr[rows + 1] - starts
+                flat = _take_strings(values, _gather(starts, lengths))
+                bounds = numpy.concatenate([[0], numpy.cumsum(lengths)])
+                bounds = bounds.tolist()
+                columns.append([flat[a:b] for a, b in
+                                zip(bounds[:-1], bounds[1:])])
+            else:
+                columns.append([None if v == "-" else v for v in
+                                _take_strings(self.columns[tag], rows)])
+        return list(zip(*columns))
+
+    def alias_groups(self):
+        """
+        Return a list of sets of names (gene id, symbol, locus tag and
+        synonyms) of each gene.
+        """
+        ids = self.gene_ids()
+        symbols = self.columns["symbol"].tolist()
+        locus_tags = self.columns["locus_tag"].tolist()
+        synonyms, offsets = self.columns["synonyms"]
+        synonyms = synonyms.tolist()
+        offsets = offsets.tolist()
+        return [set(name for name in [ids[i], symbols[i], locus_tags[i]] +
+                    synonyms[offsets[i]:offsets[i + 1]]
+                    if name and name != "-")
+                for i in range(len(ids))]
@@ -7,12 +7,12 @@ except:
 
 from urllib.request import urlopen
     
-import os, tempfile, sys
+import os, tempfile, sys, shutil
 from collections import defaultdict
 import datetime
 
 from ..utils.serverfiles import localpath_download, listfiles
-from ..utils import serverfiles
+from ..utils import serverfiles, colstore
 
 import six
 
@@ -37,6 +37,8 @@ try:
 except:
     pass  #not yet available in Orange3
 
+from .library import GeneSetLibrary, linkre, parse_gmt, read_gmt
+
 sfdomain = "gene_sets"
 
 def nth(l,n):
@@ -170,10 +172,6 @@ def go_miRNASets(org, ontology=None, enrichment=True, pval=0.05, treshold=0.04):
     gset = GeneSets(gsets)
     return gset
 
-import re
-
-linkre = re.compile("(.*?)\s?(?:\[(https?://[^[^\]]*)\])?$")
-
 def loadGMT(contents, name):
     """
     Eech line consists of tab separated elements. First is
@@ -187,23 +185,14 @@ def loadGMT(contents, name):
     Bladder_sw  Bladder_sw  PLCD4   ANGPTL1 LOC286191   ST0N1   LOC283904   ...
     cerebellum_sw   cerebellum_sw   C19orf43    LOC653464   KI110802    ...
     Cervix_sw   Cervix_sw   LAMA4   GSTM5   SNX19   DKK1    NT5E    ...
-    """
-
-    def hline(s):
-        tabs = [tab.strip() for tab in s.split("\t")]
-        groups = linkre.match(tabs[1]).groups()
-        return GeneSet(id=tabs[0], description=groups[0], link=groups[1],
-                                   hierarchy=("Custom",name), genes=tabs[2:])
-
-    def handleNELines(s, fn):
-        """
-        Run function on nonempty lines of a string.
-        Return a list of results for each line.
-        """
-        lines = (l.strip() for l in s.splitlines())
-        return [fn(l) for l in lines if l]
 
-    return GeneSets(handleNELines(contents, hline))
+    Use :func:`read_gmt` to read large files into a
+    :class:`~.library.GeneSetLibrary`.
+    """
+    return GeneSets([GeneSet(id=id, description=description, link=link,
+                             hierarchy=hierarchy, genes=genes)
+                     for id, _, description, link, hierarchy, _, genes
+                     in parse_gmt(contents.splitlines(), name)])
 
 def getGenesetsStats(genesets):
     num_sets = len(genesets)
@@ -251,12 +240,27 @@ def filename_parse(fn):
 def is_genesets_file(fn):
     return fn.startswith("gs_") and fn.endswith(".pck")
 
+#: Cached directory listings (see :func:`_cached_listing`).
+_listings = {}
+
+def _cached_listing(name, paths, list_fn):
+    """ Return the result of `list_fn()`, cached while the files (or
+    directories) at `paths` do not change. """
+    key = tuple(colstore.file_key(p) for p in paths)
+    cached = _listings.get(name)
+    if cached is None or cached[0] != key:
+        cached = key, list_fn()
+        _listings[name] = cached
+    return list(cached[1])
+
 def list_local():
     """ Returns available gene sets from the local repository:
     a list of (hierarchy, organism, on_local) """
     pth = local_path()
-    gs_files = filter(is_genesets_file, os.listdir(pth))
-    return [ filename_parse(fn) + (True,) for fn in gs_files ]
+    def list_fn():
+        gs_files = filter(is_genesets_file, os.listdir(pth))
+        return [ filename_parse(fn) + (True,) for fn in gs_files ]
+    return _cached_listing(("local", pth), [pth], list_fn)
 
 def remove_local(gene_set):
     """ Removes a given gene set from the local repository. """
@@ -266,6 +270,7 @@ def remove_local(gene_set):
         if setfile.__contains__(gene_set):
             setBgone = os.path.join(pth, setfile)
             os.remove(setBgone) 
+            shutil.rmtree(setBgone + ".lib", ignore_errors=True)
 
 def modification_date(file):
     t = os.path.getmtime(file)
@@ -288,11 +293,14 @@ def list_serverfiles_conn(serverfiles=None):
 
 def list_serverfiles():
     fname = serverfiles.localpath_download(sfdomain, "index.pck")
-    if six.PY3:
-        flist = pickle.load(open(fname, 'rb'), encoding="latin1")
-    else:
-        flist = pickle.load(open(fname, 'rb'))
-    return list_serverfiles_from_flist(flist)
+    def list_fn():
+        if six.PY3:
+            flist = pickle.load(open(fname, 'rb'), encoding="latin1")
+        else:
+            flist = pickle.load(open(fname, 'rb'))
+        return list_serverfiles_from_flist(flist)
+    return _cached_listing(("serverfiles", fname),
+                           [fname, serverfiles.localpath(sfdomain)], list_fn)
 
 def list_all(org=None, local=None):
     """
@@ -400,26 +408,34 @@ def load_serverfiles(hierarchy, organism):
     return load_fn(hierarchy, organism, list_serverfiles, 
         lambda h,o: serverfiles.localpath_download(sfdomain, filename(h, o)))
 
-def load_fn(hierarchy, organism, fnlist, fnget):
+def find_files(hierarchy, organism, fnlist, fnget):
+    """ Return the file names of gene sets in `hierarchy` (or its sub
+    hierarchies) for `organism`. """
     files = list(map(lambda x: x[:2], fnlist()))
     hierd = build_hierarchy_dict(files)
-    out = GeneSets()
     matches = hierd[(hierarchy, organism)]
     if not matches:
         exstr = "No gene sets for " + str(hierarchy) + \
                 " (org " + str(organism) + ")"
         raise NoGenesetsException(exstr)
-    for (h, o) in [ files[i] for i in hierd[(hierarchy, organism)]]:
-        fname = fnget(h, o)
-        if six.PY3:
-            out.update(pickle.load(open(fname, 'rb'), encoding="latin1"))
-        else:
-            out.update(pickle.load(open(fname, 'rb')))
+    return [fnget(h, o) for (h, o) in [files[i] for i in matches]]
+
+def library_fn(hierarchy, organism, fnlist, fnget):
+    """ Return a :class:`~.library.GeneSetLibrary` of the matching gene
+    set files (each file's library is memory mapped). """
+    libraries = [GeneSetLibrary.open(fname) for fname in
+                 find_files(hierarchy, organism, fnlist, fnget)]
+    if len(libraries) == 1:
+        return libraries[0]
+    return GeneSetLibrary.concatenate(libraries)
+
+def load_fn(hierarchy, organism, fnlist, fnget):
+    out = GeneSets()
+    for fname in find_files(hierarchy, organism, fnlist, fnget):
+        out.update(GeneSetLibrary.open(fname).genesets())
     return out
 
-def load(hierarchy, organism):
-    """ First try to load from the local registered folder. If the file
-    is not available, load it from the server files. """
+def _organism_taxid(organism):
     if organism != None:
         try:
             int(organism) #already a taxid
@@ -431,11 +447,28 @@ def load(hierarchy, organism):
                 exstr = "Could not interpret organism " + str(organism) + \
                       ". Possibilities: " + str(organismc) 
                 raise NoGenesetsException(exstr)
+    return strornone(organism)
+
+def load(hierarchy, organism):
+    """ First try to load from the local registered folder. If the file
+    is not available, load it from the server files. """
+    organism = _organism_taxid(organism)
+    try:
+        return load_local(hierarchy, organism)
+    except NoGenesetsException:
+        return load_serverfiles(hierarchy, organism)
 
+def load_library(hierarchy, organism):
+    """ Like :func:`load`, but return a
+    :class:`~.library.GeneSetLibrary` (no :class:`GeneSet` objects are
+    created until its gene sets are requested). """
+    organism = _organism_taxid(organism)
     try:
-        return load_local(hierarchy, strornone(organism))
+        return library_fn(hierarchy, organism, list_local,
+            lambda h,o: os.path.join(local_path(), filename(h, o)))
     except NoGenesetsException:
-        return load_serverfiles(hierarchy, strornone(organism))
+        return library_fn(hierarchy, organism, list_serverfiles,
+            lambda h,o: serverfiles.localpath_download(sfdomain, filename(h, o)))
 
 def collections(*args):
     """
@@ -459,7 +492,7 @@ def collections(*args):
                 result.update(new)
             else:
                 if collection.lower()[-4:] == ".gmt": #format from webpage
-                    result.update(loadGMT(open(collection,"rt").read(), collection))
+                    result.update(read_gmt(collection).genesets())
                 else:
                     raise Exception("collection() accepts files in .gmt format only.")
 
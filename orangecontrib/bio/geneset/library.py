@@ -0,0 +1,336 @@
+"""
+A compact (memory mapped) gene set library.
+
+A library holds gene sets with integer encoded membership: the distinct
+genes are kept in a sorted vocabulary (a string column) and the members
+of the sets in a CSR (indptr, members) pair of gene index arrays. The
+gene set ids, names, descriptions and links are string columns, and the
+hierarchies and organisms categorical columns. The sets are ordered by
+hierarchy, so the sets of one hierarchy are a contiguous range of rows
+and can be read (from a :mod:`~orangecontrib.bio.utils.colstore` store)
+without touching the rest.
+
+"""
+from __future__ import absolute_import
+
+import io
+import re
+import json
+import itertools
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy
+import six
+
+from orangecontrib.bio.utils import colstore
+
+#: Version of the on disk library format.
+LIBRARY_VERSION = 1
+
+#: Gene set string attributes (stored as string columns).
+TEXT_COLUMNS = ("id", "name", "description", "link")
+
+linkre = re.compile(r"(.*?)\s?(?:\[(https?://[^[^\]]*)\])?$")
+
+
+def _encode(value):
+    # A categorical (hierarchy or organism) value as a string
+    return json.dumps(list(value) if isinstance(value, tuple) else value)
+
+
+def _decode(value):
+    value = json.loads(value)
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _take(column, indices):
+    # Return a list of the strings at `indices` of a list or a StringColumn
+    if not isinstance(column, colstore.StringColumn):
+        return [column[i] for i in indices]
+    if not len(indices):
+        return []
+    starts = column.offsets[indices]
+    # include the terminating zeros
+    lengths = column.offsets[indices + 1] - starts
+    ends = numpy.cumsum(lengths)
+    gather = numpy.repeat(starts - (ends - lengths), lengths) + \
+        numpy.arange(ends[-1])
+    return column.data[gather].tobytes().decode("utf-8").split("\0")[:-1]
+
+
+def _has_prefix(hierarchy, prefix):
+    return prefix is None or \
+        (hierarchy is not None and tuple(hierarchy[:len(prefix)]) == prefix)
+
+
+class GeneSetLibrary(object):
+    """
+    A library of gene sets.
+
+    :param genes: The sorted gene vocabulary (a list or a
+        :class:`~.colstore.StringColumn`).
+    :param numpy.ndarray indptr: Member index pointers of each gene set.
+    :param numpy.ndarray members: Gene indices of the members (CSR).
+    :param dict columns: Columns of :obj:`TEXT_COLUMNS` as pairs of a
+        string column and a boolean array marking None values.
+    :param numpy.ndarray hierarchy_codes:
+        Indices of the gene set hierarchies in `hierarchies` (sorted).
+    :param list hierarchies: Hierarchies (tuples).
+    :param numpy.ndarray organism_codes:
+        Indices of the gene set organisms in `organisms`.
+    :param list organisms: Organisms (NCBI taxonomy ids).
+
+    """
+    def __init__(self, genes, indptr, members, columns, hierarchy_codes,
+                 hierarchies, organism_codes, organisms):
+        self.genes = genes
+        self.indptr = indptr
+        self.members = members
+        self.columns = columns
+        self.hierarchy_codes = hierarchy_codes
+        self.hierarchies = hierarchies
+        self.organism_codes = organism_codes
+        self.organisms = organisms
+
+    @classmethod
+    def from_sets(cls, rows):
+        """
+        Build a library from a sequence of ``(id, name, description, link,
+        hierarchy, organism, genes)`` tuples.
+        """
+        rows = list(rows)
+        hierarchies = sorted(set(row[4] for row in rows), key=_encode)
+        hierarchy_index = dict((h, i) for i, h in enumerate(hierarchies))
+        codes = numpy.array([hierarchy_index[row[4]] for row in rows],
+                            dtype=numpy.int32)
+        order = numpy.argsort(codes, kind="mergesort")
+        rows = [rows[i] for i in order]
+
+        lengths = numpy.array([len(row[6]) for row in rows], dtype=numpy.int64)
+        indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=indptr[1:])
+        flat = list(itertools.chain.from_iterable(row[6] for row in rows))
+        genes = sorted(set(flat))
+        index = dict(zip(genes, range(len(genes))))
+        members = numpy.fromiter(six.moves.map(index.__getitem__, flat),
+                                 dtype=numpy.int64, count=len(flat))
+        # members of a set in vocabulary order (and without duplicates)
+        owner = numpy.repeat(numpy.arange(len(rows)), lengths)
+        keys = numpy.sort(owner * max(len(genes), 1) + members)
+        keys = keys[numpy.concatenate([[True], keys[1:] != keys[:-1]])] \
+            if len(keys) else keys
+        owner, members = numpy.divmod(keys, max(len(genes), 1))
+        members = members.astype(numpy.int32)
+        numpy.cumsum(numpy.bincount(owner, minlength=len(rows)),
+                     out=indptr[1:])
+
+        columns = {}
+        for i, name in enumerate(TEXT_COLUMNS):
+            values = [row[i] for row in rows]
+            columns[name] = ([v if v is not None else "" for v in values],
+                             numpy.array([v is None for v in values],
+                                         dtype=bool))
+        organisms = sorted(set(row[5] for row in rows), key=_encode)
+        organism_index = dict((o, i) for i, o in enumerate(organisms))
+        return cls(genes, indptr, members, columns, codes[order],
+                   hierarchies,
+                   numpy.array([organism_index[row[5]] for row in rows],
+                               dtype=numpy.int32),
+                   organisms)
+
+    @classmethod
+    def from_genesets(cls, genesets):
+        """Build a library from :class:`GeneSet` objects."""
+        return cls.from_sets(
+            (gs.id, gs.name, gs.description, gs.link,
+             tuple(gs.hierarchy) if gs.hierarchy is not None else None,
+             gs.organism, gs.genes)
+            for gs in genesets)
+
+    @classmethod
+    def concatenate(cls, libraries):
+        """Join the gene sets of several libraries into a single library."""
+        return cls.from_sets(row for library in libraries
+                             for row in library.iter_sets())
+
+    @classmethod
+    def load(cls, path, key=None):
+        """
+        Open the library at `path` (for source file `key`). Return None if
+        there is no such (valid) library.
+        """
+        store = colstore.Store.open(path, LIBRARY_VERSION, key)
+        if store is None:
+            return None
+        # plain ndarray views of the memory maps are faster to index
+        array = lambda name: numpy.asarray(store.array(name))
+        strings = lambda name: colstore.StringColumn(
+            array(name + ".data"), array(name + ".offsets"))
+        columns = dict((name, (strings(name), array(name + ".none")))
+                       for name in TEXT_COLUMNS)
+        return cls(strings("genes"), array("indptr"), array("members"),
+                   columns, array("hierarchy.codes"),
+                   [_decode(h) for h in strings("hierarchy.vocabulary")],
+                   array("organism.codes"),
+                   [_decode(o) for o in strings("organism.vocabulary")])
+
+    def save(self, path, key=None):
+        """Save the library to `path` (for source file `key`)."""
+        with colstore.StoreWriter(path, LIBRARY_VERSION, key) as writer:
+            writer.add_strings("genes", list(self.genes))
+            writer.add_array("indptr", self.indptr)
+            writer.add_array("members", self.members)
+            for name in TEXT_COLUMNS:
+                values, none = self.columns[name]
+                writer.add_strings(name, list(values))
+                writer.add_array(name + ".none", none)
+            writer.add_codes("hierarchy", self.hierarchy_codes,
+                             [_encode(h) for h in self.hierarchies])
+            writer.add_codes("organism", self.organism_codes,
+                             [_encode(o) for o in self.organisms])
+
+    @classmethod
+    def open(cls, filename):
+        """
+        Return the library of a pickled :class:`GeneSets` file. The library
+        is cached (in `filename` + ".lib") and rebuilt if the file changes.
+        """
+        path = filename + ".lib"
+        key = colstore.file_key(filename)
+        library = cls.load(path, key)
+        if library is None:
+            with open(filename, "rb") as f:
+                if six.PY3:
+                    genesets = pickle.load(f, encoding="latin1")
+                else:
+                    genesets = pickle.load(f)
+            library = cls.from_genesets(genesets)
+            try:
+                library.save(path, key)
+            except (IOError, OSError):
+                return library
+            library = cls.load(path, key)
+        return library
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def rows(self, hierarchy=None):
+        """
+        Return an array of the rows of the gene sets in `hierarchy` (or in
+        its sub hierarchies; all the gene sets if None).
+        """
+        hierarchy = tuple(hierarchy) if hierarchy is not None else None
+        codes = [i for i, h in enumerate(self.hierarchies)
+                 if _has_prefix(h, hierarchy)]
+        # the rows are ordered by hierarchy code
+        bounds = numpy.searchsorted(self.hierarchy_codes,
+                                    [[c, c + 1] for c in codes]) \
+            .reshape(-1, 2)
+        return numpy.concatenate(
+            [numpy.arange(a, b) for a, b in bounds] +
+            [numpy.array([], dtype=numpy.int64)]).astype(numpy.int64)
+
+    def membership(self, hierarchy=None):
+        """
+        Return the ``(rows, indptr, members)`` of the gene sets in
+        `hierarchy`: their rows, and their members (gene vocabulary
+        indices) in CSR form.
+        """
+        rows = self.rows(hierarchy)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=indptr[1:])
+        gather = numpy.repeat(starts - indptr[:-1], lengths) + \
+            numpy.arange(indptr[-1])
+        return rows, indptr, self.members[gather]
+
+    def iter_sets(self, hierarchy=None):
+        """
+        Iterate over ``(id, name, description, link, hierarchy, organism,
+        genes)`` tuples of the gene sets in `hierarchy` (`genes` is a list).
+        """
+        rows, indptr, members = self.membership(hierarchy)
+        # decode only the genes of these sets
+        used, members = numpy.unique(members, return_inverse=True)
+        genes = numpy.array(_take(self.genes, used), dtype=object)
+        members = genes[members].tolist()
+        bounds = indptr.tolist()
+        text = []
+        for name in TEXT_COLUMNS:
+            values, none = self.columns[name]
+            text.append([None if n else v for v, n in
+                         zip(_take(values, rows), none[rows].tolist())])
+        hierarchies = [self.hierarchies[c] for c in
+                       self.hierarchy_codes[rows].tolist()]
+        organisms = [self.organisms[c] for c in
+                     self.organism_codes[rows].tolist()]
+        for i in range(len(rows)):
+            yield (text[0][i], text[1][i], text[2][i], text[3][i],
+                   hierarchies[i], organisms[i],
+                   members[bounds[i]:bounds[i + 1]])
+
+    def genesets(self, hierarchy=None):
+        """
+        Return the gene sets in `hierarchy` (all if None) as
+        :class:`GeneSets`.
+        """
+        from . import GeneSet, GeneSets
+        out = GeneSets()
+        for id, name, description, link, hier, organism, genes in \
+                self.iter_sets(hierarchy):
+            out.add(GeneSet(genes=genes, name=name, id=id,
+                            description=description, link=link,
+                            organism=organism, hierarchy=hier))
+        return out
+
+    def write_gmt(self, filename, hierarchy=None):
+        """
+        Write the gene sets in `hierarchy` to a GMT file (the description
+        column holds the description, or the name, and the link).
+        """
+        with io.open(filename, "w", encoding="utf-8") as f:
+            for id, name, description, link, _, _, genes in \
+                    self.iter_sets(hierarchy):
+                text = description if description is not None else name
+                text = text or ""
+                if link:
+                    text = (text + " [" + link + "]").lstrip()
+                f.write(u"\t".join([id or "", text] + genes) + u"\n")
+
+
+def parse_gmt(lines, name, organism=None):
+    """
+    Parse the lines of a GMT file into ``(id, name, description, link,
+    hierarchy, organism, genes)`` tuples (in the hierarchy
+    ``("Custom", name)``, see :func:`loadGMT`).
+    """
+    hierarchy = ("Custom", name)
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        tabs = [tab.strip() for tab in line.split("\t")]
+        description, link = linkre.match(tabs[1]).groups()
+        yield (tabs[0], None, description, link, hierarchy, organism,
+               tabs[2:])
+
+
+def read_gmt(filename, name=None, organism=None):
+    """
+    Read a GMT file into a :class:`GeneSetLibrary` (without creating
+    :class:`GeneSet` objects).
+
+    :param str filename: GMT file name.
+    :param str name: Hierarchy name (defaults to `filename`).
+    :param str organism: Organism of the gene sets.
+
+    """
+    with io.open(filename, encoding="utf-8") as f:
+        return GeneSetLibrary.from_sets(
+            parse_gmt(f, name if name is not None else filename, organism))
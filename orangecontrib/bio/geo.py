@@ -4,10 +4,15 @@ import os
 import gzip
 import re
 import io
+import shutil
+import warnings
 
 from collections import defaultdict
+from contextlib import closing
+from functools import partial
 
 import six
+from six.moves.urllib.request import urlopen
 if six.PY3:
     import pickle
 else:
@@ -25,6 +30,8 @@ else:
 
 from .utils import serverfiles
 from .utils import compat
+from .utils import colstore
+from .utils import parallel
 from . import taxonomy
 
 
@@ -66,6 +73,7 @@ DOMAIN = "GEO"
 GDS_INFO_FILENAME = "gds_info.pickled"
 FTP_NCBI = "ftp.ncbi.nih.gov"
 FTP_DIR = "pub/geo/DATA/SOFT/GDS/"
+GDS_URL = "ftp://{}/{}".format(FTP_NCBI, FTP_DIR)
 
 SOFT_ENCODING = "utf-8"  # Is this true?
 
@@ -110,81 +118,96 @@ class GDSInfo:
     def __contains__(self, key): return key in self.info
     
 
-class GeneData:
-    """Store mapping between spot id and gene."""
-    def __init__(self, spot_id, gene_name, d):
-        self.spot_id = spot_id
-        self.gene_name = gene_name
-        self.data = d
+#: Version of the parsed data set cache format.
+SOFT_CACHE_VERSION = 2
 
-class GDS():
-    """ 
-    Retrieval of a specific GEO DataSet as a :obj:`Orange.data.Table`.
+#: The number of data table rows converted to floats at once.
+SOFT_BLOCK_SIZE = 5000
 
-    Constructor returns the object that can retrieve
-    GEO DataSet (samples and gene expressions). It first checks
-    a local cache directory if the particular data file is
-    loaded locally, else it downloads it from `NCBI's GEO FTP site
-    <ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SOFT/GDS/>`_.
 
-    :param gdsname: An NCBI's ID for the data set in the form "GDSn"
-      where "n" is a GDS ID number.
+def _soft_filename(gdsname, local_dir=None):
+    if local_dir is None:
+        return serverfiles.localpath(DOMAIN, gdsname + ".soft.gz")
+    return os.path.join(local_dir, gdsname + ".soft.gz")
 
-    :param force_download: Force the download.
 
+def download_soft(gdsname, filename, source=None, verbose=False):
     """
+    Download the SOFT file of the data set `gdsname` to `filename`.
 
-    def __init__(self, gdsname, verbose=False, force_download=False):
-        self.gdsname = gdsname
-        self.verbose = verbose
-        self.force_download = force_download
-        self.filename = serverfiles.localpath(DOMAIN, self.gdsname + ".soft.gz")
-        d = os.path.dirname(self.filename)
-        if not os.path.exists(d):
-            os.makedirs(d)
-        self._getinfo() # to get the info
-        taxid = taxonomy.search(self.info["sample_organism"], exact=True)
-        self.info["taxid"] = taxid[0] if len(taxid)==1 else None
-        self._getspotmap() # to get gene->spot and spot->gene mapping
-        self.genes = sorted(self.gene2spots.keys())        
-        self.spots = sorted(self.spot2gene.keys())        
-        self.info["gene_count"] = len(self.genes)
-        self.gdsdata = None
-        self.data = None
-        
-    def _download(self):
-        """Download GDS data file if not in local cache or forced download requested."""
-        localpath = serverfiles.localpath(DOMAIN)
-        if self.force_download or not os.path.exists(self.filename):
-            base_url = ("ftp://{FTP_NCBI}/{FTP_DIR}"
-                        .format(FTP_NCBI=FTP_NCBI, FTP_DIR=FTP_DIR))
-            url = base_url + self.gdsname + ".soft.gz"
-            if six.PY2:
-                Orange.utils.wget(url, localpath, progress=self.verbose)
-            else:
-                targetfn = os.path.join(localpath, self.gdsname + ".soft.gz")
-                import urllib.request
-                r = urllib.request.urlopen(url)
-                with open(targetfn + "2", 'wb') as f:
-                     f.write(r.read())
-                with gzip.open(targetfn + "2") as f:
-                    f.read() #verify the download
-                os.rename(targetfn + "2", targetfn)
-
-    def _getinfo(self):
-        """Parse GDS data file and return a dictionary with info."""
-        getstate = lambda x: x.split(" ")[0][1:] 
-        getid = lambda x: x.rstrip().split(" ")[2]
-        self._download()
-        f = gzip.open(self.filename, "rb")
-        if six.PY3:
-            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
+    :param source: The base url of the GDS SOFT files or a local directory
+        with the files (NCBI's GEO FTP site by default).
+    """
+    source = source or GDS_URL
+    tmp = "%s.%d.download" % (filename, os.getpid())
+    try:
+        if os.path.isdir(source):
+            shutil.copyfile(os.path.join(source, gdsname + ".soft.gz"), tmp)
+        else:
+            url = source.rstrip("/") + "/" + gdsname + ".soft.gz"
+            if verbose:
+                print("Downloading %s ..." % url)
+            with closing(urlopen(url)) as r, open(tmp, "wb") as f:
+                shutil.copyfileobj(r, f)
+        with gzip.open(tmp) as f:
+            # verify the download
+            while f.read(2 ** 20):
+                pass
+        os.rename(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _open_soft(filename):
+    f = gzip.open(filename, "rb")
+    if six.PY3:
+        f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
+    return f
+
+
+def _parse_rows(rows, n_columns):
+    # Convert tab separated rows of values ('null' for unknown values) to
+    # a float32 matrix
+    values = numpy.array("\t".join(rows).replace("null", "nan").split("\t"),
+                         dtype=numpy.float32)
+    if values.size != len(rows) * n_columns:
+        raise ValueError("Malformed GDS data table")
+    return values.reshape(len(rows), n_columns)
+
+
+def _store_rows(values, start, rows):
+    # Parse `rows` into values[start:], growing `values` if needed
+    end = start + len(rows)
+    if end > len(values):
+        grown = numpy.empty((max(end, 2 * len(values)), values.shape[1]),
+                            dtype=values.dtype)
+        grown[:start] = values[:start]
+        values = grown
+    values[start:end] = _parse_rows(rows, values.shape[1])
+    return values
+
+
+def parse_soft(filename):
+    """
+    Parse a (gzipped) GDS SOFT file in a single pass.
+
+    Return a tuple (info, spots, genes, values), where `info` is a
+    dictionary with the data set information (see :obj:`GDS.info`),
+    `spots` and `genes` are arrays of spot ids and their gene identifiers
+    in the order of the data table, and `values` is a float32 matrix
+    with a row for each spot and a column for each sample (NaN for
+    unknown values).
+    """
+    getstate = lambda x: x.split(" ")[0][1:]
+    getid = lambda x: x.rstrip().split(" ")[2]
 
+    with closing(_open_soft(filename)) as f:
         state = None; previous_state = None
-    
+
         info = {"subsets" : []}
         subset = None
-    
+
         # GDS information part
         for line in f:
             if line[0] == "^":
@@ -213,39 +236,213 @@ class GDS():
         for t,v in info.items():
             if "count" in t:
                 info[t] = int(v)
-                
-        # sample information
-        state = None
-        for line in f:
-            if state == "header":
-                info["samples"] = line.rstrip().split("\t")[2:]
-                break
-            if line.startswith("!dataset_table_begin"):
-                state = "header"
-        self.info = info
 
-    def _getspotmap(self, include_spots=None):
-        """Return gene to spot and spot to genes mapings."""
-        f = gzip.open(self.filename, "rb")
-        if six.PY3:
-            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
+        # sample information
         for line in f:
             if line.startswith("!dataset_table_begin"):
                 break
-        f.readline() # skip header
-        spot2gene = {}
-        gene2spots = {}
+        info["samples"] = f.readline().rstrip().split("\t")[2:]
+
+        # data table (the rows are converted in blocks)
+        values = numpy.empty((info.get("feature_count", 0),
+                              len(info["samples"])), dtype=numpy.float32)
+        spots, genes, rows = [], [], []
+        n = 0
         for line in f:
             if line.startswith("!dataset_table_end"):
                 break
-            spot, gene = line.rstrip().split("\t")[0:2]
-            if include_spots and (spot not in include_spots):
-                continue 
-            spot2gene[spot] = gene
-            gene2spots[gene] = gene2spots.get(gene, []) + [spot]
-    
-        self.spot2gene = spot2gene
-        self.gene2spots = gene2spots
+            spot, gene, row = line.rstrip("\r\n").split("\t", 2)
+            spots.append(spot)
+            genes.append(gene)
+            rows.append(row)
+            if len(rows) == SOFT_BLOCK_SIZE:
+                values = _store_rows(values, n, rows)
+                n += len(rows)
+                rows = []
+        if rows:
+            values = _store_rows(values, n, rows)
+            n += len(rows)
+
+    if n < len(values):
+        values = values[:n].copy()
+    return info, numpy.array(spots, dtype=str), \
+        numpy.array(genes, dtype=str), values
+
+
+def _soft_cache_path(filename):
+    return filename + ".parsed"
+
+
+def _save_soft(path, key, parsed):
+    info, spots, genes, values = parsed
+    with colstore.StoreWriter(path, SOFT_CACHE_VERSION, key) as writer:
+        writer.add_meta("info", info)
+        writer.add_strings("spots", spots.tolist())
+        writer.add_strings("genes", genes.tolist())
+        writer.add_array("values", values)
+
+
+def _load_soft(store):
+    strings = lambda name: numpy.array(store.strings(name).tolist(), dtype=str)
+    return (store.value("info"), strings("spots"), strings("genes"),
+            store.array("values"))
+
+
+def read_soft(filename, use_cache=True):
+    """
+    Return :func:`parse_soft` results for a GDS SOFT file.
+
+    The results are cached in a memory mapped store next to `filename`
+    (and are reparsed if the SOFT file's size or modification time
+    changes). The `values` matrix of cached results is read only.
+    """
+    if not use_cache:
+        return parse_soft(filename)
+    path = _soft_cache_path(filename)
+    key = colstore.file_key(filename)
+    store = colstore.Store.open(path, SOFT_CACHE_VERSION, key)
+    if store is None:
+        parsed = parse_soft(filename)
+        try:
+            _save_soft(path, key, parsed)
+        except (IOError, OSError):
+            return parsed
+        store = colstore.Store.open(path, SOFT_CACHE_VERSION, key)
+    return _load_soft(store)
+
+
+def _merge_mean(values, starts):
+    known = ~numpy.isnan(values)
+    sums = numpy.add.reduceat(numpy.where(known, values, 0), starts)
+    counts = numpy.add.reduceat(known.astype(numpy.int64), starts)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def _merge_median(values, starts):
+    # groups of the same size are merged together
+    sizes = numpy.diff(numpy.append(starts, len(values)))
+    merged = numpy.empty((len(starts), values.shape[1]))
+    for size in numpy.unique(sizes):
+        groups = numpy.flatnonzero(sizes == size)
+        rows = starts[groups][:, numpy.newaxis] + numpy.arange(size)
+        with warnings.catch_warnings():
+            # all NaN slices
+            warnings.simplefilter("ignore", RuntimeWarning)
+            merged[groups] = numpy.nanmedian(values[rows], axis=1)
+    return merged
+
+
+def _merge_ufunc(ufunc, values, starts):
+    return ufunc.reduceat(values, starts)
+
+
+def _merge_generic(merge_function, values, starts):
+    ends = numpy.append(starts[1:], len(values))
+    return numpy.array([[merge_function(x) for x in values[a:b].T.tolist()]
+                        for a, b in zip(starts, ends)], dtype=float)
+
+
+_MERGE_FUNCTIONS = {
+    spots_mean: _merge_mean,
+    spots_median: _merge_median,
+    spots_min: partial(_merge_ufunc, numpy.fmin),
+    spots_max: partial(_merge_ufunc, numpy.fmax),
+}
+
+
+def merge_spots(values, genes, merge_function=spots_mean):
+    """
+    Merge the rows (spots) of `values` by their `genes`.
+
+    Return a tuple of the sorted unique genes and a matrix with their
+    merged rows. The built-in merge functions (:func:`spots_mean`,
+    :func:`spots_median`, :func:`spots_min` and :func:`spots_max`) are
+    computed for all genes at once, any other `merge_function` is called
+    with a list of spot values for each gene and sample.
+    """
+    genes, codes = numpy.unique(genes, return_inverse=True)
+    if not len(genes):
+        return genes, numpy.empty((0, values.shape[1]))
+    codes = codes.ravel()
+    order = numpy.argsort(codes, kind="mergesort")
+    starts = numpy.searchsorted(codes[order], numpy.arange(len(genes)))
+    merge = _MERGE_FUNCTIONS.get(merge_function,
+                                 partial(_merge_generic, merge_function))
+    return genes, merge(values[order].astype(numpy.float64), starts)
+
+
+def _table_rows(X):
+    if compat.OR3:
+        return X
+    return [[compat.unknown if numpy.isnan(v) else v for v in row]
+            for row in X.tolist()]
+
+
+class GDS():
+    """ 
+    Retrieval of a specific GEO DataSet as a :obj:`Orange.data.Table`.
+
+    Constructor returns the object that can retrieve
+    GEO DataSet (samples and gene expressions). It first checks
+    a local cache directory if the particular data file is
+    loaded locally, else it downloads it from `NCBI's GEO FTP site
+    <ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SOFT/GDS/>`_.
+
+    :param gdsname: An NCBI's ID for the data set in the form "GDSn"
+      where "n" is a GDS ID number.
+
+    :param force_download: Force the download.
+
+    :param source: The base url of the GDS SOFT files or a local directory
+      with the files (NCBI's GEO FTP site by default).
+
+    :param local_dir: The directory to store the data set files in (by
+      default the files are stored with the other Orange server files).
+
+    """
+
+    def __init__(self, gdsname, verbose=False, force_download=False,
+                 source=None, local_dir=None):
+        self.gdsname = gdsname
+        self.verbose = verbose
+        self.force_download = force_download
+        self.source = source
+        self.filename = _soft_filename(gdsname, local_dir)
+        d = os.path.dirname(self.filename)
+        if not os.path.exists(d):
+            os.makedirs(d)
+        self._download()
+        #: Data set information, spot ids and genes (in the order of the
+        #: data table) and a float32 matrix of spot values (samples in
+        #: columns).
+        self.info, self.spot_ids, self.spot_genes, self.values = \
+            read_soft(self.filename)
+        taxid = taxonomy.search(self.info["sample_organism"], exact=True)
+        self.info["taxid"] = taxid[0] if len(taxid)==1 else None
+        self.genes = numpy.unique(self.spot_genes).tolist()
+        self.spots = sorted(self.spot_ids.tolist())
+        self.info["gene_count"] = len(self.genes)
+        self.data = None
+        
+    def _download(self):
+        """Download GDS data file if not in local cache or forced download requested."""
+        if self.force_download or not os.path.exists(self.filename):
+            download_soft(self.gdsname, self.filename, self.source,
+                          verbose=self.verbose)
+
+    @property
+    def spot2gene(self):
+        """A dictionary mapping spot ids to genes."""
+        return dict(zip(self.spot_ids.tolist(), self.spot_genes.tolist()))
+
+    @property
+    def gene2spots(self):
+        """A dictionary mapping genes to lists of their spot ids."""
+        gene2spots = {}
+        for spot, gene in zip(self.spot_ids.tolist(), self.spot_genes.tolist()):
+            gene2spots.setdefault(gene, []).append(spot)
+        return gene2spots
         
     def sample_annotations(self, sample_type=None):
         """Return a dictionary with sample annotation."""
@@ -267,35 +464,10 @@ class GDS():
         """Return a set of sample types."""
         return set([info["type"] for info in self.info["subsets"]])
     
-    def _parse_soft(self, remove_unknown=None):
-        """Parse GDS data, returns data dictionary."""
-        f = gzip.open(self.filename, "rb")
-        if six.PY3:
-            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
-
-        mfloat = lambda x: float(x) if x != 'null' else compat.unknown
-    
-        data = {}
-        # find the start of the data part
-        for line in f:
-            if line.startswith("!dataset_table_begin"):
-                break
-        f.readline()
-        
-        # load data
-        for line in f:
-            if line.startswith("!dataset_table_end"):
-                break
-            d = line.rstrip().split("\t")
-            if remove_unknown and (float(d[2:].count('null')) / len(d[2:]) > remove_unknown):
-#                print "ZZZ", float(d[2:].count('null')) / len(d[2:]), d[2:]
-                continue 
-            data[d[0]] = GeneData(d[0], d[1], [mfloat(v) for v in d[2:]])
-        self.gdsdata = data
-    
-    def _to_ExampleTable(self, report_genes=True, merge_function=spots_mean,
-                                sample_type=None, transpose=False):
-        """Convert parsed GEO format to orange, save by genes or by spots."""
+    def _to_ExampleTable(self, names, X, report_genes=True, sample_type=None,
+                         transpose=False):
+        """Convert the (genes or spots by samples) matrix to orange."""
+        names = names.tolist()
         if transpose: # samples in rows
             sample2class = self.sample_to_class(sample_type)
             cvalues = sorted(set(sample2class.values()))
@@ -314,25 +486,19 @@ class GDS():
                 sample_type = list(ad.keys())[0]
 
             classvar = DiscreteVariable(name=sample_type or "class", values=cvalues)
-            spots = self.genes if report_genes else self.spots
-            atts = [ContinuousVariable(name=gene) for gene in spots]
+            atts = [ContinuousVariable(name=gene) for gene in names]
     
             metasvar = [ DiscreteVariable(name=n, values=sorted(values)) 
                 for n,values in ad.items() if n != sample_type ]
 
-            X = []
             Y = []
             metas = []
-            for (i, sampleid) in enumerate(self.info["samples"]):
-                vals = [ ( (merge_function([self.gdsdata[spot].data[i] for spot in self.gene2spots[gene]]) )
-                         if report_genes else self.gdsdata[gene].data[i] ) 
-                         for gene in spots ]
-                X.append(vals)
+            for sampleid in self.info["samples"]:
                 Y.append(sample2class.get(sampleid, None))
                 metas.append([samp_ann[sampleid].get(n, None) for n,_ in ad.items() if n != sample_type ])
 
             domain = compat.create_domain(atts, classvar, metasvar)
-            return compat.create_table(domain, X, Y, metas)
+            return compat.create_table(domain, _table_rows(X.T), Y, metas)
 
         else: # genes in rows
             annotations = self.sample_annotations(sample_type)
@@ -342,19 +508,9 @@ class GDS():
 
             geneatname = "gene" if report_genes else "spot"
             metasvar = [ StringVariable(geneatname) ]
-            nameval = self.genes if report_genes else self.spots
-
-            X = []
-            metas = []
-            for g in nameval:
-                if report_genes:
-                    X.append(list(map(lambda *x: merge_function(x),
-                        *[self.gdsdata[spot].data for spot in self.gene2spots[g]])))
-                else:
-                    X.append(self.gdsdata[g].data)
-            metas = [ [a] for a in nameval]
+            metas = [ [a] for a in names]
             domain = compat.create_domain(atts, None, metasvar)
-            return compat.create_table(domain, X, None, metas)
+            return compat.create_table(domain, _table_rows(X), None, metas)
 
     def getdata(self, report_genes=True, merge_function=spots_mean,
                  sample_type=None, transpose=False, remove_unknown=None):
@@ -365,6 +521,9 @@ class GDS():
           either be merged according to their gene ids
           (if True) or can be left as spots. 
 
+        :param merge_function: A function merging a list of spot values
+          of a gene (:func:`spots_mean` by default).
+
         :param transpose: The output
           table can have spots/genes in rows and samples in columns
           (False, default) or samples in rows and  spots/genes in columns
@@ -382,15 +541,18 @@ class GDS():
           of samples with unknown values is above the threshold set by
           ``remove_unknown``. If None, nothing is removed.
         """
-        if self.verbose: print("Reading data ...")
-#        if not self.gdsdata:
-        self._parse_soft(remove_unknown = remove_unknown)
-#        if remove_unknown:
-            # some spots were filtered out, need to revise spot<>gene mappings
-        self._getspotmap(include_spots=set(self.gdsdata.keys()))
+        values, spots, genes = self.values, self.spot_ids, self.spot_genes
+        if remove_unknown and values.shape[1]:
+            keep = numpy.isnan(values).mean(axis=1) <= remove_unknown
+            values, spots, genes = values[keep], spots[keep], genes[keep]
         if self.verbose: print("Converting to example table ...")
-        self.data = self._to_ExampleTable(merge_function=merge_function,
-                                          sample_type=sample_type, transpose=transpose,
+        if report_genes:
+            names, X = merge_spots(values, genes, merge_function)
+        else:
+            order = numpy.argsort(spots, kind="mergesort")
+            names, X = spots[order], values[order]
+        self.data = self._to_ExampleTable(names, X, sample_type=sample_type,
+                                          transpose=transpose,
                                           report_genes=report_genes)
         return self.data
 
@@ -405,6 +567,53 @@ class GDS():
                )
 
 
+def _load_task(args):
+    # Download and parse a data set (into its cache) in a worker process
+    gdsname, filename, source = args
+    if not os.path.exists(filename):
+        download_soft(gdsname, filename, source)
+    read_soft(filename)
+
+
+def load_many(gds_ids, n_jobs=1, transpose=False, report_genes=True,
+              source=None, local_dir=None):
+    """
+    Load many GEO DataSets as :obj:`Orange.data.Table`.
+
+    The data sets are downloaded and parsed into their memory mapped
+    caches (see :func:`read_soft`) in a pool of worker processes. The
+    tables are then constructed from the caches and yielded in the order
+    of completion as ``(gds_id, table, exception)`` tuples (`table` is
+    None and `exception` the error if a data set could not be loaded).
+
+    :param list gds_ids: GDS ids (e.g. "GDS1676").
+    :param int n_jobs: The number of worker processes (see
+        :func:`~.utils.parallel.effective_n_jobs`).
+    :param bool transpose: See :obj:`GDS.getdata`.
+    :param bool report_genes: See :obj:`GDS.getdata`.
+    :param source: See :obj:`GDS`.
+    :param local_dir: See :obj:`GDS`.
+
+    """
+    tasks = [(gds_id, _soft_filename(gds_id, local_dir), source)
+             for gds_id in gds_ids]
+    for d in set(os.path.dirname(filename) for _, filename, _ in tasks):
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+    results = parallel.parallel_imap_unordered(_load_task, tasks, n_jobs)
+    for (gds_id, _, _), _, exception in results:
+        data = None
+        if exception is None:
+            try:
+                gds = GDS(gds_id, source=source, local_dir=local_dir)
+                data = gds.getdata(report_genes=report_genes,
+                                   transpose=transpose)
+            except Exception as ex:
+                exception = ex
+        yield gds_id, data, exception
+
+
 def _float_or_na(x):
     if compat.isunknown(x):
         return compat.unknown
@@ -7,6 +7,7 @@ Gene Ontology (:mod:`go`)
 from __future__ import absolute_import
 
 import os
+import array
 import tarfile
 import gzip
 import re
@@ -27,6 +28,9 @@ except ImportError:
     
 import warnings
 
+import numpy
+import scipy.sparse
+
 from gzip import GzipFile
 from collections import defaultdict
 from operator import attrgetter
@@ -47,6 +51,15 @@ except NameError:
 
 from orangecontrib.bio.utils import serverfiles
 from orangecontrib.bio.utils import stats
+from orangecontrib.bio.utils import multitest
+from orangecontrib.bio.utils import parallel
+from orangecontrib.bio.utils import colstore
+from orangecontrib.bio.utils.stream import TextStream
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 
 from orangecontrib.bio import gene as obiGene, taxonomy as obiTaxonomy
 
@@ -54,6 +67,14 @@ default_database_path = os.path.join(serverfiles.localpath(), "GO")
 
 _CVS_REVISION_RE = re.compile(r"^(rev)?(\d+\.\d+)+$")
 
+#: Version of the binary (:mod:`~orangecontrib.bio.utils.colstore`) cache
+#: format for parsed ontology and annotation files.
+CACHE_VERSION = 1
+
+
+def _cache_path(filename):
+    return filename + ".cache"
+
 evidenceTypes = {
 # Experimental
     'EXP': 'Inferred from Experiment',
@@ -170,6 +191,37 @@ domain: OBO:TERM
 definition: Indicates that a term is the intersection of several others [OBO:defs]"""]
 
 
+
+def _iter_stanzas(lines, header=None):
+    """
+    Iterate over stanza blocks (``[Type]`` line up to and including the
+    next empty line) in an OBO file given as an iterator over `lines`.
+    Comment lines (starting with '!') are skipped and the lines preceding
+    the first stanza are appended to the `header` list.
+
+    Only the lines of the current stanza are held in memory.
+    """
+    block = None
+    in_header = header is not None
+    for line in lines:
+        if line.startswith("!"):
+            continue
+        if block is None:
+            if line.startswith("["):
+                block = [line]
+                in_header = False
+            elif in_header:
+                header.append(line)
+        elif not line.strip():
+            block.append(line)
+            yield "".join(block)
+            block = None
+        else:
+            block.append(line)
+    if block is not None:
+        yield "".join(block)
+
+
 class OBOObject(object):
     """Represents a generic OBO object (e.g. Term, Typedef, Instance, ...)
     Example:
@@ -297,6 +349,7 @@ class Ontology(object):
         self.alias_mapper = {}
         self.reverse_alias_mapper = defaultdict(set)
         self.header = ""
+        self._dag_index = None
 
         if filename is not None:
             self.parse_file(filename, progress_callback)
@@ -336,42 +389,57 @@ class Ontology(object):
 
     Load = load
 
-    def parse_file(self, file, progress_callback=None):
+    def parse_file(self, file, progress_callback=None, use_cache=True):
         """ Parse the file. file can be a filename string or an open filelike
         object. The optional progressCallback will be called with a single
         argument to report on the progress.
+
+        If `use_cache` is True and `file` is a filename, the parsed ontology
+        is stored in a binary cache next to the file and loaded from there
+        on subsequent calls (as long as the file is not modified).
         """
+        cache = None
+        if use_cache and isinstance(file, basestring) and \
+                os.path.isfile(file):
+            cache = (_cache_path(file), colstore.file_key(file))
+            store = colstore.Store.open(cache[0], CACHE_VERSION, cache[1])
+            if store is not None and store.value("type") == "ontology":
+                self._load_store(store)
+                if progress_callback:
+                    progress_callback(100.0)
+                return
+
+        stream = None
         if isinstance(file, basestring):
-            if os.path.isfile(file) and tarfile.is_tarfile(file):
-                f = tarfile.open(file).extractfile("gene_ontology_edit.obo")
-            elif os.path.isfile(file):
-                f = open(file)
-            elif os.path.isdir(file):
-                f = open(os.path.join(file, "gene_ontology_edit.obo"))
-            else:
+            if os.path.isdir(file):
+                file = os.path.join(file, "gene_ontology_edit.obo")
+            elif not os.path.isfile(file):
                 raise ValueError("Cannot open %r for parsing" % file)
+            stream = TextStream(file, member="gene_ontology_edit.obo")
+            if progress_callback:
+                lines = stream.lines(
+                    lambda p: progress_callback(0.9 * p))
+            else:
+                lines = stream.lines()
         else:
-            f = file
-
-        data = [line.decode() if not isinstance(line, str) else line for line in f.readlines()]
-        data = "".join([line for line in data if not line.startswith("!")])
-        self.header = data[: data.index("[Term]")]
-        c = re.compile("\[.+?\].*?\n\n", re.DOTALL)
-        data = c.findall(data)
-
-        milestones = progress_bar_milestones(len(data), 90)
-        for i, block in enumerate(builtinOBOObjects + data):
-            if block.startswith("[Term]"):
-                term = Term(block, self)
-                self.terms[term.id] = term
-            elif block.startswith("[Typedef]"):
-                typedef = Typedef(block, self)
-                self.typedefs[typedef.id] = typedef
-            elif block.startswith("[Instance]"):
-                instance = Instance(block, self)
-                self.instances[instance.id] = instance
-            if progress_callback and i in milestones:
-                progress_callback(90.0 * i / len(data))
+            lines = (line.decode() if not isinstance(line, str) else line
+                     for line in file)
+
+        header = []
+        stanzas, others = {}, []
+        for block in builtinOBOObjects:
+            self._add_object(block)
+        try:
+            for block in _iter_stanzas(lines, header):
+                obj = self._add_object(block)
+                if isinstance(obj, Term):
+                    stanzas[obj.id] = block
+                elif obj is not None:
+                    others.append(block)
+        finally:
+            if stream is not None:
+                stream.close()
+        self.header = "".join(header)
 
         self.alias_mapper = {}
         self.reverse_alias_mapper = defaultdict(set)
@@ -387,6 +455,109 @@ class Ontology(object):
                 pass
             if progress_callback and i in milestones:
                 progress_callback(90.0 + 10.0 * i / len(self.terms))
+        self._dag_index = None
+        if progress_callback:
+            progress_callback(100.0)
+
+        if cache is not None:
+            try:
+                self._write_store(cache[0], cache[1], stanzas, others)
+            except (IOError, OSError) as err:
+                warnings.warn("Could not write the ontology cache (%s)" % err,
+                              UserWarning)
+
+    def _add_object(self, block):
+        """
+        Create and add an OBO object from a stanza `block`. Return the
+        object or None if the stanza type is not known.
+        """
+        if block.startswith("[Term]"):
+            term = Term(block, self)
+            self.terms[term.id] = term
+            return term
+        elif block.startswith("[Typedef]"):
+            typedef = Typedef(block, self)
+            self.typedefs[typedef.id] = typedef
+            return typedef
+        elif block.startswith("[Instance]"):
+            instance = Instance(block, self)
+            self.instances[instance.id] = instance
+            return instance
+        return None
+
+    def _write_store(self, path, key, stanzas, others):
+        # terms are stored in sorted order (the DAGIndex order)
+        ids = sorted(self.terms)
+        rows = dict((term_id, i) for i, term_id in enumerate(ids))
+
+        relations = sorted(
+            (rows[parent], rows[term_id], type_id)
+            for term_id in ids
+            for type_id, parent in self.terms[term_id].related
+            if parent in rows)
+        parent = numpy.array([r[0] for r in relations], dtype=numpy.int32)
+        alt_ids = sorted(self.alias_mapper)
+
+        with colstore.StoreWriter(path, CACHE_VERSION, key) as writer:
+            writer.add_meta("type", "ontology")
+            writer.add_meta("header", self.header)
+            writer.add_strings("terms.ids", ids)
+            writer.add_strings("terms.stanzas", [stanzas[t] for t in ids])
+            writer.add_strings("terms.names",
+                               [getattr(self.terms[t], "name", "")
+                                for t in ids])
+            writer.add_categorical("terms.namespaces",
+                                   [getattr(self.terms[t], "namespace", "")
+                                    for t in ids])
+            writer.add_array("relations.child",
+                             numpy.array([r[1] for r in relations],
+                                         dtype=numpy.int32))
+            writer.add_array("relations.parent", parent)
+            writer.add_array("relations.parent_indptr",
+                             numpy.searchsorted(parent,
+                                                numpy.arange(len(ids) + 1)))
+            writer.add_categorical("relations.type",
+                                   [r[2] for r in relations])
+            writer.add_strings("others.stanzas", others)
+            writer.add_strings("alt_ids", alt_ids)
+            writer.add_array("alt_ids.target",
+                             numpy.array([rows[self.alias_mapper[a]]
+                                          for a in alt_ids],
+                                         dtype=numpy.int32))
+
+    def _load_store(self, store):
+        self.header = store.value("header", "")
+        others = store.strings("others.stanzas").tolist()
+        for block in builtinOBOObjects + others:
+            self._add_object(block)
+
+        self.terms = _LazyTerms(self, store)
+        ids = self.terms.ids
+        self.alias_mapper = dict(
+            zip(store.strings("alt_ids").tolist(),
+                [ids[i] for i in store.array("alt_ids.target")]))
+        self.reverse_alias_mapper = defaultdict(set)
+        self._dag_index = None
+
+    def relations(self):
+        """
+        Return a list of (term_id, relation_type, parent_id) tuples for all
+        relations between terms in the ontology.
+        """
+        if isinstance(self.terms, _LazyTerms):
+            return self.terms.relations()
+        return [(term_id, type_id, parent)
+                for term_id, term in six.iteritems(self.terms)
+                for type_id, parent in term.related
+                if parent in self.terms]
+
+    def dag_index(self):
+        """
+        Return a (cached) :class:`DAGIndex` of this ontology.
+        """
+        if getattr(self, "_dag_index", None) is None:
+            self._dag_index = DAGIndex(self)
+        return self._dag_index
 
     def defined_slims_subsets(self):
         """
@@ -567,6 +738,207 @@ class Ontology(object):
     DownloadOntologyAtRev = download_ontology_at_rev
 
 
+class _LazyTerms(MutableMapping):
+    """
+    A term id to :class:`Term` mapping backed by a binary ontology cache.
+    :class:`Term` objects are parsed from the stored stanzas on first access.
+    """
+    def __init__(self, ontology, store):
+        self._ontology = ontology
+        self._store = store
+        self.ids = store.strings("terms.ids").tolist()
+        self._stanzas = store.strings("terms.stanzas")
+        self._rows = dict((term_id, i) for i, term_id in enumerate(self.ids))
+        self._terms = {}
+        self._child = store.array("relations.child")
+        self._parent = store.array("relations.parent")
+        self._indptr = store.array("relations.parent_indptr")
+        codes, types = store.categorical("relations.type")
+        self._types = [intern(t) for t in types.tolist()]
+        self._type_codes = codes
+
+    def relations(self):
+        ids, types, rows = self.ids, self._types, self._rows
+        # stored relations of terms still backed by the cache (and to
+        # terms still in the mapping)
+        relations = [(ids[c], types[t], ids[p]) for c, t, p in
+                     zip(self._child, self._type_codes, self._parent)
+                     if rows.get(ids[c]) is not None and ids[p] in rows]
+        # terms added or replaced after loading
+        for term_id, term in self._terms.items():
+            if term_id in rows and rows[term_id] is None:
+                relations.extend((term_id, type_id, parent)
+                                 for type_id, parent in term.related
+                                 if parent in rows)
+        return relations
+
+    def __getitem__(self, term_id):
+        term = self._terms.get(term_id)
+        if term is None:
+            row = self._rows[term_id]
+            term = Term(self._stanzas[row], self._ontology)
+            start, end = self._indptr[row], self._indptr[row + 1]
+            term.related_to.update(
+                (self._types[t], self.ids[c])
+                for c, t in zip(self._child[start:end],
+                                self._type_codes[start:end]))
+            self._terms[term_id] = term
+        return term
+
+    def __setitem__(self, term_id, term):
+        self._terms[term_id] = term
+        # a term not backed by the cache
+        self._rows[term_id] = None
+
+    def __delitem__(self, term_id):
+        del self._rows[term_id]
+        self._terms.pop(term_id, None)
+
+    def __contains__(self, term_id):
+        return term_id in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def _csr_gather(indptr, indices, rows):
+    """
+    Return the concatenated `indices` of all `rows` of a CSR structure.
+    """
+    rows = numpy.asarray(rows, dtype=int)
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lengths = ends - starts
+    if not lengths.sum():
+        return numpy.array([], dtype=indices.dtype)
+    offsets = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths)
+    return indices[numpy.arange(lengths.sum()) + offsets]
+
+
+class DAGIndex(object):
+    """
+    A compiled, integer indexed, representation of the :class:`Ontology`
+    term graph.
+
+    Terms are numbered by their position in :obj:`terms`. Parent and child
+    links (all relationship types in :obj:`Term.related`) are stored as CSR
+    (indptr, indices) arrays.
+
+    :param Ontology ontology: The ontology.
+
+    """
+    def __init__(self, ontology):
+        #: A list of all term ids.
+        self.terms = sorted(ontology.terms)
+        #: A dict mapping term ids (and alternative ids) to integer ids.
+        self.index = dict((term, i) for i, term in enumerate(self.terms))
+        #: A dict mapping integer ids to lists of alternative ids.
+        self.alt_ids = {}
+        for alt_id, term in ontology.alias_mapper.items():
+            if term in self.index and alt_id not in self.index:
+                self.index[alt_id] = self.index[term]
+                self.alt_ids.setdefault(self.index[term], []).append(alt_id)
+
+        rows, cols = [], []
+        for term, _, parent in ontology.relations():
+            rows.append(self.index[term])
+            cols.append(self.index[parent])
+
+        n = len(self.terms)
+        parents = scipy.sparse.csr_matrix(
+            (numpy.ones(len(rows)), (rows, cols)), shape=(n, n))
+        parents.sum_duplicates()
+        parents.data[:] = 1
+        children = parents.T.tocsr()
+        children.sort_indices()
+
+        self.parent_indptr = parents.indptr
+        self.parent_indices = parents.indices
+        self.child_indptr = children.indptr
+        self.child_indices = children.indices
+
+        #: Integer term ids in topological order (parents before children).
+        self.order = self._topological_order()
+        self._ancestors = None
+        self._descendants = None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def parents(self, i):
+        """Return the integer ids of direct parents of term `i`."""
+        return self.parent_indices[self.parent_indptr[i]:
+                                   self.parent_indptr[i + 1]]
+
+    def children(self, i):
+        """Return the integer ids of direct children of term `i`."""
+        return self.child_indices[self.child_indptr[i]:
+                                  self.child_indptr[i + 1]]
+
+    def _topological_order(self):
+        n = len(self.terms)
+        indegree = numpy.diff(self.parent_indptr).astype(int)
+        level = numpy.flatnonzero(indegree == 0)
+        order = []
+        while len(level):
+            order.append(level)
+            children = _csr_gather(self.child_indptr, self.child_indices,
+                                   level)
+            numpy.subtract.at(indegree, children, 1)
+            children = numpy.unique(children)
+            level = children[indegree[children] == 0]
+        order = numpy.concatenate(order) if order else numpy.array([], int)
+        if len(order) != n:
+            raise ValueError("The ontology graph contains a cycle.")
+        return order
+
+    def ancestors(self):
+        """
+        Return the transitive closure of the parent relation as a
+        (n_terms x n_terms) sparse CSR matrix ``A`` where ``A[i, j] == 1``
+        if term `j` is `i` or any of its ancestors.
+        """
+        if self._ancestors is None:
+            n = len(self.terms)
+            closure = scipy.sparse.identity(n, format="csr") + \
+                scipy.sparse.csr_matrix(
+                    (numpy.ones(len(self.parent_indices)),
+                     self.parent_indices, self.parent_indptr), shape=(n, n))
+            closure.data[:] = 1
+            while True:
+                # path doubling; converges in log(depth) steps
+                step = closure.dot(closure)
+                step.data[:] = 1
+                if step.nnz == closure.nnz:
+                    break
+                closure = step
+            closure.sort_indices()
+            self._ancestors = closure
+        return self._ancestors
+
+    def descendants(self):
+        """
+        Return the transitive closure of the child relation (the transpose
+        of :func:`ancestors`) as a sparse CSR matrix.
+        """
+        if self._descendants is None:
+            closure = self.ancestors().T.tocsr()
+            closure.sort_indices()
+            self._descendants = closure
+        return self._descendants
+
+    def super_graph(self, terms):
+        """
+        Return the integer ids of `terms` (integer ids) and all their
+        ancestors.
+        """
+        terms = numpy.asarray(terms, dtype=int)
+        anc = self.ancestors()
+        return numpy.unique(_csr_gather(anc.indptr, anc.indices, terms))
+
+
 from collections import namedtuple
 
 _AnnotationRecordBase = namedtuple(
@@ -620,6 +992,213 @@ class AnnotationRecord(_AnnotationRecordBase):
         return list(map(intern, self.DB_Object_Synonym.split("|")))
 
 
+def _aspects_set(aspect):
+    if aspect is None:
+        return set(["P", "C", "F"])
+    elif isinstance(aspect, basestring):
+        return set([aspect])
+    else:
+        return set(aspect)
+
+
+class AnnotationIndex(object):
+    """
+    A compiled term x gene membership matrix of :class:`Annotations`
+    including the transitive closure over the ontology (a gene annotated to
+    a term is also a member of all its ancestors).
+
+    :param Annotations annotations: The annotations.
+    :param evidence_codes: Evidence codes to consider (default all).
+    :param aspect: Which aspects to use ("P", "F", "C" or a set containing
+        these elements; default all).
+
+    """
+    def __init__(self, annotations, evidence_codes=None, aspect=None):
+        annotations._ensure_ontology()
+        #: The ontology's :class:`DAGIndex`
+        self.dag = annotations.ontology.dag_index()
+        #: A list of all (canonical) gene names.
+        self.genes = sorted(annotations.gene_names)
+        #: A dict mapping gene names to integer ids (columns).
+        self.gene_index = dict((g, i) for i, g in enumerate(self.genes))
+        self._gene_array = None
+        #: A dict mapping term ids not found in the ontology to a set of
+        #: (integer) genes annotated to them.
+        self.unknown_terms = defaultdict(set)
+
+        evidence_codes = set(evidence_codes or evidenceDict.keys())
+        aspects_set = _aspects_set(aspect)
+
+        (genes, gene_names), (terms, term_ids), (evidence, evidence_names), \
+            (aspects, aspect_names) = annotations._annotation_columns(
+                ["DB_Object_Symbol", "GO_ID", "Evidence_Code", "Aspect"])
+
+        def lookup(values, mapping, dtype=int):
+            return numpy.array([mapping(v) for v in values], dtype=dtype)
+
+        selected = lookup(evidence_names, evidence_codes.__contains__, bool)[
+            evidence] & lookup(aspect_names, aspects_set.__contains__, bool)[
+            aspects]
+        cols = lookup(gene_names, self.gene_index.__getitem__)[
+            genes[selected]]
+        rows = lookup(term_ids, lambda t: self.dag.index.get(t, -1))[
+            terms[selected]]
+        unknown = rows < 0
+        for term, gene in zip(terms[selected][unknown], cols[unknown]):
+            self.unknown_terms[term_ids[term]].add(gene)
+        rows, cols = rows[~unknown], cols[~unknown]
+
+        shape = (len(self.dag), len(self.genes))
+        direct = scipy.sparse.csr_matrix(
+            (numpy.ones(len(rows)), (rows, cols)), shape=shape)
+        direct.sum_duplicates()
+        direct.data[:] = 1
+        #: Direct annotations as a (n_terms x n_genes) CSR matrix.
+        self.direct = direct
+
+        membership = self.dag.descendants().dot(direct).tocsr()
+        membership.data[:] = 1
+        membership.sort_indices()
+        #: Annotations including the transitive closure as a
+        #: (n_terms x n_genes) CSR matrix.
+        self.membership = membership
+
+    def gene_mask(self, genes):
+        """
+        Return a boolean array over :obj:`genes` marking `genes`.
+        Unknown gene names are ignored.
+        """
+        mask = numpy.zeros(len(self.genes), dtype=bool)
+        idx = [self.gene_index[g] for g in genes if g in self.gene_index]
+        mask[idx] = True
+        return mask
+
+    def counts(self, mask):
+        """
+        Return the number of genes in `mask` annotated to each term.
+        """
+        return self.membership.dot(mask.astype(float)).astype(int)
+
+    def term_genes(self, terms, mask):
+        """
+        Return a list of gene names in `mask` for each of the (integer)
+        `terms`.
+        """
+        sub = self.membership[numpy.asarray(terms, dtype=int)]
+        keep = mask[sub.indices]
+        bounds = numpy.concatenate([[0], numpy.cumsum(keep)])[sub.indptr]
+        if self._gene_array is None:
+            self._gene_array = numpy.array(self.genes, dtype=object)
+        names = self._gene_array[sub.indices[keep]]
+        return [names[start:end].tolist()
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _enrichment_chunk(args):
+    """
+    Score a chunk of gene sets for :func:`Annotations.enrichment_batch`.
+
+    `args` is a tuple of a (gene set x gene) CSR matrix and an array of
+    gene set sizes. Return (query, term, count, p_value, fdr) arrays for
+    all terms annotated by at least one gene of a gene set (counting only
+    the genes in the reference).
+    """
+    queries, sizes = args
+    membership = parallel.get_state("membership")
+    reference = parallel.get_state("reference")
+    ref_counts = parallel.get_state("ref_counts")
+
+    annotated = queries.dot(membership).tocoo()
+    order = numpy.lexsort((annotated.col, annotated.row))
+    query, term = annotated.row[order], annotated.col[order]
+
+    in_reference = queries.dot(
+        scipy.sparse.diags(reference.astype(float))).tocsr()
+    overlap = in_reference.dot(membership).tocoo()
+    # the overlap's nonzero entries are a subset of the annotated entries
+    n_terms = membership.shape[1]
+    keys = query.astype(numpy.int64) * n_terms + term
+    counts = numpy.zeros(len(keys), dtype=int)
+    counts[numpy.searchsorted(
+        keys, overlap.row.astype(numpy.int64) * n_terms + overlap.col)] = \
+        overlap.data
+
+    p_values = stats.p_values(parallel.get_state("prob"), counts,
+                              parallel.get_state("reference_size"),
+                              ref_counts[term], sizes[query])
+    fdr = None
+    if parallel.get_state("use_fdr"):
+        fdr = numpy.empty_like(p_values)
+        bounds = numpy.searchsorted(query, numpy.arange(len(sizes) + 1))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            fdr[start:end] = multitest.step_up(p_values[start:end],
+                                               end - start)
+    return query, term, counts, p_values, fdr
+
+
+class EnrichmentResults(object):
+    """
+    Results of :func:`Annotations.enrichment_batch` as parallel arrays
+    with one row for each (gene set, term) pair (ordered by gene set and
+    term).
+    """
+    def __init__(self, index, queries, reference, query, term, count,
+                 ref_count, p_value, fdr, query_size, reference_size, names):
+        self._index = index
+        self._queries = queries
+        self._reference = reference
+        self._names = names
+        #: Index of the gene set.
+        self.query = query
+        #: Index of the term (into :obj:`terms`).
+        self.term = term
+        #: Number of genes in the gene set (and reference) annotated to
+        #: the term.
+        self.count = count
+        #: Number of reference genes annotated to the term.
+        self.ref_count = ref_count
+        #: The p-value.
+        self.p_value = p_value
+        #: FDR adjusted p-values (per gene set) or None.
+        self.fdr = fdr
+        #: Number of (recognized) genes in each gene set.
+        self.query_size = query_size
+        #: Number of (recognized) reference genes.
+        self.reference_size = reference_size
+
+    @property
+    def terms(self):
+        """A list of all term ids."""
+        return self._index.dag.terms
+
+    def __len__(self):
+        return len(self.query)
+
+    def term_ids(self):
+        """Return a list of term ids for all rows."""
+        terms = self.terms
+        return [terms[t] for t in self.term]
+
+    def enriched_terms(self, i):
+        """
+        Return results for the `i`-th gene set as a dictionary in the
+        :func:`Annotations.get_enriched_terms` format.
+        """
+        start, end = numpy.searchsorted(self.query, [i, i + 1])
+        index = self._index
+        mask = numpy.zeros(len(index.genes), dtype=bool)
+        mask[self._queries[i].indices] = True
+        terms = self.term[start:end]
+        genes = index.term_genes(terms, mask & self._reference)
+        p_values = self.p_value if self.fdr is None else self.fdr
+        return dict(
+            (index.dag.terms[term],
+             ([self._names.get(g, g) for g in mapped], float(p), int(ref)))
+            for term, mapped, p, ref in zip(
+                terms, genes, p_values[start:end],
+                self.ref_count[start:end]))
+
+
 class Annotations(object):
     """
     :class:`Annotations` object holds the annotations.
@@ -646,13 +1225,12 @@ class Annotations(object):
                  progress_callback=None, rev=None):
         self.ontology = ontology
 
-        #: A dictionary mapping a gene name (DB_Object_Symbol) to a
-        #: set of all annotations of that gene.
-        self.gene_annotations = defaultdict(list)
-
-        #: A dictionary mapping a GO term id to a set of annotations that
-        #: are directly annotated to that term
-        self.term_anotations = defaultdict(list)
+        self._gene_annotations = defaultdict(list)
+        self._term_anotations = defaultdict(list)
+        self._annotations = []
+        # annotation columns loaded from a binary cache (records are
+        # created on demand, see _materialize)
+        self._columns = None
 
         self.all_annotations = defaultdict(list)
 
@@ -660,8 +1238,6 @@ class Annotations(object):
         self._gene_names_dict = None
         self._alias_mapper = None
 
-        #: A list of all :class:`AnnotationRecords` instances.
-        self.annotations = []
         self.header = ""
         self.genematcher = genematcher
         self.taxid = None
@@ -751,6 +1327,7 @@ class Annotations(object):
         """Set the ontology to use in the annotations mapping.
         """
         self.all_annotations = defaultdict(list)
+        self._annotation_indices = {}
         self._ontology = ontology
 
     def get_ontology(self):
@@ -787,7 +1364,84 @@ class Annotations(object):
 
     Load = load
 
-    def parse_file(self, file, progress_callback=None):
+    @property
+    def annotations(self):
+        """A list of all :class:`AnnotationRecord` instances."""
+        self._materialize()
+        return self._annotations
+
+    @property
+    def gene_annotations(self):
+        """
+        A dictionary mapping a gene name (DB_Object_Symbol) to a
+        list of all annotations of that gene.
+        """
+        self._materialize()
+        return self._gene_annotations
+
+    @property
+    def term_anotations(self):
+        """
+        A dictionary mapping a GO term id to a list of annotations that
+        are directly annotated to that term.
+        """
+        self._materialize()
+        return self._term_anotations
+
+    def _materialize(self):
+        """Create the annotation records from the loaded cache columns."""
+        if self._columns is None:
+            return
+        columns, self._columns = self._columns, None
+        fields = []
+        for name in annotationFields:
+            codes, vocabulary = columns[name]
+            vocabulary = numpy.array([intern(v) for v in vocabulary],
+                                     dtype=object)
+            fields.append(vocabulary[codes])
+        records = list(map(AnnotationRecord._make, zip(*fields)))
+        for a in records:
+            self._gene_annotations[a.DB_Object_Symbol].append(a)
+            self._term_anotations[a.GO_ID].append(a)
+        self._annotations.extend(records)
+
+    def _annotation_columns(self, names):
+        """
+        Return a list of (codes, vocabulary) tuples for annotation fields
+        in `names`.
+        """
+        if self._columns is not None:
+            return [(numpy.asarray(self._columns[name][0]),
+                     list(self._columns[name][1]))
+                    for name in names]
+        columns = []
+        for name in names:
+            index = {}
+            getter = attrgetter(name)
+            codes = numpy.fromiter(
+                (index.setdefault(getter(a), len(index))
+                 for a in self._annotations),
+                dtype=int, count=len(self._annotations))
+            vocabulary = sorted(index, key=index.get)
+            columns.append((codes, vocabulary))
+        return columns
+
+    def _write_store(self, path, key):
+        with colstore.StoreWriter(path, CACHE_VERSION, key) as writer:
+            writer.add_meta("type", "annotations")
+            writer.add_meta("header", self.header)
+            columns = self._annotation_columns(annotationFields)
+            for name, (codes, vocabulary) in zip(annotationFields, columns):
+                writer.add_codes(name, codes, vocabulary)
+
+    def _load_store(self, store):
+        self.header = store.value("header", "")
+        self._columns = dict((name, store.categorical(name))
+                             for name in annotationFields)
+        self._reset_caches()
+
+    def parse_file(self, file, progress_callback=None, use_cache=True,
+                   columnar=True):
         """Parse and load the annotations from file.
 
         `file` can be:
@@ -797,33 +1451,94 @@ class Annotations(object):
             - a path to the actual association file
             - an open file-like object of the association file
 
+        The file is read line by line. If `columnar` is True (and no
+        annotations are loaded yet) the fields are stored as interned
+        integer codes and the :class:`AnnotationRecord` instances are only
+        created when first accessed.
+
+        If `use_cache` is True and `file` is a filename, the parsed
+        annotations are stored in a binary cache next to the file and
+        loaded from there on subsequent calls (as long as the file is not
+        modified).
+
         """
+        empty = not self._annotations and self._columns is None
+        cache = None
+        if use_cache and isinstance(file, basestring) and \
+                os.path.isfile(file) and empty:
+            cache = (_cache_path(file), colstore.file_key(file))
+            store = colstore.Store.open(cache[0], CACHE_VERSION, cache[1])
+            if store is not None and store.value("type") == "annotations":
+                self._load_store(store)
+                if progress_callback:
+                    progress_callback(100.0)
+                return
+
+        stream = None
         if isinstance(file, basestring):
-            if os.path.isfile(file) and tarfile.is_tarfile(file):
-                f = tarfile.open(file).extractfile("gene_association")
-            elif os.path.isfile(file) and file.endswith(".gz"):
-                f = gzip.open(file)
-            elif os.path.isfile(file):
-                f = open(file)
-            elif os.path.isdir(file):
-                f = open(os.path.join(file, "gene_association"))
-            else:
+            if os.path.isdir(file):
+                file = os.path.join(file, "gene_association")
+            elif not os.path.isfile(file):
                 raise ValueError("Cannot open %r for parsing." % file)
+            stream = TextStream(file, member="gene_association")
+            lines = stream.lines(progress_callback)
         else:
-            f = file
-        lines = [line.decode() if not isinstance(line, str) else line for line in f.readlines()]
+            lines = (line.decode() if not isinstance(line, str) else line
+                     for line in file)
+
+        try:
+            if columnar and empty:
+                self._parse_columns(lines)
+            else:
+                for line in lines:
+                    if line.startswith("!"):
+                        self.header = self.header + line + "\n"
+                        continue
+                    self.add_annotation(AnnotationRecord.from_string(line))
+        finally:
+            if stream is not None:
+                stream.close()
+
+        if progress_callback:
+            progress_callback(100.0)
+
+        if cache is not None:
+            try:
+                self._write_store(cache[0], cache[1])
+            except (IOError, OSError) as err:
+                warnings.warn(
+                    "Could not write the annotations cache (%s)" % err,
+                    UserWarning)
 
-        milestones = progress_bar_milestones(len(lines), 100)
-        for i, line in enumerate(lines):
+    def _parse_columns(self, lines):
+        """
+        Parse annotation `lines` directly into integer coded columns
+        (without creating the annotation records).
+        """
+        nfields = len(annotationFields)
+        indices = [{} for _ in annotationFields]
+        codes = [array.array("i") for _ in annotationFields]
+        columns = list(zip(indices, codes))
+        header = []
+        for line in lines:
             if line.startswith("!"):
-                self.header = self.header + line + "\n"
+                header.append(line + "\n")
                 continue
+            values = line.split("\t")
+            if len(values) < nfields:
+                values.extend([""] * (nfields - len(values)))
+            # same filter as in add_annotation
+            if not values[2] or not values[4] or values[3] == "NOT":
+                continue
+            for (index, code), value in zip(columns, values):
+                code.append(index.setdefault(value, len(index)))
 
-            a = AnnotationRecord.from_string(line)
-            self.add_annotation(a)
-
-            if progress_callback and i in milestones:
-                progress_callback(100.0 * i / len(lines))
+        self.header = self.header + "".join(header)
+        self._columns = dict(
+            (name, (numpy.frombuffer(code, dtype=numpy.intc),
+                    [intern(v) for v in sorted(index, key=index.get)]))
+            for name, index, code in zip(annotationFields, indices, codes))
+        self._reset_caches()
 
     def add_annotation(self, a):
         """Add a single :class:`AnotationRecord` instance to this object.
@@ -833,10 +1548,15 @@ class Annotations(object):
         if not a.geneName or not a.GOId or a.Qualifier == "NOT":
             return
 
-        self.gene_annotations[a.geneName].append(a)
-        self.annotations.append(a)
-        self.term_anotations[a.GOId].append(a)
+        self._materialize()
+        self._gene_annotations[a.geneName].append(a)
+        self._annotations.append(a)
+        self._term_anotations[a.GOId].append(a)
+        self._reset_caches()
+
+    def _reset_caches(self):
         self.all_annotations = defaultdict(list)
+        self._annotation_indices = {}
 
         self._gene_names_dict = None
         self._gene_names = None
@@ -853,7 +1573,12 @@ class Annotations(object):
     @property
     def gene_names(self):
         if self._gene_names is None:
-            self._gene_names = set([ann.geneName for ann in self.annotations])
+            if self._columns is not None:
+                _, names = self._columns["DB_Object_Symbol"]
+                self._gene_names = set(names)
+            else:
+                self._gene_names = set([ann.geneName
+                                        for ann in self._annotations])
         return self._gene_names
 
     @property
@@ -870,6 +1595,16 @@ class Annotations(object):
         """ Return a dictionary mapping canonical names (DB_Object_Symbol)
         to `genes`.
 
+        """
+        genes = list(genes)
+        aliases = self._gene_aliases(genes)
+        return dict([(aliases[gene], gene) for gene in genes
+                     if gene in aliases])
+
+    def _gene_aliases(self, genes):
+        """
+        Return a dictionary mapping `genes` to their canonical names
+        (genes without a match are omitted).
         """
         def alias(gene):
             if self.genematcher:
@@ -878,7 +1613,11 @@ class Annotations(object):
                 return (gene if gene in self.gene_names
                         else self.alias_mapper.get(gene, None))
 
-        return dict([(alias(gene), gene) for gene in genes if alias(gene)])
+        aliases = {}
+        for gene in genes:
+            if gene not in aliases:
+                aliases[gene] = alias(gene)
+        return dict((gene, name) for gene, name in aliases.items() if name)
 
     def _collect_annotations(self, id, visited):
         """ Recursive function collects and caches all annotations for id
@@ -916,12 +1655,34 @@ class Annotations(object):
         id = self.ontology.alias_mapper.get(id, id)
         if id not in self.all_annotations or \
                 type(self.all_annotations[id]) == list:
+            # the same closure as the membership of the annotation index
+            dag = self.ontology.dag_index()
+            if id not in dag.index:
+                raise KeyError(id)
+            i = dag.index[id]
+            closure = dag.descendants()
             annot_set = set()
-            for annots in self._collect_annotations(id, set()):
-                annot_set.update(annots)
+            for j in closure.indices[closure.indptr[i]:closure.indptr[i + 1]]:
+                # records can be filed under the alternative ids
+                for term_id in [dag.terms[j]] + dag.alt_ids.get(j, []):
+                    annot_set.update(self.term_anotations.get(term_id, ()))
             self.all_annotations[id] = annot_set
         return self.all_annotations[id]
 
+    def annotation_index(self, evidence_codes=None, aspect=None):
+        """
+        Return a (cached) :class:`AnnotationIndex` for the given
+        `evidence_codes` and `aspect` filter.
+        """
+        self._ensure_ontology()
+        evidence_codes = frozenset(evidence_codes or evidenceDict.keys())
+        aspects_set = frozenset(_aspects_set(aspect))
+        key = (evidence_codes, aspects_set)
+        if key not in self._annotation_indices:
+            self._annotation_indices[key] = AnnotationIndex(
+                self, evidence_codes, aspects_set)
+        return self._annotation_indices[key]
+
     def get_all_genes(self, id, evidence_codes=None):
         """ Return a list of genes annotated by specified `evidence_codes`
         to GO term 'id' and all it's subterms."
@@ -965,74 +1726,142 @@ class Annotations(object):
         else:
             reference = self.gene_names
 
-        if aspect == None:
-            aspects_set = set(["P", "C", "F"])
-        elif isinstance(aspect, basestring):
-            aspects_set = set([aspect])
-        else:
-            aspects_set = aspect
-
-        evidence_codes = set(evidence_codes or evidenceDict.keys())
-        annotations = [ann
-                       for gene in genes for ann in self.gene_annotations[gene]
-                       if ann.Evidence_Code in evidence_codes and
-                       ann.Aspect in aspects_set]
-
-        refAnnotations = set(
-            [ann
-             for gene in reference for ann in self.gene_annotations[gene]
-             if ann.Evidence_Code in evidence_codes and
-             ann.Aspect in aspects_set]
-        )
-
-        annotationsDict = defaultdict(set)
-        for ann in annotations:
-            annotationsDict[ann.GO_ID].add(ann)
-
         self._ensure_ontology()
         if slims_only and not self.ontology.slims_subset:
             warnings.warn("Unspecified slims subset in the ontology! "
                           "Using 'goslim_generic' subset", UserWarning)
             self.ontology.set_slims_subset("goslim_generic")
 
-        terms = annotationsDict.keys()
-        filteredTerms = [term for term in terms if term in self.ontology]
+        index = self.annotation_index(evidence_codes, aspect)
+        query = index.gene_mask(genes)
+        refMask = index.gene_mask(reference)
 
-        if len(terms) != len(filteredTerms):
-            termDiff = set(terms) - set(filteredTerms)
+        querySet = set(numpy.flatnonzero(query))
+        termDiff = [term for term, annotated in index.unknown_terms.items()
+                    if querySet.intersection(annotated)]
+        if termDiff:
             warnings.warn("%s terms in the annotations were not found in the "
                           "ontology." % ",".join(map(repr, termDiff)),
                           UserWarning)
 
-        terms = self.ontology.extract_super_graph(filteredTerms)
-        res = {}
-
-        milestones = progress_bar_milestones(len(terms), 100)
-        for i, term in enumerate(terms):
-            if slims_only and term not in self.ontology.slims_subset:
-                continue
-            allAnnotations = self.get_all_annotations(term).intersection(refAnnotations)
-##            allAnnotations.intersection_update(refAnnotations)
-            allAnnotatedGenes = set([ann.geneName for ann in allAnnotations])
-            mappedGenes = genes.intersection(allAnnotatedGenes)
-
-            if len(reference) > len(allAnnotatedGenes):
-                mappedReferenceGenes = reference.intersection(allAnnotatedGenes)
-            else:
-                mappedReferenceGenes = allAnnotatedGenes.intersection(reference)
-            res[term] = ([revGenesDict[g] for g in mappedGenes],
-                         prob.p_value(len(mappedGenes), len(reference),
-                                      len(mappedReferenceGenes), len(genes)),
-                         len(mappedReferenceGenes))
-            if progress_callback and i in milestones:
-                progress_callback(100.0 * i / len(terms))
+        # all terms (and their super terms) annotated by the query genes
+        counts = index.counts(query)
+        terms = numpy.flatnonzero(counts)
+        if slims_only:
+            terms = numpy.array(
+                [t for t in terms
+                 if index.dag.terms[t] in self.ontology.slims_subset],
+                dtype=int)
+
+        # only genes in the reference are counted
+        query &= refMask
+        counts = index.counts(query)[terms]
+        refCounts = index.counts(refMask)[terms]
+        mappedGenes = index.term_genes(terms, query)
+        pvals = stats.p_values(prob, counts, len(reference),
+                               refCounts, len(genes))
+
+        res = dict([(index.dag.terms[term],
+                     ([revGenesDict[g] for g in mapped], p, int(ref)))
+                    for term, mapped, p, ref in
+                    zip(terms, mappedGenes, pvals, refCounts)])
+        if progress_callback:
+            progress_callback(100.0)
         if use_fdr:
-            res = sorted(res.items(), key=lambda x: x[1][1])
+            res = list(res.items())
             res = dict([(id, (genes, p, ref))
                         for (id, (genes, _, ref)), p in
                         zip(res, stats.FDR([p for _, (_, p, _) in res]))])
         return res
 
+    def enrichment_batch(self, gene_sets, reference=None,
+                         evidence_codes=None, aspect=None,
+                         prob=stats.Binomial(), use_fdr=True, n_jobs=1,
+                         chunk_size=500, progress_callback=None):
+        """
+        Compute term enrichment for many gene sets against the same
+        reference.
+
+        The result for each gene set equals the result of
+        :func:`get_enriched_terms`, but the reference side (gene name
+        translation and term counts) is prepared only once and the term
+        overlaps of all gene sets are counted with a single sparse matrix
+        product.
+
+        :param list gene_sets: A list of gene lists.
+        :param reference:
+            List of genes (if None all genes included in the annotations
+            will be used).
+        :param evidence_codes: List of evidence codes to consider.
+        :param aspect:
+            Which aspects to use. Use all by default. "P", "F", "C"
+            or a set containing these elements.
+        :param prob: The distribution used for p-values.
+        :param bool use_fdr: Also compute FDR (per gene set).
+        :param int n_jobs: Number of worker processes used for counting
+            (see :func:`~orangecontrib.bio.utils.parallel.effective_n_jobs`).
+        :param int chunk_size: Number of gene sets counted in one task.
+        :rtype: :class:`EnrichmentResults`
+
+        """
+        gene_sets = [list(genes) for genes in gene_sets]
+        aliases = self._gene_aliases(
+            set(gene for genes in gene_sets for gene in genes))
+        if reference:
+            reference = set(self._gene_aliases(reference).values())
+        else:
+            reference = self.gene_names
+
+        self._ensure_ontology()
+        index = self.annotation_index(evidence_codes, aspect)
+        refMask = index.gene_mask(reference)
+        refCounts = index.counts(refMask)
+
+        # (gene set x gene) incidence and the size of each translated set
+        sizes = numpy.zeros(len(gene_sets), dtype=int)
+        rows, cols = [], []
+        for i, genes in enumerate(gene_sets):
+            canonical = set(aliases[g] for g in genes if g in aliases)
+            sizes[i] = len(canonical)
+            idx = [index.gene_index[g] for g in canonical
+                   if g in index.gene_index]
+            rows.extend([i] * len(idx))
+            cols.extend(idx)
+        queries = scipy.sparse.csr_matrix(
+            (numpy.ones(len(rows)), (rows, cols)),
+            shape=(len(gene_sets), len(index.genes)))
+
+        chunks = [(queries[start: start + chunk_size],
+                   sizes[start: start + chunk_size])
+                  for start in range(0, len(gene_sets), chunk_size)]
+        callback = None
+        if progress_callback:
+            callback = lambda i: progress_callback(100.0 * i / len(chunks))
+        state = {"membership": index.membership.T.tocsr(),
+                 "reference": refMask, "ref_counts": refCounts,
+                 "reference_size": len(reference), "prob": prob,
+                 "use_fdr": use_fdr}
+        parts = parallel.parallel_map(_enrichment_chunk, chunks,
+                                      n_jobs=n_jobs, state=state,
+                                      callback=callback)
+
+        offsets = range(0, len(gene_sets), chunk_size)
+        parts = [(part[0] + offset,) + part[1:]
+                 for part, offset in zip(parts, offsets)]
+        empty = numpy.array([], dtype=int)
+        query, term, counts, p_values = [
+            numpy.concatenate([part[i] for part in parts] or [empty])
+            for i in range(4)]
+        fdr = None
+        if use_fdr:
+            fdr = numpy.concatenate([part[4] for part in parts] or
+                                    [empty.astype(float)])
+
+        return EnrichmentResults(
+            index, queries, refMask, query, term, counts, refCounts[term],
+            p_values, fdr, sizes, len(reference),
+            dict((name, gene) for gene, name in aliases.items()))
+
     def get_annotated_terms(self, genes, direct_annotation_only=False,
                             evidence_codes=None, progress_callback=None):
         """Return all terms that are annotated by genes with evidence_codes.
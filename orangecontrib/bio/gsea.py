@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 from collections import defaultdict
+import functools
 import random
 import time
 
@@ -12,6 +13,10 @@ import Orange
 from . import geneset as obiGeneSets
 from .utils.expression import *
 from . import gene as obiGene
+from .utils.gsea_engine import orderedPointersCorr, enrichmentScoreRanked, \
+    CHUNK_ELEMENTS, geneSetMatrix, enrichmentScoreMatrix, shuffledRankings, \
+    shuffledLabels, gseapval, gseapvals, gseaSignificance, runOptCallbacks, \
+    genePermutations, labelPermutations, permutationScores
 
 """
 Gene set enrichment analysis.
@@ -32,113 +37,45 @@ def issequencens(x):
 def mean(l):
     return float(sum(l))/len(l)
 
-def rankingFromOrangeMeas(meas):
+class rankingFromOrangeMeas(object):
     """
     Creates a function that sequentally ranks all attributes and returns
     results in a list. Ranking function is build out of 
     orange.MeasureAttribute.
     """
-    return lambda d: [ meas(i,d) for i in range(len(d.domain.attributes)) ]
+    def __init__(self, meas):
+        self.meas = meas
 
-def orderedPointersCorr(lcor):
-    """
-    Return a list of integers: indexes in original
-    lcor. Elements in the list are ordered by
-    their lcor[i] value. Higher correlations first.
-    """
-    ordered = [ (i,a) for i,a in enumerate(lcor) ] #original pos + correlation
-    ordered.sort(key=lambda x: -x[1]) #sort by correlation, descending
-    ordered = nth(ordered, 0) #contains positions in the original list
-    return ordered
+    def __call__(self, d):
+        return [ self.meas(i,d) for i in range(len(d.domain.attributes)) ]
 
-def enrichmentScoreRanked(subset, lcor, ordered, p=1.0, rev2=None):
+class rankingFromMatrix(object):
     """
-    Input data and subset. 
-    
-    subset: list of attribute indices of the input data belonging
-        to the same set.
-    lcor: correlations with class for each attribute in a list. 
-
-    Returns enrichment score on given data.
-
-    This implementation efficiently handles "sparse" genesets (that
-    cover only a small subset of all genes in the dataset).
+    Creates a function that ranks all attributes at once with a
+    vectorized metric (see utils.expression), which is called with the
+    expression matrix (examples x attributes, missing values as NaN)
+    and class indices (-1 for unknown) or a matrix of permuted class
+    indices (one permutation per row).
     """
+    def __init__(self, metric):
+        self.metric = metric
 
-    #print lcor
-
-    subset = set(subset)
-
-    if rev2 == None:
-        def rev(l):
-            return numpy.argsort(l)
-        rev2 = rev(ordered)
-
-    #add if gene is not in the subset
-    notInA = -(1. / (len(lcor)-len(subset)))
-    #base for addition if gene is in the subset
-
-    cors = [ abs(lcor[i])**p for i in subset ] #belowe in numpy
-    sumcors = sum(cors)
-
-    #this should not happen
-    if sumcors == 0.0:
-        return (0.0, None)
-    
-    inAb = 1./sumcors
-
-    ess = [0.0]
-    
-    map = {}
-    for i in subset:
-        orderedpos = rev2[i]
-        map[orderedpos] = inAb*abs(lcor[i]**p)
-        
-    last = 0
-
-    maxSum = minSum = csum = 0.0
-
-    for a,b in sorted(map.items()):
-        diff = a-last
-        csum += notInA*diff
-        last = a+1
-        
-        if csum < minSum:
-            minSum = csum
-        
-        csum += b
-
-        if csum > maxSum:
-            maxSum = csum
-
-    #finish it
-    diff = (len(ordered))-last
-    csum += notInA*diff
-
-    if csum < minSum:
-        minSum = csum
-
-    #print "MY", (maxSum if abs(maxSum) > abs(minSum) else minSum)
+    def __call__(self, d):
+        X, labels = dataMatrix(d)
+        return self.metric(X, labels)
 
+def dataMatrix(data):
     """
-    #BY DEFINITION
-    print("subset", subset)
-
-    for i in ordered:
-        ess.append(ess[-1] + \
-            (inAb*abs(lcor[i]**p) if i in subset else notInA)
-        )
-        if i in subset:
-            print(ess[-2], ess[-1])
-            print(i, (inAb*abs(lcor[i]**p)))
-
-    maxEs = max(ess)
-    minEs = min(ess)
-    
-    print("REAL", (maxEs if abs(maxEs) > abs(minEs) else minEs, ess[1:]))
-
+    Return the attribute values (missing as NaN) and class indices
+    (-1 for unknown) of an example table.
     """
-    return (maxSum if abs(maxSum) > abs(minSum) else minSum, [])
+    X, c = data.toNumpyMA("A/C")
+    labels = numpy.ravel(c.filled(-1)).astype(int)
+    return X.filled(numpy.nan), labels
+
+#the default ranking: signal to noise as in MA_signalToNoise
+signalToNoise = rankingFromMatrix(
+    functools.partial(signal_to_noise, stdev_floor=0.2))
 
 #from mOrngData
 def shuffleAttribute(data, attribute, locations):
@@ -188,24 +125,6 @@ def shuffleAttributes(data, rand=random.Random(0)):
     d2 = orange.ExampleTable(dom2, data)
     return d2
 
-def gseapval(es, esnull):
-    """
-    From article (PNAS):
-    estimate nominal p-value for S from esnull by using the positive
-    or negative portion of the distribution corresponding to the sign 
-    of the observed ES(S).
-    """
-    
-    try:
-        if es < 0:
-            return float(len([ a for a in esnull if a <= es ]))/ \
-                len([ a for a in esnull if a < 0])    
-        else: 
-            return float(len([ a for a in esnull if a >= es ]))/ \
-                len([ a for a in esnull if a >= 0])
-    except:
-        return 1.0
-
 
 def enrichmentScore(data, subset, rankingf):
     """
@@ -217,255 +136,80 @@ def enrichmentScore(data, subset, rankingf):
     return es,l
 
 def gseaE(data, subsets, rankingf=None, \
-        n=100, permutation="class", callback=None):
+        n=100, permutation="class", callback=None, n_jobs=1, executor=None,
+        block_size=None):
     """
     Run GSEA algorithm on an example table.
 
     data: orange example table. 
     subsets: list of distinct subsets of data.
     rankingf: function that returns correlation to class of each 
-        variable.
+        variable (default signal to noise). Rankings made with
+        rankingFromMatrix score all class permutations at once.
     n: number of random permutations to sample null distribution.
     permutation: "class" for permutating class, else permutate attribute 
         order.
+    n_jobs: number of processes for computing permutations.
+    executor: an optional concurrent.futures.Executor for computing
+        permutations (instead of n_jobs processes).
+    block_size: number of permutations per task (see permutationScores).
 
     """
 
     if not rankingf:
-        rankingf=rankingFromOrangeMeas(MA_signalToNoise())
-
-    enrichmentScores = []
- 
-    lcor = rankingf(data)
-    #print lcor
-
-    ordered = orderedPointersCorr(lcor)
-
-    def rev(l):
-        return numpy.argsort(l)
+        rankingf = signalToNoise
 
-    rev2 = rev(ordered)
-
-    for subset in subsets:
-        es = enrichmentScoreRanked(subset, lcor, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
+    vectorized = isinstance(rankingf, rankingFromMatrix) and iset(data)
+    if vectorized:
+        X, labels = dataMatrix(data)
+        lcor = rankingf.metric(X, labels)
+    else:
+        lcor = rankingf(data)
+    sets = geneSetMatrix(subsets, len(lcor))
+    enrichmentScores = enrichmentScoreMatrix([lcor], sets)[0]
 
     runOptCallbacks(callback)
 
-    #print "PERMUTATION", permutation
-
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-
-        if permutation == "class":
-            d2 = shuffleClass(data, 2000+i) #fixed permutation
-            r2 = rankingf(d2)
-        else:
-            r2 = shuffleList(lcor, random.Random(2000+i))
-
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-        for si,subset in enumerate(subsets):
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
+    if permutation == "class" and vectorized:
+        rankings = labelPermutations(X, labels, rankingf.metric)
+    elif permutation == "class":
+        rankings = classPermutations(data, rankingf)
+    else:
+        rankings = genePermutations(lcor)
 
-        runOptCallbacks(callback)
+    enrichmentNulls = permutationScores(rankings, sets, n, callback,
+        n_jobs=n_jobs, executor=executor, block_size=block_size)
 
     return gseaSignificance(enrichmentScores, enrichmentNulls)
 
 
-def runOptCallbacks(callback):
-    if callback is not None:
-        try:
-            [ a() for a in callback ]
-        except:
-            callback()            
-
-def gseaR(rankings, subsets, n, callback=None):
+def gseaR(rankings, subsets, n, callback=None, n_jobs=1, executor=None,
+        block_size=None):
     """
     """
-    enrichmentScores = []
-    ordered = orderedPointersCorr(rankings)
-    
-    def rev(l):
-        return numpy.argsort(l)
-
-    rev2 = rev(ordered)
-
-    for subset in subsets:
+    sets = geneSetMatrix(subsets, len(rankings))
+    enrichmentScores = enrichmentScoreMatrix([rankings], sets)[0]
 
-        es = enrichmentScoreRanked(subset, rankings, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
-    
     runOptCallbacks(callback)
 
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-        
-        r2 = shuffleList(rankings, random.Random(2000+i))
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-
-        for si,subset in enumerate(subsets):
-
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
-
-        runOptCallbacks(callback)
+    enrichmentNulls = permutationScores(genePermutations(rankings), sets, n,
+        callback, n_jobs=n_jobs, executor=executor, block_size=block_size)
 
     return gseaSignificance(enrichmentScores, enrichmentNulls)
 
 
-def gseaSignificance(enrichmentScores, enrichmentNulls):
-
-    #print enrichmentScores
-
-    import time
-
-    tb1 = time.time()
-
-    enrichmentPVals = []
-    nEnrichmentScores = []
-    nEnrichmentNulls = []
-
-    for i in range(len(enrichmentScores)):
-        es = enrichmentScores[i]
-        enrNull = enrichmentNulls[i]
-        #print es, enrNull
-
-        enrichmentPVals.append(gseapval(es, enrNull))
-
-        #normalize the ES(S,pi) and the observed ES(S), separetely rescaling
-        #the positive and negative scores by divident by the mean of the 
-        #ES(S,pi)
-
-        #print es, enrNull
-
-        def normalize(s):
-            try:
-                if s == 0:
-                    return 0.0
-                if s >= 0:
-                    meanPos = mean([a for a in enrNull if a >= 0])
-                    #print s, meanPos
-                    return s/meanPos
-                else:
-                    meanNeg = mean([a for a in enrNull if a < 0])
-                    #print s, meanNeg
-                    return -s/meanNeg
-            except:
-                return 0.0 #return if according mean value is uncalculable
-
-
-        nes = normalize(es)
-        nEnrichmentScores.append(nes)
-        
-        nenrNull = [ normalize(s) for s in enrNull ]
-        nEnrichmentNulls.append(nenrNull)
- 
-
-    #print "First part", time.time() - tb1
-
-    #FDR computation
-    #create a histogram of all NES(S,pi) over all S and pi
-    vals = reduce(lambda x,y: x+y, nEnrichmentNulls, [])
-
-
-    def shorten(l, p=10000):
-        """
-        Take each len(l)/p element, if len(l)/p >= 2.
-        """
-        e = len(l)/p
-        if e <= 1:
-            return l
-        else:
-            return [ l[i] for i in xrange(0, len(l), e) ]
-
-    #vals = shorten(vals) -> this can speed up second part. is it relevant TODO?
-
+class classPermutations(object):
     """
-    Use this null distribution to compute an FDR q value, for a given NES(S) =
-    NES* >= 0. The FDR is the ratio of the percantage of all (S,pi) with
-    NES(S,pi) >= 0, whose NES(S,pi) >= NES*, divided by the percentage of
-    observed S wih NES(S) >= 0, whose NES(S) >= NES*, and similarly if NES(S)
-    = NES* <= 0.
+    Rankings (made with rankingf) of data with the class permuted
+    with shuffleClass for each seed.
     """
+    def __init__(self, data, rankingf):
+        self.data = data
+        self.rankingf = rankingf
 
-    nvals = numpy.array(sorted(vals))
-    nnes = numpy.array(sorted(nEnrichmentScores))
-
-    #print "LEN VALS", len(vals), len(nEnrichmentScores)
-
-    fdrs = []
-
-    import operator
-
-    for i in range(len(enrichmentScores)):
-
-        nes = nEnrichmentScores[i]
-
-        """
-        #Strighfoward but slow implementation follows in comments.
-        #Useful as code description.
-        
-        if nes >= 0:
-            op0 = operator.ge
-            opn = operator.ge
-        else:
-            op0 = operator.lt
-            opn = operator.le
-
-        allPos = [a for a in vals if op0(a,0)]
-        allHigherAndPos = [a for a in allPos if opn(a,nes) ]
-
-        nesPos = [a for a in nEnrichmentScores if op0(a,0) ]
-        nesHigherAndPos = [a for a in nesPos if opn(a,nes) ]
-
-        top = len(allHigherAndPos)/float(len(allPos)) #p value
-        down = len(nesHigherAndPos)/float(len(nesPos))
-        
-        l1 = [ len(allPos), len(allHigherAndPos), len(nesPos), len(nesHigherAndPos)]
-
-        allPos = allHigherAndPos = nesPos =  nesHigherAndPos = 1
-
-        """
-
-        #this could be speed up twice with the same accuracy! 
-        if nes >= 0:
-            allPos = int(len(vals) - numpy.searchsorted(nvals, 0, side="left"))
-            allHigherAndPos = int(len(vals) - numpy.searchsorted(nvals, nes, side="left"))
-            nesPos = len(nnes) - int(numpy.searchsorted(nnes, 0, side="left"))
-            nesHigherAndPos = len(nnes) - int(numpy.searchsorted(nnes, nes, side="left"))
-        else:
-            allPos = int(numpy.searchsorted(nvals, 0, side="left"))
-            allHigherAndPos = int(numpy.searchsorted(nvals, nes, side="right"))
-            nesPos = int(numpy.searchsorted(nnes, 0, side="left"))
-            nesHigherAndPos = int(numpy.searchsorted(nnes, nes, side="right"))
-           
-        """
-        #Comparing results
-        l2 = [ allPos, allHigherAndPos, nesPos, nesHigherAndPos ]
-        diffs = [ l1[i]-l2[i] for i in range(len(l1)) ]
-        sumd = sum( [ abs(a) for a in diffs ] )
-        if sumd > 0:
-            print(nes > 0)
-            print("orig", l1)
-            print("modi", l2)
-        """
-
-        try:
-            top = allHigherAndPos/float(allPos) #p value
-            down = nesHigherAndPos/float(nesPos)
-
-            fdrs.append(top/down)
-        except:
-            fdrs.append(1000000000.0)
-    
-    #print "Whole part", time.time() - tb1
-
-    return zip(enrichmentScores, nEnrichmentScores, enrichmentPVals, fdrs)
+    def __call__(self, seeds):
+        #fixed permutation
+        return [ self.rankingf(shuffleClass(self.data, seed)) for seed in seeds ]
 
 
 def nth(l,n): return [ a[n] for a in l ]
@@ -895,10 +639,16 @@ class GSEA(object):
         to a self.genesets: key is genesetname, it's values are individual
         genes and match results.
         """
-        for g in obiGeneSets.GeneSets(genesets):
-            genes = g.genes
-            datamatch = filter(lambda x: x[1] != None, 
-                [ (gene, self.gm.umatch(gene)) for gene in genes])
+        genesets = list(obiGeneSets.GeneSets(genesets))
+        # match the genes of all gene sets at once
+        allgenes = list(set(gene for g in genesets for gene in g.genes))
+        matches, _ = self.gm.umatch_many(allgenes)
+        targets = self.gm.matcho.targets
+        matched = dict((gene, targets[m])
+                       for gene, m in zip(allgenes, matches) if m >= 0)
+        for g in genesets:
+            datamatch = [ (gene, matched[gene]) for gene in g.genes
+                          if gene in matched ]
             self.genesets[g] = datamatch
 
     def selectGenesets(self, minSize=3, maxSize=1000, minPart=0.1):
@@ -930,7 +680,15 @@ class GSEA(object):
         """
         return dict( (gs, self.genesIndices(nth(self.genesets[gs],1))) for gs in gsets)
 
-    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class"):
+    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class", n_jobs=1, executor=None):
+        """
+        Compute enrichment of gene sets.
+
+        Permutations can be computed in parallel with n_jobs processes
+        (-1 for all processors) or with a concurrent.futures.Executor.
+        Each permutation has a fixed seed, so the results do not depend
+        on the number of processes.
+        """
 
         subsetsok = self.selectGenesets(minSize=minSize, maxSize=maxSize, minPart=minPart)
 
@@ -944,10 +702,10 @@ class GSEA(object):
             return {} # quick return if no genesets
 
         if len(itOrFirst(self.data)) > 1:
-            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf)
+            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf, n_jobs=n_jobs, executor=executor)
         else:
             rankings = [ self.data[0][at].native() for at in self.data.domain.attributes ]
-            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None)
+            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None, n_jobs=n_jobs, executor=executor)
 
         res = {}
 
@@ -984,7 +742,7 @@ def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
 
 def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     at_least=3, phenotypes=None, gene_desc=None, phen_desc=None, n=100, 
-    permutation="phenotype", callback=None, rankingf=None):
+    permutation="phenotype", callback=None, rankingf=None, n_jobs=1):
     """ Run Gene Set Enrichment Analysis.
 
     :param Orange.data.Table data: Gene expression data.  
@@ -1015,6 +773,8 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
         specifies a sample, then the user should pass the meta variable
         containing the gene names. Defaults to attribute names if each
         example specifies one sample.
+    :param int n_jobs: Number of processes used for permutations
+        (-1 for all processors). Default: 1.
 
     :return: | a dictionary where key is a gene set and values are:
         | { es: enrichment score, 
@@ -1033,19 +793,19 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
         maxSize=max_size, minPart=min_part, n=n, permutation=permutation, 
         geneVar=gene_desc, callback=callback, phenVar=phen_desc, 
-        classValues=phenotypes)
+        classValues=phenotypes, rankingf=rankingf, n_jobs=n_jobs)
 
 def runGSEA(data, organism=None, classValues=None, geneSets=None, n=100, 
         permutation="class", minSize=3, maxSize=1000, minPart=0.1, atLeast=3, 
         matcher=None, geneVar=None, phenVar=None, caseSensitive=False, 
-        rankingf=None, callback=None):
+        rankingf=None, callback=None, n_jobs=1):
     gso = GSEA(data, organism=organism, matcher=matcher, 
         classValues=classValues, atLeast=atLeast, caseSensitive=caseSensitive,
         geneVar=geneVar, phenVar=phenVar)
     gso.addGenesets(geneSets)
     res1 = gso.compute(n=n, permutation=permutation, minSize=minSize,
         maxSize=maxSize, minPart=minPart, rankingf=rankingf,
-        callback=callback)
+        callback=callback, n_jobs=n_jobs)
     return res1
 
 def etForAttribute(datal,a):
@@ -58,8 +58,9 @@ from itertools import chain
 from datetime import datetime
 from contextlib import contextmanager
 
+import numpy
+
 from orangecontrib.bio import utils, taxonomy
-from orangecontrib.bio.utils import progress_bar_milestones
 from orangecontrib.bio.kegg import databases
 from orangecontrib.bio.kegg import entry
 
@@ -68,6 +69,7 @@ from orangecontrib.bio.kegg.brite import BriteEntry, Brite
 from orangecontrib.bio.kegg import api
 from orangecontrib.bio.kegg import conf
 from orangecontrib.bio.kegg import pathway
+from orangecontrib.bio.kegg import pathway_index
 
 from functools import reduce
 
@@ -158,13 +160,24 @@ class Organism(object):
 
     def pathways(self, with_ids=None):
         """
-        Return a list of all pathways for this organism.
+        Return a list of all pathways for this organism (or only the
+        pathways that include all genes in `with_ids`).
         """
         if with_ids is not None:
-            return self.api.get_pathways_by_genes(with_ids)
+            return self.get_pathways_by_genes(with_ids)
         else:
             return [p.entry_id for p in self.api.list_pathways(self.org_code)]
 
+    def pathway_index(self):
+        """
+        Return the gene to pathway :class:`~.pathway_index.PathwayIndex`
+        for this organism.
+        """
+        if getattr(self, "_pathway_index", None) is None:
+            self._pathway_index = pathway_index.pathway_index(
+                self.org_code, self.api)
+        return self._pathway_index
+
     def list_pathways(self):
         """
         List all pathways for this organism.
@@ -194,35 +207,22 @@ class Organism(object):
             reference = self.genes.keys()
         reference = set(reference)
 
-        allPathways = defaultdict(lambda: [[], 1.0, []])
-        milestones = progress_bar_milestones(len(genes), 100)
-        pathways_db = KEGGPathways()
-
-        pathways_for_gene = []
-        for i, gene in enumerate(genes):
-            pathways_for_gene.append(self.pathways([gene]))
-            if callback and i in milestones:
-                callback(i * 50.0 / len(genes))
-
-        # pre-cache for speed
-        pathways_db.pre_cache([pid for pfg in pathways_for_gene
-                               for pid in pfg])
-        for i, (gene, pathways) in enumerate(zip(genes, pathways_for_gene)):
-            for pathway in pathways:
-                if pathways_db.get_entry(pathway).gene:
-                    allPathways[pathway][0].append(gene)
-            if callback and i in milestones:
-                callback(50.0 + i * 50.0 / len(genes))
-
-        pItems = allPathways.items()
-
-        for i, (p_id, entry) in enumerate(pItems):
-            pathway = pathways_db.get_entry(p_id)
-            entry[2].extend(reference.intersection(pathway.gene or []))
-            entry[1] = prob.p_value(len(entry[0]), len(reference),
-                                    len(entry[2]), len(genes))
-        return dict([(pid, (genes, p, len(ref)))
-                     for pid, (genes, p, ref) in allPathways.items()])
+        index = self.pathway_index()
+        if callback:
+            callback(50.0)
+
+        counts = index.counts(index.gene_mask(genes))
+        pathways = numpy.flatnonzero(counts)
+        ref_counts = index.counts(index.gene_mask(reference))[pathways]
+        mapped = index.pathway_genes(pathways, index.gene_mask(genes))
+
+        pvals = utils.stats.p_values(
+            prob, counts[pathways], len(reference), ref_counts, len(genes))
+        if callback:
+            callback(100.0)
+        return dict((index.pathways[p], (g, pval, int(ref)))
+                    for p, g, pval, ref in zip(pathways, mapped, pvals,
+                                               ref_counts))
 
     def get_genes_by_enzyme(self, enzyme):
         enzyme = KEGGEnzyme().get_entry(enzyme)
@@ -239,14 +239,7 @@ class Organism(object):
 
     def get_pathways_by_genes(self, gene_ids):
         """ Pathways that include all genes in gene_ids. """
-        l = self.api.get_genes_pathway_organism(self.org_code)
-        gene_ids = set(gene_ids)
-        gtp = defaultdict(set)
-        for a,b in l:
-            gtp[a].add(b)
-        pathways = [ gtp[g] for g in gene_ids ]
-        pathways = reduce(set.intersection, pathways)
-        return sorted(pathways)
+        return self.pathway_index().pathways_by_genes(gene_ids)
 
     def get_pathways_by_enzymes(self, enzyme_ids):
         enzyme_ids = set(enzyme_ids)
@@ -349,18 +349,36 @@ except ImportError:
 
 
 class CachedKeggApi(KeggApi):
-    def __init__(self, store=None):
+    """
+    A :class:`KeggApi` with the results cached in a local store.
+
+    :param snapshot: An offline snapshot (a path or a
+        :class:`~.snapshot.KeggSnapshot`) to serve all requests from.
+        The results are then only cached in memory.
+
+    """
+    def __init__(self, store=None, snapshot=None):
         KeggApi.__init__(self)
         if store is None:
             self.store = {}
+        if snapshot is not None:
+            from .snapshot import snapshot_service
+            self.service = snapshot_service(snapshot)
+        self._memory_store = None
 
     # Needed API for cached decorator.
     def cache_store(self):
         from . import conf
+        if getattr(self.service, "read_only", False):
+            # nothing to gain from a persistent cache of a local snapshot
+            if self._memory_store is None:
+                self._memory_store = caching.DictStore()
+            return self._memory_store
         path = conf.params["cache.path"]
         touch_dir(path)
         return caching.Sqlite3Store(os.path.join(path,
-                                                 "kegg_api_cache_2.sqlite3"))
+                                                 "kegg_api_cache_2.sqlite3"),
+                                    maintain=True)
 
     def last_modified(self, args, kwargs=None):
         return getattr(self, "default_release", "")
@@ -400,57 +418,136 @@ class CachedKeggApi(KeggApi):
             raise ValueError("Can batch at most 10 ids at a time.")
 
         get = self.get
-        uncached = []
-        unmatched = set()
 
         with closing(get.cache_store()) as store:
-            # Which ids are already cached
-            # TODO: Invalidate entries by release string.
-            for id in ids:
-                key = get.key_from_args((id,))
-                if not get.key_has_valid_cache(key, store):
-                    uncached.append(id)
-
-        if uncached:
-            # in case there are duplicate ids
-            uncached = sorted(set(uncached))
-
-            rval = KeggApi.get(self, uncached)
-
-            if rval is not None:
-                entries = rval.split("///\n")
-            else:
-                entries = []
-
-            if entries and not entries[-1].strip():
-                # Delete the last single newline entry if present
-                del entries[-1]
-
-            if len(entries) != len(uncached):
-                new_uncached, entries = match_by_ids(uncached, entries)
-                unmatched = set(uncached) - set(new_uncached)
-                uncached = new_uncached
-                warnings.warn("Unable to match entries for keys: %s." %
-                              ", ".join(map(repr, unmatched)))
-
-            with closing(get.cache_store()) as store:
-                for id, entry in zip(uncached, entries):
-                    key = get.key_from_args((id,))
-                    if entry is not None:
-                        entry = entry + "///\n"
-                    store[key] = cache_entry(entry, mtime=datetime.now())
+            # Which ids are already cached (and valid for the release)
+            uncached = self._uncached_ids(ids, store)
+            if uncached:
+                self._store_entries(store, self._fetch_entries(uncached))
 
-        # Finally join all the results, but drop all None objects
-
-        with closing(get.cache_store()):
             keys = [get.key_from_args((id,)) for id in ids]
-            entries = [store[key].value for key in keys]
+            cached = store.get_many(keys)
+            entries = [cached[key].value if key in cached else None
+                       for key in keys]
 
+        # Finally join all the results, but drop all None objects
         entries = filter(lambda e: e is not None, entries)
 
         rval = "".join(entries)
         return rval
 
+    def _uncached_ids(self, ids, store):
+        """
+        Return a sorted list of unique `ids` without a valid cache entry
+        in `store`.
+        """
+        get = self.get
+        keys = dict((get.key_from_args((id,)), id) for id in ids)
+        valid = get.valid_entries(list(keys), store)
+        return sorted(id for key, id in keys.items() if key not in valid)
+
+    def _fetch_entries(self, ids):
+        """
+        Retrieve the entries for `ids` (at most 10) and return a list of
+        (id, entry text) pairs (the text is None for ids KEGG does not
+        return, so they are cached as missing). Does not use the cache
+        store, so it can be called from multiple threads.
+        """
+        missing = []
+        rval = KeggApi.get(self, ids)
+
+        if rval is not None:
+            entries = rval.split("///\n")
+        else:
+            entries = []
+
+        if entries and not entries[-1].strip():
+            # Delete the last single newline entry if present
+            del entries[-1]
+
+        if len(entries) != len(ids):
+            matched, entries = match_by_ids(ids, entries)
+            found = set(matched)
+            missing = [id for id in ids if id not in found]
+            ids = matched
+            warnings.warn("Unable to match entries for keys: %s." %
+                          ", ".join(map(repr, missing)))
+
+        return [(id, entry + "///\n") for id, entry in zip(ids, entries)] + \
+               [(id, None) for id in missing]
+
+    def _store_entries(self, store, entries):
+        """
+        Store the (id, entry text) pairs in a single transaction (None
+        texts record ids without an entry).
+        """
+        get = self.get
+        mtime = datetime.now()
+        release = get.release_from_args(None)
+        store.set_many((get.key_from_args((id,)),
+                        cache_entry(entry, mtime, release=release))
+                       for id, entry in entries)
+
+    def cached_entries(self, ids):
+        """
+        Return a list of cached entry texts for `ids` (None for ids that
+        are not cached) retrieved with a single query.
+        """
+        get = self.get
+        keys = [get.key_from_args((id,)) for id in ids]
+        with closing(get.cache_store()) as store:
+            cached = store.get_many(keys)
+        return [cached[key].value if key in cached else None
+                for key in keys]
+
+    def fetch(self, ids, batch_size=10, max_workers=None, rate_limit=None,
+              progress_callback=None):
+        """
+        Retrieve and cache the entries for all `ids` that are not already
+        cached, with up to `max_workers` concurrent requests of
+        `batch_size` ids each and at most `rate_limit` requests per
+        second (the defaults are the "service.max_workers" and
+        "service.rate_limit" configuration parameters).
+
+        The entries of each finished request are stored (in a single
+        transaction) as soon as it completes, so an interrupted or failed
+        run can be resumed by calling `fetch` again with the same `ids`.
+
+        :param list ids: KEGG ids (with the database prefix).
+        :param int batch_size: The number of ids per request (at most 10).
+        :param progress_callback:
+            An optional function called with the percentage of finished
+            requests.
+
+        """
+        from . import conf
+        from ..utils import parallel
+
+        if batch_size > 10 or batch_size < 1:
+            raise ValueError("Invalid batch_size")
+        if max_workers is None:
+            max_workers = int(conf.params["service.max_workers"])
+        if rate_limit is None:
+            rate_limit = float(conf.params["service.rate_limit"])
+
+        with closing(self.get.cache_store()) as store:
+            uncached = self._uncached_ids(ids, store)
+            batches = [uncached[i: i + batch_size]
+                       for i in range(0, len(uncached), batch_size)]
+
+            results = parallel.thread_imap_unordered(
+                self._fetch_entries, batches, n_threads=max_workers,
+                rate=rate_limit)
+            try:
+                for i, (_, entries, error) in enumerate(results, 1):
+                    if error is not None:
+                        raise error
+                    self._store_entries(store, entries)
+                    if progress_callback:
+                        progress_callback(100.0 * i / len(batches))
+            finally:
+                results.close()
+
     @cached_method
     def conv(self, target_db, source):
         return KeggApi.conv(self, target_db, source)
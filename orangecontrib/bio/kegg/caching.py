@@ -4,6 +4,9 @@ Caching framework for cached kegg api calls.
 """
 import os
 import sqlite3
+import threading
+import time
+import zlib
 try:
     import cPickle as pickle
 except ImportError:
@@ -17,7 +20,7 @@ from . import conf
 import six
 
 try:
-    from UserDict import DictMixin
+    from collections.abc import MutableMapping as DictMixin
 except ImportError:
     from collections import MutableMapping as DictMixin
 
@@ -35,101 +38,371 @@ class Store(object):
         pass
 
 
+#: How long (in seconds) to wait for other connections' locks.
+TIMEOUT = 60
+
+#: Shared sqlite3 connections (one per process and file).
+_connections = {}
+_connections_lock = threading.Lock()
+
+#: Files for which the invalidation/eviction policy was already applied
+#: (by this process).
+_maintained = set()
+
+
+def _connection(filename):
+    """
+    Return the (shared) connection for `filename` and a lock guarding it.
+    """
+    key = (os.getpid(), os.path.abspath(filename))
+    with _connections_lock:
+        if key not in _connections:
+            con = sqlite3.connect(filename, timeout=TIMEOUT,
+                                  check_same_thread=False)
+            try:
+                con.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.DatabaseError:
+                # e.g. on network file systems
+                pass
+            con.execute("PRAGMA synchronous=NORMAL")
+            _connections[key] = (con, threading.RLock())
+            with con:
+                _init_schema(con)
+        return _connections[key]
+
+
+def close_connections():
+    """
+    Close all shared sqlite3 store connections (of this process).
+    """
+    with _connections_lock:
+        for key, (con, lock) in list(_connections.items()):
+            if key[0] == os.getpid():
+                with lock:
+                    con.close()
+                del _connections[key]
+        _maintained.clear()
+
+
+#: Version of the sqlite3 store schema (stored in PRAGMA user_version).
+SCHEMA_VERSION = 3
+
+
+def _init_schema(con):
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        # An old (pickled TEXT values) or unknown format; start over.
+        con.execute("DROP INDEX IF EXISTS cache_index")
+        con.execute("DROP TABLE IF EXISTS cache")
+        con.execute("PRAGMA user_version = %i" % SCHEMA_VERSION)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS cache
+            (key TEXT PRIMARY KEY,
+             value BLOB,
+             size INTEGER,
+             mtime REAL,
+             atime REAL
+            )
+    """)
+    con.execute("""
+        CREATE INDEX IF NOT EXISTS cache_atime
+        ON cache (atime)
+    """)
+
+
+def _timestamp(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+
+def _chunks(seq, n=500):
+    # sqlite limits the number of query parameters
+    for start in range(0, len(seq), n):
+        yield seq[start:start + n]
+
+
 class Sqlite3Store(Store, DictMixin):
+    """
+    A persistent (sqlite3) key value store.
+
+    Values are pickled and zlib compressed. The database is in WAL mode
+    and the connection is shared by all store instances for the same file
+    (in a process), so opening a store is cheap.
+
+    The store records the write (`mtime`) and last access (`atime`) times
+    of all values for expiring old (:func:`expire`) and evicting least
+    recently used (:func:`evict`) values.
 
-    def __init__(self, filename):
+    :param str filename: The database filename.
+    :param bool maintain:
+        If True then apply the "cache.invalidate" and "cache.max_size"
+        configuration policies (:func:`maintain`) when the file is first
+        opened by the process.
+
+    """
+    #: zlib compression level
+    COMPRESSION = 6
+
+    #: Do not record accesses more often than this (seconds).
+    ATIME_RESOLUTION = 3600
+
+    def __init__(self, filename, maintain=False):
+        Store.__init__(self)
         self.filename = filename
-        self.con = sqlite3.connect(filename)
-        self.con.execute("""
-            CREATE TABLE IF NOT EXISTS cache
-                (key TEXT UNIQUE,
-                 value TEXT
-                )
-        """)
-        self.con.execute("""
-            CREATE INDEX IF NOT EXISTS cache_index
-            ON cache (key)
-        """)
-        self.con.commit()
+        self.con, self._lock = _connection(filename)
+        if maintain:
+            key = (os.getpid(), os.path.abspath(filename))
+            if key not in _maintained:
+                _maintained.add(key)
+                self.maintain()
+
+    @classmethod
+    def _dumps(cls, value):
+        return sqlite3.Binary(zlib.compress(
+            pickle.dumps(value, protocol=2), cls.COMPRESSION))
+
+    @staticmethod
+    def _loads(data):
+        return pickle.loads(zlib.decompress(bytes(data)))
+
+    def get_many(self, keys):
+        """
+        Return a dictionary with values of all `keys` that are in the
+        store.
+        """
+        keys = list(set(keys))
+        found = {}
+        now = time.time()
+        with self._lock:
+            for chunk in _chunks(keys):
+                params = ",".join("?" * len(chunk))
+                rows = self.con.execute(
+                    "SELECT key, value FROM cache WHERE key IN (%s)" % params,
+                    chunk).fetchall()
+                for key, value in rows:
+                    try:
+                        found[key] = self._loads(value)
+                    except Exception:
+                        # A corrupt entry; treat it as missing
+                        pass
+                if rows:
+                    self._touch(chunk, now)
+        return found
+
+    def _touch(self, keys, now):
+        # Record the access time (for evict). This is only a hint, so do
+        # not wait for (or fail the read on) another writer's lock.
+        self.con.execute("PRAGMA busy_timeout = 0")
+        try:
+            with self.con:
+                self.con.execute(
+                    "UPDATE cache SET atime=? WHERE key IN (%s) "
+                    "AND atime < ?" % ",".join("?" * len(keys)),
+                    [now] + keys + [now - self.ATIME_RESOLUTION])
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            self.con.execute("PRAGMA busy_timeout = %i" % (TIMEOUT * 1000))
+
+    def set_many(self, items):
+        """
+        Store all (key, value) pairs from `items` in a single transaction.
+        """
+        now = time.time()
+        rows = []
+        for key, value in items:
+            data = self._dumps(value)
+            rows.append((key, data, len(data), now, now))
+        with self._lock, self.con:
+            self.con.executemany("""
+                INSERT OR REPLACE INTO cache
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+
+    def delete_many(self, keys):
+        """
+        Remove all `keys` from the store (in a single transaction).
+        """
+        keys = list(keys)
+        with self._lock, self.con:
+            for chunk in _chunks(keys):
+                self.con.execute(
+                    "DELETE FROM cache WHERE key IN (%s)" %
+                    ",".join("?" * len(chunk)), chunk)
 
     def __getitem__(self, key):
-        cur = self.con.execute("""
-            SELECT value
-            FROM cache
-            WHERE key=?
-        """, (key,))
-        r = cur.fetchall()
-        if not r:
+        found = self.get_many([key])
+        if key not in found:
             raise KeyError(key)
-        else:
-            pickle_str = r[0][0]
-            if not six.PY3:
-                pickle_str = str(pickle_str)
-            try:
-                return pickle.loads(pickle_str)
-            except Exception:
-                raise KeyError(key)
+        return found[key]
 
     def __setitem__(self, key, value):
-        value = pickle.dumps(value)
-        self.con.execute("""
-            INSERT OR REPLACE INTO cache
-            VALUES (?, ?)
-        """, (key, value))
-        self.con.commit()
+        self.set_many([(key, value)])
 
     def __delitem__(self, key):
-        self.con.execute("""
-            DELETE FROM cache
-            WHERE key=?
-        """, (key,))
-        self.con.commit()
+        self.delete_many([key])
+
+    def __contains__(self, key):
+        with self._lock:
+            cur = self.con.execute("SELECT 1 FROM cache WHERE key=?", (key,))
+            return cur.fetchone() is not None
 
     def keys(self):
-        cur = self.con.execute("""
-            SELECT key
-            FROM cache
-        """)
-        return [str(r[0]) for r in cur.fetchall()]
+        with self._lock:
+            cur = self.con.execute("SELECT key FROM cache")
+            return [str(r[0]) for r in cur.fetchall()]
 
-    def close(self):
-        pass
+    def __iter__(self):
+        # iterate over a snapshot of keys (so the store can be modified)
+        return iter(self.keys())
 
     def __len__(self):
-        return None
-
-    def __iter__(self):
-        return None
+        with self._lock:
+            return self.con.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def size(self):
+        """Return the total size (in bytes) of the stored values."""
+        with self._lock:
+            cur = self.con.execute("SELECT SUM(size) FROM cache")
+            return cur.fetchone()[0] or 0
+
+    def expire(self, before):
+        """
+        Remove all values stored before `before` (a datetime). Return the
+        number of removed values.
+        """
+        with self._lock, self.con:
+            cur = self.con.execute("DELETE FROM cache WHERE mtime < ?",
+                                   (_timestamp(before),))
+            return cur.rowcount
+
+    def evict(self, max_size):
+        """
+        Remove the least recently used values until the total size is at
+        most `max_size` bytes. Return the number of removed values.
+        """
+        excess = self.size() - max_size
+        if excess <= 0:
+            return 0
+        keys = []
+        with self._lock:
+            cur = self.con.execute("SELECT key, size FROM cache ORDER BY atime")
+            for key, size in cur:
+                keys.append(key)
+                excess -= size
+                if excess <= 0:
+                    break
+        self.delete_many(keys)
+        return len(keys)
+
+    def maintain(self):
+        """
+        Expire stale values by the "cache.invalidate" policy and evict the
+        least recently used ones above the "cache.max_size" (in MB)
+        limit.
+        """
+        before = invalidate_before()
+        if before is not None:
+            self.expire(before)
+        max_size = float(conf.params.get("cache.max_size") or 0)
+        if max_size > 0:
+            self.evict(int(max_size * 2 ** 20))
 
+    def close(self):
+        # the connection is shared (see close_connections)
+        pass
 
 
 class DictStore(Store, DictMixin):
+    """
+    An in memory store (with the same interface as :class:`Sqlite3Store`).
+    """
     def __init__(self):
         Store.__init__(self)
+        self._data = {}
+
+    def get_many(self, keys):
+        return dict((key, self._data[key]) for key in keys
+                    if key in self._data)
+
+    def set_many(self, items):
+        self._data.update(items)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        self._data.pop(key, None)
 
     def close(self):
         pass
 
     def __len__(self):
-        return None
+        return len(self._data)
 
     def __iter__(self):
-        return None
-
+        return iter(list(self._data))
 
 
 class cache_entry(object):
-    def __init__(self, value, mtime=None, expires=None):
+    #: The source release (a `last_modified` string) the value was
+    #: retrieved from (if known).
+    release = None
+
+    def __init__(self, value, mtime=None, expires=None, release=None):
         self.value = value
         self.mtime = mtime
         self.expires = expires
+        self.release = release
 
 _SESSION_START = datetime.now()
 
 
+def _as_datetime(d):
+    # Need to check datetime first (it subclasses date)
+    if isinstance(d, datetime):
+        return d
+    elif isinstance(d, date):
+        return datetime(d.year, d.month, d.day, 1, 1, 1)
+    else:
+        return None
+
+
+def invalidate_before(policy=None):
+    """
+    Return the time before which cached values are stale according to
+    the invalidation `policy` ("always", "session", "daily", "weekly" or
+    "never"; default is the "cache.invalidate" configuration parameter),
+    or None if they never are.
+    """
+    if policy is None:
+        policy = conf.params["cache.invalidate"]
+    if policy == "always":
+        return datetime.now()
+    elif policy == "session":
+        return _SESSION_START
+    elif policy == "daily":
+        return datetime.now().replace(hour=0, minute=0, second=0,
+                                      microsecond=0)
+    elif policy == "weekly":
+        return datetime.now() - timedelta(7)
+    else:
+        return None
+
+
 class cached_wrapper(object):
     """
-    TODO: needs documentation
+    A method wrapper caching the results in a persistent store (by the
+    method name and arguments).
+
+    Cached values are valid until they expire by the "cache.invalidate"
+    policy or the `last_modified` release of the instance changes.
     """
     def __init__(self, function, instance, class_, cache_store,
                  last_modified=None):
@@ -157,15 +430,24 @@ class cached_wrapper(object):
         if self.instance is not None:
             return self.instance.last_modified(args)
 
+    def release_from_args(self, args):
+        """
+        Return the release string to record with new cache entries (or
+        None).
+        """
+        last_modified = self.last_modified_from_args(args)
+        if isinstance(last_modified, six.string_types) and last_modified:
+            return last_modified
+        return None
+
     def invalidate_args(self, args):
         return self.invalidate_key(self.key_from_args(args))
 
     def invalidate_all(self):
         prefix = self.key_from_args(()).rstrip(",)")
-        with self.cache_store() as store:
-            for key in store:
-                if key.startswith(prefix):
-                    del store[key]
+        with closing(self.cache_store()) as store:
+            store.delete_many([key for key in store
+                               if key.startswith(prefix)])
 
     def memoize(self, args, kwargs, value, timestamp=None):
         key = self.key_from_args(args, kwargs)
@@ -173,62 +455,53 @@ class cached_wrapper(object):
             timestamp = datetime.now()
 
         with closing(self.cache_store()) as store:
-            store[key] = cache_entry(value, mtime=timestamp)
+            store[key] = cache_entry(value, mtime=timestamp,
+                                     release=self.release_from_args(args))
 
     def __call__(self, *args):
         key = self.key_from_args(args)
         with closing(self.cache_store()) as store:
-            if self.key_has_valid_cache(key, store):
-                rval = store[key].value
+            entry = store.get(key)
+            if entry is not None and self.is_entry_valid(entry, args):
+                rval = entry.value
             else:
                 rval = self.function(self.instance, *args)
-                store[key] = cache_entry(rval, datetime.now(), None)
+                store[key] = cache_entry(rval, datetime.now(), None,
+                                         self.release_from_args(args))
 
         return rval
 
     def key_has_valid_cache(self, key, store):
-        if key not in store:
-            return False
-        else:
-            entry = store[key]
-            return self.is_entry_valid(entry, None)
+        entry = store.get(key)
+        return entry is not None and self.is_entry_valid(entry, None)
+
+    def valid_entries(self, keys, store):
+        """
+        Return a dictionary of all valid cache entries for `keys` in
+        `store` (retrieved with a single query).
+        """
+        entries = store.get_many(keys)
+        return dict((key, entry) for key, entry in entries.items()
+                    if self.is_entry_valid(entry, None))
 
     def is_entry_valid(self, entry, args):
-        # For now always return True, the caching architecture needs to be
-        # completely reworked
-        return True
-
-        # Need to check datetime first (it subclasses date)
-        if isinstance(entry.mtime, datetime):
-            mtime = entry.mtime
-        elif isinstance(entry.mtime, date):
-            mtime = datetime(entry.mtime.year, entry.mtime.month,
-                             entry.mtime.day, 1, 1, 1)
-        else:
+        mtime = _as_datetime(getattr(entry, "mtime", None))
+        if mtime is None:
             return False
 
         last_modified = self.last_modified_from_args(args)
 
-        if isinstance(last_modified, date):
-            last_modified = datetime(last_modified.year, last_modified.month,
-                                     last_modified.day, 1, 1, 1)
-        elif isinstance(last_modified, str):
-            # Could have different format
-            mtime = mtime.strftime("%Y %m %d %H %M %S")
-
-        elif last_modified is None:
-            if conf.params["cache.invalidate"] == "always":
+        if isinstance(last_modified, six.string_types):
+            # A release string; the entry must be from the same release
+            if last_modified and \
+                    getattr(entry, "release", None) != last_modified:
                 return False
-            elif conf.params["cache.invalidate"] == "session":
-                last_modified = _SESSION_START
-            elif conf.params["cache.invalidate"] == "daily":
-                last_modified = datetime.now().replace(hour=0, minute=0,
-                                                       second=0, microsecond=0)
-            elif conf.params["cache.invalidate"] == "weekly":
-                last_modified = datetime.now() - timedelta(7)
-            else:  # ???
-                pass
-        return last_modified <= mtime
+        elif _as_datetime(last_modified) is not None:
+            if mtime < _as_datetime(last_modified):
+                return False
+
+        before = invalidate_before()
+        return before is None or mtime >= before
 
 
 class cached_method(object):
@@ -244,9 +517,9 @@ class cached_method(object):
     def get_cache_store(self, instance, owner):
         if hasattr(instance, "cache_store"):
             return instance.cache_store
-        elif not hasattr("_cached_method_cache"):
+        elif not hasattr(instance, "_cached_method_cache"):
             instance._cached_method_cache = DictStore()
-        return instance._cached_method_cache
+        return lambda: instance._cached_method_cache
 
 
 class bget_cached_method(cached_method):
@@ -23,10 +23,20 @@ default = """
 path = %(kegg_dir)s/
 store = sqlite3
 invalidate = weekly
+# evict the least recently used entries above this size (in MB, 0 for no
+# limit)
+max_size = 0
 
 [service]
 transport = urllib2
 # transport = requests
+# the number of concurrent requests and the maximum number of requests
+# per second (0 for no limit) when retrieving many entries
+max_workers = 4
+rate_limit = 3
+# serve all requests from an offline snapshot (see kegg.snapshot) instead
+# of the KEGG web service
+snapshot =
 
 """
 
@@ -49,7 +59,11 @@ _ALL_PARAMS = [
     "cache.path",
     "cache.store",
     "cache.invalidate",
-    "service.transport"
+    "cache.max_size",
+    "service.transport",
+    "service.max_workers",
+    "service.rate_limit",
+    "service.snapshot",
 ]
 
 for p in _ALL_PARAMS:
@@ -3,6 +3,7 @@ DBGET entry
 """
 from __future__ import absolute_import
 
+import re
 import warnings
 from collections import defaultdict
 
@@ -55,16 +56,73 @@ def entry_decorate(cls):
     return cls
 
 
+#: Matches the start of a section (a line not starting with a space) or
+#: the end of an entry ('///').
+_SECTION_RE = re.compile(r"^(?:(///)|[^ \n])", re.M)
+
+_NONBLANK_RE = re.compile(r"\S")
+
+#: Default column at which the section contents start.
+_DEFAULT_OFFSET = 12
+
+
+def _partition_title(line):
+    """
+    Split a section (or subsection) title from the rest of the line.
+    """
+    try:
+        title, rest = line.lstrip(" ").split(" ", 1)
+    except ValueError:
+        # no contents, only section title
+        title = line.strip()
+        rest = ""
+    return title, rest.lstrip(" ")
+
+
+def _index_sections(text, start=0, end=None):
+    """
+    Find the sections of the (first) entry in `text[start:end]`.
+
+    Return a tuple with a list of (title, start, end) section offsets into
+    `text`, the contents column and the offset at which the entry ends.
+    """
+    end = len(text) if end is None else end
+    sections = []
+    offset = _DEFAULT_OFFSET
+    entry_end = end
+    for match in _SECTION_RE.finditer(text, start, end):
+        pos = match.start()
+        if sections:
+            title, section_start, _ = sections[-1]
+            sections[-1] = (title, section_start, pos)
+        if match.group(1):
+            # '///' ends the entry
+            eol = text.find("\n", pos, end)
+            entry_end = end if eol == -1 else eol + 1
+            break
+        eol = text.find("\n", pos, end)
+        eol = end if eol == -1 else eol + 1
+        title, rest = _partition_title(text[pos:eol])
+        if title == "ENTRY" and not sections:
+            offset = (eol - pos) - len(rest)
+        sections.append((title, pos, end))
+    return sections, offset, entry_end
+
+
 class DBEntry(object):
     """
     A DBGET entry object.
+
+    Only the section offsets are found when the entry is constructed; the
+    field objects are created from the text when they are first accessed.
     """
     FIELDS = [("ENTRY", fields.DBEntryField)]
     MULTIPLE_FIELDS = []
 
     def __init__(self, text=None):
         self._sections = {}
-        self.fields = []
+        self._text = ""
+        self._fields = []
         if text is not None:
             self.parse(text)
 
@@ -79,68 +137,109 @@ class DBEntry(object):
         """
         Parse `text` string containing a formated DBGET entry.
         """
-        parser = DBGETEntryParser()
-        gen = parser.parse_string(text)
-        field_constructors = dict(self.FIELDS)
+        self._index(text)
 
-        current = None
-        current_subfield = None
-        entry_fields = []
-        for (event, title, text) in gen:
-            if event == DBGETEntryParser.SECTION_START:
-                if title in field_constructors:
-                    ftype = field_constructors[title]
-                else:
-                    ftype = fields.DBSimpleField
-                current = ftype(text)
-                if current.TITLE is None:
-                    current.TITLE = title
-            elif event == DBGETEntryParser.SECTION_END:
-                entry_fields.append(current)
-                current = None
-            elif event == DBGETEntryParser.SUBSECTION_START:
-                current_subfield = fields.DBSimpleField(text)
-                current_subfield.TITLE = title
-                if not isinstance(current, fields.DBFieldWithSubsections):
-                    # Upgrade simple fields to FieldWithSubsection
-                    new = fields.DBFieldWithSubsections(current.text)
-                    new.TITLE = current.TITLE
-                    current = new
-
-            elif event == DBGETEntryParser.SUBSECTION_END:
-                current.subsections.append(current_subfield)
-                current_subfield = None
-            elif event == DBGETEntryParser.TEXT:
-                if current_subfield is not None:
-                    current_subfield.text += text
-                elif current is not None:
-                    current.text += text
-            elif event == DBGETEntryParser.ENTRY_END:
-                break
-
-        self.fields = entry_fields
-        self._consolidate()
+    def _index(self, text, start=0, end=None):
+        # Index the sections of the entry in text[start:end]; return the
+        # offset at which the entry ends
+        sections, self._offset, entry_end = _index_sections(text, start, end)
+        self._text = text
+        self._order = sections
+        self._sections = {}
+        for title, section_start, section_end in sections:
+            self._sections.setdefault(title, []).append(
+                (section_start, section_end))
+        self._fields = None
+        return entry_end
+
+    def __getattr__(self, name):
+        # Create the field object(s) of section `name` on first access
+        if name.startswith("_") or name not in self.__dict__.get(
+                "_sections", {}):
+            raise AttributeError(name)
+        ranges = self._sections[name]
+        if name in self.MULTIPLE_FIELDS:
+            value = [self._make_field(name, start, end)
+                     for start, end in ranges]
+        else:
+            value = self._make_field(name, *ranges[-1])
+        setattr(self, name, value)
+        return value
+
+    def _make_field(self, title, start, end):
+        """
+        Create a field object from the section at `text[start:end]`.
+        """
+        lines = self._text[start:end].splitlines(True)
+        _, rest = _partition_title(lines[0])
+        ftype = dict(self.FIELDS).get(title, fields.DBSimpleField)
+        current = ftype(rest)
+        if current.TITLE is None:
+            current.TITLE = title
+        if title == "ENTRY":
+            return current
+
+        offset = self._offset
+        textline_start = " " * offset
+        # the text parts of the section and of each subsection
+        parts = [[rest]]
+        subtitles = []
+        for line in lines[1:]:
+            if line.startswith(textline_start):
+                parts[-1].append(line[offset:])
+            elif line.strip():
+                # A new subsection
+                subtitle, rest = _partition_title(line)
+                subtitles.append(subtitle)
+                parts.append([rest])
+
+        current.text = "".join(parts[0])
+        if subtitles and \
+                not isinstance(current, fields.DBFieldWithSubsections):
+            # Upgrade simple fields to FieldWithSubsection
+            new = fields.DBFieldWithSubsections(current.text)
+            new.TITLE = current.TITLE
+            current = new
+        for subtitle, subparts in zip(subtitles, parts[1:]):
+            subsection = fields.DBSimpleField("".join(subparts))
+            subsection.TITLE = subtitle
+            current.subsections.append(subsection)
+        return current
+
+    @property
+    def fields(self):
+        """
+        A list of all field objects (in the order of the entry text).
+        """
+        if self._fields is None:
+            self._consolidate()
+        return self._fields
 
     def _consolidate(self):
         """
-        Update mapping to field entries.
+        Create all field objects.
         """
         registered_fields = dict(self.FIELDS)
         multiple_fields = set(self.MULTIPLE_FIELDS)
-
-        for field in self.fields:
-            title = field.TITLE
+        seen = {}
+        entry_fields = []
+        for title, start, end in self._order:
             if title not in registered_fields:
-                import warnings
                 warnings.warn("Nonregisterd field %r in %r" % \
                               (title, type(self)))
-
+            # the i-th occurrence of the section
+            i = seen.get(title, 0)
+            seen[title] = i + 1
+            value = getattr(self, title)
             if title in multiple_fields:
-                if not hasattr(self, title):
-                    setattr(self, title, [])
-                getattr(self, title).append(field)
+                entry_fields.append(value[i])
+            elif i == len(self._sections[title]) - 1:
+                entry_fields.append(value)
             else:
-                setattr(self, title, field)
+                # a repeated single field (only the last one is an
+                # attribute)
+                entry_fields.append(self._make_field(title, start, end))
+        self._fields = entry_fields
 
     def __str__(self):
         return self.format()
@@ -163,3 +262,27 @@ class DBEntry(object):
                 return f.text
         else:
             return None
+
+
+def parse_entries(text, entry_type=DBEntry):
+    """
+    Parse a DBGET formated `text` with one or more entries (e.g. the
+    response to a ``get`` request for several ids) and return a list of
+    `entry_type` instances.
+
+    The entries are indexed in place (they all refer to `text`, which is
+    not split into separate strings).
+    """
+    entries = []
+    start = 0
+    while True:
+        nonblank = _NONBLANK_RE.search(text, start)
+        if nonblank is None:
+            break
+        entry = entry_type.__new__(entry_type)
+        DBEntry.__init__(entry)
+        start = entry._index(text, nonblank.start())
+        if not entry._order:
+            break
+        entries.append(entry)
+    return entries
@@ -0,0 +1,163 @@
+"""
+Gene to pathway incidence index of an organism.
+
+The index is built from a single bulk ``link pathway <org>`` KEGG api
+call and cached on disk (in a :mod:`~orangecontrib.bio.utils.colstore`
+store keyed by the organism's KEGG release).
+
+"""
+from __future__ import absolute_import
+
+import os
+
+import numpy
+import scipy.sparse
+
+from orangecontrib.bio.utils import colstore
+
+from . import conf
+
+#: Version of the on disk index format.
+CACHE_VERSION = 1
+
+
+def _index_path(org):
+    return os.path.join(conf.params["cache.path"], "pathway_index", org)
+
+
+class PathwayIndex(object):
+    """
+    A (pathways x genes) membership matrix.
+
+    :param list genes: Sorted KEGG gene ids (e.g. 'hsa:672').
+    :param list pathways: Sorted KEGG pathway ids (e.g. 'path:hsa00010').
+    :param membership: A (pathways x genes) CSR matrix of ones.
+
+    """
+    def __init__(self, genes, pathways, membership):
+        #: A list of all gene ids (columns).
+        self.genes = genes
+        #: A list of all pathway ids (rows).
+        self.pathways = pathways
+        #: A dict mapping gene ids to columns.
+        self.gene_index = dict((g, i) for i, g in enumerate(genes))
+        #: A dict mapping pathway ids to rows.
+        self.pathway_index = dict((p, i) for i, p in enumerate(pathways))
+        #: Pathway membership as a (n_pathways x n_genes) CSR matrix.
+        self.membership = membership
+        self._gene_array = None
+
+    @classmethod
+    def from_links(cls, links):
+        """
+        Build the index from a sequence of (gene id, pathway id) pairs
+        (as returned by ``KeggApi.link("pathway", org)``).
+        """
+        links = list(links)
+        genes = sorted(set(g for g, _ in links))
+        pathways = sorted(set(p for _, p in links))
+        gene_index = dict((g, i) for i, g in enumerate(genes))
+        pathway_index = dict((p, i) for i, p in enumerate(pathways))
+        rows = numpy.fromiter((pathway_index[p] for _, p in links),
+                              dtype=numpy.int32, count=len(links))
+        cols = numpy.fromiter((gene_index[g] for g, _ in links),
+                              dtype=numpy.int32, count=len(links))
+        membership = scipy.sparse.csr_matrix(
+            (numpy.ones(len(links), dtype=numpy.int8), (rows, cols)),
+            shape=(len(pathways), len(genes)))
+        membership.sum_duplicates()
+        membership.data[:] = 1
+        membership.sort_indices()
+        return cls(genes, pathways, membership)
+
+    @classmethod
+    def load(cls, path, release):
+        """
+        Load the index stored at `path` for KEGG `release`. Return None if
+        there is no such (valid) index.
+        """
+        store = colstore.Store.open(path, CACHE_VERSION, {"release": release})
+        if store is None:
+            return None
+        shape = tuple(store.value("shape"))
+        membership = scipy.sparse.csr_matrix(
+            (numpy.ones(len(store.array("indices")), dtype=numpy.int8),
+             numpy.asarray(store.array("indices")),
+             numpy.asarray(store.array("indptr"))),
+            shape=shape)
+        return cls(store.strings("genes").tolist(),
+                   store.strings("pathways").tolist(), membership)
+
+    def save(self, path, release):
+        """Save the index to `path` for KEGG `release`."""
+        with colstore.StoreWriter(path, CACHE_VERSION,
+                                  {"release": release}) as writer:
+            writer.add_strings("genes", self.genes)
+            writer.add_strings("pathways", self.pathways)
+            writer.add_array("indices", self.membership.indices)
+            writer.add_array("indptr", self.membership.indptr)
+            writer.add_meta("shape", list(self.membership.shape))
+
+    def gene_mask(self, genes):
+        """
+        Return a boolean array over :obj:`genes` marking `genes`.
+        Unknown gene ids are ignored.
+        """
+        mask = numpy.zeros(len(self.genes), dtype=bool)
+        idx = [self.gene_index[g] for g in genes if g in self.gene_index]
+        mask[idx] = True
+        return mask
+
+    def counts(self, mask):
+        """
+        Return the number of genes in `mask` in each pathway.
+        """
+        return self.membership.dot(mask.astype(numpy.int32))
+
+    def pathway_genes(self, pathways, mask):
+        """
+        Return a list of gene ids in `mask` for each of the (integer)
+        `pathways`.
+        """
+        sub = self.membership[numpy.asarray(pathways, dtype=int)]
+        keep = mask[sub.indices]
+        bounds = numpy.concatenate([[0], numpy.cumsum(keep)])[sub.indptr]
+        if self._gene_array is None:
+            self._gene_array = numpy.array(self.genes, dtype=object)
+        names = self._gene_array[sub.indices[keep]]
+        return [names[start:end].tolist()
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def pathways_by_genes(self, genes):
+        """
+        Return a sorted list of pathway ids that include all `genes`.
+        """
+        genes = set(genes)
+        if not genes or not genes <= set(self.gene_index):
+            return []
+        counts = self.counts(self.gene_mask(genes))
+        return [self.pathways[i] for i in numpy.flatnonzero(counts == len(genes))]
+
+
+def pathway_index(org, api=None):
+    """
+    Return the :class:`PathwayIndex` for KEGG organism code `org`.
+
+    The index is loaded from the local cache if it exists for the current
+    KEGG release of the organism, else it is built (with a single
+    ``link pathway <org>`` call) and cached.
+
+    :param str org: KEGG organism code.
+    :param api: A :class:`~.api.CachedKeggApi` instance to use.
+
+    """
+    if api is None:
+        from .api import CachedKeggApi
+        api = CachedKeggApi()
+    release = api.info(org).release
+    path = _index_path(org)
+    index = PathwayIndex.load(path, release)
+    if index is None:
+        index = PathwayIndex.from_links(api.link("pathway", org))
+        index.save(path, release)
+    return index
@@ -3,6 +3,11 @@
 """
 from __future__ import absolute_import
 
+from contextlib import closing
+
+from six.moves.urllib.parse import quote
+from six.moves.urllib.request import urlopen
+
 REST_API = "http://rest.kegg.jp/"
 
 
@@ -27,8 +32,69 @@ def slumber_service():
     return slumber_service._cached
 
 
-from . import conf
+class _RestResource(object):
+    def __init__(self, url, timeout):
+        self._url = url
+        self._timeout = timeout
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _RestResource(self._url + "/" + name, self._timeout)
+
+    def __call__(self, arg):
+        return _RestResource(self._url + "/" + quote(str(arg), safe=":+"),
+                             self._timeout)
+
+    def get(self):
+        with closing(urlopen(self._url, timeout=self._timeout)) as response:
+            return response.read().decode("utf-8")
+
+
+class rest_service(object):
+    """
+    A minimal rest service (with the same interface as the `slumber`
+    based service) using only the standard library. It is safe to use
+    from multiple threads.
+
+    :param str url: The base url of the REST api.
+    :param float timeout: Request timeout in seconds.
 
-default_service = slumber_service
+    """
+    def __init__(self, url=REST_API, timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _RestResource(self.url + "/" + name, self.timeout)
+
+
+def default_service():
+    """
+    Return a :class:`~.snapshot.snapshot_service` if the
+    "service.snapshot" configuration parameter is set, else the `slumber`
+    based service if available, else a :class:`rest_service`.
+    """
+    path = conf.params["service.snapshot"]
+    if path:
+        cached = getattr(default_service, "_snapshot", None)
+        if cached is None or cached.snapshot.path != path:
+            from .snapshot import snapshot_service
+            cached = default_service._snapshot = snapshot_service(path)
+        return cached
+
+    try:
+        import slumber
+    except ImportError:
+        if not hasattr(default_service, "_cached"):
+            default_service._cached = rest_service()
+        return default_service._cached
+    else:
+        return slumber_service()
+
+
+from . import conf
 
-web_service = slumber_service
+web_service = default_service
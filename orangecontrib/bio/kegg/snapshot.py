@@ -0,0 +1,281 @@
+"""
+Offline KEGG snapshots.
+
+A snapshot is a :mod:`~orangecontrib.bio.utils.colstore` store with the
+raw KEGG REST api responses for the organism list, pathway lists, gene
+lists, gene to pathway/enzyme/KO links and id conversion tables of a set
+of organisms (and optionally some DBGET entries). It is memory mapped
+when opened so a single snapshot can serve any number of processes
+without network access.
+
+Build a snapshot with::
+
+    python -m orangecontrib.bio.kegg.snapshot kegg-snapshot hsa mmu
+
+and use it by setting the "service.snapshot" configuration parameter
+(or by passing `snapshot` to :class:`~.api.CachedKeggApi`).
+
+"""
+from __future__ import absolute_import
+
+import bisect
+from datetime import datetime
+
+import six
+
+from orangecontrib.bio.utils import colstore
+
+#: Version of the snapshot format.
+SNAPSHOT_VERSION = 1
+
+#: Databases whose entry lists are included in every snapshot.
+DATABASES = ["genome", "pathway"]
+
+#: (target, source) link tables included for each organism.
+ORGANISM_LINKS = [("pathway", "{org}"), ("enzyme", "{org}"), ("ko", "{org}")]
+
+#: (target, source) conversion tables included for each organism.
+ORGANISM_CONV = [("{org}", "ncbi-geneid"), ("{org}", "ncbi-proteinid")]
+
+
+def _request(service, path):
+    # Perform a REST request given as a list of path components
+    # (e.g. ["link", "pathway", "hsa"]).
+    resource = getattr(service, path[0])
+    for part in path[1:]:
+        resource = resource(part)
+    return resource.get()
+
+
+def snapshot_requests(organisms, databases=DATABASES):
+    """
+    Return a list of REST request paths (lists of components) to include
+    in a snapshot of `organisms`.
+    """
+    requests = [["list", "organism"]]
+    for db in databases:
+        requests += [["info", db], ["list", db]]
+    for org in organisms:
+        requests += [["info", org], ["list", org], ["list", "pathway", org]]
+        requests += [["link", target, source.format(org=org)]
+                     for target, source in ORGANISM_LINKS]
+        requests += [["conv", target.format(org=org), source]
+                     for target, source in ORGANISM_CONV]
+    return requests
+
+
+def build_snapshot(path, organisms, databases=DATABASES, entries=(),
+                   api=None, progress_callback=None):
+    """
+    Retrieve the data for `organisms` from KEGG and write a snapshot to
+    `path`.
+
+    Besides the list, link and conv tables the snapshot includes the
+    GENOME entries of the `organisms` and the DBGET `entries` (a list of
+    ids with the database prefix, e.g. 'path:hsa00010').
+
+    :param str path: The snapshot (directory) path.
+    :param list organisms: KEGG organism codes.
+    :param list databases: Databases to include the entry lists of.
+    :param list entries: Additional DBGET entry ids to include.
+    :param api: A :class:`~.api.CachedKeggApi` to retrieve the data with
+        (the entries are cached, so an interrupted build can be resumed).
+    :param progress_callback:
+        An optional function called with the percentage of finished
+        requests.
+
+    """
+    if api is None:
+        from .api import CachedKeggApi
+        api = CachedKeggApi()
+
+    requests = snapshot_requests(organisms, databases)
+    responses = {}
+    for i, request in enumerate(requests):
+        responses["/".join(request)] = _request(api.service, request)
+        if progress_callback:
+            progress_callback(50.0 * (i + 1) / len(requests))
+
+    codes = dict((org.org_code, org.entry_id)
+                 for org in api.list_organisms())
+    genomes = dict(("genome:" + codes[org], "genome:" + org)
+                   for org in organisms if org in codes)
+    ids = sorted(set(list(genomes) + list(entries)))
+
+    def fetch_progress(p):
+        if progress_callback:
+            progress_callback(50.0 + p / 2)
+
+    api.fetch(ids, progress_callback=fetch_progress)
+    texts = api.cached_entries(ids)
+    found = [(id, text) for id, text in zip(ids, texts) if text]
+    # GENOME entries are also retrieved by organism code
+    found += [(genomes[id], text) for id, text in found if id in genomes]
+    found.sort()
+
+    release = api.info("pathway").release
+    keys = sorted(responses)
+    with colstore.StoreWriter(path, SNAPSHOT_VERSION) as writer:
+        writer.add_strings("requests", keys)
+        writer.add_strings("responses", [responses[k] for k in keys])
+        writer.add_strings("entry_ids", [id for id, _ in found])
+        writer.add_strings("entries", [text for _, text in found])
+        writer.add_meta("release", release)
+        writer.add_meta("organisms", list(organisms))
+        writer.add_meta("created", datetime.now().isoformat())
+
+
+class KeggSnapshot(object):
+    """
+    Read only access to a snapshot written by :func:`build_snapshot`.
+
+    :param str path: The snapshot path.
+
+    """
+    def __init__(self, path):
+        store = colstore.Store.open(path, SNAPSHOT_VERSION)
+        if store is None:
+            raise ValueError("%r is not a KEGG snapshot" % path)
+        self.path = path
+        self._requests = store.strings("requests")
+        self._responses = store.strings("responses")
+        self._entry_ids = store.strings("entry_ids")
+        self._entries = store.strings("entries")
+        #: The KEGG (pathway database) release of the snapshot.
+        self.release = store.value("release")
+        #: Organism codes included in the snapshot.
+        self.organisms = store.value("organisms", [])
+
+    @staticmethod
+    def _lookup(keys, values, key):
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return values[i]
+        return None
+
+    def response(self, path):
+        """
+        Return the stored response for a REST request `path` (a list of
+        components). Raise a :class:`KeyError` if it is not in the
+        snapshot.
+        """
+        method = path[0]
+        if method == "get":
+            return self._get("+".join(path[1:]).split("+"))
+
+        text = self._lookup(self._requests, self._responses, "/".join(path))
+        if text is not None:
+            return text
+        elif method in ("link", "conv") and len(path) == 3:
+            return self._filter_table(path)
+        elif method == "find" and len(path) == 3:
+            return self._find(path[1], path[2])
+        raise KeyError("/".join(path))
+
+    def entry(self, id):
+        """
+        Return the DBGET entry text for `id` (or None if it is not in the
+        snapshot).
+        """
+        return self._lookup(self._entry_ids, self._entries, id)
+
+    def _get(self, ids):
+        return "".join(text for text in map(self.entry, ids)
+                       if text is not None)
+
+    def _filter_table(self, path):
+        # link/conv for a list of ids, answered from the whole organism's
+        # (or database's) table
+        method, target, ids = path
+        ids = ids.split("+")
+        lines = []
+        for source in sorted(set(id.split(":", 1)[0] for id in ids)):
+            table = self._lookup(self._requests, self._responses,
+                                 "/".join([method, target, source]))
+            if table is None:
+                raise KeyError("/".join(path))
+            selected = set(ids)
+            lines.extend(line for line in table.splitlines()
+                         if line.split("\t", 1)[0] in selected)
+        return "".join(line + "\n" for line in lines)
+
+    def _find(self, db, keywords):
+        # a case insensitive keyword search in the database's entry list
+        table = self._lookup(self._requests, self._responses, "list/" + db)
+        if table is None:
+            raise KeyError("find/%s/%s" % (db, keywords))
+        keywords = [k.lower() for k in keywords.split("+") if k]
+        return "".join(line + "\n" for line in table.splitlines()
+                       if all(k in line.lower() for k in keywords))
+
+
+class _SnapshotResource(object):
+    def __init__(self, snapshot, path):
+        self._snapshot = snapshot
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _SnapshotResource(self._snapshot, self._path + [name])
+
+    def __call__(self, arg):
+        return _SnapshotResource(self._snapshot,
+                                 self._path + [six.text_type(arg)])
+
+    def get(self):
+        return self._snapshot.response(self._path)
+
+
+class snapshot_service(object):
+    """
+    A service (with the same interface as :class:`.service.rest_service`)
+    answering the requests from a :class:`KeggSnapshot`.
+
+    :param snapshot: A :class:`KeggSnapshot` or a snapshot path.
+
+    """
+    #: The service does not modify its data (the responses need not be
+    #: cached).
+    read_only = True
+
+    def __init__(self, snapshot):
+        if isinstance(snapshot, six.string_types):
+            snapshot = KeggSnapshot(snapshot)
+        self.snapshot = snapshot
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _SnapshotResource(self.snapshot, [name])
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Build an offline KEGG snapshot.")
+    parser.add_argument("path", help="Output snapshot path")
+    parser.add_argument("organisms", nargs="+", help="KEGG organism codes")
+    parser.add_argument("--pathway-entries", action="store_true",
+                        help="Include the organisms' pathway entries")
+    args = parser.parse_args(argv)
+
+    from .api import CachedKeggApi
+    api = CachedKeggApi()
+    entries = []
+    if args.pathway_entries:
+        for org in args.organisms:
+            entries.extend(p.entry_id for p in api.list_pathways(org))
+
+    def progress(p):
+        sys.stderr.write("\r%5.1f %%" % p)
+
+    build_snapshot(args.path, args.organisms, entries=entries, api=api,
+                   progress_callback=progress)
+    sys.stderr.write("\n")
+
+
+if __name__ == "__main__":
+    main()
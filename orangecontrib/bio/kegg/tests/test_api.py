@@ -1,4 +1,5 @@
 import unittest
+import warnings
 import tempfile
 import shutil
 
@@ -115,3 +116,112 @@ def load_tests(loader, tests, ignore):
         )
     )
     return tests
+
+
+class KeggStandIn(object):
+    """
+    A local HTTP server standing in for the KEGG REST api 'get' method.
+    """
+    def __init__(self):
+        from six.moves import BaseHTTPServer
+        import threading
+
+        self.requests = []
+        self.fail = set()
+        self.missing = set()
+        stand_in = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                _, method, arg = self.path.split("/", 2)
+                ids = arg.split("+")
+                stand_in.requests.append(ids)
+                if method != "get" or stand_in.fail & set(ids):
+                    self.send_error(500)
+                    return
+                body = "".join(
+                    "ENTRY       {}  Test\nNAME        {}\n///\n".format(
+                        id.split(":", 1)[1], id)
+                    for id in ids if id not in stand_in.missing)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.end_headers()
+                self.wfile.write(body.encode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%i/" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestFetch(unittest.TestCase):
+    def setUp(self):
+        from orangecontrib.bio.kegg import service
+        self.tmpdir = tempfile.mkdtemp(prefix="kegg-tests")
+        self.old_cache_path = keggconf.params["cache.path"]
+        keggconf.params["cache.path"] = self.tmpdir
+        self.stand_in = KeggStandIn()
+        self.api = keggapi.CachedKeggApi()
+        self.api.service = service.rest_service(self.stand_in.url)
+
+    def tearDown(self):
+        from orangecontrib.bio.kegg import caching
+        self.stand_in.close()
+        caching.close_connections()
+        keggconf.params["cache.path"] = self.old_cache_path
+        shutil.rmtree(self.tmpdir)
+
+    def test_fetch(self):
+        ids = ["hsa:%i" % i for i in range(1, 36)]
+        progress = []
+        self.api.fetch(ids, max_workers=3, rate_limit=0,
+                       progress_callback=progress.append)
+        self.assertEqual(len(self.stand_in.requests), 4)
+        self.assertEqual(sorted(sum(self.stand_in.requests, [])),
+                         sorted(ids))
+        self.assertEqual(progress[-1], 100.0)
+
+        text = self.api.get(["hsa:3", "hsa:1"])
+        self.assertEqual(text.count("///\n"), 2)
+        self.assertLess(text.index("hsa:3"), text.index("hsa:1"))
+        self.assertEqual(len(self.stand_in.requests), 4)
+
+    def test_missing(self):
+        ids = ["hsa:%i" % i for i in range(1, 8)]
+        self.stand_in.missing = set(["hsa:3", "hsa:5"])
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            self.api.fetch(ids, rate_limit=0)
+        self.assertEqual(len(self.stand_in.requests), 1)
+
+        # ids without an entry are cached too
+        self.api.fetch(ids, rate_limit=0)
+        text = self.api.get(["hsa:3", "hsa:4"])
+        self.assertEqual(len(self.stand_in.requests), 1)
+        self.assertEqual(text.count("///\n"), 1)
+        entries = self.api.cached_entries(ids)
+        self.assertEqual([id for id, e in zip(ids, entries) if e is None],
+                         ["hsa:3", "hsa:5"])
+
+    def test_resume(self):
+        ids = ["hsa:%i" % i for i in range(1, 51)]
+        self.stand_in.fail = set(["hsa:25"])
+        with self.assertRaises(Exception):
+            self.api.fetch(ids, max_workers=1, rate_limit=0)
+        self.stand_in.fail = set()
+        failed = len(self.stand_in.requests)
+        self.api.fetch(ids, max_workers=2, rate_limit=0)
+        retried = sum(self.stand_in.requests[failed:], [])
+        self.assertIn("hsa:25", retried)
+        # the first batch was stored before the failure
+        self.assertFalse(set(self.stand_in.requests[0]) & set(retried))
+        self.assertEqual(set(retried) | set(self.stand_in.requests[0]),
+                         set(ids))
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from orangecontrib.bio.kegg import caching
+from orangecontrib.bio.kegg import conf as keggconf
+
+
+class TestSqlite3Store(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="kegg-tests")
+        self.filename = os.path.join(self.tmpdir, "store.sqlite3")
+
+    def tearDown(self):
+        caching.close_connections()
+        shutil.rmtree(self.tmpdir)
+
+    def test_store(self):
+        store = caching.Sqlite3Store(self.filename)
+        store["a"] = [1, 2, 3]
+        store.set_many([("b", "x" * 10000), ("c", None)])
+        self.assertEqual(store["a"], [1, 2, 3])
+        self.assertEqual(store.get_many(["a", "b", "d"]),
+                         {"a": [1, 2, 3], "b": "x" * 10000})
+        self.assertIn("c", store)
+        self.assertNotIn("d", store)
+        self.assertRaises(KeyError, lambda: store["d"])
+        self.assertEqual(len(store), 3)
+        self.assertEqual(sorted(store), ["a", "b", "c"])
+        # values are compressed
+        self.assertLess(store.size(), 1000)
+
+        del store["a"]
+        store.delete_many(["b"])
+        self.assertEqual(sorted(caching.Sqlite3Store(self.filename)), ["c"])
+
+    def test_old_schema(self):
+        con = sqlite3.connect(self.filename)
+        con.execute("CREATE TABLE cache (key TEXT UNIQUE, value TEXT)")
+        con.execute("INSERT INTO cache VALUES ('a', 'garbage')")
+        con.commit()
+        con.close()
+        store = caching.Sqlite3Store(self.filename)
+        self.assertEqual(len(store), 0)
+        store["a"] = 1
+        self.assertEqual(store["a"], 1)
+
+    def test_eviction(self):
+        store = caching.Sqlite3Store(self.filename)
+        store.ATIME_RESOLUTION = 0
+        for key in "abcd":
+            store[key] = os.urandom(1000)
+        store.get_many(["a"])
+        store.evict(store.size() - 1)
+        self.assertEqual(sorted(store), ["a", "c", "d"])
+
+        self.assertEqual(store.expire(datetime.now() - timedelta(1)), 0)
+        self.assertEqual(store.expire(datetime.now() + timedelta(1)), 3)
+        self.assertEqual(len(store), 0)
+
+    def test_read_while_locked(self):
+        store = caching.Sqlite3Store(self.filename)
+        store.ATIME_RESOLUTION = 0
+        store["a"] = 1
+        # another writer holds the write lock
+        other = sqlite3.connect(self.filename, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            self.assertEqual(store.get_many(["a"]), {"a": 1})
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        store["b"] = 2
+        self.assertEqual(store["b"], 2)
+
+
+class TestCachedWrapper(unittest.TestCase):
+    class Api(object):
+        release = ""
+
+        def __init__(self, store):
+            self.calls = 0
+            self._store = store
+
+        def cache_store(self):
+            return self._store
+
+        def last_modified(self, args):
+            return self.release
+
+        @caching.cached_method
+        def method(self, arg):
+            self.calls += 1
+            return arg * 2
+
+    def setUp(self):
+        self.policy = keggconf.params["cache.invalidate"]
+
+    def tearDown(self):
+        keggconf.params["cache.invalidate"] = self.policy
+
+    def test_valid(self):
+        api = self.Api(caching.DictStore())
+        keggconf.params["cache.invalidate"] = "weekly"
+        self.assertEqual(api.method(2), 4)
+        self.assertEqual(api.method(2), 4)
+        self.assertEqual(api.calls, 1)
+
+        key = api.method.key_from_args((2,))
+        entry = api.cache_store()[key]
+        entry.mtime = datetime.now() - timedelta(8)
+        self.assertFalse(api.method.is_entry_valid(entry, (2,)))
+        keggconf.params["cache.invalidate"] = "never"
+        self.assertTrue(api.method.is_entry_valid(entry, (2,)))
+
+        keggconf.params["cache.invalidate"] = "always"
+        api.method(2)
+        self.assertEqual(api.calls, 2)
+
+    def test_release(self):
+        api = self.Api(caching.DictStore())
+        keggconf.params["cache.invalidate"] = "never"
+        api.release = "81.0"
+        api.method(1)
+        api.method(1)
+        self.assertEqual(api.calls, 1)
+        api.release = "82.0"
+        api.method(1)
+        self.assertEqual(api.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,7 +3,8 @@ import doctest
 
 import unittest
 
-from orangecontrib.bio.kegg.entry import parser, fields, DBEntry, entry_decorate
+from orangecontrib.bio.kegg.entry import parser, fields, DBEntry, \
+    entry_decorate, parse_entries
 
 
 TEST_ENTRY = """\
@@ -33,6 +34,31 @@ class TestEntry(unittest.TestCase):
         self.assertEqual(entry.ENTRY.TITLE, "ENTRY")
         self.assertEqual(str(entry), TEST_ENTRY[:-4])
 
+    def test_lazy(self):
+        entry = Entry(TEST_ENTRY)
+        self.assertNotIn("DESCRIPTION", entry.__dict__)
+        self.assertEqual(entry.NAME.text, "test\n")
+        self.assertNotIn("DESCRIPTION", entry.__dict__)
+        description = entry.DESCRIPTION
+        self.assertIsInstance(description, fields.DBFieldWithSubsections)
+        self.assertEqual(description.text,
+                         "This is a test's description.\n"
+                         "It spans\nmultiple lines\n")
+        self.assertEqual(description.subsections[0].TITLE, "SUB")
+        self.assertIs(entry.DESCRIPTION, description)
+        self.assertIsNone(getattr(entry, "GENE", None))
+        self.assertEqual([f.TITLE for f in entry.fields],
+                         ["ENTRY", "NAME", "DESCRIPTION"])
+
+    def test_parse_entries(self):
+        text = TEST_ENTRY + TEST_ENTRY.replace("test_id", "other_id") + "\n"
+        entries = parse_entries(text, Entry)
+        self.assertEqual([e.entry_key for e in entries],
+                         ["test_id", "other_id"])
+        self.assertEqual(str(entries[1]),
+                         TEST_ENTRY[:-4].replace("test_id", "other_id"))
+        self.assertEqual(parse_entries(""), [])
+
 
 class TestParser(unittest.TestCase):
     def test_parser(self):
@@ -0,0 +1,102 @@
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import backports.unittest_mock
+    backports.unittest_mock.install()
+    from unittest import mock
+
+from orangecontrib.bio import kegg
+from orangecontrib.bio.kegg import api as keggapi
+from orangecontrib.bio.kegg import caching
+from orangecontrib.bio.kegg import conf as keggconf
+from orangecontrib.bio.kegg import pathway_index
+from orangecontrib.bio.utils import stats
+
+from .test_api import namespace
+
+info_hsa = """\
+T01001           Homo sapiens (human) KEGG Genes Database
+hsa              Release 81.0+/01-18, Jan 17
+                 Kanehisa Laboratories
+                 34,567 entries
+"""
+
+link_pathway_hsa = """\
+hsa:1\tpath:hsa00010
+hsa:2\tpath:hsa00010
+hsa:3\tpath:hsa00010
+hsa:3\tpath:hsa00020
+hsa:4\tpath:hsa00020
+hsa:5\tpath:hsa00030
+"""
+
+
+class TestPathwayIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="kegg-tests")
+        self.old_cache_path = keggconf.params["cache.path"]
+        keggconf.params["cache.path"] = self.tmpdir
+        self.calls = []
+
+        def link(target):
+            def source(org):
+                self.calls.append((target, org))
+                return namespace(get=lambda: link_pathway_hsa)
+            return source
+
+        self.api = keggapi.CachedKeggApi()
+        self.api.service = namespace(
+            info=lambda db: namespace(get=lambda: info_hsa),
+            link=link)
+
+    def tearDown(self):
+        caching.close_connections()
+        keggconf.params["cache.path"] = self.old_cache_path
+        shutil.rmtree(self.tmpdir)
+
+    def test_index(self):
+        index = pathway_index.pathway_index("hsa", self.api)
+        self.assertEqual(index.pathways, ["path:hsa00010", "path:hsa00020",
+                                          "path:hsa00030"])
+        self.assertEqual(list(index.counts(index.gene_mask(["hsa:3", "x"]))),
+                         [1, 1, 0])
+        self.assertEqual(index.pathways_by_genes(["hsa:3"]),
+                         ["path:hsa00010", "path:hsa00020"])
+        self.assertEqual(index.pathways_by_genes(["hsa:3", "hsa:4"]),
+                         ["path:hsa00020"])
+        self.assertEqual(index.pathways_by_genes(["hsa:3", "x"]), [])
+
+        cached = pathway_index.pathway_index("hsa", self.api)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cached.genes, index.genes)
+        self.assertEqual((cached.membership != index.membership).nnz, 0)
+
+        self.api.service.info = lambda db: namespace(
+            get=lambda: info_hsa.replace("81.0", "82.0"))
+        self.api.info.cache_clear()
+        pathway_index.pathway_index("hsa", self.api)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_enriched_pathways(self):
+        with mock.patch.object(kegg, "organism_name_search", lambda n: n):
+            organism = kegg.Organism("hsa")
+        organism.api = self.api
+        reference = ["hsa:%i" % i for i in range(1, 11)]
+        res = organism.get_enriched_pathways(["hsa:1", "hsa:3", "hsa:9"],
+                                             reference=reference)
+        self.assertEqual(set(res), set(["path:hsa00010", "path:hsa00020"]))
+        genes, p, ref = res["path:hsa00010"]
+        self.assertEqual(genes, ["hsa:1", "hsa:3"])
+        self.assertEqual(ref, 3)
+        self.assertAlmostEqual(p, stats.Binomial().p_value(2, 10, 3, 3))
+        self.assertEqual(res["path:hsa00020"][0], ["hsa:3"])
+        self.assertEqual(organism.pathways(["hsa:1", "hsa:2"]),
+                         ["path:hsa00010"])
+
+
+if __name__ == "__main__":
+    unittest.main()
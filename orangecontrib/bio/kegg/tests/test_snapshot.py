@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from orangecontrib.bio.kegg import api as keggapi
+from orangecontrib.bio.kegg import caching
+from orangecontrib.bio.kegg import conf as keggconf
+from orangecontrib.bio.kegg import databases
+from orangecontrib.bio.kegg import pathway_index
+from orangecontrib.bio.kegg import snapshot
+
+from .test_api import list_organism, list_pathway_hsa, info_pathway, \
+    genome_T01001
+
+
+class Resource(object):
+    """A stand in for a REST service resource answered from a dict."""
+    def __init__(self, responses, path):
+        self.responses = responses
+        self.path = path
+
+    def __getattr__(self, name):
+        return Resource(self.responses, self.path + [name])
+
+    def __call__(self, arg):
+        return Resource(self.responses, self.path + [arg])
+
+    def get(self):
+        path = "/".join(self.path)
+        if self.path[0] == "get":
+            return "".join(self.responses["get/" + id]
+                           for id in self.path[1].split("+"))
+        return self.responses[path]
+
+
+class Service(object):
+    def __init__(self, responses):
+        self.responses = responses
+
+    def __getattr__(self, name):
+        return Resource(self.responses, [name])
+
+
+RESPONSES = {
+    "list/organism": list_organism,
+    "info/pathway": info_pathway,
+    "info/genome": info_pathway,
+    "info/hsa": info_pathway,
+    "list/pathway": "path:map00010\tGlycolysis / Gluconeogenesis\n",
+    "list/genome": "gn:T01001\thsa, HUMAN, 9606; Homo sapiens (human)\n"
+                   "gn:T00005\tsce, YEAST, 559292; Saccharomyces cerevisiae\n",
+    "list/hsa": "hsa:1\tA1BG; alpha-1-B glycoprotein\n"
+                "hsa:2\tA2M; alpha-2-macroglobulin\n",
+    "list/pathway/hsa": list_pathway_hsa,
+    "link/pathway/hsa": "hsa:1\tpath:hsa00010\nhsa:2\tpath:hsa00020\n",
+    "link/enzyme/hsa": "hsa:2\tec:1.1.1.1\n",
+    "link/ko/hsa": "hsa:1\tko:K00001\nhsa:2\tko:K00002\n",
+    "conv/hsa/ncbi-geneid": "ncbi-geneid:1\thsa:1\nncbi-geneid:2\thsa:2\n",
+    "conv/hsa/ncbi-proteinid": "",
+    "get/genome:T01001": genome_T01001,
+}
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="kegg-tests")
+        self.old_params = dict(keggconf.params)
+        keggconf.params["cache.path"] = os.path.join(self.tmpdir, "cache")
+        self.path = os.path.join(self.tmpdir, "snapshot")
+
+        api = keggapi.CachedKeggApi()
+        api.service = Service(RESPONSES)
+        snapshot.build_snapshot(self.path, ["hsa"], api=api)
+
+    def tearDown(self):
+        caching.close_connections()
+        keggconf.params.update(self.old_params)
+        shutil.rmtree(self.tmpdir)
+
+    def test_snapshot(self):
+        api = keggapi.CachedKeggApi(snapshot=self.path)
+        self.assertEqual(api.service.snapshot.release,
+                         "81.0+/01-18, Jan 17")
+        self.assertEqual([o.org_code for o in api.list_organisms()],
+                         ["hsa", "sce", "ddi"])
+        self.assertEqual(len(api.list_pathways("hsa")), 3)
+        self.assertEqual(api.get_genes_by_organism("hsa"), ["hsa:1", "hsa:2"])
+        self.assertEqual(api.conv("hsa", "ncbi-geneid")[0],
+                         ("ncbi-geneid:1", "hsa:1"))
+        self.assertEqual(api.link("ko", ids=["hsa:2"]),
+                         [("hsa:2", "ko:K00002")])
+        self.assertEqual(api.get(["genome:T01001"]), genome_T01001)
+        self.assertEqual(api.get(["genome:hsa"]), genome_T01001)
+        self.assertIn("hsa", api.find("genome", "sapiens"))
+        with self.assertRaises(KeyError):
+            api.list("compound")
+
+        index = pathway_index.pathway_index("hsa", api)
+        self.assertEqual(index.pathways_by_genes(["hsa:1"]), ["path:hsa00010"])
+
+    def test_configured(self):
+        keggconf.params["service.snapshot"] = self.path
+        genome = databases.Genome()
+        self.assertEqual(genome.org_code_to_entry_key("hsa"), "T01001")
+        self.assertEqual(genome["T01001"].organism_code, "hsa")
+        self.assertEqual(genome.search("Homo sapiens"), ["hsa"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -543,8 +543,10 @@ class obiMeSH(object):
                         self.statistics[k][1] += 1  # increased noCluster
         self.ratio = float(cln) / float(n)
         # enrichment
-        for i in self.statistics.iterkeys():
-            self.statistics[i][2] = HYPERG.p_value(int(self.statistics[i][1]), int(n), int(cln), int(self.statistics[i][0]))
+        keys = self.statistics.keys()
+        pvals = HYPERG.p_values([int(self.statistics[i][1]) for i in keys], int(n), int(cln), [int(self.statistics[i][0]) for i in keys])
+        for i, pval in zip(keys, pvals):
+            self.statistics[i][2] = float(pval)
             self.statistics[i][3] = float(self.statistics[i][1]) / float(self.statistics[i][0]) / self.ratio   # fold enrichment
         self.calculated = True
 
@@ -3,11 +3,15 @@ import sqlite3
 import tarfile
 import shutil
 import tempfile
-import collections
 import textwrap
 
 from collections import namedtuple
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 try:
     from urllib2 import urlopen
 except ImportError:
@@ -15,6 +19,8 @@ except ImportError:
 
 import six
 
+from .taxonomy_index import TaxonomyIndex
+
 __all__ = ["Taxonomy"]
 
 pjoin = os.path.join
@@ -45,26 +51,27 @@ class taxon(_taxon):
     _repr_pretty_ = namedtuple_repr_pretty
 
 
-class Taxonomy(collections.Mapping):
+class Taxonomy(Mapping):
     SCHEMA_VERSION = (0, 0, 1)
 
     def __init__(self, taxdb):
+        self._filename = taxdb
         self._con = sqlite3.connect(taxdb, timeout=15)
         self._con.execute("""
             CREATE INDEX IF NOT EXISTS
                 index_names_tax_id ON names(tax_id)
         """)
+        self._index = None
 
-    def __node_query(self, tax_id):
-        c = self._con.execute("""
-            SELECT nodes.tax_id, nodes.parent_tax_id, ranks.rank
-            FROM nodes INNER JOIN ranks USING(rank_id)
-            WHERE tax_id = ?
-        """, (tax_id,))
-        if not c:
-            raise KeyError(tax_id)
-        else:
-            return next(c)
+    @property
+    def index(self):
+        """
+        The :class:`~.taxonomy_index.TaxonomyIndex` of the tree (built on
+        first use).
+        """
+        if self._index is None:
+            self._index = TaxonomyIndex.open(self._filename)
+        return self._index
 
     def __getitem__(self, tax_id):
         if not isinstance(tax_id, six.string_types):
@@ -85,59 +92,47 @@ class Taxonomy(collections.Mapping):
         for name, name_class in names:
             if name_class == "scientific name":
                 scientific_name = name
-        node = self.__node_query(tax_id)
-        _, parent, rank = node
-        return taxon(str(tax_id), str(parent), scientific_name, names, rank)
+        # The root (with tax_id 1) has itself as a parent
+        parent = self.index.parent(tax_id) or tax_id
+        rank = self.index.rank(tax_id)
+        return taxon(str(tax_id), parent, scientific_name, names, rank)
 
     def __iter__(self):
         c = self._con.execute("SELECT tax_id FROM nodes")
         return (str(r[0]) for r in c)
 
     def __len__(self):
-        c = self._con.execute("SELECT COUNT(*) FROM nodes")
-        return next(c)[0]
+        return len(self.index)
 
     def search(self, name, exact=True):
-        # First ensure the name column is indexed.
-        self._con.execute("""
-            CREATE INDEX IF NOT EXISTS
-                index_names_name ON names(name)""")
+        """
+        Return an iterator over tax ids with a name equal to (or starting
+        with if not `exact`) `name`, ignoring case.
+        """
+        return iter(self.index.search(name, exact))
 
-        if not exact:
-            name = "{0}%".format(name)
-            operator = "LIKE"
-        else:
-            operator = "="
+    def lineage(self, tax_id):
+        return self.index.lineage(tax_id)
 
-        c = self._con.execute("""
-            SELECT DISTINCT(tax_id)
-            FROM names
-            WHERE names.name {operator} ?
-            """.format(operator=operator), (name,))
-        return (str(r[0]) for r in c)
+    def lineage_many(self, tax_ids):
+        """
+        Return a list of lineages (lists of tax ids from the root down to
+        the parent) of `tax_ids`.
+        """
+        return self.index.lineage_many(tax_ids)
 
-    def lineage(self, tax_id):
-        lineage = []
-        while True:
-            parent = self.parent_tax_id(tax_id)
-            if parent is not None:
-                lineage.append(parent)
-                tax_id = parent
-            else:
-                break
-        return list(reversed(lineage))
+    def lca_many(self, tax_ids1, tax_ids2):
+        """
+        Return a list of the lowest common ancestors of the corresponding
+        `tax_ids1` and `tax_ids2`.
+        """
+        return self.index.lca_many(tax_ids1, tax_ids2)
 
     def parent_tax_id(self, tax_id):
         if not isinstance(tax_id, six.string_types):
             raise TypeError("Expected a string")
 
-        node = self.__node_query(tax_id)
-        _, parent, _ = node
-        if parent == int(tax_id):
-            # The root (with tax_id 1) has itself as a parent
-            return None
-        else:
-            return str(parent)
+        return self.index.parent(tax_id)
 
     def child_tax_ids(self, tax_id):
         if not isinstance(tax_id, six.string_types):
@@ -0,0 +1,401 @@
+"""
+A compact (memory mapped) index of the NCBI taxonomy tree.
+
+The nodes are kept in integer arrays ordered by tax id (parent rows, rank
+codes and depths). A depth first (pre-order) tour of the tree places every
+subtree in a contiguous range of tour positions, so ancestor tests are
+O(1), and the lowest common ancestor of two nodes is found with a range
+minimum query over the depths along the tour (answered with a sparse table
+of block minima). All names are kept in a sorted (lower case) string
+column for exact and prefix search. The index is built once from the
+taxonomy SQLite database and stored in a
+:mod:`~orangecontrib.bio.utils.colstore` store next to it.
+
+"""
+from __future__ import absolute_import
+
+import bisect
+import sqlite3
+
+import numpy
+
+from orangecontrib.bio.utils import colstore
+
+#: Version of the on disk index format.
+INDEX_VERSION = 1
+
+#: Block size of the range minimum query table.
+RMQ_BLOCK = 32
+
+#: Names of the index arrays.
+ARRAYS = ("tax_ids", "parents", "rank_codes", "depths", "tour_start",
+          "subtree_size", "tour", "tour_depths", "rmq_table", "name_rows")
+
+_MAX_DEPTH = numpy.iinfo(numpy.int32).max
+
+
+def _gather(starts, lengths):
+    # Indices of the concatenated ranges [starts[i], starts[i] + lengths[i])
+    ends = numpy.cumsum(lengths)
+    return numpy.repeat(starts - (ends - lengths), lengths) + \
+        numpy.arange(ends[-1] if len(ends) else 0)
+
+
+def _tree_tour(parents):
+    # Return the (depths, tour_start, subtree_size) arrays of the forest
+    # given by `parents` (parent rows, -1 for roots). The tree is walked
+    # one level at a time (children in row order).
+    n = len(parents)
+    has_parent = numpy.flatnonzero(parents >= 0)
+    children = has_parent[numpy.argsort(parents[has_parent], kind="mergesort")]
+    indptr = numpy.zeros(n + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(parents[has_parent], minlength=n),
+                 out=indptr[1:])
+
+    depths = numpy.full(n, -1, dtype=numpy.int32)
+    levels = []
+    level = numpy.flatnonzero(parents < 0)
+    while len(level):
+        depths[level] = len(levels)
+        levels.append(level)
+        level = children[_gather(indptr[level],
+                                 indptr[level + 1] - indptr[level])]
+
+    size = numpy.ones(n, dtype=numpy.int64)
+    for level in reversed(levels[1:]):
+        numpy.add.at(size, parents[level], size[level])
+
+    start = numpy.zeros(n, dtype=numpy.int64)
+    for i, level in enumerate(levels):
+        # the subtrees of siblings follow each other after their parent
+        before = numpy.cumsum(size[level]) - size[level]
+        if i == 0:
+            start[level] = before
+            continue
+        parent = parents[level]
+        first = numpy.flatnonzero(
+            numpy.concatenate([[True], parent[1:] != parent[:-1]]))
+        base = numpy.repeat(before[first],
+                            numpy.diff(numpy.append(first, len(level))))
+        start[level] = start[parent] + 1 + before - base
+    return depths, start, size
+
+
+def _rmq_table(values, block):
+    # A sparse table of the positions of block minima: row k holds the
+    # position of the minimum of blocks [i, i + 2 ** k)
+    n_blocks = max(-(-len(values) // block), 1)
+    padded = numpy.full(n_blocks * block, _MAX_DEPTH, dtype=numpy.int32)
+    padded[:len(values)] = values
+    best = padded.reshape(n_blocks, block).argmin(axis=1) + \
+        numpy.arange(n_blocks) * block
+    table = [best]
+    width = 1
+    while 2 * width <= n_blocks:
+        prev = table[-1]
+        left, right = prev[:-width], prev[width:]
+        row = prev.copy()
+        row[:-width] = numpy.where(padded[right] < padded[left], right, left)
+        table.append(row)
+        width *= 2
+    return numpy.array(table, dtype=numpy.int32)
+
+
+class TaxonomyIndex(object):
+    """
+    An index of the taxonomy tree.
+
+    :param dict arrays: Index arrays (see :obj:`ARRAYS`); the node arrays
+        are ordered by (integer) tax id.
+    :param ranks: Rank names (the vocabulary of the `rank_codes`).
+    :param scientific_names: Scientific names of the nodes (a list or a
+        :class:`~.colstore.StringColumn`).
+    :param name_keys: Sorted lower case names (a list or a
+        :class:`~.colstore.StringColumn`) of the nodes at `name_rows`.
+
+    """
+    def __init__(self, arrays, ranks, scientific_names, name_keys):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.ranks = ranks
+        self.scientific_names = scientific_names
+        self.name_keys = name_keys
+
+    @classmethod
+    def build(cls, tax_ids, parent_tax_ids, rank_codes, ranks, names):
+        """
+        Build the index.
+
+        :param tax_ids: Integer tax ids of the nodes.
+        :param parent_tax_ids: Integer tax ids of their parents (a root
+            is its own parent).
+        :param rank_codes: Indices of the node ranks in `ranks`.
+        :param list ranks: Rank names.
+        :param names: A sequence of (tax id, name, name class) tuples.
+
+        """
+        tax_ids = numpy.asarray(tax_ids, dtype=numpy.int64)
+        order = numpy.argsort(tax_ids, kind="mergesort")
+        tax_ids = tax_ids[order]
+        parent_tax_ids = numpy.asarray(parent_tax_ids, dtype=numpy.int64)[order]
+        rank_codes = numpy.asarray(rank_codes, dtype=numpy.int32)[order]
+
+        parents = numpy.searchsorted(tax_ids, parent_tax_ids)
+        parents = numpy.minimum(parents, max(len(tax_ids) - 1, 0))
+        known = (tax_ids[parents] == parent_tax_ids) & \
+            (parent_tax_ids != tax_ids)
+        parents = numpy.where(known, parents, -1).astype(numpy.int32)
+
+        depths, start, size = _tree_tour(parents)
+        tour = numpy.zeros(len(tax_ids), dtype=numpy.int32)
+        tour[start] = numpy.arange(len(tax_ids))
+        tour_depths = depths[tour]
+
+        name_ids = numpy.array([int(tax_id) for tax_id, _, _ in names],
+                               dtype=numpy.int64)
+        name_rows = numpy.searchsorted(tax_ids, name_ids)
+        name_rows = numpy.minimum(name_rows, max(len(tax_ids) - 1, 0))
+        known = (tax_ids[name_rows] == name_ids) if len(tax_ids) else \
+            numpy.zeros(len(names), dtype=bool)
+        scientific_names = [""] * len(tax_ids)
+        keys = []
+        for (_, name, name_class), row, valid in zip(
+                names, name_rows.tolist(), known.tolist()):
+            if valid:
+                keys.append((name.lower(), row))
+                if name_class == "scientific name":
+                    scientific_names[row] = name
+        keys.sort()
+        name_keys = [key for key, _ in keys]
+        name_rows = numpy.array([row for _, row in keys], dtype=numpy.int32)
+
+        arrays = {"tax_ids": tax_ids,
+                  "parents": parents,
+                  "rank_codes": rank_codes,
+                  "depths": depths,
+                  "tour_start": start.astype(numpy.int32),
+                  "subtree_size": size.astype(numpy.int32),
+                  "tour": tour,
+                  "tour_depths": tour_depths,
+                  "rmq_table": _rmq_table(tour_depths, RMQ_BLOCK),
+                  "name_rows": name_rows}
+        return cls(arrays, list(ranks), scientific_names, name_keys)
+
+    @classmethod
+    def from_db(cls, taxdb):
+        """Build the index from a taxonomy SQLite database."""
+        con = sqlite3.connect(taxdb, timeout=15)
+        try:
+            ranks = con.execute(
+                "SELECT rank_id, rank FROM ranks ORDER BY rank_id").fetchall()
+            nodes = numpy.array(
+                con.execute("SELECT tax_id, parent_tax_id, rank_id "
+                            "FROM nodes").fetchall(),
+                dtype=numpy.int64).reshape(-1, 3)
+            names = con.execute("""
+                SELECT names.tax_id, names.name, name_classes.name_class
+                FROM names INNER JOIN name_classes USING (name_class_id)
+            """).fetchall()
+        finally:
+            con.close()
+        rank_ids = numpy.array([rank_id for rank_id, _ in ranks],
+                               dtype=numpy.int64)
+        codes = numpy.searchsorted(rank_ids, nodes[:, 2])
+        return cls.build(nodes[:, 0], nodes[:, 1], codes,
+                         [rank for _, rank in ranks], names)
+
+    @classmethod
+    def load(cls, path, key=None):
+        """
+        Open the index at `path` (for database file `key`). Return None if
+        there is no such (valid) index.
+        """
+        store = colstore.Store.open(path, INDEX_VERSION, key)
+        if store is None:
+            return None
+        # plain ndarray views of the memory maps are faster to index
+        arrays = dict((name, numpy.asarray(store.array(name)))
+                      for name in ARRAYS)
+        return cls(arrays, store.strings("ranks").tolist(),
+                   store.strings("scientific_names"),
+                   store.strings("name_keys"))
+
+    def save(self, path, key=None):
+        """Save the index to `path` (for database file `key`)."""
+        with colstore.StoreWriter(path, INDEX_VERSION, key) as writer:
+            for name in ARRAYS:
+                writer.add_array(name, getattr(self, name))
+            writer.add_strings("ranks", list(self.ranks))
+            writer.add_strings("scientific_names", list(self.scientific_names))
+            writer.add_strings("name_keys", list(self.name_keys))
+
+    @classmethod
+    def open(cls, taxdb):
+        """
+        Return the index of a taxonomy database. The index is cached (in
+        `taxdb` + ".index") and rebuilt if the database changes.
+        """
+        path = taxdb + ".index"
+        key = colstore.file_key(taxdb)
+        index = cls.load(path, key)
+        if index is None:
+            index = cls.from_db(taxdb)
+            try:
+                index.save(path, key)
+            except (IOError, OSError):
+                return index
+            index = cls.load(path, key)
+        return index
+
+    def __len__(self):
+        return len(self.tax_ids)
+
+    def rows(self, tax_ids):
+        """
+        Return an array of the rows of `tax_ids` (raise KeyError for
+        unknown ids).
+        """
+        try:
+            ids = numpy.array([int(tax_id) for tax_id in tax_ids],
+                              dtype=numpy.int64)
+        except ValueError as err:
+            raise KeyError(str(err))
+        rows = numpy.searchsorted(self.tax_ids, ids)
+        found = rows < len(self.tax_ids)
+        found[found] = self.tax_ids[rows[found]] == ids[found]
+        if not found.all():
+            raise KeyError(str(ids[~found][0]))
+        return rows
+
+    def tax_id_list(self, rows):
+        """Return a list of the tax ids (strings) at `rows`."""
+        return [str(tax_id) for tax_id in self.tax_ids[rows].tolist()]
+
+    def parent(self, tax_id):
+        """Return the parent of `tax_id` (None for the root)."""
+        parent = self.parents[self.rows([tax_id])[0]]
+        return self.tax_id_list([parent])[0] if parent >= 0 else None
+
+    def rank(self, tax_id):
+        """Return the rank of `tax_id`."""
+        return self.rank_many([tax_id])[0]
+
+    def rank_many(self, tax_ids):
+        """Return a list of the ranks of `tax_ids`."""
+        return [self.ranks[code] for code in
+                self.rank_codes[self.rows(tax_ids)].tolist()]
+
+    def name(self, tax_id):
+        """Return the scientific name of `tax_id`."""
+        return self.scientific_names[int(self.rows([tax_id])[0])]
+
+    def lineage(self, tax_id):
+        """
+        Return a list of the ancestors of `tax_id` from the root down to
+        its parent.
+        """
+        return self.lineage_many([tax_id])[0]
+
+    def lineage_many(self, tax_ids):
+        """Return a list of the lineages (see :func:`lineage`) of `tax_ids`."""
+        rows = self.rows(tax_ids)
+        depths = self.depths[rows]
+        height = int(depths.max()) if len(rows) else 0
+        # ancestors[k] are the ancestors k + 1 levels above `rows`
+        ancestors = numpy.zeros((height, len(rows)), dtype=numpy.int64)
+        current = rows
+        for k in range(height):
+            current = numpy.maximum(self.parents[current], 0)
+            ancestors[k] = current
+        # reversed, so a lineage is a prefix of its row
+        unique, inverse = numpy.unique(ancestors[::-1].T, return_inverse=True)
+        names = numpy.array(self.tax_id_list(unique), dtype=object)
+        ids = names[inverse.reshape(len(rows), height)].tolist()
+        return [path[height - depth:] for path, depth in
+                zip(ids, depths.tolist())]
+
+    def is_ancestor(self, ancestor, tax_id):
+        """Is `ancestor` a (proper) ancestor of `tax_id`."""
+        return bool(self.is_ancestor_many([ancestor], [tax_id])[0])
+
+    def is_ancestor_many(self, ancestors, tax_ids):
+        """
+        Return a boolean array telling if `ancestors` are (proper)
+        ancestors of the corresponding `tax_ids`.
+        """
+        a, b = self.rows(ancestors), self.rows(tax_ids)
+        start, position = self.tour_start[a], self.tour_start[b]
+        return (start < position) & (position < start + self.subtree_size[a])
+
+    def _range_min(self, lo, hi):
+        # Return the tour positions of the minimal depths in the
+        # (inclusive) ranges [lo, hi]
+        block = RMQ_BLOCK
+        values = self.tour_depths
+        offsets = numpy.arange(block)
+        index = numpy.arange(len(lo))
+
+        def better(a, b):
+            return numpy.where(values[b] < values[a], b, a)
+
+        def scan(first, last):
+            positions = first[:, None] + offsets
+            depths = values[numpy.minimum(positions, len(values) - 1)]
+            depths = numpy.where(positions <= last[:, None], depths,
+                                 _MAX_DEPTH)
+            return positions[index, depths.argmin(axis=1)]
+
+        lo_block, hi_block = lo // block, hi // block
+        best = scan(lo, numpy.minimum(hi, lo_block * block + block - 1))
+        best = better(best, scan(numpy.maximum(hi_block * block, lo), hi))
+        middle = numpy.flatnonzero(hi_block - lo_block > 1)
+        if len(middle):
+            first, last = lo_block[middle] + 1, hi_block[middle] - 1
+            level = numpy.frexp(last - first + 1)[1] - 1
+            candidates = better(
+                self.rmq_table[level, first],
+                self.rmq_table[level, last - (1 << level) + 1])
+            best[middle] = better(best[middle], candidates)
+        return best
+
+    def lca(self, tax_id1, tax_id2):
+        """
+        Return the lowest common ancestor of `tax_id1` and `tax_id2` (None
+        if they are in different trees).
+        """
+        return self.lca_many([tax_id1], [tax_id2])[0]
+
+    def lca_many(self, tax_ids1, tax_ids2):
+        """
+        Return a list of the lowest common ancestors (see :func:`lca`) of
+        the corresponding `tax_ids1` and `tax_ids2`.
+        """
+        a, b = self.rows(tax_ids1), self.rows(tax_ids2)
+        start_a, start_b = self.tour_start[a], self.tour_start[b]
+        lo = numpy.minimum(start_a, start_b)
+        hi = numpy.maximum(start_a, start_b)
+        lca = a.copy()
+        distinct = numpy.flatnonzero(lo < hi)
+        if len(distinct):
+            # the shallowest node in the tour after the first node and up
+            # to the second is a child of their common ancestor
+            child = self.tour[self._range_min(lo[distinct] + 1, hi[distinct])]
+            lca[distinct] = self.parents[child]
+        return [str(tax_id) if row >= 0 else None for tax_id, row in
+                zip(self.tax_ids[numpy.maximum(lca, 0)].tolist(),
+                    lca.tolist())]
+
+    def search(self, name, exact=True):
+        """
+        Return a list of tax ids with a name equal to (or starting with if
+        not `exact`) `name`. Both exact and prefix search ignore case, as
+        the database queries did (its names column has NOCASE collation).
+        """
+        key = name.lower()
+        lo = bisect.bisect_left(self.name_keys, key)
+        if exact:
+            hi = bisect.bisect_right(self.name_keys, key, lo)
+        else:
+            hi = bisect.bisect_left(self.name_keys, key + u"\uffff", lo)
+        rows = numpy.unique(self.name_rows[lo:hi])
+        return self.tax_id_list(rows)
@@ -49,6 +49,7 @@ import re
 import warnings
 import keyword
 import operator
+import itertools
 
 from functools import reduce
 from collections import defaultdict
@@ -57,6 +58,8 @@ import six
 
 from six import StringIO
 
+from orangecontrib.bio.utils.stream import TextStream
+
 try:
     from urllib2 import urlopen
 except ImportError:
@@ -538,23 +541,36 @@ class OBOParser(object):
         """
         Parse the file and yield parse events.
 
+        The file is read line by line. If the file is a
+        :class:`~orangecontrib.bio.utils.stream.TextStream`, the
+        `progress_callback` is called with the percentage of the consumed
+        file.
+
         .. todo List events and values
 
         """
-        data = self.file.read()
-        header = data[: data.index("\n[")]
-        body = data[data.index("\n[") + 1:]
-        for line in header.splitlines():
-            if line.strip():
+        if isinstance(self.file, TextStream):
+            lines = self.file.lines(progress_callback)
+        else:
+            lines = iter(self.file)
+
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if line.startswith("["):
+                break
+            elif line.strip():
                 yield "HEADER_TAG", line.split(": ", 1)
+        else:
+            return
 
-        current = None
         #  For speed make these functions local
         startswith = str.startswith
         endswith = str.endswith
         parse_tag_value_ = parse_tag_value
 
-        for line in body.splitlines():
+        current = None
+        lines = itertools.chain([line], (l.rstrip("\r\n") for l in lines))
+        for line in lines:
             if startswith(line, "[") and endswith(line, "]"):
                 yield "START_STANZA", line.strip("[]")
                 current = line
@@ -629,10 +645,8 @@ class OBOOntology(object):
 
         """
         if isinstance(file, six.string_types):
-            if six.PY3:
-                file = open(file, "r", encoding="utf-8")
-            else:
-                file = open(file, "rb")
+            with TextStream(file) as stream:
+                return self.load(stream, progress_callback)
 
         parser = OBOParser(file)
         current = None
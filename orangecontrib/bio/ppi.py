@@ -14,6 +14,15 @@ import sqlite3
 import errno
 import posixpath
 import textwrap
+import json
+import time
+import itertools
+import contextlib
+
+from six.moves import intern
+
+import numpy
+import scipy.sparse
 
 from Orange.base import Table
 from Orange.data.domain import Domain
@@ -24,6 +33,8 @@ from collections import defaultdict, namedtuple
 from operator import itemgetter
 
 from .utils import serverfiles
+from .utils import colstore
+from .utils import parallel
 try:
     from Orange.utils import ConsoleProgressBar, wget
 except ImportError:
@@ -58,6 +69,49 @@ def mkdir_p(path, mode=0o777):
             raise
 
 
+#: The number of rows inserted with a single executemany call when
+#: building the databases.
+IMPORT_BATCH_SIZE = 100000
+
+
+def _bulk_import_pragmas(con):
+    """
+    Tune the sqlite connection `con` for a (single writer) database build.
+    The database is not recoverable if the build is interrupted.
+    """
+    con.execute("PRAGMA journal_mode = OFF")
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute("PRAGMA temp_store = MEMORY")
+    con.execute("PRAGMA cache_size = -262144")
+
+
+def _insert_many(con, sql, rows, name=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Insert `rows` with `sql` in batches of `batch_size`. Return the
+    number of inserted rows (and print the insert rate if `name` is
+    given).
+    """
+    rows = iter(rows)
+    count = 0
+    start = time.time()
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        con.executemany(sql, batch)
+        count += len(batch)
+    if name is not None:
+        elapsed = max(time.time() - start, 1e-6)
+        print("{}: {} rows in {:.1f} s ({:.0f} rows/s)".format(
+            name, count, elapsed, count / elapsed))
+    return count
+
+
+def _init_db_task(args):
+    cls, version, taxid, kwargs = args
+    return cls.init_db(version, taxid, **kwargs)
+
+
 class PPIDatabase(object):
     """
     A general interface for protein-protein interaction database access.
@@ -78,6 +132,20 @@ class PPIDatabase(object):
         [('...
 
     """
+    #: The (table, id column, taxid column) of the proteins table (used by
+    #: :func:`network`).
+    NETWORK_PROTEINS = None
+
+    #: The (table, id column 1, id column 2, score column) of the links
+    #: table (used by :func:`network`).
+    NETWORK_LINKS = None
+
+    #: Are all links stored in both directions (with the same score).
+    NETWORK_SYMMETRIC = False
+
+    #: Version of the cached network (.npz) files.
+    NETWORK_CACHE_VERSION = 1
+
     def __init__(self):
         pass
 
@@ -116,6 +184,12 @@ class PPIDatabase(object):
         """
         raise NotImplementedError
 
+    def synonyms_many(self, ids):
+        """
+        Return a dict mapping each of `ids` to a list of its synonyms.
+        """
+        return dict((id, self.synonyms(id)) for id in ids)
+
     def all_edges_annotated(self, taxid=None):
         """
         Return a list of all edges annotated. If taxid is not None
@@ -148,19 +222,174 @@ class PPIDatabase(object):
         """
         from orangecontrib import network
 
+        ids, adjacency = self.network(taxid=taxid)
+        synonyms = self.synonyms_many(ids)
         graph = network.Graph()
-        ids = self.ids(taxid=taxid)
-        for id in ids:
-            graph.add_node(id, synonyms=",".join(self.synonyms(id)))
-
-        for id in ids:
-            edges = self.edges(id)
-
-            for id1, id2, score in edges:
-                graph.add_edge(id1, id2, weight=score)
-
+        graph.add_nodes_from(
+            (id, {"synonyms": ",".join(synonyms[id])}) for id in ids)
+        adjacency = adjacency.tocoo()
+        graph.add_edges_from(
+            (ids[i], ids[j], {"weight": score})
+            for i, j, score in zip(adjacency.row, adjacency.col,
+                                   adjacency.data.tolist()))
         return graph
 
+    def network(self, query=None, taxid=None, hops=1, min_score=None,
+                use_cache=True):
+        """
+        Return the interaction network of a whole organism (or the
+        neighbourhood of a set of proteins) as a tuple of an array of
+        protein ids and a symmetric (n_ids x n_ids)
+        :class:`scipy.sparse.csr_matrix` adjacency matrix with the edge
+        scores (the maximum score of the links between two proteins in
+        either direction; links with no score have a score of 1).
+
+        The network is retrieved with a few set based queries. Whole
+        organism networks are cached (in a .npz file next to the database
+        for each database version).
+
+        :param list query: Protein ids. If given, the network includes
+            only these proteins and the proteins at most `hops` links
+            away from them (the query proteins are first in the ids
+            array).
+        :param str taxid: Limit the network to this organism.
+        :param int hops: The neighbourhood size (0 for the links among
+            the `query` proteins only).
+        :param min_score: Ignore links with a lower score.
+        :param bool use_cache: Use (and update) the cached whole organism
+            networks.
+
+        """
+        if query is not None:
+            return self._query_network(list(query), taxid, hops, min_score)
+
+        cache = self._network_cache_path(taxid, min_score) \
+            if use_cache else None
+        if cache is not None:
+            key = json.dumps(self._network_version(), sort_keys=True)
+            net = _load_network(cache, key)
+            if net is not None:
+                return net
+        net = self._query_network(None, taxid, hops, min_score)
+        if cache is not None:
+            _save_network(cache, key, *net)
+        return net
+
+    def _network_version(self):
+        """
+        Return a json serializable key identifying the version of the
+        database (to validate the cached networks).
+        """
+        try:
+            version = self.db.execute("SELECT * FROM version").fetchall()
+        except sqlite3.Error:
+            version = None
+        return {"cache": self.NETWORK_CACHE_VERSION,
+                "db": version or colstore.file_key(self.filename)}
+
+    def _network_cache_path(self, taxid, min_score):
+        filename = getattr(self, "filename", None)
+        if filename is None or not os.path.exists(filename):
+            return None
+        return "{}.network.{}.{}.npz".format(
+            filename, taxid or "all",
+            "all" if min_score is None else min_score)
+
+    def _query_network(self, query, taxid, hops, min_score):
+        proteins, id_col, taxid_col = self.NETWORK_PROTEINS
+        links, col1, col2, score_col = self.NETWORK_LINKS
+        db = self.db
+        score_filter, score_args = "", ()
+        if min_score is not None:
+            score_filter = " AND {} >= ?".format(score_col)
+            score_args = (min_score,)
+
+        if self.NETWORK_SYMMETRIC:
+            # every link is stored in both directions
+            score_filter += " AND {} < {}".format(col1, col2)
+
+        if query is None:
+            where, args = "", ()
+            if taxid is not None:
+                where, args = " WHERE {} = ?".format(taxid_col), (taxid,)
+            ids = [r[0] for r in db.execute(
+                "SELECT DISTINCT {} FROM {}{} ORDER BY {}".format(
+                    id_col, proteins, where, id_col), args)]
+            # a single scan of the links table (faster than a join)
+            index = dict(zip(ids, range(len(ids))))
+            cur = db.execute("SELECT {}, {}, {} FROM {} WHERE 1{}".format(
+                col1, col2, score_col, links, score_filter), score_args)
+            edges = [(index[id1], index[id2], score)
+                     for id1, id2, score in cur
+                     if id1 in index and id2 in index]
+            return numpy.array(ids, dtype=object), \
+                _symmetric_adjacency(edges, len(ids))
+
+        ids = self._neighbourhood(query, taxid, hops, score_filter,
+                                  score_args)
+        with _temp_tables(db, "_nodes"):
+            db.execute("CREATE TEMP TABLE _nodes "
+                       "(id TEXT PRIMARY KEY, i INTEGER)")
+            db.executemany("INSERT INTO _nodes VALUES (?, ?)",
+                           zip(ids, range(len(ids))))
+            cur = db.execute("""
+                SELECT n1.i, n2.i, {score}
+                FROM {links} JOIN _nodes AS n1 ON {links}.{col1} = n1.id
+                             JOIN _nodes AS n2 ON {links}.{col2} = n2.id
+                WHERE 1{filter}
+                """.format(score=score_col, links=links, col1=col1,
+                           col2=col2, filter=score_filter), score_args)
+            edges = cur.fetchall()
+        return numpy.array(ids, dtype=object), \
+            _symmetric_adjacency(edges, len(ids))
+
+    def _neighbourhood(self, query, taxid, hops, score_filter, score_args):
+        # Breadth first search from the query (one set based query per
+        # hop); return a list of ids (the query first, then the rest
+        # sorted)
+        proteins, id_col, taxid_col = self.NETWORK_PROTEINS
+        links, col1, col2, score_col = self.NETWORK_LINKS
+        db = self.db
+        query = list(dict.fromkeys(query))
+        with _temp_tables(db, "_next", "_frontier", "_seen"):
+            db.execute("CREATE TEMP TABLE _frontier (id TEXT PRIMARY KEY)")
+            db.execute("CREATE TEMP TABLE _seen (id TEXT PRIMARY KEY)")
+            db.executemany("INSERT OR IGNORE INTO _frontier VALUES (?)",
+                           ((id,) for id in query))
+            db.execute("INSERT INTO _seen SELECT id FROM _frontier")
+            taxid_filter, taxid_args = "", ()
+            if taxid is not None:
+                taxid_filter = " AND n IN (SELECT {} FROM {} WHERE {} = ?)"\
+                    .format(id_col, proteins, taxid_col)
+                taxid_args = (taxid,)
+            for _ in range(hops):
+                db.execute("""
+                    CREATE TEMP TABLE _next AS
+                    SELECT DISTINCT n FROM (
+                        SELECT {col2} AS n FROM {links}
+                        WHERE {col1} IN (SELECT id FROM _frontier){filter}
+                        UNION
+                        SELECT {col1} AS n FROM {links}
+                        WHERE {col2} IN (SELECT id FROM _frontier){filter}
+                    )
+                    WHERE n NOT IN (SELECT id FROM _seen){taxid_filter}
+                    """.format(links=links, col1=col1, col2=col2,
+                               filter=score_filter,
+                               taxid_filter=taxid_filter),
+                    score_args * 2 + taxid_args)
+                db.execute("DELETE FROM _frontier")
+                db.execute("INSERT INTO _frontier SELECT n FROM _next")
+                db.execute("INSERT INTO _seen SELECT n FROM _next")
+                db.execute("DROP TABLE temp._next")
+                if not db.execute("SELECT 1 FROM _frontier LIMIT 1") \
+                        .fetchone():
+                    break
+            query_set = set(query)
+            rest = [r[0] for r in db.execute(
+                "SELECT id FROM _seen ORDER BY id")
+                if r[0] not in query_set]
+        return query + rest
+
     @classmethod
     def download_data(self):
         """
@@ -175,6 +404,99 @@ class PPIDatabase(object):
             return v_type(value)
 
 
+def _batches(items, size=500):
+    # Split `items` into lists short enough for an sql 'in (?, ...)'
+    # clause
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+@contextlib.contextmanager
+def _temp_tables(db, *names):
+    # Drop the temp tables `names` before and after the block. Commit the
+    # (implicit) transaction the block opened, but leave a transaction
+    # the caller already had open alone.
+    # (Python 2's sqlite3 has no in_transaction; always commit there)
+    in_transaction = getattr(db, "in_transaction", False)
+    for name in names:
+        db.execute("DROP TABLE IF EXISTS temp.{}".format(name))
+    try:
+        yield
+    finally:
+        for name in names:
+            db.execute("DROP TABLE IF EXISTS temp.{}".format(name))
+        if not in_transaction:
+            db.commit()
+
+
+def _query_with_ids(db, sql, args, ids):
+    # Run `sql` (referencing the `_query` table of `ids`) and return all
+    # the rows
+    with _temp_tables(db, "_query"):
+        db.execute("CREATE TEMP TABLE _query (id TEXT PRIMARY KEY)")
+        db.executemany("INSERT OR IGNORE INTO _query VALUES (?)",
+                       ((id,) for id in ids))
+        return db.execute(sql, args).fetchall()
+
+
+def _symmetric_adjacency(edges, n):
+    """
+    Return a symmetric CSR matrix from (i, j, score) `edges` taking the
+    maximum score of duplicated (in either direction) edges.
+    """
+    edges = numpy.array(edges, dtype=object).reshape(-1, 3)
+    rows = edges[:, 0].astype(numpy.int32)
+    cols = edges[:, 1].astype(numpy.int32)
+    scores = edges[:, 2]
+    scores[numpy.equal(scores, None)] = 1
+    scores = scores.astype(numpy.float32)
+
+    rows, cols = numpy.concatenate([rows, cols]), \
+        numpy.concatenate([cols, rows])
+    scores = numpy.concatenate([scores, scores])
+    order = numpy.lexsort((cols, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    first = numpy.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    starts = numpy.flatnonzero(first)
+    if len(starts):
+        scores = numpy.maximum.reduceat(scores, starts)
+    rows, cols = rows[starts], cols[starts]
+    indptr = numpy.zeros(n + 1, dtype=numpy.int32)
+    numpy.cumsum(numpy.bincount(rows, minlength=n), out=indptr[1:])
+    return scipy.sparse.csr_matrix((scores, cols, indptr), shape=(n, n))
+
+
+def _save_network(path, key, ids, adjacency):
+    # Cache the network at `path` (a failed write only leaves it uncached)
+    tmp = "%s.%d.tmp.npz" % (path, os.getpid())
+    try:
+        numpy.savez(tmp, key=numpy.array(key), ids=ids.astype(str),
+                    data=adjacency.data, indices=adjacency.indices,
+                    indptr=adjacency.indptr)
+        colstore.replace_file(tmp, path)
+    except (IOError, OSError):
+        pass
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _load_network(path, key):
+    # Return the (ids, adjacency) network cached at `path` or None if it
+    # does not exist (or is not for `key`)
+    try:
+        with numpy.load(path) as f:
+            if str(f["key"]) != key:
+                return None
+            ids = f["ids"].astype(object)
+            adjacency = scipy.sparse.csr_matrix(
+                (f["data"], f["indices"], f["indptr"]),
+                shape=(len(ids), len(ids)))
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+    return ids, adjacency
+
+
 class BioGRID(PPIDatabase):
     """
     Access `BioGRID <http://thebiogrid.org>`_ PPI data.
@@ -266,6 +588,11 @@ class BioGRID(PPIDatabase):
         "31033": None
     }
 
+    NETWORK_PROTEINS = ("proteins", "biogrid_id_interactor",
+                        "organism_interactor")
+    NETWORK_LINKS = ("links", "biogrid_id_interactor_a",
+                     "biogrid_id_interactor_b", "score")
+
     def __init__(self):
         self.filename = serverfiles.localpath_download(
             self.DOMAIN, self.SERVER_FILE)
@@ -500,6 +827,28 @@ class BioGRID(PPIDatabase):
         else:
             return []
 
+    def synonyms_many(self, ids):
+        """
+        Return a dict mapping each of `ids` to a list of its synonyms.
+        """
+        synonyms = dict((id, []) for id in ids)
+        for batch in _batches(list(synonyms)):
+            cur = self.db.execute("""\
+                select biogrid_id_interactor,
+                       entrez_gene_interactor,
+                       systematic_name_interactor,
+                       official_symbol_interactor,
+                       synonyms_interactor
+                from proteins
+                where biogrid_id_interactor in ({})""".format(
+                    ",".join("?" * len(batch))),
+                batch)
+            for rec in cur:
+                names = list(rec[1:-1]) + \
+                    (rec[-1].split("|") if rec[-1] is not None else [])
+                synonyms[rec[0]] = [s for s in names if s is not None]
+        return synonyms
+
     def all_edges(self, taxid=None):
         """
         Return a list of all edges. If taxid is not None return the
@@ -631,6 +980,7 @@ class BioGRID(PPIDatabase):
         next(rows)  # read the header line
 
         con = sqlite3.connect(os.path.join(dirname, BioGRID.SERVER_FILE))
+        _bulk_import_pragmas(con)
         con.execute("drop table if exists links")  # Drop old table
         con.execute("drop table if exists proteins")  # Drop old table
 
@@ -662,14 +1012,19 @@ class BioGRID(PPIDatabase):
                 organism_interactor text
             )""")
 
-        proteins = {}
-
         # Values that go in the links table
         link_indices = [0, 3, 4, 11, 12, 13, 14, 17, 18, 19, 20, 21, 22, 23]
         # Values that go in the proteins table
         interactor_a_indices = [3, 1, 5, 7, 9, 15]
         # Values that go in the proteins table
         interactor_b_indices = [4, 2, 6, 8, 10, 16]
+        # Repeated (low cardinality) link columns
+        interned = [1, 2, 3, 4, 7, 13]
+
+        # Ids of the proteins already inserted (the first occurrence of
+        # an interactor is stored)
+        seen = set()
+        new_proteins = []
 
         def to_none(val):
             return None if val == "-" else val
@@ -677,46 +1032,71 @@ class BioGRID(PPIDatabase):
         def processlinks(rowiter):
             for row in rowiter:
                 fields = list(map(to_none, row))
-                yield [fields[i] for i in link_indices]
+                link = [fields[i] for i in link_indices]
+                for i in interned:
+                    if link[i] is not None:
+                        link[i] = intern(link[i])
+                yield link
+
+                for indices in (interactor_a_indices, interactor_b_indices):
+                    id = fields[indices[0]]
+                    if id not in seen:
+                        seen.add(intern(id))
+                        new_proteins.append([fields[i] for i in indices])
+
+        def processproteins(links):
+            # insert the new proteins along with (each batch of) links
+            for link in links:
+                yield link
+                if len(new_proteins) >= IMPORT_BATCH_SIZE:
+                    flush_proteins()
+
+        def flush_proteins():
+            con.executemany("""\
+                insert into proteins values (?, ?, ?, ?, ?, ?)
+                """, new_proteins)
+            del new_proteins[:]
 
-                interactor_a = [fields[i] for i in interactor_a_indices]
-                interactor_b = [fields[i] for i in interactor_b_indices]
-                proteins[interactor_a[0]] = interactor_a
-                proteins[interactor_b[0]] = interactor_b
-
-        con.executemany("""
-            insert into links values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, processlinks(rows))
-
-        con.executemany("""\
-            insert into proteins values (?, ?, ?, ?, ?, ?)
-            """, proteins.values())
-        con.commit()
+        with con:
+            _insert_many(con, """
+                insert into links
+                values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, processproteins(processlinks(rows)), name="links")
+            flush_proteins()
+            print("Indexing the database")
+            cls.create_db_index(con)
         con.close()
 
-    def init_db_index(self):
+    @classmethod
+    def create_db_index(cls, dbcon):
         """
-        Will create an indexes (if not already present) in the database
-        for faster searching by primary ids.
-
+        Create the indexes (if not already present) in the database for
+        faster searching by primary ids.
         """
-        self.db.execute("""\
+        dbcon.execute("""\
         create index if not exists index_on_biogrid_id_interactor_a
            on links (biogrid_id_interactor_a)
         """)
-        self.db.execute("""\
+        dbcon.execute("""\
         create index if not exists index_on_biogrid_id_interactor_b
            on links (biogrid_id_interactor_b)
         """)
-        self.db.execute("""\
+        dbcon.execute("""\
         create index if not exists index_on_biogrid_id_interactor
            on proteins (biogrid_id_interactor)
         """)
-        self.db.execute("""\
+        dbcon.execute("""\
         create index if not exists index_on_organism_interactor
            on proteins (organism_interactor)
         """)
 
+    def init_db_index(self):
+        """
+        Will create an indexes (if not already present) in the database
+        for faster searching by primary ids.
+
+        """
+        self.create_db_index(self.db)
 
 
 STRINGInteraction = namedtuple(
@@ -764,6 +1144,10 @@ class STRING(PPIDatabase):
     FILENAME = "string.protein.{taxid}.sqlite"
     VERSION = "3.0"
 
+    NETWORK_PROTEINS = ("proteins", "protein_id", "taxid")
+    NETWORK_LINKS = ("links", "protein_id1", "protein_id2", "score")
+    NETWORK_SYMMETRIC = True
+
     # Mapping from taxonomy.common_taxids() to taxids in STRING.
 
     TAXID_MAP = {"352472": "44689",  # Dictyostelium discoideum
@@ -852,6 +1236,22 @@ class STRING(PPIDatabase):
         res = cur.fetchall()
         return [r[0] for r in res]
 
+    def synonyms_many(self, ids):
+        """
+        Return a dict mapping each of `ids` to a list of its synonyms (see
+        :func:`synonyms`).
+        """
+        synonyms = dict((id, []) for id in ids)
+        for batch in _batches(list(synonyms)):
+            cur = self.db.execute("""\
+                select protein_id, alias
+                from aliases
+                where protein_id in ({})
+                """.format(",".join("?" * len(batch))), batch)
+            for id, alias in cur:
+                synonyms[id].append(alias)
+        return synonyms
+
     def synonyms_with_source(self, id):
         """
         Return a list of synonyms for primary `id` along with its
@@ -901,10 +1301,26 @@ class STRING(PPIDatabase):
         return cur.fetchall()
 
     def all_edges_annotated(self, taxid=None):
-        res = []
-        for id in self.ids(taxid):
-            res.extend(self.edges_annotated(id))
-        return res
+        if taxid is not None:
+            cur = self.db.execute("""\
+                select links.protein_id1, links.protein_id2, links.score,
+                       actions.action, actions.mode, actions.score
+                from links join proteins on
+                       links.protein_id1=proteins.protein_id
+                     left join actions on
+                       links.protein_id1=actions.protein_id1 and
+                       links.protein_id2=actions.protein_id2
+                where proteins.taxid=?
+            """, (taxid,))
+        else:
+            cur = self.db.execute("""\
+                select links.protein_id1, links.protein_id2, links.score,
+                       actions.action, actions.mode, actions.score
+                from links left join actions on
+                       links.protein_id1=actions.protein_id1 and
+                       links.protein_id2=actions.protein_id2
+            """)
+        return list(map(STRINGInteraction._make, cur.fetchall()))
 
     def edges_annotated(self, id):
         cur = self.db.execute("""\
@@ -932,17 +1348,98 @@ class STRING(PPIDatabase):
             """, (name, taxid))
         return map(itemgetter(0), cur)
 
+    def _score_source(self, channels):
+        """
+        Return the (connection, table, score expression) to query the
+        link scores of `channels` from.
+        """
+        if channels:
+            raise ValueError("Channel scores are only available in "
+                             "STRINGDetailed")
+        return self.db, "links", "score"
+
+    def neighbours(self, ids, min_score=None, top_k=None, channels=None):
+        """
+        Return a list of edges (3-tuples (id, neighbour, score)) from each
+        of `ids` to its neighbours, ordered by `ids` and decreasing score.
+
+        The query runs in sql and (with the database indexes) only
+        reads the `top_k` best scored links of each protein, so it is
+        fast even for hub proteins.
+
+        :param list ids: Protein ids.
+        :param min_score: Ignore links with a lower score.
+        :param int top_k: Return at most `top_k` highest scoring
+            neighbours of each protein.
+        :param list channels: Score the links by the maximum score of
+            these evidence channels instead of the combined score (only
+            :class:`STRINGDetailed`; see :obj:`STRINGDetailed.CHANNELS`).
+
+        """
+        db, table, score = self._score_source(channels)
+        where, args = "", ()
+        if min_score is not None:
+            where, args = " AND {} >= ?".format(score), (min_score,)
+        if top_k is None:
+            sql = """
+                SELECT q.id, t.protein_id2, {score}
+                FROM _query AS q JOIN {table} AS t ON t.protein_id1 = q.id
+                WHERE 1{where}
+                ORDER BY q.rowid, {score} DESC
+                """
+        else:
+            # a correlated subquery selects each protein's top_k links
+            sql = """
+                SELECT q.id, t.protein_id2, {score}
+                FROM _query AS q JOIN {table} AS t ON t.rowid IN (
+                    SELECT rowid FROM {table}
+                    WHERE protein_id1 = q.id{where}
+                    ORDER BY {score} DESC LIMIT ?)
+                ORDER BY q.rowid, {score} DESC
+                """
+            args = args + (top_k,)
+        sql = sql.format(score=score, table=table, where=where)
+        return _query_with_ids(db, sql, args, ids)
+
+    def subnetwork(self, ids, min_score=None, channels=None):
+        """
+        Return a list of edges (3-tuples (id1, id2, score)) between the
+        proteins in `ids`. Each interaction is listed once (with
+        ``id1 < id2``).
+
+        :param list ids: Protein ids.
+        :param min_score: Ignore links with a lower score.
+        :param list channels: See :func:`neighbours`.
+
+        """
+        db, table, score = self._score_source(channels)
+        where, args = "", ()
+        if min_score is not None:
+            where, args = " AND {} >= ?".format(score), (min_score,)
+        sql = """
+            SELECT t.protein_id1, t.protein_id2, {score}
+            FROM _query AS q JOIN {table} AS t ON t.protein_id1 = q.id
+            WHERE t.protein_id1 < t.protein_id2
+                  AND t.protein_id2 IN (SELECT id FROM _query){where}
+            ORDER BY t.protein_id1, t.protein_id2
+            """.format(score=score, table=table, where=where)
+        return _query_with_ids(db, sql, args, ids)
+
     @classmethod
-    def download_data(cls, version, taxids=None):
+    def download_data(cls, version, taxids=None, n_jobs=1):
         """
         Download the  PPI data for local work (this may take some time).
         Pass the version of the  STRING release e.g. v9.1.
+
+        The databases for `taxids` are built in `n_jobs` processes (one
+        organism per process).
         """
         if taxids is None:
             taxids = cls.common_taxids()
 
-        for taxid in taxids:
-            cls.init_db(version, taxid)
+        parallel.parallel_map(
+            _init_db_task, [(cls, version, taxid, {}) for taxid in taxids],
+            n_jobs=n_jobs)
 
     @classmethod
     def init_db(cls, version, taxid, cache_dir=None, dbfilename=None):
@@ -1001,6 +1498,7 @@ class STRING(PPIDatabase):
         filesize = st_size(links_filename)
 
         con = sqlite3.connect(dbfilename)
+        _bulk_import_pragmas(con)
 
         with con:
             cls.clear_db(con)
@@ -1011,24 +1509,21 @@ class STRING(PPIDatabase):
 
             def read_links(reader, progress):
                 for i, (p1, p2, score) in enumerate(reader):
-                    yield p1, p2, int(score)
+                    yield intern(p1), intern(p2), int(score)
 
                     if i % 100000 == 0:
                         # Update the progress every 100000 lines
                         progress(100.0 * links_fileobj.tell() / filesize)
 
-            con.executemany("INSERT INTO links VALUES (?, ?, ?)",
-                            read_links(reader, progress))
+            _insert_many(con, "INSERT INTO links VALUES (?, ?, ?)",
+                         read_links(reader, progress), name="links")
 
             progress.finish()
 
-            def part(string, sep, part):
-                return string.split(sep)[part]
-
-            con.create_function("part", 3, part)
             con.execute("""
                 INSERT INTO proteins
-                SELECT protein_id1, part(protein_id1, '.', 0)
+                SELECT protein_id1,
+                       substr(protein_id1, 1, instr(protein_id1, '.') - 1)
                 FROM (SELECT DISTINCT(protein_id1)
                      FROM links
                      ORDER BY protein_id1)
@@ -1044,13 +1539,14 @@ class STRING(PPIDatabase):
             def read_actions(reader):
                 for i, (p1, p2, mode, action, a_is_acting, score) in \
                         enumerate(reader):
-                    yield p1, p2, mode, action, int(score)
+                    yield (intern(p1), intern(p2), intern(mode),
+                           intern(action), int(score))
 
                     if i % 10000 == 0:
                         progress(100.0 * actions_fileobj.tell() / filesize)
 
-            con.executemany("INSERT INTO actions VALUES (?, ?, ?, ?, ?)",
-                            read_actions(reader))
+            _insert_many(con, "INSERT INTO actions VALUES (?, ?, ?, ?, ?)",
+                         read_actions(reader), name="actions")
 
             progress.finish()
 
@@ -1062,12 +1558,12 @@ class STRING(PPIDatabase):
 
             def read_aliases(reader, progress):
                 for i, (taxid_proteinid, alias, source) in enumerate(reader):
-                    yield (taxid_proteinid, alias, source)
+                    yield (intern(taxid_proteinid), alias, intern(source))
                     if i % 10000 == 0:
                         progress(100.0 * aliases_fileobj.tell() / filesize)
 
-            con.executemany("INSERT INTO aliases VALUES (?, ?, ?)",
-                            read_aliases(reader, progress))
+            _insert_many(con, "INSERT INTO aliases VALUES (?, ?, ?)",
+                         read_aliases(reader, progress), name="aliases")
 
             progress.finish()
 
@@ -1118,6 +1614,9 @@ class STRING(PPIDatabase):
             CREATE INDEX IF NOT EXISTS index_link_protein_id2
                 ON links (protein_id2);
 
+            CREATE INDEX IF NOT EXISTS index_link_protein_id1_score
+                ON links (protein_id1, score, protein_id2);
+
             CREATE INDEX IF NOT EXISTS index_action_protein_id1
                 ON actions (protein_id1);
             
@@ -1189,6 +1688,10 @@ class STRINGDetailed(STRING):
     """
     FILENAME_DETAILED = "string.protein.detailed.{taxid}.sqlite"
 
+    #: Evidence channels (columns of the evidence table).
+    CHANNELS = ("neighborhood", "fusion", "cooccurence", "coexpression",
+                "experimental", "database", "textmining")
+
     def __init__(self, taxid=None, database=None, detailed_database=None):
         STRING.__init__(self, taxid, database)
         if taxid is not None and detailed_database is not None:
@@ -1217,6 +1720,40 @@ class STRINGDetailed(STRING):
         cur = self.db_detailed.execute(sql)
         return cur.fetchall()
 
+    def _score_source(self, channels):
+        if not channels:
+            return STRING._score_source(self, channels)
+        unknown = set(channels) - set(self.CHANNELS)
+        if unknown:
+            raise ValueError("Unknown channels: {}".format(
+                ", ".join(sorted(unknown))))
+        channels = [c for c in self.CHANNELS if c in channels]
+        if len(channels) == 1:
+            score = channels[0]
+        else:
+            score = "max({})".format(", ".join(channels))
+        return self.db_detailed, "evidence", score
+
+    @classmethod
+    def create_evidence_index(cls, dbcon):
+        """
+        Create the evidence table indexes (one covering index per
+        channel for the :func:`neighbours` queries).
+        """
+        dbcon.execute("""
+            CREATE INDEX IF NOT EXISTS index_evidence
+                ON evidence (protein_id1, protein_id2)
+            """)
+        dbcon.execute("""
+            CREATE INDEX IF NOT EXISTS index_evidence_id2
+                ON evidence (protein_id2)
+            """)
+        for channel in cls.CHANNELS:
+            dbcon.execute("""
+                CREATE INDEX IF NOT EXISTS index_evidence_id1_{0}
+                    ON evidence (protein_id1, {0}, protein_id2)
+                """.format(channel))
+
     def edges_annotated(self, id):
         edges = STRING.edges_annotated(self, id)
         edges_nc = []
@@ -1383,6 +1920,7 @@ class STRINGDetailed(STRING):
         links_file = gzip.open(pjoin(cache_dir, filename), mode='rt')
 
         con = sqlite3.connect(dbfilename)
+        _bulk_import_pragmas(con)
         with con:
             con.execute("""
                 DROP TABLE IF EXISTS evidence
@@ -1413,29 +1951,20 @@ class STRINGDetailed(STRING):
             def read_links(reader):
                 for i, (p1, p2, n, f, c, cx, ex, db, t, _) in \
                         enumerate(reader):
-                    yield p1, p2, n, f, c, cx, ex, db, t
+                    yield intern(p1), intern(p2), n, f, c, cx, ex, db, t
 
                     if i % 10000 == 0:
                         progress(100.0 * links_fileobj.tell() / filesize)
 
-            con.executemany("""
+            _insert_many(con, """
                 INSERT INTO evidence
                 VALUES  (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, read_links(links))
+                """, read_links(links), name="evidence")
 
             progress.finish()
 
             print("Indexing")
-            con.execute("""\
-                CREATE INDEX IF NOT EXISTS index_evidence
-                    ON evidence (protein_id1, protein_id2)
-                
-                CREATE INDEX IF NOT EXISTS index_evidence_id1
-                    ON evidence (protein_id1)
-                
-                CREATE INDEX IF NOT EXISTS index_evidence_id1
-                    ON evidence (protein_id2)
-            """)
+            cls.create_evidence_index(con)
 
             con.executescript("""
                 DROP TABLE IF EXISTS version;
@@ -1450,14 +1979,6 @@ class STRINGDetailed(STRING):
                 INSERT INTO version
                 VALUES (?, ?)""", (version, cls.VERSION))
 
-    @classmethod
-    def download_data(cls, version, taxids=None):
-        if taxids is None:
-            taxids = cls.common_taxids()
-
-        for taxid in taxids:
-            cls.init_db(version, taxid)
-
 
 ##########
 # Obsolete
@@ -1,14 +1,221 @@
-from __future__ import absolute_import
+from __future__ import absolute_import, division
 
 import networkx as nx
 import numpy as np
+import scipy.sparse
 from math import erf, sqrt
 from Orange.base import Table
 from Orange.data.domain import Domain
 from Orange.data.variable import DiscreteVariable, ContinuousVariable
 
+#: Networks with more nodes store their distances as sparse per distance
+#: shells (only the reachable pairs) instead of a dense matrix.
+DENSE_MAX_NODES = 2 ** 14
+
+#: Number of rows (shortest path sources or permutations) processed at once.
+BLOCK_SIZE = 256
+
+#: Weight vectors with at most this fraction of nonzero weights are
+#: scored by looking up the distances between the weighted nodes only.
+SPARSE_WEIGHTS = 0.25
+
+
+def adjacency_matrix(network, nodes):
+    """
+    Return the adjacency matrix (scipy.sparse.csr_matrix) of `network`
+    with rows and columns in the order of `nodes`.
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    n = len(nodes)
+    edges = np.array([(index[u], index[v]) for u, v in network.edges()],
+                     dtype=int).reshape(-1, 2)
+    adjacency = scipy.sparse.csr_matrix(
+        (np.ones(len(edges), dtype=np.int8), (edges[:, 0], edges[:, 1])),
+        shape=(n, n))
+    if not network.is_directed():
+        adjacency = adjacency + adjacency.T
+    return adjacency.tocsr()
+
+
+def _shortest_path_blocks(adjacency, directed):
+    # level synchronous breadth first search from BLOCK_SIZE sources at
+    # a time (a frontier expansion is a sparse matrix product); unreachable
+    # nodes are at distance -1
+    n = adjacency.shape[0]
+    if not directed:
+        adjacency = adjacency + adjacency.T
+    # step.dot(frontier) marks the successors of frontier nodes
+    step = scipy.sparse.csr_matrix(adjacency.T, dtype=np.float32)
+    for start in range(0, n, BLOCK_SIZE):
+        sources = np.arange(start, min(start + BLOCK_SIZE, n))
+        columns = np.arange(len(sources))
+        dist = np.full((n, len(sources)), -1, dtype=np.int32)
+        dist[sources, columns] = 0
+        frontier = np.zeros((n, len(sources)), dtype=np.float32)
+        frontier[sources, columns] = 1
+        d = 0
+        while True:
+            d += 1
+            reached = (step.dot(frontier) > 0) & (dist < 0)
+            if not reached.any():
+                break
+            dist[reached] = d
+            frontier = reached.astype(np.float32)
+        yield start, dist.T
+
+
+def _min_int_dtype(max_value):
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class DistanceMatrix(object):
+    """
+    All pairs shortest path lengths in a dense matrix of the smallest
+    sufficient integer type (-1 for unreachable pairs).
+
+    :param adjacency: Adjacency matrix of the network.
+    :param bool directed: Follow the edges in their direction only.
+
+    """
+    def __init__(self, adjacency, directed=False):
+        n = adjacency.shape[0]
+        self.matrix = np.empty((n, n), dtype=np.int8)
+        for start, dist in _shortest_path_blocks(adjacency, directed):
+            dtype = _min_int_dtype(dist.max(initial=0))
+            if np.dtype(dtype).itemsize > self.matrix.dtype.itemsize:
+                self.matrix = self.matrix.astype(dtype)
+            self.matrix[start:start + len(dist)] = dist
+        self.max_dist = int(self.matrix.max(initial=0))
+
+    def _row_blocks(self):
+        n = len(self.matrix)
+        for start in range(0, n, BLOCK_SIZE):
+            yield slice(start, min(start + BLOCK_SIZE, n))
+
+    def counts(self):
+        """
+        Return the number of nodes at each distance (0 to `max_dist`)
+        from each node (nodes x distances).
+        """
+        n = len(self.matrix)
+        counts = np.zeros((n, self.max_dist + 1))
+        for rows in self._row_blocks():
+            block = self.matrix[rows]
+            for d in range(self.max_dist + 1):
+                counts[rows, d] = (block == d).sum(axis=1)
+        return counts
+
+    def pair_sums(self, weights):
+        """
+        Return the sums of products of weights of all (ordered) node pairs
+        at each distance (weight vectors x distances) for a matrix of
+        weight vectors (one per row).
+        """
+        n = len(self.matrix)
+        sums = np.zeros((len(weights), self.max_dist + 1))
+        nonzero = [np.flatnonzero(w) for w in weights]
+        dense = [i for i, nz in enumerate(nonzero)
+                 if len(nz) > SPARSE_WEIGHTS * n]
+        for i, nz in enumerate(nonzero):
+            if len(nz) <= SPARSE_WEIGHTS * n:
+                dist = self.matrix[np.ix_(nz, nz)].ravel()
+                w = np.outer(weights[i, nz], weights[i, nz]).ravel()
+                reachable = dist >= 0
+                sums[i] = np.bincount(dist[reachable], w[reachable],
+                                      minlength=self.max_dist + 1)
+        if dense:
+            W = weights[dense]
+            for rows in self._row_blocks():
+                block = self.matrix[rows]
+                for d in range(self.max_dist + 1):
+                    shell = (block == d).astype(W.dtype)
+                    sums[dense, d] += (W.dot(shell.T) * W[:, rows]).sum(axis=1)
+        return sums
+
+    def within_sums(self, weights, s):
+        """
+        Return the sums of weights of nodes within distance `s` of each
+        node.
+        """
+        sums = np.zeros(len(self.matrix))
+        for rows in self._row_blocks():
+            block = self.matrix[rows]
+            within = (block >= 0) & (block <= s)
+            sums[rows] = within.dot(weights)
+        return sums
+
+
+class DistanceShells(object):
+    """
+    All pairs shortest path lengths as sparse per distance shells; shell
+    `d` is a sparse matrix with ones for the node pairs at distance `d`.
+    Only reachable pairs are stored.
+
+    :param adjacency: Adjacency matrix of the network.
+    :param bool directed: Follow the edges in their direction only.
+
+    """
+    def __init__(self, adjacency, directed=False):
+        n = adjacency.shape[0]
+        pairs = {}
+        for start, dist in _shortest_path_blocks(adjacency, directed):
+            rows, cols = np.nonzero(dist > 0)
+            values = dist[rows, cols]
+            order = np.argsort(values, kind="mergesort")
+            rows, cols, values = rows[order] + start, cols[order], values[order]
+            bounds = np.flatnonzero(np.diff(values)) + 1
+            for r, c, v in zip(np.split(rows, bounds), np.split(cols, bounds),
+                               np.split(values, bounds)):
+                if len(v):
+                    pairs.setdefault(int(v[0]), []).append(
+                        (r.astype(np.int32), c.astype(np.int32)))
+        self.max_dist = max(pairs) if pairs else 0
+        self.shells = [scipy.sparse.identity(n, dtype=np.int8, format="csr")]
+        for d in range(1, self.max_dist + 1):
+            parts = pairs.pop(d, [])
+            rows = np.concatenate([r for r, _ in parts] or [[]])
+            cols = np.concatenate([c for _, c in parts] or [[]])
+            self.shells.append(scipy.sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                shape=(n, n)))
+
+    def counts(self):
+        """See :func:`DistanceMatrix.counts`."""
+        return np.column_stack([np.diff(shell.indptr)
+                                for shell in self.shells]).astype(float)
+
+    def pair_sums(self, weights):
+        """See :func:`DistanceMatrix.pair_sums`."""
+        W = np.asarray(weights, dtype=float).T
+        return np.column_stack([(shell.dot(W) * W).sum(axis=0)
+                                for shell in self.shells])
+
+    def within_sums(self, weights, s):
+        """See :func:`DistanceMatrix.within_sums`."""
+        sums = np.zeros(len(weights))
+        for shell in self.shells[:s + 1]:
+            sums += shell.dot(weights)
+        return sums
+
 
 class SANTA(object):
+    """
+    Spatial analysis of functional enrichment (SANTA) of `node_weights`
+    on `network`.
+
+    The shortest path lengths between all nodes are computed once and
+    kept in a compact :class:`DistanceMatrix` or, for networks with more
+    than `DENSE_MAX_NODES` nodes, in :class:`DistanceShells`; Knet is then
+    a cumulative (over distances) weighted quadratic form, computed for
+    whole matrices of permuted weights at once.
+
+    :param networkx.Graph network: The network.
+    :param dict node_weights: Weights of (a subset of) the nodes.
+
+    """
     def __init__(self, network, node_weights):
         self.network = network
         self.node_weights = node_weights
@@ -22,19 +229,29 @@ class SANTA(object):
         self.max_dist = None
         self.mean_node_weight = None
 
-    def _calc_network_properties(self):
-        if self.dist_matrix is None:
-            self.dist_matrix = nx.all_pairs_shortest_path_length(self.network)
-
-        if self.max_dist is None:
-            self.max_dist = max(max(n.values()) for n in self.dist_matrix.values())
+        self._counts = None
 
+    def _calc_network_properties(self):
         if self.nodes is None:
-            self.nodes = self.network.nodes()
+            self.nodes = list(self.network.nodes())
 
         if self.number_of_nodes is None:
             self.number_of_nodes = self.network.number_of_nodes()
 
+        if self.dist_matrix is None:
+            adjacency = adjacency_matrix(self.network, self.nodes)
+            if self.number_of_nodes > DENSE_MAX_NODES:
+                distances = DistanceShells
+            else:
+                distances = DistanceMatrix
+            self.dist_matrix = distances(adjacency, self.network.is_directed())
+
+        if self.max_dist is None:
+            self.max_dist = self.dist_matrix.max_dist
+
+        if self._counts is None:
+            self._counts = self.dist_matrix.counts()
+
         if self.mean_node_weight is None:
             self.mean_node_weight = sum(self.node_weights.values()) / self.number_of_nodes
 
@@ -45,44 +262,37 @@ class SANTA(object):
             for n, w in self.node_weights.items():
                 self.all_node_weights[self.w_index[n]] = w
 
-    def _k_net(self, s):
-        k_net_s = 0
-
-        for i in self.dist_matrix:
-            if self.all_node_weights[self.w_index[i]] != 0:
-                tmp = 0
-
-                for j in self.dist_matrix[i]:
-                    if self.dist_matrix[i][j] <= s:
-                        tmp += self.all_node_weights[self.w_index[j]] - self.mean_node_weight
-
-                k_net_s += tmp * self.all_node_weights[self.w_index[i]]
-
-        return k_net_s
+    def _k_net(self, weights):
+        """
+        Knet for distances 0 to `max_dist` - 1 for a matrix of weight
+        vectors (one per row).
+        """
+        pn = 2 / (self.mean_node_weight * self.number_of_nodes) ** 2
+        pairs = self.dist_matrix.pair_sums(weights)
+        centered = pairs - self.mean_node_weight * weights.dot(self._counts)
+        return np.cumsum(centered[:, :self.max_dist], axis=1) * pn
 
     def k_net(self):
         self._calc_network_properties()
         self._set_all_node_weights()
 
-        k_net = np.zeros(self.max_dist)
-
-        for s in range(self.max_dist):
-            k_net[s] = self._k_net(s)
-
-        k_net = k_net * (2 / (self.mean_node_weight * self.number_of_nodes)**2)
+        k_net = self._k_net(self.all_node_weights[None, :])[0]
         auk_k_net = np.trapz(k_net)
         return k_net, auk_k_net
 
     def auk_p_value(self, permutations):
         _, obs_auk = self.k_net()
         auk_perm = np.zeros(permutations)
-        original_node_weights = np.copy(self.all_node_weights)
+        weights = np.copy(self.all_node_weights)
 
-        for i in range(permutations):
-            np.random.shuffle(self.all_node_weights)
-            auk_perm[i] = self.k_net()[1]
-
-        self.all_node_weights = original_node_weights
+        for start in range(0, permutations, BLOCK_SIZE):
+            block = np.zeros((min(BLOCK_SIZE, permutations - start),
+                              self.number_of_nodes))
+            for row in block:
+                np.random.shuffle(weights)
+                row[:] = weights
+            auk_perm[start:start + len(block)] = \
+                np.trapz(self._k_net(block), axis=1)
 
         auk_perm_mean = np.mean(auk_perm)
         auk_perm_std = np.std(auk_perm)
@@ -97,16 +307,12 @@ class SANTA(object):
         self._set_all_node_weights()
 
         pn = (2 / (self.mean_node_weight * self.number_of_nodes)**2)
-        k_node = []
+        within = self.dist_matrix.within_sums(self.all_node_weights, s)
+        count = self._counts[:, :s + 1].sum(axis=1)
+        scores = (within - self.mean_node_weight * count) * pn
 
-        for i in self.dist_matrix:
-            if self.all_node_weights[self.w_index[i]] == 0:
-                tmp = [i, 0, s]
-                for j in self.dist_matrix[i]:
-                    if self.dist_matrix[i][j] <= s:
-                        tmp[1] += self.all_node_weights[self.w_index[j]] - self.mean_node_weight
-                tmp[1] *= pn
-                k_node.append(tmp)
+        k_node = [[self.nodes[i], scores[i], s]
+                  for i in np.flatnonzero(self.all_node_weights == 0)]
 
         return sorted(k_node, key=lambda n: -n[1])
 
@@ -132,4 +338,3 @@ class SANTA(object):
         domain = Domain(values)
 
         return Table(domain, [[n, v] for n, v in enumerate(v_list)])
-
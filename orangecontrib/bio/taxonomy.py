@@ -3,6 +3,7 @@ from __future__ import absolute_import, division
 import os
 import sys
 import warnings
+import threading
 
 try:
     import cPickle as pickle
@@ -15,6 +16,7 @@ except ImportError:
     from orangecontrib.bio.utils import environ
 
 from orangecontrib.bio.utils import serverfiles
+from orangecontrib.bio.utils.colstore import file_key
 
 _COMMON_NAMES = (
     ("3702",   "Arabidopsis thaliana"),
@@ -135,10 +137,7 @@ def pickled_cache(filename=None, dependencies=[], version=1, maxSize=30,
         else:
             cache_filename = filename
 
-        def f(*args, **kwargs):
-            currentVersion = tuple([datetime_info(domain, file)
-                                    for domain, file in dependencies] +
-                                    [version, pytag])
+        def read_cache(currentVersion):
             try:
                 with open(cache_filename, "rb") as f:
                     cachedVersion, cache = pickle.load(f)
@@ -152,16 +151,32 @@ def pickled_cache(filename=None, dependencies=[], version=1, maxSize=30,
                     "An error occurred while reading cache, using empty cache",
                     UserWarning)
                 cachedVersion, cache = "no version", {}
-            else:
-                if cachedVersion != currentVersion:
-                    cachedVersion, cache = "no version", {}
+            if cachedVersion != currentVersion:
+                cache = {}
+            return cache
+
+        # the cache (and its version) last read or written by this process
+        loaded = {}
+        # guards `loaded` (and the cache file) against concurrent calls
+        lock = threading.Lock()
 
+        def f(*args, **kwargs):
+            currentVersion = tuple([datetime_info(domain, file)
+                                    for domain, file in dependencies] +
+                                    [version, pytag])
             allArgs = args + tuple([(key, tuple(value) if type(value) in [set, list] else value)\
                                      for key, value in kwargs.items()])
-            if allArgs in cache:
-                return cache[allArgs]
-            else:
-                res = func(*args, **kwargs)
+            with lock:
+                if loaded.get("version") == currentVersion:
+                    cache = loaded["cache"]
+                else:
+                    cache = read_cache(currentVersion)
+                    loaded.update(version=currentVersion, cache=cache)
+                if allArgs in cache:
+                    return cache[allArgs]
+
+            res = func(*args, **kwargs)
+            with lock:
                 if len(cache) > maxSize:
                     del cache[next(iter(cache))]
                 cache[allArgs] = res
@@ -171,8 +186,7 @@ def pickled_cache(filename=None, dependencies=[], version=1, maxSize=30,
                                     protocol=pickleprotocol)
                 except (OSError, IOError) as err:
                     pass
-
-                return res
+            return res
         return f
 
     return cached
@@ -195,27 +209,40 @@ class Taxonomy(object):
             raise UnknownSpeciesIdentifier(id)
 
     def search(self, string, onlySpecies=True, exact=False):
-        res = self._tax.search(string, exact)
+        res = list(self._tax.search(string, exact))
         if onlySpecies:
-            res = [taxid for taxid in res
-                   if self._tax[taxid].rank == "species"]
+            ranks = self._tax.index.rank_many(res)
+            res = [taxid for taxid, rank in zip(res, ranks)
+                   if rank == "species"]
         return res
 
     def __iter__(self):
         return iter(self._tax)
 
     def __getitem__(self, id):
-        return self.get_entry(id).name
+        try:
+            return self._tax.index.name(id)
+        except KeyError:
+            raise UnknownSpeciesIdentifier(id)
 
     def other_names(self, id):
         return [(name, q) for name, q in self._tax[id].synonyms
                 if q != "scientific name"]
 
     def rank(self, id):
-        return self._tax[id].rank
+        return self._tax.index.rank(id)
 
     def parent(self, id):
-        return self._tax[id].parent_tax_id
+        return self._tax.index.parent(id) or id
+
+    def lineage(self, id):
+        return self._tax.lineage(id)
+
+    def lineage_many(self, ids):
+        return self._tax.lineage_many(ids)
+
+    def lca_many(self, ids1, ids2):
+        return self._tax.lca_many(ids1, ids2)
 
     def subnodes(self, id, levels=1):
         res = self._tax.child_tax_ids(id)
@@ -228,6 +255,27 @@ class Taxonomy(object):
         return list(self._tax)
 
 
+#: Taxonomy instances shared by the module level functions (one per
+#: thread, as sqlite3 connections can not be shared between threads).
+_shared = threading.local()
+
+
+def _shared_taxonomy():
+    """
+    Return the shared :class:`Taxonomy` instance (opened again if the
+    database file changed since).
+    """
+    filename = serverfiles.localpath(Taxonomy.DOMAIN, Taxonomy.FILENAME)
+    try:
+        key = file_key(filename)
+    except OSError:
+        key = None
+    if key is None or getattr(_shared, "key", None) != key:
+        _shared.taxonomy = Taxonomy()
+        _shared.key = file_key(filename)
+    return _shared.taxonomy
+
+
 @pickled_cache(None, [("Taxonomy", "ncbi-taxonomy.sqlite")], version=2)
 def name(taxid):
     """
@@ -238,7 +286,7 @@ def name(taxid):
     if taxid in _COMMON_NAMES:
         return _COMMON_NAMES[taxid]
     else:
-        return Taxonomy()[taxid]
+        return _shared_taxonomy()[taxid]
 
 
 @pickled_cache(None, [("Taxonomy", "ncbi-taxonomy.sqlite")], version=2)
@@ -249,26 +297,40 @@ def other_names(taxid):
     Use :func:`name` to retrieve the scientific name.
 
     """
-    return  Taxonomy().other_names(taxid)
+    return  _shared_taxonomy().other_names(taxid)
 
 
-@pickled_cache(None, [("Taxonomy", "ncbi-taxonomy.sqlite")], version=2)
 def search(string, onlySpecies=True, exact=False):
     """ Search the NCBI taxonomy database for an organism.
 
     :param string: Search string.
     :param onlySpecies: Return only taxids of species (and subspecies).
-    :param exact:  Return only taxids of organism that exactly match the string.
+    :param exact:  Return only taxids of organism that exactly match the string
+        (names are always compared ignoring case).
     """
-    ids = Taxonomy().search(string, onlySpecies, exact)
+    ids = _shared_taxonomy().search(string, onlySpecies, exact)
     return list(ids)
 
 
-@pickled_cache(None, [("Taxonomy", "ncbi-taxonomy.sqlite")], version=2)
 def lineage(taxid):
     """ Return a list of taxids ordered from the topmost node (root) to taxid.
     """
-    return Taxonomy()._tax.lineage(taxid)
+    return _shared_taxonomy().lineage(taxid)
+
+
+def lineage_many(taxids):
+    """
+    Return a list of lineages (see :func:`lineage`) of `taxids`.
+    """
+    return _shared_taxonomy().lineage_many(taxids)
+
+
+def lca_many(taxids1, taxids2):
+    """
+    Return a list of the lowest common ancestors of the corresponding
+    `taxids1` and `taxids2` (None for taxids without a common ancestor).
+    """
+    return _shared_taxonomy().lca_many(taxids1, taxids2)
 
 
 def to_taxid(code, mapTo=None):
@@ -318,7 +380,7 @@ def taxids():
     """
     Returns a list of all (about half a million!) NCBI's taxonomy ID's.
     """
-    return Taxonomy().taxids()
+    return _shared_taxonomy().taxids()
 
 
 def ensure_downloaded(callback=None, verbose=True):
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from orangecontrib.bio.utils import colstore
+
+
+class TestColstore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.store")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, value, key=None):
+        with colstore.StoreWriter(self.path, 1, key) as writer:
+            writer.add_array("a", numpy.arange(value))
+            writer.add_strings("s", ["x", "yy", str(value)])
+            writer.add_categorical("c", ["b", "a", "b"])
+            writer.add_meta("value", value)
+
+    def test_store(self):
+        self.write(3, {"k": 1})
+        store = colstore.Store.open(self.path, 1, {"k": 1})
+        self.assertEqual(store.array("a").tolist(), [0, 1, 2])
+        self.assertEqual(store.strings("s").tolist(), ["x", "yy", "3"])
+        codes, vocabulary = store.categorical("c")
+        self.assertEqual([vocabulary[c] for c in codes], ["b", "a", "b"])
+        self.assertEqual(store.value("value"), 3)
+        self.assertIn("s", store)
+        self.assertIsNone(colstore.Store.open(self.path, 2))
+        self.assertIsNone(colstore.Store.open(self.path, 1, {"k": 2}))
+        self.assertIsNone(
+            colstore.Store.open(os.path.join(self.dir, "none"), 1))
+
+    def test_rebuild_while_open(self):
+        self.write(3)
+        old = colstore.Store.open(self.path, 1)
+        self.write(5)
+        # the open store is still readable
+        self.assertEqual(old.array("a").tolist(), [0, 1, 2])
+        self.assertEqual(old.strings("s")[2], "3")
+        new = colstore.Store.open(self.path, 1)
+        self.assertEqual(new.array("a").tolist(), list(range(5)))
+        self.assertEqual(
+            sorted(f for f in os.listdir(self.path) if not f.startswith(".")),
+            ["CURRENT", colstore._current_data(self.path)])
+
+    def test_concurrent_writers(self):
+        first = colstore.StoreWriter(self.path, 1)
+        second = colstore.StoreWriter(self.path, 1)
+        for writer, value in [(first, 1), (second, 2)]:
+            writer.add_array("a", numpy.arange(value))
+        second.commit()
+        first.commit()
+        store = colstore.Store.open(self.path, 1)
+        self.assertEqual(store.array("a").tolist(), [0])
+        self.assertFalse(
+            [f for f in os.listdir(self.path) if f.startswith(".tmp")])
+
+    def test_missing_files(self):
+        self.write(3)
+        os.remove(os.path.join(self.path, colstore._current_data(self.path),
+                               "a.npy"))
+        self.assertIsNone(colstore.Store.open(self.path, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
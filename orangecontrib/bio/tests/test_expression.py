@@ -0,0 +1,83 @@
+import unittest
+
+import numpy
+import scipy.stats
+
+from orangecontrib.bio.utils import expression
+
+
+class TestRankingMetrics(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        self.X = rng.normal(loc=5, scale=2, size=(30, 40))
+        self.X[rng.uniform(size=self.X.shape) < 0.1] = numpy.nan
+        self.labels = rng.randint(0, 3, size=30)
+        self.permuted = numpy.array([rng.permutation(self.labels)
+                                     for _ in range(4)])
+
+    def groups(self, j, labels=None):
+        labels = self.labels if labels is None else labels
+        column = self.X[:, j]
+        return [column[(labels == g) & ~numpy.isnan(column)]
+                for g in range(3)]
+
+    def test_signal_to_noise(self):
+        def std(v):
+            return max(numpy.std(v, ddof=1), 0.2 * abs(v.mean() or 1.0))
+
+        s2n = expression.signal_to_noise(self.X, self.labels,
+                                         stdev_floor=0.2)
+        for j, score in enumerate(s2n):
+            a, b, _ = self.groups(j)
+            self.assertAlmostEqual(
+                score, (a.mean() - b.mean()) / (std(a) + std(b)))
+
+    def test_t_test(self):
+        T, P = expression.t_test(self.X, self.labels, a=1, b=2)
+        for j in range(self.X.shape[1]):
+            _, a, b = self.groups(j)
+            t, p = scipy.stats.ttest_ind(a, b)
+            self.assertAlmostEqual(T[j], t)
+            self.assertAlmostEqual(P[j], p)
+
+    def test_anova(self):
+        F, P = expression.anova_f(self.X, self.labels)
+        for j in range(self.X.shape[1]):
+            f, p = scipy.stats.f_oneway(*self.groups(j))
+            self.assertAlmostEqual(F[j], f)
+            self.assertAlmostEqual(P[j], p)
+
+    def test_fold_change(self):
+        fc = expression.fold_change(self.X, self.labels)
+        for j, score in enumerate(fc):
+            a, b, _ = self.groups(j)
+            self.assertAlmostEqual(score, a.mean() / b.mean())
+
+    def test_pearson(self):
+        y = self.labels * 1.5 + numpy.arange(30) % 4
+        r = expression.pearson_correlation(self.X, y)
+        for j, score in enumerate(r):
+            valid = ~numpy.isnan(self.X[:, j])
+            self.assertAlmostEqual(
+                score, numpy.corrcoef(self.X[valid, j], y[valid])[0, 1])
+
+    def test_label_matrix(self):
+        for metric in [expression.signal_to_noise, expression.fold_change,
+                       lambda X, L: expression.t_test(X, L)[0],
+                       lambda X, L: expression.anova_f(X, L)[1],
+                       expression.pearson_correlation]:
+            scores = metric(self.X, self.permuted)
+            self.assertEqual(scores.shape, (4, self.X.shape[1]))
+            for labels, row in zip(self.permuted, scores):
+                numpy.testing.assert_allclose(row, metric(self.X, labels))
+
+    def test_too_few_samples(self):
+        X = numpy.arange(12.0).reshape(4, 3)
+        s2n = expression.signal_to_noise(X, [0, 1, 1, 1])
+        self.assertTrue(numpy.all(numpy.isnan(s2n)))
+        T, P = expression.t_test(X, [0, 1, 2, 2])
+        self.assertTrue(numpy.all(numpy.isnan(T)))
+
+
+if __name__ == "__main__":
+    unittest.main()
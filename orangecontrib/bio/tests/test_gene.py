@@ -0,0 +1,228 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import backports.unittest_mock
+    backports.unittest_mock.install()
+    from unittest import mock
+
+from orangecontrib.bio import gene
+from orangecontrib.bio.gene.alias_index import AliasIndex
+from orangecontrib.bio.gene.info_store import GeneInfoStore
+
+GROUPS = [{"CDK1", "CDC2", "983"}, {"CDK2", "1017"}, {"cdc2", "X"}]
+
+
+class MatcherAliasesTest(gene.MatcherAliasesPickled):
+    created = 0
+
+    def create_aliases(self):
+        MatcherAliasesTest.created += 1
+        return GROUPS
+
+    def create_aliases_version(self):
+        return "v1"
+
+    def filename(self):
+        return "test_aliases"
+
+
+class TestAliasIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_lookup(self):
+        index = AliasIndex.from_groups(GROUPS)
+        self.assertEqual(index.lookup("cdc2"), [0, 2])
+        self.assertEqual(index.lookup("1017"), [1])
+        self.assertEqual(index.lookup("none"), [])
+        self.assertEqual(list(index.find(["X", "none", "cdk1"])),
+                         [index.find(["x"])[0], -1, index.find(["CDK1"])[0]])
+        self.assertEqual(index.group(0), ["983", "CDC2", "CDK1"])
+
+        index = AliasIndex.from_groups(GROUPS, ignore_case=False)
+        self.assertEqual(index.lookup("cdc2"), [2])
+        self.assertEqual(index.lookup("cdk1"), [])
+
+    def test_save_load(self):
+        path = os.path.join(self.dir, "index")
+        AliasIndex.from_groups(GROUPS).save(path, "v1")
+        self.assertIsNone(AliasIndex.load(path, "v2"))
+        self.assertIsNone(AliasIndex.load(path, "v1", ignore_case=False))
+        index = AliasIndex.load(path, "v1")
+        self.assertEqual(index.lookup("CDC2"), [0, 2])
+        self.assertEqual([set(g) for g in index.alias_groups()], GROUPS)
+
+    def test_matcher(self):
+        old_path = gene.gene_matcher_path
+        gene.gene_matcher_path = self.dir
+        MatcherAliasesTest.created = 0
+        try:
+            matcher = MatcherAliasesTest()
+            matcher.set_targets(["1017", "983", "x"])
+            self.assertEqual(matcher.umatch("CDK2"), "1017")
+            self.assertEqual(sorted(matcher.match("CDC2")), ["983", "x"])
+            self.assertEqual(matcher.umatch("CDC2"), None)
+            self.assertEqual(matcher.match("none"), [])
+            self.assertEqual(matcher.explain("cdk2"),
+                             [(["1017"], {"CDK2", "1017"})])
+
+            # the second matcher uses the saved index
+            matcher = MatcherAliasesTest()
+            matcher.set_targets(["CDK1"])
+            self.assertEqual(matcher.umatch("983"), "CDK1")
+            self.assertEqual(MatcherAliasesTest.created, 1)
+
+            # an index for other options is rebuilt from the pickled aliases
+            matcher = MatcherAliasesTest(ignore_case=False)
+            matcher.set_targets(["1017"])
+            self.assertEqual(matcher.umatch("cdk2"), None)
+            self.assertEqual(matcher.umatch("CDK2"), "1017")
+            self.assertEqual(MatcherAliasesTest.created, 1)
+
+            # both indices are kept
+            with mock.patch.object(AliasIndex, "from_groups",
+                                   side_effect=AssertionError):
+                for ignore_case in [True, False]:
+                    matcher = MatcherAliasesTest(ignore_case=ignore_case)
+                    matcher.set_targets(["1017"])
+                    self.assertEqual(matcher.umatch("CDK2"), "1017")
+
+            # an index that can not be saved is still used
+            shutil.rmtree(os.path.join(self.dir, "test_aliases.index"))
+            with mock.patch.object(AliasIndex, "save",
+                                   side_effect=IOError):
+                matcher = MatcherAliasesTest()
+                matcher.set_targets(["1017"])
+                self.assertEqual(matcher.umatch("cdk2"), "1017")
+        finally:
+            gene.gene_matcher_path = old_path
+
+
+class TestMatchMany(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.old_path = gene.gene_matcher_path
+        gene.gene_matcher_path = self.dir
+
+    def tearDown(self):
+        gene.gene_matcher_path = self.old_path
+        shutil.rmtree(self.dir)
+
+    def test_match_many(self):
+        targets = ["1017", "983", "x", "CDK1"]
+        names = ["CDK2", "cdc2", "none", "cdk1", "CDK2", "983"]
+        for matcher in [gene.MatcherAliases(GROUPS), MatcherAliasesTest(),
+                        gene.matcher([MatcherAliasesTest()]),
+                        gene.MatcherDirect()]:
+            match = matcher.set_targets(targets)
+            indptr, indices = matcher.match_many(names)
+            for i, name in enumerate(names):
+                self.assertEqual(
+                    sorted(targets[j] for j in indices[indptr[i]:indptr[i + 1]]),
+                    sorted(matcher.match(name)))
+            unique, ambiguous = match.umatch_many(names)
+            for i, name in enumerate(names):
+                umatch = matcher.umatch(name)
+                self.assertEqual(targets[unique[i]] if unique[i] >= 0 else None,
+                                 umatch)
+                self.assertEqual(ambiguous[i], len(matcher.match(name)) > 1)
+            # the same targets reuse the match (and its cached results)
+            self.assertIs(matcher.set_targets(list(targets)), match)
+
+        unique, ambiguous = gene.matcher([MatcherAliasesTest()]) \
+            .set_targets(targets).umatch_many(names)
+        self.assertEqual(unique.tolist(), [0, -1, -1, 3, 0, 1])
+        self.assertEqual(ambiguous.tolist(),
+                         [False, True, False, False, False, False])
+
+        match = gene.MatcherDirect().set_targets(targets)
+        self.assertEqual(match.umatch_many([])[0].tolist(), [])
+
+
+GENE_INFO = """\
+#tax_id\tGeneID\tSymbol\tLocusTag\tSynonyms\tdbXrefs\tchromosome\t\
+map_location\tdescription\ttype_of_gene\tSymbol_from_nomenclature_authority\t\
+Full_name_from_nomenclature_authority\tNomenclature_status\t\
+Other_designations\tModification_date
+9606\t983\tCDK1\t-\tCDC2|CDC28A\tMIM:116940|HGNC:HGNC:1722\t10\t10q21.2\t\
+cyclin dependent kinase 1\tprotein-coding\tCDK1\tcyclin dependent kinase 1\t\
+O\tcyclin-dependent kinase 1\t20160417
+9606\t1017\tCDK2\t-\tCDKN2|p33(CDK2)\tHGNC:HGNC:1771\t12\t12q13\t\
+cyclin dependent kinase 2\tprotein-coding\tCDK2\tcyclin dependent kinase 2\t\
+O\t-\t20160417
+9606\t2000\tDUP\tL1\tCDC2\t-\t1\t-\tfirst\tunknown\t-\t-\t-\t-\t20160417
+9606\t2001\tDUP\tL2\t-\t-\t1\t-\tsecond\tunknown\t-\t-\t-\t-\t20160417
+""".replace("\\\n", "")
+
+
+class TestNCBIGeneInfo(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "gene_info.9606.db")
+        with open(self.filename, "w") as f:
+            f.write(GENE_INFO)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_store(self):
+        store = GeneInfoStore.open(self.filename)
+        self.assertTrue(os.path.isdir(self.filename + ".store"))
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.gene_ids(), ["983", "1017", "2000", "2001"])
+        self.assertEqual(store.find_ids(["1017", "x", "983"]).tolist(),
+                         [1, -1, 0])
+        # non unique symbols are not indexed
+        self.assertEqual(store.find_symbols(["CDK2", "DUP", "cdk2"]).tolist(),
+                         [1, -1, -1])
+        self.assertEqual(store.value("synonyms", 1), ["CDKN2", "p33(CDK2)"])
+        self.assertEqual(store.value("other_designations", 1), [])
+        self.assertIsNone(store.value("locus_tag", 0))
+        self.assertEqual(store.alias_groups()[2], {"2000", "DUP", "L1", "CDC2"})
+
+        stored = GeneInfoStore.load(self.filename + ".store")
+        built = GeneInfoStore.from_file(self.filename)
+        for row in range(4):
+            self.assertEqual(stored.row(row), built.row(row))
+
+    def test_gene_info(self):
+        matcher = gene.MatcherAliases(
+            GeneInfoStore.from_file(self.filename).alias_groups())
+        info = gene.NCBIGeneInfo.load(self.filename, genematcher=matcher)
+        self.assertEqual(len(info), 4)
+        self.assertEqual(info.keys(), ["983", "1017", "2000", "2001"])
+        self.assertIn("983", info)
+        self.assertNotIn("CDK1", info)
+
+        gi = info["983"]
+        self.assertEqual(repr(gi), GENE_INFO.splitlines()[1])
+        self.assertEqual(gi.synonyms, ["CDC2", "CDC28A"])
+        self.assertIsNone(gi.locus_tag)
+        self.assertRaises(KeyError, info.__getitem__, "CDK1")
+        # the matcher is only needed for names other than ids and symbols
+        self.assertEqual(info.get_info("CDK2").gene_id, "1017")
+        self.assertIsNone(info._matcher)
+
+        self.assertEqual(info.get_info("cdc28a").gene_id, "983")
+        self.assertEqual(info.get_info("L2").gene_id, "2001")
+        self.assertIsNone(info.get_info("DUP"))
+        self.assertIsNone(info.get_info("CDC2"))
+        self.assertRaises(KeyError, info, "none")
+        self.assertEqual(
+            [gi.gene_id if gi else None for gi in info.get_info_many(
+                ["1017", "DUP", "CDK1", "l1", "none"])],
+            ["1017", None, "983", "2000", None])
+        self.assertEqual([gi.description for gi in info.values()],
+                         [info[id].description for id in info.keys()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import backports.unittest_mock
+    backports.unittest_mock.install()
+    from unittest import mock
+
+from orangecontrib.bio import geneset
+from orangecontrib.bio.geneset import GeneSet, GeneSets
+from orangecontrib.bio.geneset.library import GeneSetLibrary, read_gmt
+
+GENESETS = GeneSets([
+    GeneSet(id="GO:1", name="one", genes=["CDK1", "CDK2"],
+            hierarchy=("GO", "biological_process"), organism="9606",
+            link="http://go/1"),
+    GeneSet(id="GO:2", name="two", genes=["CDK2", "TP53", "CDK2"],
+            hierarchy=("GO", "molecular_function"), organism="9606"),
+    GeneSet(id="GO:3", name="three", genes=[],
+            hierarchy=("GO", "biological_process"), organism="9606",
+            description="empty"),
+    GeneSet(id="hsa1", name=u"é", genes=["BRCA1"],
+            hierarchy=("KEGG", "pathways"), organism="9606")])
+
+GMT = """\
+set1\tfirst set [http://example.com/1]\tA\tB\tC
+set2\tsecond set\tC\tD
+
+set3\t[http://example.com/3]\tE
+"""
+
+
+class TestGeneSetLibrary(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_library(self):
+        library = GeneSetLibrary.from_genesets(GENESETS)
+        self.assertEqual(len(library), 4)
+        self.assertEqual(library.genes, ["BRCA1", "CDK1", "CDK2", "TP53"])
+        self.assertEqual(library.genesets(), GENESETS)
+
+        path = os.path.join(self.dir, "library")
+        library.save(path, {"v": 1})
+        self.assertIsNone(GeneSetLibrary.load(path, {"v": 2}))
+        library = GeneSetLibrary.load(path, {"v": 1})
+        self.assertEqual(library.genesets(), GENESETS)
+        self.assertEqual(library.genesets(("GO",)),
+                         GeneSets([gs for gs in GENESETS if gs.id != "hsa1"]))
+        self.assertEqual(
+            sorted(gs.id for gs in library.genesets(
+                ("GO", "biological_process"))), ["GO:1", "GO:3"])
+        self.assertEqual(library.genesets(("none",)), GeneSets())
+
+        rows, indptr, members = library.membership(
+            ("GO", "molecular_function"))
+        self.assertEqual(indptr.tolist(), [0, 2])
+        self.assertEqual([library.genes[i] for i in members], ["CDK2", "TP53"])
+
+        merged = GeneSetLibrary.concatenate([library, library])
+        self.assertEqual(len(merged), 8)
+        self.assertEqual(merged.genesets(), GENESETS)
+
+    def test_gmt(self):
+        filename = os.path.join(self.dir, "sets.gmt")
+        with open(filename, "w") as f:
+            f.write(GMT)
+        library = read_gmt(filename, "sets")
+        self.assertEqual(library.genesets(), geneset.loadGMT(GMT, "sets"))
+        gs = [gs for gs in library.genesets() if gs.id == "set1"][0]
+        self.assertEqual((gs.description, gs.link, gs.hierarchy),
+                         ("first set", "http://example.com/1",
+                          ("Custom", "sets")))
+
+        exported = os.path.join(self.dir, "exported.gmt")
+        library.write_gmt(exported)
+        self.assertEqual(read_gmt(exported, "sets").genesets(),
+                         library.genesets())
+
+    def test_load(self):
+        with mock.patch.object(geneset, "local_path", lambda: self.dir):
+            geneset.register(GeneSets([gs for gs in GENESETS
+                                      if gs.hierarchy[0] == "GO"]))
+            geneset.register(GeneSets([gs for gs in GENESETS
+                                      if gs.hierarchy[0] == "KEGG"]))
+            self.assertEqual(sorted(geneset.list_local()),
+                             [(("GO",), "9606", True),
+                              (("KEGG", "pathways"), "9606", True)])
+            self.assertEqual(geneset.load_local((), "9606"), GENESETS)
+            self.assertTrue(os.path.isdir(os.path.join(
+                self.dir, geneset.filename(("GO",), "9606") + ".lib")))
+            # the second time the gene sets are read from the libraries
+            self.assertEqual(geneset.load_local(("KEGG",), "9606"),
+                             GeneSets([gs for gs in GENESETS
+                                      if gs.id == "hsa1"]))
+            library = geneset.library_fn(
+                (), "9606", geneset.list_local,
+                lambda h, o: os.path.join(self.dir, geneset.filename(h, o)))
+            self.assertEqual(library.genesets(), GENESETS)
+            self.assertRaises(geneset.NoGenesetsException,
+                              geneset.load_local, ("none",), "9606")
+
+
+if __name__ == "__main__":
+    unittest.main()
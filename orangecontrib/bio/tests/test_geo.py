@@ -0,0 +1,180 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+try:
+    from unittest import mock
+except ImportError:
+    import backports.unittest_mock
+    backports.unittest_mock.install()
+    from unittest import mock
+
+from orangecontrib.bio import geo
+
+SOFT = """\
+^DATABASE = Geo
+!Database_name = Gene Expression Omnibus (GEO)
+^DATASET = GDS1
+!dataset_title = A test data set
+!dataset_sample_organism = Homo sapiens
+!dataset_sample_count = 3
+!dataset_feature_count = 2
+^SUBSET = GDS1_1
+!subset_dataset_id = GDS1
+!subset_description = control
+!subset_sample_id = GSM1,GSM2
+!subset_type = disease state
+^SUBSET = GDS1_2
+!subset_dataset_id = GDS1
+!subset_description = tumor
+!subset_sample_id = GSM3
+!subset_type = disease state
+^DATASET = GDS1
+#ID_REF = Platform reference identifier
+#IDENTIFIER = identifier
+!dataset_table_begin
+ID_REF\tIDENTIFIER\tGSM1\tGSM2\tGSM3
+s3\tB\t1.0\t2.0\tnull
+s1\tA\t1.5\tnull\tnull
+s2\tB\t3.0\t4.0\t5.0
+s4\tB\tnull\t0.5\tnull
+!dataset_table_end
+"""
+
+
+def write_soft(filename, text=SOFT):
+    with gzip.open(filename, "wb") as f:
+        f.write(text.encode("utf-8"))
+
+
+class TestSoft(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "GDS1.soft.gz")
+        write_soft(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse_soft(self):
+        old_block_size = geo.SOFT_BLOCK_SIZE
+        geo.SOFT_BLOCK_SIZE = 3
+        try:
+            info, spots, genes, values = geo.parse_soft(self.filename)
+        finally:
+            geo.SOFT_BLOCK_SIZE = old_block_size
+        self.assertEqual(info["title"], "A test data set")
+        self.assertEqual(info["sample_count"], 3)
+        self.assertEqual(info["samples"], ["GSM1", "GSM2", "GSM3"])
+        self.assertEqual(
+            info["subsets"],
+            [{"id": "GDS1_1", "description": "control",
+              "sample_id": ["GSM1", "GSM2"], "type": "disease state"},
+             {"id": "GDS1_2", "description": "tumor",
+              "sample_id": ["GSM3"], "type": "disease state"}])
+        self.assertEqual(spots.tolist(), ["s3", "s1", "s2", "s4"])
+        self.assertEqual(genes.tolist(), ["B", "A", "B", "B"])
+        self.assertEqual(values.dtype, numpy.float32)
+        numpy.testing.assert_equal(
+            values, [[1, 2, numpy.nan], [1.5, numpy.nan, numpy.nan],
+                     [3, 4, 5], [numpy.nan, 0.5, numpy.nan]])
+
+    def test_read_soft_cache(self):
+        parsed = geo.read_soft(self.filename)
+        self.assertTrue(os.path.isdir(self.filename + ".parsed"))
+        cached = geo.read_soft(self.filename)
+        self.assertEqual(cached[0], parsed[0])
+        self.assertEqual(cached[1].tolist(), parsed[1].tolist())
+        numpy.testing.assert_equal(cached[3], parsed[3])
+        self.assertIsInstance(cached[3], numpy.memmap)
+
+        # a changed file is parsed again
+        write_soft(self.filename, SOFT.replace("s4\tB", "s4\tC"))
+        os.utime(self.filename, (0, 0))
+        self.assertEqual(geo.read_soft(self.filename)[2].tolist(),
+                         ["B", "A", "B", "C"])
+
+    def test_merge_spots(self):
+        _, _, genes, values = geo.parse_soft(self.filename)
+        for merge in [geo.spots_mean, geo.spots_median, geo.spots_min,
+                      geo.spots_max, lambda x: len(x)]:
+            names, merged = geo.merge_spots(values, genes, merge)
+            self.assertEqual(names.tolist(), ["A", "B"])
+            for name, row in zip(names, merged):
+                spots = values[genes == name].astype(float)
+                numpy.testing.assert_almost_equal(
+                    row, [merge(list(x)) for x in spots.T])
+
+    def test_gds(self):
+        with mock.patch.object(geo.taxonomy, "search",
+                               lambda *args, **kwargs: ["9606"]):
+            gds = geo.GDS("GDS1", local_dir=self.dir)
+        self.assertEqual(gds.info["taxid"], "9606")
+        self.assertEqual(gds.info["gene_count"], 2)
+        self.assertEqual(gds.genes, ["A", "B"])
+        self.assertEqual(gds.gene2spots, {"A": ["s1"], "B": ["s3", "s2", "s4"]})
+
+        data = gds.getdata()
+        self.assertEqual([a.name for a in data.domain.attributes],
+                         ["GSM1", "GSM2", "GSM3"])
+        self.assertEqual(data.domain.attributes[2].attributes,
+                         {"disease state": "tumor"})
+        self.assertEqual(list(data.metas[:, 0]), ["A", "B"])
+        numpy.testing.assert_almost_equal(
+            data.X, [[1.5, numpy.nan, numpy.nan], [2, 13. / 6, 5]])
+
+        data = gds.getdata(report_genes=False, remove_unknown=0.5)
+        self.assertEqual(list(data.metas[:, 0]), ["s2", "s3"])
+
+        data = gds.getdata(transpose=True, merge_function=geo.spots_max)
+        self.assertEqual([a.name for a in data.domain.attributes], ["A", "B"])
+        self.assertEqual(list(data.Y), [0, 0, 1])
+        numpy.testing.assert_almost_equal(
+            data.X, [[1.5, 3], [numpy.nan, 4], [numpy.nan, 5]])
+
+
+class TestLoadMany(unittest.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.local_dir = tempfile.mkdtemp()
+        write_soft(os.path.join(self.source, "GDS1.soft.gz"))
+        write_soft(os.path.join(self.source, "GDS2.soft.gz"),
+                   SOFT.replace("GDS1", "GDS2").replace("\tA\t", "\tC\t"))
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.local_dir)
+
+    def load(self, gds_ids, n_jobs):
+        with mock.patch.object(geo.taxonomy, "search",
+                               lambda *args, **kwargs: ["9606"]):
+            return dict((gds_id, (data, exception)) for gds_id, data, exception
+                        in geo.load_many(gds_ids, n_jobs=n_jobs,
+                                         source=self.source,
+                                         local_dir=self.local_dir))
+
+    def test_load_many(self):
+        results = self.load(["GDS1", "GDS2", "GDS3"], n_jobs=2)
+        self.assertEqual(sorted(results), ["GDS1", "GDS2", "GDS3"])
+        self.assertEqual(list(results["GDS1"][0].metas[:, 0]), ["A", "B"])
+        self.assertEqual(list(results["GDS2"][0].metas[:, 0]), ["B", "C"])
+        self.assertIsNone(results["GDS3"][0])
+        self.assertIsInstance(results["GDS3"][1], (IOError, OSError))
+        for gds_id in ["GDS1", "GDS2"]:
+            self.assertIsNone(results[gds_id][1])
+            self.assertTrue(os.path.isdir(os.path.join(
+                self.local_dir, gds_id + ".soft.gz.parsed")))
+
+        # the second time the data sets are loaded from the local files
+        shutil.rmtree(self.source)
+        os.makedirs(self.source)
+        results = self.load(["GDS2"], n_jobs=1)
+        self.assertEqual(list(results["GDS2"][0].metas[:, 0]), ["B", "C"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,273 @@
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from six import StringIO
+
+import numpy
+
+from orangecontrib.bio import go
+
+ONTOLOGY = """\
+format-version: 1.2
+
+[Term]
+id: GO:0000001
+name: root
+namespace: biological_process
+
+[Term]
+id: GO:0000002
+name: a
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000003
+name: b
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000004
+name: c
+namespace: biological_process
+alt_id: GO:0000104
+is_a: GO:0000002 ! a
+relationship: part_of GO:0000003 ! b
+
+"""
+
+
+def gaf_line(gene, term, evidence="IDA", aspect="P"):
+    return "\t".join(["DB", "ID:" + gene, gene, "", term, "ref", evidence,
+                      "", aspect, "", gene.lower(), "protein", "taxon:1",
+                      "20100101", "DB", "", ""]) + "\n"
+
+ANNOTATIONS = "".join([
+    "!gaf-version: 2.0\n",
+    gaf_line("G1", "GO:0000004"),
+    gaf_line("G2", "GO:0000002"),
+    gaf_line("G3", "GO:0000003", evidence="IEA"),
+    gaf_line("G4", "GO:0000104"),
+    gaf_line("G5", "GO:0000001", aspect="F"),
+])
+
+
+class TestDAGIndex(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+
+    def test_index(self):
+        dag = self.ontology.dag_index()
+        self.assertIs(dag, self.ontology.dag_index())
+        self.assertEqual(len(dag), 4)
+        self.assertEqual(dag.index["GO:0000104"], dag.index["GO:0000004"])
+        self.assertEqual(dag.alt_ids, {dag.index["GO:0000004"]:
+                                       ["GO:0000104"]})
+        c = dag.index["GO:0000004"]
+        self.assertEqual(sorted(dag.terms[i] for i in dag.parents(c)),
+                         ["GO:0000002", "GO:0000003"])
+        self.assertEqual(len(dag.children(dag.index["GO:0000001"])), 2)
+
+        position = dict((t, i) for i, t in enumerate(dag.order))
+        for t in range(len(dag)):
+            for p in dag.parents(t):
+                self.assertLess(position[p], position[t])
+
+    def test_super_graph(self):
+        dag = self.ontology.dag_index()
+        terms = dag.super_graph([dag.index["GO:0000004"]])
+        self.assertEqual(
+            set(dag.terms[t] for t in terms),
+            self.ontology.extract_super_graph(["GO:0000004"]))
+
+    def test_descendants(self):
+        dag = self.ontology.dag_index()
+        closure = dag.descendants()
+        self.assertIs(closure, dag.descendants())
+        self.assertEqual((closure != dag.ancestors().T).nnz, 0)
+        b = dag.index["GO:0000003"]
+        self.assertEqual(
+            sorted(dag.terms[i] for i in
+                   closure.indices[closure.indptr[b]:closure.indptr[b + 1]]),
+            ["GO:0000003", "GO:0000004"])
+
+
+class TestAnnotationIndex(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+        self.annotations = go.Annotations(StringIO(ANNOTATIONS),
+                                          ontology=self.ontology)
+
+    def test_membership(self):
+        index = self.annotations.annotation_index()
+        counts = index.counts(numpy.ones(len(index.genes), dtype=bool))
+        terms = dict(zip(index.dag.terms, counts))
+        self.assertEqual(terms, {"GO:0000001": 5, "GO:0000002": 3,
+                                 "GO:0000003": 3, "GO:0000004": 2})
+
+        index = self.annotations.annotation_index(
+            evidence_codes=["IDA"], aspect="P")
+        counts = index.counts(numpy.ones(len(index.genes), dtype=bool))
+        terms = dict(zip(index.dag.terms, counts))
+        self.assertEqual(terms, {"GO:0000001": 3, "GO:0000002": 3,
+                                 "GO:0000003": 2, "GO:0000004": 2})
+
+    def test_all_annotations(self):
+        index = self.annotations.annotation_index()
+        mask = numpy.ones(len(index.genes), dtype=bool)
+        for term, genes in zip(index.dag.terms,
+                               index.term_genes(range(len(index.dag)), mask)):
+            annotations = self.annotations.get_all_annotations(term)
+            self.assertEqual(sorted(a.geneName for a in annotations),
+                             sorted(genes))
+        self.assertEqual(
+            len(self.annotations.get_all_annotations("GO:0000104")), 2)
+
+    def test_enriched_terms(self):
+        res = self.annotations.get_enriched_terms(["G1", "G3"],
+                                                  use_fdr=False)
+        self.assertEqual(set(res), set(["GO:0000001", "GO:0000002",
+                                        "GO:0000003", "GO:0000004"]))
+        self.assertEqual(sorted(res["GO:0000003"][0]), ["G1", "G3"])
+        self.assertEqual(res["GO:0000003"][2], 3)
+        self.assertEqual(res["GO:0000002"][0], ["G1"])
+        self.assertEqual(res["GO:0000001"][1], 1.0)
+
+    def test_enrichment_batch(self):
+        gene_sets = [["G1", "G3"], ["G2", "G4", "G5", "X"], [], ["G5"]]
+        reference = ["G1", "G2", "G3", "G4"]
+        for n_jobs in [1, 2]:
+            res = self.annotations.enrichment_batch(
+                gene_sets, reference=reference, n_jobs=n_jobs, chunk_size=2)
+            self.assertEqual(list(res.query_size), [2, 3, 0, 1])
+            self.assertEqual(res.reference_size, 4)
+            for i, genes in enumerate(gene_sets):
+                expected = self.annotations.get_enriched_terms(
+                    genes, reference=reference)
+                actual = res.enriched_terms(i)
+                self.assertEqual(set(actual), set(expected))
+                for term in expected:
+                    self.assertEqual(sorted(actual[term][0]),
+                                     sorted(expected[term][0]))
+                    self.assertAlmostEqual(actual[term][1],
+                                           expected[term][1])
+                    self.assertEqual(actual[term][2], expected[term][2])
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.obo = os.path.join(self.tmpdir, "gene_ontology_edit.obo")
+        self.gaf = os.path.join(self.tmpdir, "gene_association")
+        with open(self.obo, "w") as f:
+            f.write(ONTOLOGY)
+        with open(self.gaf, "w") as f:
+            f.write(ANNOTATIONS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache(self):
+        o1 = go.Ontology(self.obo)
+        a1 = go.Annotations(self.gaf, ontology=o1)
+        self.assertTrue(os.path.isdir(self.obo + ".cache"))
+        self.assertTrue(os.path.isdir(self.gaf + ".cache"))
+
+        o2 = go.Ontology(self.obo)
+        a2 = go.Annotations(self.gaf, ontology=o2)
+        self.assertEqual(sorted(o1), sorted(o2))
+        self.assertEqual(o1.alias_mapper, o2.alias_mapper)
+        for term in o1:
+            self.assertEqual(o1[term].name, o2[term].name)
+            self.assertEqual(o1[term].related, o2[term].related)
+            self.assertEqual(o1[term].related_to, o2[term].related_to)
+
+        self.assertEqual(a1.gene_names, a2.gene_names)
+        self.assertEqual(
+            a1.get_enriched_terms(["G1", "G4"]),
+            a2.get_enriched_terms(["G1", "G4"]))
+        self.assertEqual(list(a1), list(a2))
+        self.assertEqual(a1.gene_annotations, a2.gene_annotations)
+
+    def test_invalidate(self):
+        go.Ontology(self.obo)
+        with open(self.obo, "a") as f:
+            f.write("[Term]\nid: GO:0000005\nname: d\n"
+                    "is_a: GO:0000001 ! root\n\n")
+        ontology = go.Ontology(self.obo)
+        self.assertIn("GO:0000005", ontology)
+        self.assertIn(("is_a", "GO:0000005"),
+                      ontology["GO:0000001"].related_to)
+
+
+    def test_modified_terms(self):
+        go.Ontology(self.obo)
+        ontology = go.Ontology(self.obo)
+        plain = go.Ontology(self.obo)
+        plain.terms = dict((term_id, plain[term_id]) for term_id in plain)
+        for o in [ontology, plain]:
+            o.terms["GO:0000004"] = go.Term(
+                "[Term]\nid: GO:0000004\nname: c\n"
+                "is_a: GO:0000003 ! b\n", o)
+            del o.terms["GO:0000002"]
+        self.assertEqual(sorted(ontology.relations()),
+                         [("GO:0000003", "is_a", "GO:0000001"),
+                          ("GO:0000004", "is_a", "GO:0000003")])
+        self.assertEqual(sorted(ontology.relations()),
+                         sorted(plain.relations()))
+        self.assertEqual(ontology.dag_index().terms,
+                         ["GO:0000001", "GO:0000003", "GO:0000004"])
+
+
+class TestParse(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stanzas(self):
+        header = []
+        blocks = list(go._iter_stanzas(StringIO(ONTOLOGY + "! end\n"),
+                                       header))
+        self.assertEqual(header, ["format-version: 1.2\n", "\n"])
+        self.assertEqual(len(blocks), 4)
+        self.assertTrue(all(b.startswith("[Term]") for b in blocks))
+        blocks = list(go._iter_stanzas(StringIO("[Term]\nid: A")))
+        self.assertEqual(blocks, ["[Term]\nid: A"])
+
+    def test_columnar(self):
+        records = go.Annotations(ontology=go.Ontology(StringIO(ONTOLOGY)))
+        records.parse_file(StringIO(ANNOTATIONS), columnar=False)
+        columnar = go.Annotations(ontology=go.Ontology(StringIO(ONTOLOGY)))
+        columnar.parse_file(StringIO(ANNOTATIONS), columnar=True)
+        self.assertIsNotNone(columnar._columns)
+        self.assertEqual(columnar.gene_names, records.gene_names)
+        self.assertEqual(columnar.header, records.header)
+        self.assertEqual(list(columnar), list(records))
+
+    def test_compressed(self):
+        gaf = os.path.join(self.tmpdir, "gene_association.gz")
+        with gzip.open(gaf, "wb") as f:
+            f.write(ANNOTATIONS.encode("utf-8"))
+        obo = os.path.join(self.tmpdir, "gene_ontology_edit.obo")
+        with open(obo, "w") as f:
+            f.write(ONTOLOGY)
+        tar = os.path.join(self.tmpdir, "ontology.tar.gz")
+        with tarfile.open(tar, "w:gz") as f:
+            f.add(obo, "gene_ontology_edit.obo")
+
+        progress = []
+        ontology = go.Ontology(tar, progress_callback=progress.append)
+        self.assertEqual(len(ontology), 4)
+        self.assertEqual(ontology.header, "format-version: 1.2\n\n")
+        self.assertEqual(progress[-1], 100.0)
+
+        annotations = go.Annotations(ontology=ontology)
+        annotations.parse_file(gaf, use_cache=False)
+        self.assertEqual(len(annotations.gene_names), 5)
@@ -0,0 +1,162 @@
+import random
+import unittest
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from orangecontrib.bio.utils import gsea_engine, parallel
+from orangecontrib.bio.utils.expression import signal_to_noise
+
+
+def reference_pval(es, esnull):
+    # per gene set nominal p-value as computed before vectorization
+    try:
+        if es < 0:
+            return float(len([a for a in esnull if a <= es])) / \
+                len([a for a in esnull if a < 0])
+        else:
+            return float(len([a for a in esnull if a >= es])) / \
+                len([a for a in esnull if a >= 0])
+    except ZeroDivisionError:
+        return 1.0
+
+
+def reference_normalize(s, esnull):
+    try:
+        if s == 0:
+            return 0.0
+        if s >= 0:
+            pos = [a for a in esnull if a >= 0]
+            return s / (sum(pos) / float(len(pos)))
+        else:
+            neg = [a for a in esnull if a < 0]
+            return -s / (sum(neg) / float(len(neg)))
+    except ZeroDivisionError:
+        return 0.0
+
+
+class TestGseaEngine(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.lcor = rng.normal(size=60).tolist()
+        self.subsets = [[0, 1, 2], [5, 17, 33, 41, 59], [10],
+                        list(range(20, 35)), [3, 3, 8, 44], []]
+        self.n = 40
+
+    def reference(self):
+        """ES and null scores with the per set, per permutation code."""
+        def scores(lcor):
+            ordered = gsea_engine.orderedPointersCorr(lcor)
+            rev = numpy.argsort(ordered)
+            return [gsea_engine.enrichmentScoreRanked(
+                        subset, lcor, ordered, rev2=rev)[0]
+                    if subset else 0.0
+                    for subset in self.subsets]
+
+        es = scores(self.lcor)
+        nulls = [[] for _ in self.subsets]
+        for i in range(self.n):
+            shuffled = list(self.lcor)
+            random.Random(2000 + i).shuffle(shuffled)
+            for null, s in zip(nulls, scores(shuffled)):
+                null.append(s)
+        return es, nulls
+
+    def test_enrichment_scores(self):
+        sets = gsea_engine.geneSetMatrix(self.subsets, len(self.lcor))
+        es = gsea_engine.enrichmentScoreMatrix([self.lcor], sets)[0]
+        nulls = gsea_engine.enrichmentScoreMatrix(
+            gsea_engine.shuffledRankings(self.lcor, range(2000, 2000 + self.n)),
+            sets)
+        ref_es, ref_nulls = self.reference()
+        numpy.testing.assert_allclose(es, ref_es, atol=1e-12)
+        numpy.testing.assert_allclose(nulls.T, ref_nulls, atol=1e-12)
+
+    def test_significance(self):
+        es, nulls = self.reference()
+        result = gsea_engine.gseaSignificance(es, nulls)
+        self.assertEqual(len(result), len(self.subsets))
+        for (res, nes, pval, _), s, null in zip(result, es, nulls):
+            self.assertAlmostEqual(res, s)
+            self.assertAlmostEqual(nes, reference_normalize(s, null))
+            self.assertAlmostEqual(pval, reference_pval(s, null))
+            self.assertAlmostEqual(gsea_engine.gseapval(s, null), pval)
+
+    def test_shuffled_labels(self):
+        labels = [0, 0, 1, 1, 1, 0, -1]
+        shuffled = gsea_engine.shuffledLabels(labels, [3, 4])
+        for row, seed in zip(shuffled, [3, 4]):
+            locations = list(range(len(labels)))
+            random.Random(seed).shuffle(locations)
+            expected = [None] * len(labels)
+            for i, location in enumerate(locations):
+                expected[location] = labels[i]
+            self.assertEqual(row.tolist(), expected)
+
+
+def scaled(i):
+    return parallel.get_state("scale") * i
+
+
+class TestParallelState(unittest.TestCase):
+    def test_executor_state(self):
+        # concurrent calls share the executor's threads
+        with ThreadPoolExecutor(4) as executor, \
+                ThreadPoolExecutor(8) as callers:
+            def run(scale):
+                return parallel.parallel_map(
+                    scaled, range(50), state={"scale": scale},
+                    executor=executor, chunksize=3)
+            results = list(callers.map(run, range(1, 9)))
+        for scale, result in zip(range(1, 9), results):
+            self.assertEqual(result, [scale * i for i in range(50)])
+        self.assertFalse(parallel.has_state("scale"))
+
+
+class TestPermutationScores(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(1)
+        self.X = rng.normal(size=(20, 50))
+        self.labels = numpy.array([0] * 10 + [1] * 10)
+        self.sets = gsea_engine.geneSetMatrix(
+            [[0, 1, 2, 3], list(range(10, 30)), [7, 40, 49]], 50)
+        self.es = gsea_engine.enrichmentScoreMatrix(
+            [signal_to_noise(self.X, self.labels)], self.sets)[0]
+
+    def check_same(self, rankings, n=30):
+        def run(**kwargs):
+            nulls = gsea_engine.permutationScores(
+                rankings, self.sets, n, block_size=7, **kwargs)
+            return nulls, gsea_engine.gseaSignificance(self.es, nulls)
+
+        nulls, significance = run(n_jobs=1)
+        self.assertEqual(nulls.shape, (3, n))
+        with ThreadPoolExecutor(3) as executor:
+            others = [run(n_jobs=2), run(executor=executor)]
+        for other_nulls, other_significance in others:
+            numpy.testing.assert_array_equal(other_nulls, nulls)
+            self.assertEqual(other_significance, significance)
+        self.assertFalse(parallel.has_state("rankings"))
+
+    def test_label_permutations(self):
+        self.check_same(gsea_engine.labelPermutations(
+            self.X, self.labels, functools.partial(signal_to_noise, stdev_floor=0.2)))
+
+    def test_gene_permutations(self):
+        self.check_same(gsea_engine.genePermutations(
+            signal_to_noise(self.X, self.labels)))
+
+    def test_block_size(self):
+        rankings = gsea_engine.genePermutations(numpy.linspace(-1, 1, 50))
+        calls = []
+        whole = gsea_engine.permutationScores(
+            rankings, self.sets, 10, callback=lambda: calls.append(1))
+        self.assertEqual(len(calls), 10)
+        numpy.testing.assert_array_equal(
+            gsea_engine.permutationScores(rankings, self.sets, 10,
+                                          block_size=3), whole)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from orangecontrib.bio import ppi
+
+
+class TestSTRINGNetwork(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "string.sqlite")
+        con = sqlite3.connect(self.filename)
+        ppi.STRING.clear_db(con)
+        proteins = [("9606.A", "9606"), ("9606.B", "9606"),
+                    ("9606.C", "9606"), ("9606.D", "9606"),
+                    ("9606.E", "9606"), ("10090.F", "10090")]
+        links = [("9606.A", "9606.B", 900), ("9606.B", "9606.C", 400),
+                 ("9606.C", "9606.D", 800), ("9606.A", "9606.C", 700)]
+        con.executemany("INSERT INTO proteins VALUES (?, ?)", proteins)
+        con.executemany("INSERT INTO links VALUES (?, ?, ?)",
+                        links + [(b, a, s) for a, b, s in links])
+        con.executemany("INSERT INTO aliases VALUES (?, ?, ?)",
+                        [("9606.A", "a1", "src"), ("9606.A", "a2", "src"),
+                         ("9606.D", "d", "src")])
+        ppi.STRING.create_db_index(con)
+        con.commit()
+        con.close()
+        self.db = ppi.STRING(database=self.filename)
+
+    def tearDown(self):
+        self.db.db.close()
+        shutil.rmtree(self.dir)
+
+    def edges(self, ids, adjacency):
+        adjacency = adjacency.tocoo()
+        self.assertEqual((adjacency != adjacency.T).nnz, 0)
+        return set((ids[i], ids[j], s) for i, j, s in
+                   zip(adjacency.row, adjacency.col, adjacency.data)
+                   if ids[i] < ids[j])
+
+    def test_network(self):
+        ids, adjacency = self.db.network(taxid="9606")
+        self.assertEqual(list(ids), self.db.ids("9606"))
+        self.assertEqual(self.edges(ids, adjacency),
+                         {("9606.A", "9606.B", 900), ("9606.B", "9606.C", 400),
+                          ("9606.C", "9606.D", 800), ("9606.A", "9606.C", 700)})
+
+        ids, adjacency = self.db.network(taxid="9606", min_score=700)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(self.edges(ids, adjacency)), 3)
+
+        # the second call is served from the cache
+        self.assertTrue(os.path.exists(
+            self.filename + ".network.9606.700.npz"))
+        cached_ids, cached = self.db.network(taxid="9606", min_score=700)
+        self.assertEqual(list(cached_ids), list(ids))
+        self.assertEqual((cached != adjacency).nnz, 0)
+
+        # an existing (stale) cache is replaced; failed writes are ignored
+        cache = self.filename + ".network.9606.700.npz"
+        ppi._save_network(cache, "other", ids, adjacency)
+        self.assertIsNotNone(ppi._load_network(cache, "other"))
+        ppi._save_network(os.path.join(self.dir, "none", "net.npz"),
+                          "other", ids, adjacency)
+        self.assertFalse([f for f in os.listdir(self.dir) if ".tmp" in f])
+
+    def test_neighbourhood(self):
+        ids, adjacency = self.db.network(query=["9606.D"], hops=0)
+        self.assertEqual(list(ids), ["9606.D"])
+        self.assertEqual(adjacency.nnz, 0)
+
+        ids, adjacency = self.db.network(query=["9606.D", "9606.E"], hops=1)
+        self.assertEqual(list(ids), ["9606.D", "9606.E", "9606.C"])
+        self.assertEqual(self.edges(ids, adjacency),
+                         {("9606.C", "9606.D", 800)})
+
+        ids, _ = self.db.network(query=["9606.D"], hops=2)
+        self.assertEqual(list(ids), ["9606.D", "9606.A", "9606.B", "9606.C"])
+
+        ids, _ = self.db.network(query=["9606.D"], hops=2, min_score=500)
+        self.assertEqual(list(ids), ["9606.D", "9606.A", "9606.C"])
+
+    def test_neighbours(self):
+        self.assertEqual(
+            self.db.neighbours(["9606.C", "9606.A"]),
+            [("9606.C", "9606.D", 800), ("9606.C", "9606.A", 700),
+             ("9606.C", "9606.B", 400), ("9606.A", "9606.B", 900),
+             ("9606.A", "9606.C", 700)])
+        self.assertEqual(
+            self.db.neighbours(["9606.C", "9606.A"], min_score=500, top_k=1),
+            [("9606.C", "9606.D", 800), ("9606.A", "9606.B", 900)])
+        self.assertEqual(self.db.neighbours(["9606.E"]), [])
+        with self.assertRaises(ValueError):
+            self.db.neighbours(["9606.A"], channels=["experimental"])
+
+    def test_subnetwork(self):
+        self.assertEqual(
+            self.db.subnetwork(["9606.A", "9606.B", "9606.C"]),
+            [("9606.A", "9606.B", 900), ("9606.A", "9606.C", 700),
+             ("9606.B", "9606.C", 400)])
+        self.assertEqual(
+            self.db.subnetwork(["9606.A", "9606.B", "9606.C"], min_score=800),
+            [("9606.A", "9606.B", 900)])
+
+    def test_query_with_ids_transaction(self):
+        con = self.db.db
+        con.execute("INSERT INTO proteins VALUES ('9606.X', '9606')")
+        rows = ppi._query_with_ids(
+            con, "SELECT protein_id FROM proteins "
+                 "WHERE protein_id IN (SELECT id FROM _query)",
+            (), ["9606.A", "9606.X"])
+        self.assertEqual(sorted(rows), [("9606.A",), ("9606.X",)])
+        # the caller's transaction is left open
+        self.assertTrue(con.in_transaction)
+        self.db.neighbours(["9606.A"])
+        self.db.network(query=["9606.A"], hops=1)
+        con.rollback()
+        self.assertNotIn("9606.X", self.db.ids("9606"))
+
+    def test_queries_release_locks(self):
+        self.db.network(query=["9606.A"], hops=2)
+        self.db.subnetwork(["9606.A", "9606.B"])
+        self.db.neighbours(["9606.A"])
+        self.assertFalse(self.db.db.in_transaction)
+        # another connection can write
+        other = sqlite3.connect(self.filename, timeout=0)
+        try:
+            other.execute("INSERT INTO proteins VALUES ('9606.Y', '9606')")
+            other.commit()
+        finally:
+            other.close()
+
+    def test_synonyms_many(self):
+        synonyms = self.db.synonyms_many(["9606.A", "9606.B", "9606.D"])
+        self.assertEqual(synonyms, {"9606.A": ["a1", "a2"], "9606.B": [],
+                                    "9606.D": ["d"]})
+        for id, syn in synonyms.items():
+            self.assertEqual(sorted(syn), sorted(self.db.synonyms(id)))
+
+    def test_all_edges_annotated(self):
+        edges = self.db.all_edges_annotated(taxid="9606")
+        self.assertEqual(len(edges), 8)
+        self.assertEqual(
+            sorted(edges),
+            sorted(e for id in self.db.ids("9606")
+                   for e in self.db.edges_annotated(id)))
+
+
+class TestSTRINGInitDb(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, flatfile, lines):
+        filename = "9606.{}.v10.txt.gz".format(flatfile)
+        with gzip.open(os.path.join(self.dir, filename), "wt") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+    def test_init_db(self):
+        self.write("protein.links", [
+            "protein1 protein2 combined_score",
+            "9606.A 9606.B 900", "9606.B 9606.A 900",
+            "9606.B 9606.C 400", "9606.C 9606.B 400"])
+        self.write("protein.actions", [
+            "item_id_a\titem_id_b\tmode\taction\ta_is_acting\tscore",
+            "9606.A\t9606.B\tbinding\t\t0\t900"])
+        self.write("protein.aliases", [
+            "## string_protein_id\talias\tsource",
+            "9606.A\tAAA\tEnsembl", "9606.A\tA1\tBLAST"])
+        filename = os.path.join(self.dir, "string.sqlite")
+        ppi.STRING.init_db("v10", "9606", cache_dir=self.dir,
+                           dbfilename=filename)
+
+        db = ppi.STRING(database=filename)
+        try:
+            self.assertEqual(db.organisms(), ["9606"])
+            self.assertEqual(sorted(db.ids()), ["9606.A", "9606.B", "9606.C"])
+            self.assertEqual(sorted(db.synonyms("9606.A")), ["A1", "AAA"])
+            self.assertEqual(sorted(db.edges("9606.B")),
+                             [("9606.B", "9606.A", 900),
+                              ("9606.B", "9606.C", 400)])
+            self.assertEqual(len(db.all_edges_annotated()), 4)
+            indexes = [r[0] for r in db.db.execute(
+                "SELECT name FROM sqlite_master WHERE type='index'")]
+            self.assertIn("index_link_protein_id1", indexes)
+        finally:
+            db.db.close()
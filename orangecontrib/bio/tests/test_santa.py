@@ -0,0 +1,72 @@
+import unittest
+
+import numpy
+import networkx as nx
+
+from orangecontrib.bio import santa
+
+
+def k_net_reference(network, weights, s):
+    nodes = list(network.nodes())
+    mean = sum(weights.values()) / len(nodes)
+    dist = dict(nx.all_pairs_shortest_path_length(network))
+    k = sum(weights.get(i, 0) * (weights.get(j, 0) - mean)
+            for i in nodes for j, d in dist[i].items() if d <= s)
+    return k * 2 / (mean * len(nodes)) ** 2
+
+
+class TestSANTA(unittest.TestCase):
+    def setUp(self):
+        self.network = nx.gnm_random_graph(60, 70, seed=42)
+        self.network.add_nodes_from(range(60, 64))
+        rng = numpy.random.RandomState(42)
+        self.weights = {int(n): float(rng.uniform(0.5, 1.5))
+                        for n in rng.choice(64, 12, replace=False)}
+
+    def test_distances(self):
+        nodes = list(self.network.nodes())
+        adjacency = santa.adjacency_matrix(self.network, nodes)
+        matrix = santa.DistanceMatrix(adjacency)
+        shells = santa.DistanceShells(adjacency)
+        self.assertEqual(matrix.max_dist, shells.max_dist)
+        self.assertEqual(matrix.matrix.dtype, numpy.int8)
+        dist = dict(nx.all_pairs_shortest_path_length(self.network))
+        for i in nodes:
+            for j in nodes:
+                d = dist[i].get(j, -1)
+                self.assertEqual(matrix.matrix[i, j], d)
+                if d >= 0:
+                    self.assertEqual(shells.shells[d][i, j], 1)
+        numpy.testing.assert_equal(matrix.counts(), shells.counts())
+
+    def test_k_net(self):
+        k_net, auk = santa.SANTA(self.network, self.weights).k_net()
+        expected = [k_net_reference(self.network, self.weights, s)
+                    for s in range(len(k_net))]
+        numpy.testing.assert_almost_equal(k_net, expected)
+        self.assertAlmostEqual(auk, numpy.trapz(expected))
+
+    def test_permutations(self):
+        defaults = santa.DENSE_MAX_NODES, santa.SPARSE_WEIGHTS
+
+        def restore():
+            santa.DENSE_MAX_NODES, santa.SPARSE_WEIGHTS = defaults
+        self.addCleanup(restore)
+
+        results = []
+        for dense_max, sparse_weights in [(1000, 1.0), (1000, 0.0), (0, 1.0)]:
+            santa.DENSE_MAX_NODES = dense_max
+            santa.SPARSE_WEIGHTS = sparse_weights
+            numpy.random.seed(0)
+            s = santa.SANTA(self.network, self.weights)
+            results.append((s.k_net()[0], s.auk_p_value(20), s.k_node(2)))
+        for k_net, p, k_node in results[1:]:
+            numpy.testing.assert_almost_equal(k_net, results[0][0])
+            self.assertAlmostEqual(p, results[0][1])
+            self.assertEqual(sorted(n for n, _, _ in k_node),
+                             sorted(n for n, _, _ in results[0][2]))
+        self.assertTrue(all(n not in self.weights for n, _, _ in k_node))
+
+
+if __name__ == "__main__":
+    unittest.main()
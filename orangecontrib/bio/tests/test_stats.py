@@ -0,0 +1,97 @@
+import math
+import unittest
+
+import numpy
+
+from orangecontrib.bio.utils import stats, multitest
+
+
+def binomial_pvalue(k, N, m, n):
+    p = float(m) / N
+    return sum(math.factorial(n) / (math.factorial(i) * math.factorial(n - i)) *
+               p ** i * (1 - p) ** (n - i) for i in range(k, n + 1))
+
+
+def hypergeometric_pvalue(k, N, m, n):
+    def bin(n, k):
+        if k < 0 or k > n:
+            return 0
+        return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+    return sum(float(bin(m, i) * bin(N - m, n - i)) / bin(N, n)
+               for i in range(k, min(n, m) + 1))
+
+
+class TestDistributions(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        N = rng.randint(1, 80, size=200)
+        m = numpy.array([rng.randint(0, x + 1) for x in N])
+        n = numpy.array([rng.randint(0, x + 1) for x in N])
+        k = numpy.array([rng.randint(0, min(a, b) + 2) for a, b in zip(m, n)])
+        self.args = list(zip(k, N, m, n))
+
+    def test_binomial(self):
+        binom = stats.Binomial()
+        pvals = binom.p_values(*zip(*self.args))
+        for args, p in zip(self.args, pvals):
+            args = list(map(int, args))
+            self.assertAlmostEqual(p, binomial_pvalue(*args), places=10)
+            self.assertEqual(p, binom.p_value(*args))
+
+    def test_hypergeometric(self):
+        hyper = stats.Hypergeometric()
+        pvals = hyper.p_values(*zip(*self.args))
+        for args, p in zip(self.args, pvals):
+            args = list(map(int, args))
+            self.assertAlmostEqual(p, hypergeometric_pvalue(*args), places=10)
+            self.assertEqual(p, hyper.p_value(*args))
+
+    def test_small_p_values(self):
+        hyper = stats.Hypergeometric()
+        p = hyper.p_value(60, 20000, 100, 100)
+        expected = hypergeometric_pvalue(60, 20000, 100, 100)
+        self.assertLess(abs(p - expected) / expected, 1e-8)
+
+    def test_broadcasting(self):
+        hyper = stats.Hypergeometric()
+        pvals = hyper.p_values([0, 1, 2], 100, [10, 20, 30], 10)
+        self.assertEqual(pvals.shape, (3,))
+        self.assertEqual(pvals[0], 1.0)
+        self.assertEqual(len(stats.p_values(hyper, [], 100, [], 10)), 0)
+
+
+class TestMultitest(unittest.TestCase):
+    def test_fdr(self):
+        p = [0.01, 0.04, 0.03, 0.005, 0.5]
+        numpy.testing.assert_almost_equal(
+            multitest.fdr_bh(p), [0.025, 0.05, 0.05, 0.025, 0.5])
+        numpy.testing.assert_almost_equal(stats.FDR(p), multitest.fdr_bh(p))
+        h = 1 + 1. / 2 + 1. / 3 + 1. / 4 + 1. / 5
+        numpy.testing.assert_almost_equal(
+            multitest.fdr_by(p), numpy.minimum(multitest.fdr_bh(p) * h, 1))
+        numpy.testing.assert_almost_equal(
+            numpy.minimum(stats.FDR(p, dependent=True), 1),
+            multitest.fdr_by(p))
+        self.assertEqual(stats.FDR([]), [])
+
+    def test_missing(self):
+        p = [0.01, numpy.nan, 0.02]
+        numpy.testing.assert_almost_equal(
+            multitest.fdr_bh(p), [0.02, numpy.nan, 0.02])
+
+    def test_bonferroni_holm(self):
+        p = [0.01, 0.04, 0.03, 0.005]
+        numpy.testing.assert_almost_equal(
+            multitest.bonferroni(p), [0.04, 0.16, 0.12, 0.02])
+        numpy.testing.assert_almost_equal(
+            multitest.holm(p), [0.03, 0.06, 0.06, 0.02])
+
+    def test_qvalues(self):
+        p = numpy.random.RandomState(0).uniform(size=1000)
+        numpy.testing.assert_almost_equal(
+            multitest.qvalues(p), multitest.fdr_bh(p))
+        pi0 = multitest.estimate_pi0(p, lambdas=0.5)
+        self.assertGreater(pi0, 0.8)
+        numpy.testing.assert_almost_equal(
+            multitest.qvalues(p, pi0=pi0),
+            numpy.minimum(multitest.fdr_bh(p) * pi0, 1))
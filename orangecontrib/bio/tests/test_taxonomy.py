@@ -1,10 +1,48 @@
+import io
 import os
+import shutil
+import tarfile
+import tempfile
 import unittest
 import errno
+import sqlite3
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import backports.unittest_mock
+    backports.unittest_mock.install()
+    from unittest import mock
+
+import numpy
 
 from orangecontrib.bio import taxonomy
+from orangecontrib.bio.ncbi.taxonomy import Taxonomy
+from orangecontrib.bio.ncbi.taxonomy_index import TaxonomyIndex
 from orangecontrib.bio.utils import serverfiles
 
+NODES = [("1", "1", "no rank"),
+         ("2", "1", "superkingdom"),
+         ("9605", "9604", "genus"),
+         ("9604", "2", "family"),
+         ("9606", "9605", "species"),
+         ("9598", "9605", "species"),
+         ("4932", "4930", "species"),
+         ("4930", "2", "genus")]
+
+NAMES = [("1", "root", "", "scientific name"),
+         ("2", "Eukaryota", "", "scientific name"),
+         ("9604", "Hominidae", "", "scientific name"),
+         ("9605", "Homo", "Homo <primates>", "scientific name"),
+         ("9606", "Homo sapiens", "", "scientific name"),
+         ("9606", "human", "", "genbank common name"),
+         ("9598", "Pan troglodytes", "", "scientific name"),
+         ("9598", "chimpanzee", "", "genbank common name"),
+         ("4930", "Saccharomyces", "", "scientific name"),
+         ("4932", "Saccharomyces cerevisiae", "", "scientific name"),
+         ("4932", "Homo yeast", "", "misnomer")]
+
 
 def islocal():
     try:
@@ -18,6 +56,156 @@ def islocal():
         return True
 
 
+def write_taxdump(filename):
+    with tarfile.open(filename, "w:gz") as tar:
+        for name, rows in [("nodes.dmp", NODES), ("names.dmp", NAMES)]:
+            data = "".join("\t|\t".join(row) + "\t|\n" for row in rows)
+            data = data.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+class TestTaxonomyIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "taxonomy.sqlite")
+        taxdump = os.path.join(self.dir, "taxdump.tar.gz")
+        write_taxdump(taxdump)
+        Taxonomy.initialize(self.filename, taxdump)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_taxonomy(self):
+        tax = Taxonomy(self.filename)
+        self.assertEqual(len(tax), 8)
+        self.assertEqual(tax.lineage("9606"), ["1", "2", "9604", "9605"])
+        self.assertEqual(tax.lineage("1"), [])
+        self.assertEqual(tax.parent_tax_id("9606"), "9605")
+        self.assertIsNone(tax.parent_tax_id("1"))
+        self.assertEqual(tax["9605"].name, "Homo <primates>")
+        self.assertEqual(tax["9606"].rank, "species")
+        self.assertEqual(tax["1"].parent_tax_id, "1")
+        self.assertEqual(sorted(tax.search("HUMAN")), ["9606"])
+        self.assertEqual(sorted(tax.search("homo", exact=False)),
+                         ["4932", "9605", "9606"])
+        self.assertEqual(list(tax.search("homo")), [])
+        self.assertRaises(KeyError, tax.lineage, "3")
+        self.assertTrue(os.path.isdir(self.filename + ".index"))
+
+    def test_search_ignores_case(self):
+        # the same matches as the names table queries (NOCASE collation)
+        tax = Taxonomy(self.filename)
+        con = sqlite3.connect(self.filename)
+        try:
+            for name in ["HUMAN", "Homo Sapiens", "homo", "YEAST", "Ho",
+                         "eukaryota"]:
+                for exact, query in [(True, name), (False, name + "%")]:
+                    cur = con.execute(
+                        "SELECT DISTINCT tax_id FROM names WHERE name %s ?"
+                        % ("=" if exact else "LIKE"), (query,))
+                    self.assertEqual(
+                        sorted(tax.search(name, exact)),
+                        sorted(str(row[0]) for row in cur), (name, exact))
+        finally:
+            con.close()
+
+    def test_shared_instance(self):
+        def localpath(*args, **kwargs):
+            return self.filename
+
+        with mock.patch.object(serverfiles, "localpath", localpath), \
+                mock.patch.object(serverfiles, "localpath_download",
+                                  localpath):
+            try:
+                self.assertEqual(taxonomy.lineage("9606"),
+                                 ["1", "2", "9604", "9605"])
+                shared = taxonomy._shared_taxonomy()
+                self.assertIs(taxonomy._shared_taxonomy(), shared)
+                # a changed database file is opened again
+                st = os.stat(self.filename)
+                os.utime(self.filename, (st.st_atime, st.st_mtime + 10))
+                self.assertIsNot(taxonomy._shared_taxonomy(), shared)
+                self.assertEqual(taxonomy.search("human", exact=True),
+                                 ["9606"])
+            finally:
+                taxonomy._shared.__dict__.clear()
+
+    def test_many(self):
+        index = TaxonomyIndex.open(self.filename)
+        ids = ["9606", "9598", "4932", "9605", "1", "9606"]
+        self.assertEqual(index.lineage_many(ids),
+                         [Taxonomy(self.filename).lineage(i) for i in ids])
+        self.assertEqual(index.lca_many(ids, ["9598", "9606", "9606",
+                                              "9606", "4932", "9606"]),
+                         ["9605", "9605", "2", "9605", "1", "9606"])
+        self.assertEqual(index.is_ancestor_many(["9605", "9606", "2", "1"],
+                                                ["9606", "9606", "4932", "2"])
+                         .tolist(), [True, False, True, True])
+        self.assertEqual(index.rank_many(["9606", "4930"]),
+                         ["species", "genus"])
+
+    def test_random_tree(self):
+        rng = numpy.random.RandomState(0)
+        n = 1000
+        parents = [0] + [int(rng.randint(i)) for i in range(1, n)]
+        tax_ids = rng.permutation(numpy.arange(1, n + 1) * 7)
+        index = TaxonomyIndex.build(
+            tax_ids, tax_ids[parents], numpy.zeros(n, dtype=int), ["r"], [])
+
+        def path(i):
+            # the nodes from i up to the root
+            nodes = [i]
+            while nodes[-1] != 0:
+                nodes.append(parents[nodes[-1]])
+            return nodes
+
+        a, b = rng.randint(n, size=500), rng.randint(n, size=500)
+        expected = []
+        for i, j in zip(a, b):
+            ancestors = set(path(i))
+            expected.append(str(tax_ids[next(k for k in path(j)
+                                             if k in ancestors)]))
+        self.assertEqual(index.lca_many(tax_ids[a], tax_ids[b]), expected)
+        self.assertEqual(
+            index.lineage_many(tax_ids[a]),
+            [[str(tax_ids[k]) for k in reversed(path(i)[1:])] for i in a])
+
+
+class TestPickledCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_threads(self):
+        filename = os.path.join(self.dir, "cache.pickle")
+
+        @taxonomy.pickled_cache(filename, maxSize=5)
+        def square(i):
+            return [i * i] * 20000
+
+        errors = []
+
+        def run(start):
+            try:
+                for i in range(start, start + 20):
+                    self.assertEqual(square(i), [i * i] * 20000)
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=run, args=(k * 100,))
+                   for k in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(square(5), [25] * 20000)
+
+
 class TestTaxonomy(unittest.TestCase):
     @classmethod
     def setUpClass(self):
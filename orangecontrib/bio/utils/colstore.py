@@ -0,0 +1,280 @@
+"""
+A simple versioned, memory-mapped columnar on-disk store.
+
+A store is a directory holding a `CURRENT` file naming the data directory
+in use. A data directory holds a `meta.json` file (the format version and
+a key identifying the source data) and one `.npy` file per array. Arrays
+are loaded with ``numpy.load(mmap_mode="r")`` so opening a store is cheap
+and the pages are shared between processes.
+
+A rebuilt store is written into a new data directory and published by
+atomically replacing `CURRENT`, so readers (in this or other processes)
+always see a complete store.
+
+Besides plain arrays a store can hold string columns (a single ``\\0``
+separated utf-8 blob with offsets) and categorical columns (integer codes
+into a string vocabulary).
+
+"""
+from __future__ import absolute_import
+
+import os
+import io
+import json
+import shutil
+import tempfile
+import threading
+
+import numpy
+
+_META = "meta.json"
+_CURRENT = "CURRENT"
+
+
+def replace_file(src, dst):
+    """
+    Rename `src` to `dst` replacing an existing file (atomically, except
+    on Python 2 which can not rename over an existing file).
+    """
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+    else:
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def file_key(path):
+    """
+    Return a dictionary identifying the state of the file at `path`
+    (its size and modification time).
+    """
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime": int(st.st_mtime * 1000)}
+
+
+class StringColumn(object):
+    """
+    An immutable sequence of strings stored in a single byte blob.
+
+    :param numpy.ndarray data: A uint8 array of ``\\0`` terminated utf-8
+        encoded strings.
+    :param numpy.ndarray offsets: Start offsets of the strings in `data`
+        (with an additional final offset equal to ``len(data)``).
+
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self._list = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_list(cls, strings):
+        """Create a column from a list of strings."""
+        encoded = [s.encode("utf-8") for s in strings]
+        lengths = numpy.array([len(s) + 1 for s in encoded], dtype=numpy.int64)
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        data = numpy.frombuffer(
+            b"".join(s + b"\0" for s in encoded), dtype=numpy.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if self._list is not None:
+            return self._list[i]
+        if i < 0:
+            i += len(self)
+        start, end = self.offsets[i], self.offsets[i + 1] - 1
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        """Return (and cache) all strings as a list."""
+        with self._lock:
+            if self._list is None:
+                if len(self) == 0:
+                    self._list = []
+                else:
+                    text = self.data[:-1].tobytes().decode("utf-8")
+                    self._list = text.split("\0")
+            return self._list
+
+
+def _current_data(path):
+    # The name of the current data directory of the store at `path` (or
+    # None if there is none)
+    try:
+        with io.open(os.path.join(path, _CURRENT), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def _load(basename):
+    filename = basename + ".npy"
+    try:
+        return numpy.load(filename, mmap_mode="r")
+    except ValueError:
+        # empty arrays can not be memory mapped
+        return numpy.load(filename)
+
+
+class StoreWriter(object):
+    """
+    Write a new :class:`Store` to `path`.
+
+    The data is written into a new data directory which is made current
+    (atomically) on :func:`commit`.
+
+    """
+    def __init__(self, path, version, key=None):
+        self.path = path
+        self.meta = {"version": version, "key": key or {}, "arrays": []}
+        try:
+            os.makedirs(path)
+        except OSError:
+            # a concurrent writer could have created it
+            if not os.path.isdir(path):
+                raise
+        self._tmpdir = tempfile.mkdtemp(dir=path, prefix=".tmp-")
+
+    def add_array(self, name, array):
+        """Store an array under `name`."""
+        numpy.save(os.path.join(self._tmpdir, name + ".npy"),
+                   numpy.ascontiguousarray(array))
+        self.meta["arrays"].append(name)
+
+    def add_strings(self, name, strings):
+        """Store a list of strings as a string column."""
+        column = StringColumn.from_list(strings)
+        self.add_array(name + ".data", column.data)
+        self.add_array(name + ".offsets", column.offsets)
+
+    def add_categorical(self, name, values):
+        """
+        Store a list of strings as integer codes into a sorted vocabulary.
+        """
+        vocabulary = sorted(set(values))
+        index = dict((v, i) for i, v in enumerate(vocabulary))
+        codes = numpy.fromiter((index[v] for v in values), dtype=int,
+                               count=len(values))
+        self.add_codes(name, codes, vocabulary)
+
+    def add_codes(self, name, codes, vocabulary):
+        """
+        Store a categorical column given as integer `codes` into a list of
+        strings (`vocabulary`).
+        """
+        dtype = numpy.int32 if len(vocabulary) > 2 ** 15 else numpy.int16
+        self.add_array(name + ".codes", numpy.asarray(codes, dtype=dtype))
+        self.add_strings(name + ".vocabulary", vocabulary)
+
+    def add_meta(self, name, value):
+        """Store a small json serializable value."""
+        self.meta.setdefault("values", {})[name] = value
+
+    def commit(self):
+        """Finish writing and move the store into place."""
+        with io.open(os.path.join(self._tmpdir, _META), "w",
+                     encoding="utf-8") as f:
+            f.write(json.dumps(self.meta, sort_keys=True))
+        name = "data-" + os.path.basename(self._tmpdir)[len(".tmp-"):]
+        os.rename(self._tmpdir, os.path.join(self.path, name))
+        previous = _current_data(self.path)
+        fd, tmpname = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            f.write(name)
+        replace_file(tmpname, os.path.join(self.path, _CURRENT))
+        if previous is not None and previous != name:
+            # readers which already opened it keep their memory maps
+            shutil.rmtree(os.path.join(self.path, previous),
+                          ignore_errors=True)
+
+    def abort(self):
+        """Remove the partially written store."""
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class Store(object):
+    """
+    Read access to a columnar store directory written by :class:`StoreWriter`.
+
+    :param str path: The store directory.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        name = _current_data(path)
+        if name is None:
+            raise IOError("No store at {!r}".format(path))
+        datadir = os.path.join(path, name)
+        with io.open(os.path.join(datadir, _META), encoding="utf-8") as f:
+            self.meta = json.loads(f.read())
+        # open all the arrays now; the data directory is removed when the
+        # store is rebuilt
+        self._arrays = dict((array, _load(os.path.join(datadir, array)))
+                            for array in self.meta["arrays"])
+
+    @classmethod
+    def open(cls, path, version, key=None):
+        """
+        Open and return the store at `path` if it exists, and its version
+        and key match, else return None.
+        """
+        try:
+            store = cls(path)
+        except (IOError, OSError, ValueError):
+            return None
+        if store.version != version or \
+                (key is not None and store.key != key):
+            return None
+        return store
+
+    @property
+    def version(self):
+        return self.meta.get("version")
+
+    @property
+    def key(self):
+        return self.meta.get("key")
+
+    def __contains__(self, name):
+        return name in self.meta["arrays"] or \
+            name + ".codes" in self.meta["arrays"] or \
+            name + ".data" in self.meta["arrays"]
+
+    def array(self, name):
+        """Return the (memory mapped) array stored under `name`."""
+        return self._arrays[name]
+
+    def strings(self, name):
+        """Return the :class:`StringColumn` stored under `name`."""
+        return StringColumn(self.array(name + ".data"),
+                            self.array(name + ".offsets"))
+
+    def categorical(self, name):
+        """
+        Return a (codes, vocabulary) tuple of a categorical column
+        (`vocabulary` is a :class:`StringColumn`).
+        """
+        return (self.array(name + ".codes"),
+                self.strings(name + ".vocabulary"))
+
+    def value(self, name, default=None):
+        """Return a value stored with :func:`StoreWriter.add_meta`."""
+        return self.meta.get("values", {}).get(name, default)
@@ -166,6 +166,202 @@ class MA_anova(object):
         except:
             return 1.0 if self.prob else 0.0
 
+"""\
+Phenotype ranking metrics
+=========================
+
+Score all genes (columns of an expression matrix) against a phenotype at
+once. The phenotype can be given as a single label vector or as a matrix
+of (permuted) label vectors, one per row, in which case the scores for all
+of them are computed together.
+
+Missing values (NaN) in the expression matrix are ignored.
+
+"""
+
+
+def _label_matrix(labels):
+    labels = numpy.asarray(labels)
+    if labels.ndim not in (1, 2):
+        raise ValueError("labels must be a vector or a matrix")
+    return numpy.atleast_2d(labels), labels.ndim == 1
+
+
+def _group_stats(X, labels, groups):
+    """
+    Return per group sample counts, means and sums of squared deviations
+    from the mean; each an array of shape (len(groups), n_labelings,
+    n_genes).
+    """
+    X = numpy.asarray(X, dtype=float)
+    valid = ~numpy.isnan(X)
+    complete = valid.all()
+    # center the columns for numerical precision of the sums of squares
+    with numpy.errstate(invalid="ignore"):
+        center = numpy.nanmean(X, axis=0) if not complete else X.mean(axis=0)
+    center = numpy.where(numpy.isnan(center), 0.0, center)
+    Xc = numpy.where(valid, X - center, 0.0)
+    Xc2 = Xc ** 2
+    valid = valid.astype(float)
+
+    count, mean, m2 = [], [], []
+    for g in groups:
+        member = (labels == g).astype(float)
+        if complete:
+            n = numpy.repeat(member.sum(axis=1)[:, None], X.shape[1], axis=1)
+        else:
+            n = member.dot(valid)
+        s = member.dot(Xc)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            m = s / n
+            d = member.dot(Xc2) - s * m
+        d = numpy.where(n > 0, numpy.maximum(d, 0.0), 0.0)
+        count.append(n)
+        mean.append(m + center)
+        m2.append(d)
+    return numpy.array(count), numpy.array(mean), numpy.array(m2)
+
+
+def _result(values, single):
+    return values[0] if single else values
+
+
+def signal_to_noise(X, labels, a=0, b=1, stdev_floor=0.0):
+    """
+    Signal to noise ratio of all columns of `X`: the difference of means
+    of groups `a` and `b` divided by the sum of their standard deviations.
+
+    :param numpy.ndarray X: Expression matrix (samples x genes).
+    :param labels: Integer group labels of the samples (a vector) or a
+        matrix with one labeling per row.
+    :param int a: Label of the first group.
+    :param int b: Label of the second group.
+    :param float stdev_floor:
+        Use at least `stdev_floor` * \|mean\| (mean 0 is adjusted to 1)
+        as the standard deviation of a group (GSEA uses 0.2).
+    :rtype: numpy.ndarray (genes, or labelings x genes)
+
+    """
+    L, single = _label_matrix(labels)
+    n, m, m2 = _group_stats(X, L, [a, b])
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        std = numpy.sqrt(m2 / (n - 1))
+        std = numpy.where(n > 1, std, numpy.nan)
+        if stdev_floor:
+            std = numpy.maximum(
+                std, stdev_floor * numpy.abs(numpy.where(m == 0, 1.0, m)))
+        s2n = (m[0] - m[1]) / (std[0] + std[1])
+    return _result(s2n, single)
+
+
+def t_test(X, labels, a=0, b=1):
+    """
+    Two sample (pooled variance) t-test of all columns of `X` between
+    groups `a` and `b`.
+
+    :param numpy.ndarray X: Expression matrix (samples x genes).
+    :param labels: Group labels (see :func:`signal_to_noise`).
+    :rtype: (numpy.ndarray, numpy.ndarray) tuple of t statistics and
+        two sided p-values.
+
+    """
+    L, single = _label_matrix(labels)
+    n, m, m2 = _group_stats(X, L, [a, b])
+    df = n[0] + n[1] - 2
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        var = (m2[0] + m2[1]) / df
+        t = (m[0] - m[1]) / numpy.sqrt(var * (1.0 / n[0] + 1.0 / n[1]))
+        t = numpy.where(df > 0, t, numpy.nan)
+        p = 2 * scipy.stats.t.sf(numpy.abs(t), df)
+    return _result(t, single), _result(p, single)
+
+
+def fold_change(X, labels, a=0, b=1):
+    """
+    Fold change (ratio of means of groups `a` and `b`) of all columns
+    of `X`.
+
+    :param numpy.ndarray X: Expression matrix (samples x genes).
+    :param labels: Group labels (see :func:`signal_to_noise`).
+    :rtype: numpy.ndarray
+
+    """
+    L, single = _label_matrix(labels)
+    _, m, _ = _group_stats(X, L, [a, b])
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        fc = m[0] / m[1]
+    return _result(fc, single)
+
+
+def anova_f(X, labels, groups=None):
+    """
+    One way ANOVA F-test of all columns of `X` between the groups.
+
+    :param numpy.ndarray X: Expression matrix (samples x genes).
+    :param labels: Group labels (see :func:`signal_to_noise`); samples
+        with negative labels are excluded.
+    :param list groups: Labels of the groups to compare (default all
+        non negative labels).
+    :rtype: (numpy.ndarray, numpy.ndarray) tuple of F statistics and
+        p-values.
+
+    """
+    L, single = _label_matrix(labels)
+    if groups is None:
+        groups = [g for g in numpy.unique(L) if g >= 0]
+    n, m, m2 = _group_stats(X, L, groups)
+    present = n > 0
+    k = present.sum(axis=0)
+    total = n.sum(axis=0)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        mn = numpy.where(present, m, 0.0)
+        grand = (n * mn).sum(axis=0) / total
+        ssb = (n * (mn - grand) ** 2).sum(axis=0)
+        ssw = m2.sum(axis=0)
+        dfb, dfw = k - 1, total - k
+        F = (ssb / dfb) / (ssw / dfw)
+        F = numpy.where((dfb > 0) & (dfw > 0), F, numpy.nan)
+        p = scipy.stats.f.sf(F, dfb, dfw)
+    return _result(F, single), _result(p, single)
+
+
+def pearson_correlation(X, y):
+    """
+    Pearson correlation of all columns of `X` with a (continuous)
+    phenotype `y`.
+
+    :param numpy.ndarray X: Expression matrix (samples x genes).
+    :param y: Phenotype values of the samples (a vector) or a matrix
+        with one (permuted) phenotype per row.
+    :rtype: numpy.ndarray
+
+    """
+    Y, single = _label_matrix(y)
+    X = numpy.asarray(X, dtype=float)
+    Y = Y.astype(float)
+    valid = ~numpy.isnan(X)
+    Y = Y - Y.mean(axis=1)[:, None]
+    with numpy.errstate(invalid="ignore"):
+        Xc = X - numpy.nanmean(X, axis=0)
+    Xc = numpy.where(valid, Xc, 0.0)
+    if valid.all():
+        n = float(X.shape[0])
+        sy = numpy.zeros((Y.shape[0], 1))
+        syy = (Y ** 2).sum(axis=1)[:, None]
+    else:
+        valid = valid.astype(float)
+        n = valid.sum(axis=0)
+        sy = Y.dot(valid)
+        syy = (Y ** 2).dot(valid)
+    sx = Xc.sum(axis=0)
+    sxx = (Xc ** 2).sum(axis=0)
+    sxy = Y.dot(Xc)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        r = (n * sxy - sx * sy) / \
+            numpy.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+    return _result(r, single)
+
+
 import numpy as np
 import numpy.ma as ma
 
@@ -0,0 +1,380 @@
+"""
+Gene set enrichment scores, permutation null distributions and their
+significance (the numerical part of GSEA, see :mod:`orangecontrib.bio.gsea`).
+
+Everything here works on plain numpy arrays and does not need Orange.
+"""
+from __future__ import absolute_import
+
+import random
+
+import numpy
+import scipy.sparse
+
+from . import parallel
+
+def orderedPointersCorr(lcor):
+    """
+    Return a list of integers: indexes in original
+    lcor. Elements in the list are ordered by
+    their lcor[i] value. Higher correlations first.
+    """
+    #stable sort by correlation, descending
+    lcor = numpy.asarray(lcor, dtype=float)
+    return list(numpy.argsort(-lcor, kind="mergesort"))
+
+def enrichmentScoreRanked(subset, lcor, ordered, p=1.0, rev2=None):
+    """
+    Input data and subset. 
+    
+    subset: list of attribute indices of the input data belonging
+        to the same set.
+    lcor: correlations with class for each attribute in a list. 
+
+    Returns enrichment score on given data.
+
+    This implementation efficiently handles "sparse" genesets (that
+    cover only a small subset of all genes in the dataset).
+    """
+
+    subset = set(subset)
+
+    if rev2 is None:
+        def rev(l):
+            return numpy.argsort(l)
+        rev2 = rev(ordered)
+
+    #add if gene is not in the subset
+    notInA = -(1. / (len(lcor)-len(subset)))
+    #base for addition if gene is in the subset
+
+    cors = [ abs(lcor[i])**p for i in subset ] #belowe in numpy
+    sumcors = sum(cors)
+
+    #this should not happen
+    if sumcors == 0.0:
+        return (0.0, None)
+    
+    inAb = 1./sumcors
+
+    map = {}
+    for i in subset:
+        orderedpos = rev2[i]
+        map[orderedpos] = inAb*abs(lcor[i]**p)
+        
+    last = 0
+
+    maxSum = minSum = csum = 0.0
+
+    for a,b in sorted(map.items()):
+        diff = a-last
+        csum += notInA*diff
+        last = a+1
+        
+        if csum < minSum:
+            minSum = csum
+        
+        csum += b
+
+        if csum > maxSum:
+            maxSum = csum
+
+    #finish it
+    diff = (len(ordered))-last
+    csum += notInA*diff
+
+    if csum < minSum:
+        minSum = csum
+
+    return (maxSum if abs(maxSum) > abs(minSum) else minSum, [])
+
+#at most this many (permutation x gene set member) elements are
+#processed at once by enrichmentScoreMatrix
+CHUNK_ELEMENTS = 2 ** 22
+
+def geneSetMatrix(subsets, ngenes):
+    """
+    Return a (gene set x gene) sparse CSR indicator matrix for a list
+    of subsets (lists of gene indices). Duplicate indices are ignored.
+    """
+    rows = numpy.repeat(numpy.arange(len(subsets)),
+                        [len(subset) for subset in subsets])
+    cols = numpy.array([i for subset in subsets for i in subset], dtype=int)
+    m = scipy.sparse.csr_matrix((numpy.ones(len(cols)), (rows, cols)),
+                                shape=(len(subsets), ngenes))
+    m.sum_duplicates()
+    m.data[:] = 1
+    return m
+
+def enrichmentScoreMatrix(rankings, sets, p=1.0):
+    """
+    Compute enrichment scores of all gene sets for one or more rankings
+    at once.
+
+    rankings: a list of correlations with class for each gene or
+        a (n rankings x genes) array of them.
+    sets: a (gene set x gene) indicator matrix (see geneSetMatrix).
+
+    Returns an array of enrichment scores (rankings x gene sets).
+    Same as enrichmentScoreRanked for each ranking and set.
+    """
+    rankings = numpy.atleast_2d(numpy.asarray(rankings, dtype=float))
+    sets = scipy.sparse.csr_matrix(sets)
+    nrankings, ngenes = rankings.shape
+    nsets = sets.shape[0]
+    es = numpy.zeros((nrankings, nsets))
+
+    sizes = numpy.diff(sets.indptr)
+    nonempty = numpy.flatnonzero(sizes)
+    if len(nonempty) == 0:
+        return es
+
+    starts = sets.indptr[nonempty]
+    members = sets.indices
+    setid = numpy.repeat(numpy.arange(nsets), sizes)
+    #number of preceding set members in the ranked order
+    hitsbefore = numpy.arange(len(members)) - sets.indptr[setid]
+    with numpy.errstate(divide="ignore"):
+        notInA = numpy.where(sizes < ngenes,
+                             1. / (ngenes - sizes), 0.)[setid]
+
+    offsets = setid.astype(numpy.int64) * ngenes
+    chunk = max(1, CHUNK_ELEMENTS // max(len(members), ngenes))
+
+    for start in range(0, nrankings, chunk):
+        r = rankings[start:start + chunk]
+        k = len(r)
+        ordered = numpy.argsort(-r, axis=1, kind="mergesort")
+        rev = numpy.empty_like(ordered)
+        rev[numpy.arange(k)[:, None], ordered] = numpy.arange(ngenes)
+
+        #positions of set members in the ranked order, sorted within sets
+        pos = rev[:, members] + offsets
+        pos.sort(axis=1)
+        pos -= offsets
+
+        weights = numpy.abs(numpy.take_along_axis(
+            r, numpy.take_along_axis(ordered, pos, axis=1), axis=1)) ** p
+        csum = numpy.cumsum(weights, axis=1)
+        before = numpy.concatenate(
+            [numpy.zeros((k, 1)), csum[:, :-1]], axis=1)[:, sets.indptr[setid]]
+        csum = csum - before
+        sumcors = numpy.add.reduceat(weights, starts, axis=1)
+        valid = sumcors > 0
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            inAb = numpy.zeros((k, nsets))
+            inAb[:, nonempty] = numpy.where(valid, 1. / sumcors, 0.)
+        inAb = inAb[:, setid]
+
+        misses = (pos - hitsbefore) * notInA
+        #running sum right after (maxima) and right before (minima) hits
+        maxSum = numpy.maximum(numpy.maximum.reduceat(
+            csum * inAb - misses, starts, axis=1), 0.)
+        minSum = numpy.minimum(numpy.minimum.reduceat(
+            (csum - weights) * inAb - misses, starts, axis=1), 0.)
+        chunkes = numpy.where(numpy.abs(maxSum) > numpy.abs(minSum),
+                              maxSum, minSum)
+        es[start:start + k, nonempty] = numpy.where(valid, chunkes, 0.)
+
+    return es
+
+def shuffledRankings(lcor, seeds):
+    """
+    Return an array of rankings (one row for each seed) with shuffled
+    gene order. The same as shuffleList(lcor, random.Random(seed)).
+    """
+    lcor = numpy.asarray(lcor, dtype=float)
+    out = numpy.empty((len(seeds), len(lcor)))
+    for i, seed in enumerate(seeds):
+        order = list(range(len(lcor)))
+        random.Random(seed).shuffle(order)
+        out[i] = lcor[order]
+    return out
+
+def shuffledLabels(labels, seeds):
+    """
+    Return a matrix of class indices (one row for each seed) permuted
+    the same way as shuffleClass permutes the class.
+    """
+    labels = numpy.asarray(labels)
+    shuffled = numpy.empty((len(seeds), len(labels)), dtype=labels.dtype)
+    for row, seed in zip(shuffled, seeds):
+        locations = list(range(len(labels)))
+        random.Random(seed).shuffle(locations)
+        row[locations] = labels
+    return shuffled
+
+class genePermutations(object):
+    """
+    Rankings with the gene order of lcor shuffled for each seed (see
+    shuffledRankings).
+    """
+    def __init__(self, lcor):
+        self.lcor = numpy.asarray(lcor, dtype=float)
+
+    def __call__(self, seeds):
+        return shuffledRankings(self.lcor, seeds)
+
+class labelPermutations(object):
+    """
+    Rankings of the expression matrix X (examples x genes) for class
+    labels permuted with each seed (see shuffledLabels). The vectorized
+    metric (see utils.expression) ranks all permutations at once.
+    """
+    def __init__(self, X, labels, metric):
+        self.X = X
+        self.labels = labels
+        self.metric = metric
+
+    def __call__(self, seeds):
+        return self.metric(self.X, shuffledLabels(self.labels, seeds))
+
+def runOptCallbacks(callback):
+    if callback is not None:
+        try:
+            [ a() for a in callback ]
+        except:
+            callback()            
+
+def permutationBlock(seeds):
+    """ Null enrichment scores (permutations x gene sets) for seeds. """
+    return enrichmentScoreMatrix(parallel.get_state("rankings")(seeds),
+                                 parallel.get_state("sets"))
+
+#when computing in parallel, the permutations are split into at least
+#this many blocks by default
+PARALLEL_BLOCKS = 16
+
+def permutationScores(rankings, sets, n, callback=None, n_jobs=1,
+        executor=None, block_size=None):
+    """
+    Return null enrichment scores (gene sets x n permutations).
+
+    rankings: a function returning rankings (one per seed) for a list of
+        seeds, like genePermutations; permutation i uses seed 2000+i.
+        It is sent to each worker, so it must be picklable for processes.
+    sets: a (gene set x gene) indicator matrix (see geneSetMatrix).
+    n_jobs, executor: compute blocks of permutations in n_jobs
+        processes or with an executor (the results do not depend on it).
+    block_size: number of permutations per task (by default as many as
+        fit into CHUNK_ELEMENTS, but at least PARALLEL_BLOCKS blocks when
+        computing in parallel).
+    """
+    if block_size is None:
+        block_size = max(1, CHUNK_ELEMENTS // max(sets.nnz, sets.shape[1]))
+        if executor is not None or parallel.effective_n_jobs(n_jobs) > 1:
+            block_size = max(1, min(block_size, n // PARALLEL_BLOCKS))
+    blocks = [ range(2000 + start, 2000 + min(start + block_size, n))
+               for start in range(0, n, block_size) ]
+
+    done = [0]
+    def blocksDone(count):
+        for seeds in blocks[done[0]:count]:
+            for _ in seeds:
+                runOptCallbacks(callback)
+        done[0] = count
+
+    state = { "rankings": rankings, "sets": sets }
+    scores = parallel.parallel_map(permutationBlock, blocks, n_jobs=n_jobs,
+        state=state, executor=executor, callback=blocksDone)
+
+    enrichmentNulls = numpy.zeros((sets.shape[0], n))
+    for seeds, s in zip(blocks, scores):
+        enrichmentNulls[:, seeds[0] - 2000:seeds[-1] - 1999] = s.T
+    return enrichmentNulls
+
+def gseapval(es, esnull):
+    """
+    From article (PNAS):
+    estimate nominal p-value for S from esnull by using the positive
+    or negative portion of the distribution corresponding to the sign 
+    of the observed ES(S).
+    """
+    return float(gseapvals([es], [esnull])[0])
+
+def gseapvals(es, esnull):
+    """
+    Vectorized gseapval for arrays of enrichment scores (gene sets) and
+    their null distributions (gene sets x permutations).
+    """
+    es = numpy.asarray(es, dtype=float)
+    esnull = numpy.asarray(esnull, dtype=float).reshape(len(es), -1)
+    neg = es[:, None] < 0
+    higher = numpy.where(neg, esnull <= es[:, None],
+                         esnull >= es[:, None]).sum(axis=1)
+    total = numpy.where(neg, esnull < 0, esnull >= 0).sum(axis=1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        pvals = higher / total.astype(float)
+    pvals[total == 0] = 1.0
+    return pvals
+
+def gseaSignificance(enrichmentScores, enrichmentNulls):
+    """
+    Compute normalized enrichment scores, nominal p-values and FDR for
+    enrichment scores and their null distributions (a list of lists or
+    a gene sets x permutations array).
+
+    Returns a list of (es, nes, p-value, fdr) tuples.
+    """
+    es = numpy.asarray(enrichmentScores, dtype=float)
+    null = numpy.asarray(enrichmentNulls, dtype=float).reshape(len(es), -1)
+
+    enrichmentPVals = gseapvals(es, null)
+
+    #normalize the ES(S,pi) and the observed ES(S), separetely rescaling
+    #the positive and negative scores by divident by the mean of the 
+    #ES(S,pi)
+    pos = null >= 0
+    neg = ~pos
+    npos = pos.sum(axis=1)
+    nneg = neg.sum(axis=1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        meanPos = numpy.where(pos, null, 0).sum(axis=1) / npos
+        meanNeg = numpy.where(neg, null, 0).sum(axis=1) / nneg
+
+        def normalize(s):
+            s = numpy.asarray(s, dtype=float)
+            mp = meanPos.reshape((-1,) + (1,) * (s.ndim - 1))
+            mn = meanNeg.reshape((-1,) + (1,) * (s.ndim - 1))
+            res = numpy.where(s >= 0, s / mp, -s / mn)
+            #return 0 if according mean value is uncalculable
+            res[(s == 0) | ~numpy.isfinite(res)] = 0.0
+            return res
+
+        nEnrichmentScores = normalize(es)
+        nEnrichmentNulls = normalize(null)
+
+    """
+    Use this null distribution to compute an FDR q value, for a given NES(S) =
+    NES* >= 0. The FDR is the ratio of the percantage of all (S,pi) with
+    NES(S,pi) >= 0, whose NES(S,pi) >= NES*, divided by the percentage of
+    observed S wih NES(S) >= 0, whose NES(S) >= NES*, and similarly if NES(S)
+    = NES* <= 0.
+    """
+
+    #create a histogram of all NES(S,pi) over all S and pi
+    nvals = numpy.sort(nEnrichmentNulls.ravel())
+    nnes = numpy.sort(nEnrichmentScores)
+    nes = nEnrichmentScores
+    ispos = nes >= 0
+
+    ss = numpy.searchsorted
+    allPos = numpy.where(ispos, len(nvals) - ss(nvals, 0, side="left"),
+                         ss(nvals, 0, side="left"))
+    allHigherAndPos = numpy.where(ispos,
+                                  len(nvals) - ss(nvals, nes, side="left"),
+                                  ss(nvals, nes, side="right"))
+    nesPos = numpy.where(ispos, len(nnes) - ss(nnes, 0, side="left"),
+                         ss(nnes, 0, side="left"))
+    nesHigherAndPos = numpy.where(ispos,
+                                  len(nnes) - ss(nnes, nes, side="left"),
+                                  ss(nnes, nes, side="right"))
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        top = allHigherAndPos / allPos.astype(float) #p value
+        down = nesHigherAndPos / nesPos.astype(float)
+        fdrs = top / down
+    fdrs[(allPos == 0) | (nesPos == 0) | (down == 0)] = 1000000000.0
+
+    return list(zip(es.tolist(), nEnrichmentScores.tolist(),
+                    enrichmentPVals.tolist(), fdrs.tolist()))
@@ -0,0 +1,206 @@
+"""
+Multiple hypothesis testing corrections on arrays of p-values.
+
+All functions accept a sequence (or array) of p-values and return a
+:class:`numpy.ndarray` of adjusted values in the same order. Missing
+values (NaN) are ignored and are kept in the output.
+
+"""
+from __future__ import absolute_import, division
+
+import math
+import threading
+
+import numpy
+
+#: Euler-Mascheroni constant
+EULER_GAMMA = 0.57721566490153286060651209008240243104215933593992
+
+_HARMONIC_EXACT_MAX = 100000
+_harmonic_cache = {}
+_harmonic_lock = threading.Lock()
+
+
+def harmonic_number(m):
+    """
+    Return the `m`-th harmonic number ``sum(1/i for i in range(1, m + 1))``.
+
+    For `m` larger than 100000 the approximation ``log(m) + gamma`` (with an
+    error less than 5e-6) is used.
+    """
+    m = int(m)
+    if m > _HARMONIC_EXACT_MAX:
+        return math.log(m) + EULER_GAMMA
+    with _harmonic_lock:
+        if m not in _harmonic_cache:
+            _harmonic_cache[m] = float(
+                numpy.sum(1.0 / numpy.arange(1, m + 1)[::-1]))
+        return _harmonic_cache[m]
+
+
+def _prepare(p_values, m=None):
+    p = numpy.asarray(p_values, dtype=float).ravel()
+    valid = numpy.flatnonzero(~numpy.isnan(p))
+    if m is None or m == 0:
+        m = len(valid)
+    return p, valid, m
+
+
+def _finish(p, valid, adjusted):
+    out = numpy.full(p.shape, numpy.nan)
+    out[valid] = numpy.minimum(adjusted, 1.0)
+    return out
+
+
+def step_up(p_values, m, presorted=False):
+    """
+    Return ``min(m * p[j] / rank(j) for j >= i)`` (in the ascending order
+    of `p_values`) for all `p_values`. This is the core of the Benjamini &
+    Hochberg type corrections. The result is not clipped to 1.
+
+    :param numpy.ndarray p_values: A 1D array of p-values (without NaNs).
+    :param float m: A multiplier (the number of tests).
+    :param bool presorted: `p_values` are already in ascending order.
+    """
+    p = numpy.asarray(p_values, dtype=float)
+    n = len(p)
+    if n == 0:
+        return numpy.array([], dtype=float)
+    if presorted:
+        order = None
+        sp = p
+    else:
+        order = numpy.argsort(p, kind="mergesort")
+        sp = p[order]
+    adjusted = sp * (float(m) / numpy.arange(1, n + 1))
+    adjusted = numpy.minimum.accumulate(adjusted[::-1])[::-1]
+    if order is None:
+        return adjusted
+    out = numpy.empty_like(adjusted)
+    out[order] = adjusted
+    return out
+
+
+def fdr_bh(p_values, m=None):
+    """
+    `Benjamini & Hochberg
+    <http://en.wikipedia.org/wiki/False_discovery_rate>`_ false discovery
+    rate correction.
+
+    :param p_values: A sequence of p-values.
+    :param int m: Number of hypotheses tested (default: number of
+        non missing p-values).
+    :rtype: numpy.ndarray
+    """
+    p, valid, m = _prepare(p_values, m)
+    return _finish(p, valid, step_up(p[valid], m))
+
+
+def fdr_by(p_values, m=None):
+    """
+    Benjamini & Yekutieli false discovery rate correction (valid for
+    dependent hypotheses).
+
+    :param p_values: A sequence of p-values.
+    :param int m: Number of hypotheses tested (default: number of
+        non missing p-values).
+    :rtype: numpy.ndarray
+    """
+    p, valid, m = _prepare(p_values, m)
+    return _finish(p, valid, step_up(p[valid], m * harmonic_number(m)))
+
+
+def bonferroni(p_values, m=None):
+    """
+    `Bonferroni correction
+    <http://en.wikipedia.org/wiki/Bonferroni_correction>`_.
+
+    :param p_values: A sequence of p-values.
+    :param int m: Number of hypotheses tested (default: number of
+        non missing p-values).
+    :rtype: numpy.ndarray
+    """
+    p, valid, m = _prepare(p_values, m)
+    return _finish(p, valid, p[valid] * m)
+
+
+def holm(p_values, m=None):
+    """
+    `Holm-Bonferroni
+    <http://en.wikipedia.org/wiki/Holm%E2%80%93Bonferroni_method>`_
+    step-down correction.
+
+    :param p_values: A sequence of p-values.
+    :param int m: Number of hypotheses tested (default: number of
+        non missing p-values).
+    :rtype: numpy.ndarray
+    """
+    p, valid, m = _prepare(p_values, m)
+    pv = p[valid]
+    order = numpy.argsort(pv, kind="mergesort")
+    adjusted = pv[order] * (m - numpy.arange(len(pv)))
+    adjusted = numpy.maximum.accumulate(adjusted)
+    out = numpy.empty_like(adjusted)
+    out[order] = adjusted
+    return _finish(p, valid, out)
+
+
+def estimate_pi0(p_values, lambdas=None):
+    """
+    Estimate the proportion of true null hypotheses (Storey & Tibshirani,
+    2003).
+
+    :param p_values: A sequence of p-values.
+    :param lambdas:
+        A tuning parameter or a sequence of them. For a single value
+        ``#(p > lambda) / (m * (1 - lambda))`` is returned, for a sequence
+        a cubic spline is fitted to the estimates and evaluated at the
+        largest lambda. Defaults to ``numpy.arange(0, 0.95, 0.05)``.
+
+    :rtype: float
+    """
+    p = numpy.asarray(p_values, dtype=float).ravel()
+    p = numpy.sort(p[~numpy.isnan(p)])
+    m = len(p)
+    if m == 0:
+        return 1.0
+    if lambdas is None:
+        lambdas = numpy.arange(0, 0.95, 0.05)
+    lambdas = numpy.asarray(lambdas, dtype=float)
+    # count of p-values greater than each lambda
+    greater = m - numpy.searchsorted(p, lambdas, side="right")
+    pi0 = greater / (m * (1.0 - lambdas))
+    if lambdas.ndim == 0:
+        pi0 = float(pi0)
+    elif len(lambdas) < 4:
+        pi0 = float(pi0[-1])
+    else:
+        import scipy.interpolate
+        spline = scipy.interpolate.UnivariateSpline(lambdas, pi0, k=3)
+        pi0 = float(spline(lambdas[-1]))
+        if pi0 <= 0:
+            pi0 = float(numpy.min(greater / (m * (1.0 - lambdas))))
+    if pi0 <= 0:
+        # all p-values are small; fall back to the conservative estimate
+        return 1.0
+    return min(pi0, 1.0)
+
+
+def qvalues(p_values, pi0=1.0, m=None):
+    """
+    Storey q-values (Storey & Tibshirani (2003) Statistical significance for
+    genomewide studies. PNAS 100(16), pp. 9440-5).
+
+    :param p_values: A sequence of p-values.
+    :param pi0:
+        The proportion of true null hypotheses. If None it is estimated
+        with :func:`estimate_pi0`. With the default ``pi0=1`` the q-values
+        equal the Benjamini & Hochberg FDR.
+    :param int m: Number of hypotheses tested (default: number of
+        non missing p-values).
+    :rtype: numpy.ndarray
+    """
+    p, valid, m = _prepare(p_values, m)
+    if pi0 is None:
+        pi0 = estimate_pi0(p[valid])
+    return _finish(p, valid, step_up(p[valid], pi0 * m))
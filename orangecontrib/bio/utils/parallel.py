@@ -0,0 +1,282 @@
+"""
+Helpers for running independent tasks in a pool of worker processes
+(or threads).
+"""
+from __future__ import absolute_import
+
+import time
+import threading
+import itertools
+import contextlib
+import multiprocessing
+
+from six.moves import queue
+
+#: State shared with the worker functions (set by the pool initializer).
+_state = {}
+
+#: Per thread state of tasks run in this process (see :func:`_using_state`).
+_local = threading.local()
+
+def effective_n_jobs(n_jobs):
+    """
+    Return the number of worker processes to use for `n_jobs`. None or 1
+    mean no workers, negative numbers count back from the number of CPUs
+    (-1 means all CPUs).
+    """
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        n_jobs = multiprocessing.cpu_count() + 1 + n_jobs
+    return max(int(n_jobs), 1)
+
+
+def _set_state(state):
+    _state.clear()
+    _state.update(state)
+
+
+def _current_state():
+    return getattr(_local, "state", _state)
+
+
+@contextlib.contextmanager
+def _using_state(state):
+    """Make `state` the current thread's state, restoring it on exit."""
+    previous = getattr(_local, "state", None)
+    _local.state = state
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _local.state
+        else:
+            _local.state = previous
+
+
+def _call_with_state(args):
+    func, state, items = args
+    with _using_state(state):
+        return [func(item) for item in items]
+
+
+def has_state(name):
+    """Is `name` in the shared state (see :func:`get_state`)."""
+    return name in _current_state()
+
+
+def get_state(name):
+    """
+    Return the shared state item `name` (see :func:`parallel_map`) from
+    within a task function.
+    """
+    return _current_state()[name]
+
+
+def _chunks(iterable, size):
+    items = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parallel_map(func, iterable, n_jobs=1, state=None, executor=None,
+                 callback=None, chunksize=1):
+    """
+    Apply `func` to every item of `iterable` and return a list of results
+    (in order).
+
+    :param func: A picklable (module level) function of one argument.
+    :param iterable: Task arguments.
+    :param int n_jobs: The number of worker processes (see
+        :func:`effective_n_jobs`). With 1 the tasks run in this process.
+    :param dict state:
+        Shared read only data for the tasks (accessed with
+        :func:`get_state`). It is sent to each worker process only once.
+    :param executor:
+        An optional `concurrent.futures.Executor` to use instead of a new
+        process pool. The `state` is sent along with each chunk of tasks
+        (so it must be picklable for a `ProcessPoolExecutor`) and is only
+        visible to the tasks of this call.
+    :param callback:
+        An optional function called with the number of finished tasks
+        after each one completes (after each chunk with an executor).
+    :param int chunksize:
+        The number of tasks submitted to the `executor` at once.
+
+    """
+    state = state or {}
+    n_jobs = effective_n_jobs(n_jobs)
+    results = []
+    if executor is not None:
+        tasks = ((func, state, chunk)
+                 for chunk in _chunks(iterable, max(chunksize, 1)))
+        for chunk in executor.map(_call_with_state, tasks):
+            results.extend(chunk)
+            if callback is not None:
+                callback(len(results))
+        return results
+
+    if n_jobs == 1:
+        with _using_state(state):
+            for result in (func(item) for item in iterable):
+                results.append(result)
+                if callback is not None:
+                    callback(len(results))
+        return results
+
+    pool = multiprocessing.Pool(n_jobs, initializer=_set_state,
+                                initargs=(state,))
+    try:
+        for result in pool.imap(func, iterable):
+            results.append(result)
+            if callback is not None:
+                callback(len(results))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def _call_catching(args):
+    func, item = args
+    try:
+        return item, func(item), None
+    except Exception as ex:
+        return item, None, ex
+
+
+def parallel_imap_unordered(func, iterable, n_jobs=1, state=None):
+    """
+    Apply `func` to every item of `iterable` in a pool of worker processes
+    and yield ``(item, result, exception)`` tuples in the order of
+    completion (`exception` is None if the call succeeded).
+
+    :param func: A picklable (module level) function of one argument.
+    :param iterable: Task arguments.
+    :param int n_jobs: The number of worker processes (see
+        :func:`effective_n_jobs`). With 1 the tasks run in this process
+        (in order).
+    :param dict state:
+        Shared read only data for the tasks (see :func:`parallel_map`).
+
+    """
+    state = state or {}
+    n_jobs = effective_n_jobs(n_jobs)
+    tasks = ((func, item) for item in iterable)
+    if n_jobs == 1:
+        for task in tasks:
+            with _using_state(state):
+                result = _call_catching(task)
+            yield result
+        return
+
+    pool = multiprocessing.Pool(n_jobs, initializer=_set_state,
+                                initargs=(state,))
+    try:
+        for result in pool.imap_unordered(_call_catching, tasks):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class RateLimiter(object):
+    """
+    Limit the rate of some action to at most `rate` per second (across
+    all threads). Call :func:`wait` before each action.
+
+    :param float rate: Actions per second (None or 0 for no limit).
+
+    """
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next action is allowed."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def thread_imap_unordered(func, iterable, n_threads=4, rate=None):
+    """
+    Apply `func` to every item of `iterable` in `n_threads` worker threads
+    and yield ``(item, result, exception)`` tuples in the order of
+    completion (`exception` is None if the call succeeded).
+
+    At most `n_threads` calls are in flight and at most `n_threads`
+    finished results wait to be consumed, so items are drawn from
+    `iterable` lazily. Closing the generator stops the workers after
+    their current call.
+
+    :param func: A function of one argument (called from worker threads).
+    :param iterable: Task arguments.
+    :param int n_threads: The number of worker threads.
+    :param float rate: Limit the calls to at most `rate` per second.
+
+    """
+    items = iter(iterable)
+    lock = threading.Lock()
+    stop = threading.Event()
+    results = queue.Queue(maxsize=max(n_threads, 1))
+    limiter = RateLimiter(rate)
+    done = object()
+
+    def put(value):
+        # do not block forever if the consumer went away
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def worker():
+        try:
+            while not stop.is_set():
+                with lock:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                limiter.wait()
+                try:
+                    put((item, func(item), None))
+                except Exception as ex:
+                    put((item, None, ex))
+        finally:
+            put(done)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(n_threads, 1))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    running = len(threads)
+    try:
+        while running:
+            value = results.get()
+            if value is done:
+                running -= 1
+            else:
+                yield value
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
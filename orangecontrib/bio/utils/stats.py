@@ -2,6 +2,10 @@ import math
 import threading
 import six
 
+import numpy
+
+from . import multitest
+
 
 def _lngamma(z):
     x = 0
@@ -55,6 +59,103 @@ class LogBin(object):
         else:
             return _lngamma(n + 1)
 
+#: Cached log-factorial table shared by the batch p-value computations
+#: (``_LOG_FACTORIALS[i] == log(i!)``). Grown on demand.
+_LOG_FACTORIALS = numpy.zeros(2)
+_LOG_FACTORIALS_LOCK = threading.Lock()
+
+
+def log_factorials(n):
+    """
+    Return an array `t` of (at least) ``n + 1`` elements with
+    ``t[i] == log(i!)``.
+
+    The table is cached at module level and extended as needed.
+    """
+    global _LOG_FACTORIALS
+    table = _LOG_FACTORIALS
+    if n < len(table):
+        return table
+    with _LOG_FACTORIALS_LOCK:
+        table = _LOG_FACTORIALS
+        if n >= len(table):
+            size = max(n + 1, 2 * len(table))
+            ext = numpy.array([math.lgamma(i + 1)
+                               for i in range(len(table), size)])
+            table = numpy.concatenate([table, ext])
+            _LOG_FACTORIALS = table
+    return table
+
+
+def _as_int_arrays(*args):
+    arrays = numpy.broadcast_arrays(*[numpy.asarray(a) for a in args])
+    shape = arrays[0].shape
+    return shape, [numpy.ravel(a).astype(numpy.int64) for a in arrays]
+
+
+def _segment_log_sum(lo, hi, log_pmf):
+    """
+    Return ``log(sum(exp(log_pmf(seg, i)) for i in range(lo, hi + 1)))``
+    for all segments at once (-inf for empty segments).
+
+    `log_pmf` is called once with two flat arrays: the segment index and
+    the value `i` of every term of every segment.
+    """
+    lengths = numpy.maximum(hi - lo + 1, 0)
+    out = numpy.full(len(lengths), -numpy.inf)
+    total = int(lengths.sum())
+    if total == 0:
+        return out
+    nonempty = numpy.flatnonzero(lengths)
+    ends = numpy.cumsum(lengths)
+    starts = ends - lengths
+    seg = numpy.repeat(numpy.arange(len(lengths)), lengths)
+    i = numpy.arange(total) - starts[seg] + lo[seg]
+    logp = log_pmf(seg, i)
+    # log-sum-exp with a per-segment maximum for numerical stability
+    mx = numpy.zeros(len(lengths))
+    mx[nonempty] = numpy.maximum.reduceat(logp, starts[nonempty])
+    mx[~numpy.isfinite(mx)] = 0.0
+    with numpy.errstate(divide="ignore"):
+        s = numpy.add.reduceat(numpy.exp(logp - mx[seg]), starts[nonempty])
+        out[nonempty] = mx[nonempty] + numpy.log(s)
+    return out
+
+
+def _tail_p_values(k, lo, hi, log_pmf):
+    """
+    Upper tail probabilities ``P(X >= k)`` for distributions with support
+    ``[lo, hi]`` given by a `log_pmf` (see :func:`_segment_log_sum`).
+
+    As in the scalar implementation the shorter of the two tails is summed;
+    when the complement is small (and thus inexact) the upper tail is
+    summed directly.
+    """
+    p = numpy.ones(len(k))
+    p[k > hi] = 0.0
+    todo = (k > lo) & (k <= hi)
+    upper = todo & (hi - k + 1 <= k - lo)
+    lower = todo & ~upper
+
+    idx = numpy.flatnonzero(lower)
+    if len(idx):
+        ls = _segment_log_sum(lo[idx], k[idx] - 1,
+                              lambda seg, i: log_pmf(idx[seg], i))
+        value = -numpy.expm1(ls)
+        # if the value is small it is probably inexact due to the limited
+        # precision of floats, as for example  (1-(1-1e-20)) -> 0
+        inexact = value < 1e-3
+        upper[idx[inexact]] = True
+        p[idx[~inexact]] = value[~inexact]
+
+    idx = numpy.flatnonzero(upper)
+    if len(idx):
+        ls = _segment_log_sum(k[idx], hi[idx],
+                              lambda seg, i: log_pmf(idx[seg], i))
+        p[idx] = numpy.exp(ls)
+    return numpy.clip(p, 0.0, 1.0)
+
+
 class Binomial(LogBin):
     """ `Binomial distribution 
     <http://en.wikipedia.org/wiki/Binomial_distribution>`_ is a discrete
@@ -88,19 +189,38 @@ class Binomial(LogBin):
 
     def p_value(self, k, N, m, n):
         """ The probability that k or more tests are positive. """
-        if n - k + 1 <= k:
-            #starting from k gives the shorter list of values
-            return sum(self.__call__(i, N, m, n) for i in range(k, n+1))
-        else:
-            value = 1.0 - sum(self.__call__(i, N, m, n) for i in range(k))
-            #if the value is small it is probably inexact due to the limited
-            #precision of floats, as for example  (1-(1-1e-20)) -> 0
-            #if so, compute the result without substraction
-            if value < 1e-3: #arbitary threshold
-                #print "INEXACT", value, sum(self.__call__(i, N, m, n) for i in range(k, n+1))
-                return sum(self.__call__(i, N, m, n) for i in range(k, n+1))
-            else:
-                return value
+        return float(self.p_values(k, N, m, n))
+
+    def p_values(self, k, N, m, n):
+        """
+        Vectorized :func:`p_value`. The arguments can be arrays (or scalars)
+        of equal (or broadcastable) shape; return an array of probabilities
+        that k or more tests are positive.
+        """
+        shape, (k, N, m, n) = _as_int_arrays(k, N, m, n)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            p = m / N.astype(float)
+            logp, logq = numpy.log(p), numpy.log1p(-p)
+        table = log_factorials(int(n.max()) if len(n) else 0)
+
+        def log_pmf(j, i):
+            nj = n[j]
+            return (table[nj] - table[nj - i] - table[i] +
+                    i * logp[j] + (nj - i) * logq[j])
+
+        degenerate = (p <= 0.0) | (p >= 1.0)
+        lo = numpy.zeros_like(n)
+        hi = n.copy()
+        # all the probability mass is in one point
+        lo[p <= 0.0] = hi[p <= 0.0] = 0
+        lo[p >= 1.0] = n[p >= 1.0]
+        res = numpy.empty(len(k))
+        res[degenerate] = (k[degenerate] <= lo[degenerate]).astype(float)
+        nd = numpy.flatnonzero(~degenerate)
+        res[nd] = _tail_p_values(
+            k[nd], lo[nd], hi[nd], lambda j, i: log_pmf(nd[j], i))
+        return res.reshape(shape)
+
 
 class Hypergeometric(LogBin):
     """ `Hypergeometric distribution
@@ -129,28 +249,41 @@ class Hypergeometric(LogBin):
         """ 
         The probability that k or more tests are positive.
         """
+        return float(self.p_values(k, N, m, n))
 
-        if min(n,m) - k + 1 <= k:
-            #starting from k gives the shorter list of values
-            return sum(self.__call__(i, N, m, n) for i in range(k, min(n,m)+1))
-        else:
-            value = 1.0 - sum(self.__call__(i, N, m, n) for i in (range(k)))
-            #if the value is small it is probably inexact due to the limited
-            #precision of floats, as for example  (1-(1-1e-20)) -> 0
-            #if so, compute the result without substraction
-            if value < 1e-3: #arbitary threshold
-                #print "INEXACT", value, sum(self.__call__(i, N, m, n) for i in range(k, min(n,m)+1))
-                return sum(self.__call__(i, N, m, n) for i in range(k, min(n,m)+1))
-            else:
-                return value
+    def p_values(self, k, N, m, n):
+        """
+        Vectorized :func:`p_value`. The arguments can be arrays (or scalars)
+        of equal (or broadcastable) shape; return an array of probabilities
+        that k or more tests are positive.
+        """
+        shape, (k, N, m, n) = _as_int_arrays(k, N, m, n)
+        table = log_factorials(int(N.max()) if len(N) else 0)
+
+        def log_pmf(j, i):
+            Nj, mj, nj = N[j], m[j], n[j]
+            return (table[mj] - table[mj - i] - table[i] +
+                    table[Nj - mj] - table[Nj - mj - nj + i] - table[nj - i] -
+                    table[Nj] + table[Nj - nj] + table[nj])
 
-## to speed-up FDR, calculate ahead sum([1/i for i in range(1, m+1)]), for m in [1,100000]. For higher values of m use an approximation, with error less or equal to 4.99999157277e-006. (sum([1/i for i in range(1, m+1)])  ~ log(m) + 0.5772..., 0.5572 is an Euler-Mascheroni constant) 
-c = [1.0]
-for m in range(2, 100000):
-    c.append( c[-1] + 1.0/m)
+        lo = numpy.maximum(0, n + m - N)
+        hi = numpy.minimum(n, m)
+        return _tail_p_values(k, lo, hi, log_pmf).reshape(shape)
+
+def p_values(prob, k, N, m, n):
+    """
+    Return a list of `prob`'s p-values for sequences of (k, N, m, n)
+    arguments. The vectorized ``prob.p_values`` is used if available.
+    """
+    if hasattr(prob, "p_values"):
+        return list(map(float, prob.p_values(k, N, m, n)))
+    else:
+        return [prob.p_value(*args)
+                for args in zip(*numpy.broadcast_arrays(k, N, m, n))]
 
 def is_sorted(l):
-    return all(l[i] <= l[i+1] for i in range(len(l)-1))
+    l = numpy.asarray(l)
+    return bool(numpy.all(l[:-1] <= l[1:]))
 
 def FDR(p_values, dependent=False, m=None, ordered=False):
     """
@@ -160,41 +293,20 @@ def FDR(p_values, dependent=False, m=None, ordered=False):
     :param dependent: use correction for dependent hypotheses (default False).
     :param m: number of hypotheses tested (default ``len(p_values)``).
     :param ordered: prevent sorting of p-values if they are already sorted (default False).
-    """
-
-    if not ordered:
-        ordered = is_sorted(p_values)
-
-    if not ordered:
-        joined = [ (v,i) for i,v in enumerate(p_values) ]
-        joined.sort()
-        p_values = [ p[0] for p in joined ]
-        indices = [ p[1] for p in joined ]
 
+    .. seealso:: :mod:`orangecontrib.bio.utils.multitest` for array based
+        corrections.
+    """
+    p_values = numpy.asarray(p_values, dtype=float).ravel()
     if not m:
         m = len(p_values)
-    if m <= 0 or not p_values:
+    if m <= 0 or not len(p_values):
         return []
 
     if dependent: # correct q for dependent tests
-        k = c[m-1] if m <= len(c) else math.log(m) + 0.57721566490153286060651209008240243104215933593992
-        m = m * k
-
-    tmp_fdrs = [p*m/(i+1.0) for (i, p) in enumerate(p_values)]
-    fdrs = []
-    cmin = tmp_fdrs[-1]
-    for f in reversed(tmp_fdrs):
-        cmin = min(f, cmin)
-        fdrs.append( cmin)
-    fdrs.reverse()
-
-    if not ordered:
-        new = [ None ] * len(fdrs)
-        for v,i in zip(fdrs, indices):
-            new[i] = v
-        fdrs = new
-
-    return fdrs
+        m = m * multitest.harmonic_number(m)
+
+    return multitest.step_up(p_values, m, presorted=ordered).tolist()
 
 def Bonferroni(p_values, m=None):
     """
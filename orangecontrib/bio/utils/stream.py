@@ -0,0 +1,87 @@
+"""
+Streaming line access to (possibly compressed) text files.
+"""
+from __future__ import absolute_import
+
+import io
+import os
+import gzip
+import tarfile
+
+
+class TextStream(object):
+    """
+    Open a plain, gzip compressed or tar archived text file for streaming
+    (line by line) reading.
+
+    Progress is measured by the number of bytes consumed from the (possibly
+    compressed) file on disk.
+
+    :param str path: Path to the file.
+    :param str member:
+        Name of the archive member to read if `path` is a tar file
+        (default the first regular file in the archive).
+    :param str encoding: Text encoding.
+
+    """
+    def __init__(self, path, member=None, encoding="utf-8"):
+        self.path = path
+        self.raw = io.open(path, "rb")
+        self.size = os.fstat(self.raw.fileno()).st_size
+        self._tar = None
+        try:
+            if tarfile.is_tarfile(path):
+                self._tar = tarfile.open(fileobj=self.raw)
+                if member is None:
+                    member = next(m for m in self._tar if m.isfile())
+                stream = self._tar.extractfile(member)
+            elif path.endswith(".gz"):
+                stream = gzip.GzipFile(fileobj=self.raw)
+            else:
+                stream = self.raw
+        except Exception:
+            self.raw.close()
+            raise
+        self.text = io.TextIOWrapper(stream, encoding=encoding)
+
+    def tell(self):
+        """Return the number of bytes consumed from the file on disk."""
+        return self.raw.tell()
+
+    def lines(self, progress_callback=None, step=1.0):
+        """
+        Iterate over lines of the file.
+
+        :param progress_callback:
+            An optional function called with the percentage (0.0 - 100.0)
+            of the consumed file, at most once every `step` percent.
+        """
+        if progress_callback is None:
+            for line in self.text:
+                yield line
+            return
+
+        size = float(max(self.size, 1))
+        last = 0.0
+        for i, line in enumerate(self.text):
+            if i % 1000 == 0:
+                progress = 100.0 * self.raw.tell() / size
+                if progress - last >= step:
+                    progress_callback(progress)
+                    last = progress
+            yield line
+
+    def __iter__(self):
+        return self.lines()
+
+    def close(self):
+        self.text.close()
+        if self._tar is not None:
+            self._tar.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -29,6 +29,7 @@ from Orange.widgets.utils import concurrent
 from orangecontrib.bio.widgets3.utils import gui as guiutils
 from orangecontrib.bio.widgets3.utils import group as grouputils
 from orangecontrib.bio.widgets3.utils.settings import SetContextHandler
+from orangecontrib.bio.utils import expression
 
 
 def score_fold_change(a, b, axis=0):
@@ -46,72 +47,16 @@ def score_fold_change(a, b, axis=0):
     -------
     FC : array
         The FC scores
-    """
-    mean_a = np.nanmean(a, axis=axis)
-    mean_b = np.nanmean(b, axis=axis)
-    res = mean_a / mean_b
-    warning = None
-    if np.any(res < 0):
-        res[res < 0] = float("nan")
-        warning = "Negative fold change scores were ignored. You should use another scoring method."
-    return res, warning
-
-
-def score_log_fold_change(a, b, axis=0):
-    """
-    Return the log2(FC).
 
     See Also
     --------
-    score_fold_change
-
+    score_fold_change_labels
     """
-    s, w = score_fold_change(a, b, axis=axis) 
-    return np.log2(s), w
-
-
-def score_ttest(a, b, axis=0):
-    T, P = scipy.stats.ttest_ind(a, b, axis=axis)
-    return T, P
-
-
-def score_ttest_t(a, b, axis=0):
-    T, _ = score_ttest(a, b, axis=axis)
-    return T
-
-
-def score_ttest_p(a, b, axis=0):
-    _, P = score_ttest(a, b, axis=axis)
-    return P
-
-
-def score_anova(*arrays, axis=0):
-    F, P = f_oneway(*arrays, axis=axis)
-    return F, P
-
-
-def score_anova_(*arrays, axis=0):
-    arrays = [np.asarray(arr, dtype=float) for arr in arrays]
-
-    if not len(arrays) > 1:
-        raise TypeError("Need at least 2 positional arguments")
-
-    if not 0 <= axis < 2:
-        raise ValueError("0 <= axis < 2")
-
-    if not all(arrays[i].ndim == arrays[i + 1].ndim
-               for i in range(len(arrays) - 2)):
-        raise ValueError("All arrays must have the same number of dimensions")
-
-    if axis >= arrays[0].ndim:
-        raise ValueError()
-
-    if axis == 0:
-        arrays = [arr.T for arr in arrays]
-
-    scores = [scipy.stats.f_oneway(*ars) for ars in zip(*arrays)]
-    F, P = zip(*scores)
-    return np.array(F, dtype=float), np.array(P, dtype=float)
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    if axis == 1:
+        a, b = a.T, b.T
+    labels = np.repeat([0, 1], [a.shape[0], b.shape[0]])
+    return score_fold_change_labels(np.concatenate([a, b]), labels)
 
 
 def f_oneway(*arrays, axis=0):
@@ -161,26 +106,6 @@ def f_oneway(*arrays, axis=0):
     return f, prob
 
 
-def score_anova_f(*arrays, axis=0):
-    F, _ = score_anova(*arrays, axis=axis)
-    return F
-
-
-def score_anova_p(*arrays, axis=0):
-    _, P = score_anova(*arrays, axis=axis)
-    return P
-
-
-def score_signal_to_noise(a, b, axis=0):
-    mean_a = np.nanmean(a, axis=axis)
-    mean_b = np.nanmean(b, axis=axis)
-
-    std_a = np.nanstd(a, axis=axis, ddof=1)
-    std_b = np.nanstd(b, axis=axis, ddof=1)
-
-    return (mean_a - mean_b) / (std_a + std_b)
-
-
 def score_mann_whitney(a, b, axis=0):
     a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
 
@@ -206,6 +131,76 @@ def score_mann_whitney_u(a, b, axis=0):
     return U
 
 
+# Scores of all features (columns of `X`) for a vector of group labels
+# of the samples (rows of `X`) or for a matrix of (permuted) labelings,
+# one per row, all at once (see `orangecontrib.bio.utils.expression`).
+# The t-test and ANOVA scores of features with missing values in the
+# compared groups are NaN (as with `scipy.stats`); the fold change and
+# signal to noise scores ignore the missing values.
+
+def nan_if_missing(X, labels, scores, groups):
+    """
+    Set the `scores` of features (columns of `X`) with missing values
+    in samples labeled with any of `groups` to NaN.
+    """
+    inside = np.isin(np.atleast_2d(labels), groups).astype(float)
+    missing = inside.dot(np.isnan(X).astype(float)) > 0
+    scores = np.array(scores, dtype=float)
+    scores[missing.reshape(scores.shape)] = np.nan
+    return scores
+
+
+def score_fold_change_labels(X, labels):
+    res = expression.fold_change(X, labels)
+    warning = None
+    if np.any(res < 0):
+        res[res < 0] = float("nan")
+        warning = "Negative fold change scores were ignored. You should use another scoring method."
+    return res, warning
+
+
+def score_log_fold_change_labels(X, labels):
+    s, w = score_fold_change_labels(X, labels)
+    return np.log2(s), w
+
+
+def score_ttest_t_labels(X, labels):
+    T, _ = expression.t_test(X, labels)
+    return nan_if_missing(X, labels, T, [0, 1])
+
+
+def score_ttest_p_labels(X, labels):
+    _, P = expression.t_test(X, labels)
+    return nan_if_missing(X, labels, P, [0, 1])
+
+
+def score_anova_f_labels(X, labels):
+    F, _ = expression.anova_f(X, labels)
+    return nan_if_missing(X, labels, F, _nonnegative(labels))
+
+
+def score_anova_p_labels(X, labels):
+    _, P = expression.anova_f(X, labels)
+    return nan_if_missing(X, labels, P, _nonnegative(labels))
+
+
+def _nonnegative(labels):
+    labels = np.unique(labels)
+    return labels[labels >= 0]
+
+
+def score_signal_to_noise_labels(X, labels):
+    return expression.signal_to_noise(X, labels)
+
+
+def score_mann_whitney_u_labels(X, labels):
+    labels = np.asarray(labels)
+    if labels.ndim == 1:
+        return score_mann_whitney_u(X[labels == 0], X[labels == 1])
+    return np.array([score_mann_whitney_u(X[row == 0], X[row == 1])
+                     for row in labels])
+
+
 class InfiniteLine(pg.InfiniteLine):
     def paint(self, painter, option, widget=None):
         brect = self.boundingRect()
@@ -533,18 +528,24 @@ class OWFeatureSelection(widget.OWWidget):
     TwoSampleTest, VarSampleTest = 1, 2
     #: Available scoring methods
 
+    #: (name, side, test type, score function of data and group labels)
     Scores = [
-        ("Fold Change", TwoTail, TwoSampleTest, score_fold_change),
-        ("log2(Fold Change)", TwoTail, TwoSampleTest, score_log_fold_change),
-        ("T-test", TwoTail, TwoSampleTest, score_ttest_t),
-        ("T-test P-value", LowTail, TwoSampleTest, score_ttest_p),
-        ("ANOVA", HighTail, VarSampleTest, score_anova_f),
-        ("ANOVA P-value", LowTail, VarSampleTest, score_anova_p),
+        ("Fold Change", TwoTail, TwoSampleTest, score_fold_change_labels),
+        ("log2(Fold Change)", TwoTail, TwoSampleTest,
+         score_log_fold_change_labels),
+        ("T-test", TwoTail, TwoSampleTest, score_ttest_t_labels),
+        ("T-test P-value", LowTail, TwoSampleTest, score_ttest_p_labels),
+        ("ANOVA", HighTail, VarSampleTest, score_anova_f_labels),
+        ("ANOVA P-value", LowTail, VarSampleTest, score_anova_p_labels),
         ("Signal to Noise Ratio", TwoTail, TwoSampleTest,
-         score_signal_to_noise),
-        ("Mann-Whitney", LowTail, TwoSampleTest, score_mann_whitney_u),
+         score_signal_to_noise_labels),
+        ("Mann-Whitney", LowTail, TwoSampleTest,
+         score_mann_whitney_u_labels),
     ]
 
+    #: Number of label permutations scored together.
+    PermutationBlock = 10
+
     settingsHandler = SetContextHandler()
 
     #: Selected score index.
@@ -815,9 +816,14 @@ class OWFeatureSelection(widget.OWWidget):
 
         _, side, test_type, score_func = self.Scores[self.score_index]
 
-        def compute_scores(X, group_indices, warn=False):
-            arrays = [X[ind] for ind in group_indices]
-            ss = score_func(*arrays, axis=0)
+        def group_labels(group_indices, nsamples):
+            labels = np.full(nsamples, -1, dtype=int)
+            for i, ind in enumerate(group_indices):
+                labels[ind] = i
+            return labels
+
+        def compute_scores(X, labels, warn=False):
+            ss = score_func(X, labels)
             return ss[0] if isinstance(ss, tuple) and not warn else ss
 
         def permute_indices(group_indices, random_state=None):
@@ -865,7 +871,8 @@ class OWFeatureSelection(widget.OWWidget):
         def compute_scores_with_perm(X, indices, nperm=0, rstate=None,
                                      progress_advance=None):
             warning = None
-            scores = compute_scores(X, indices, warn=True)
+            scores = compute_scores(X, group_labels(indices, X.shape[0]),
+                                    warn=True)
             if isinstance(scores, tuple):
                 scores, warning = scores
 
@@ -876,15 +883,18 @@ class OWFeatureSelection(widget.OWWidget):
                 if rstate is None:
                     rstate = np.random.RandomState(0)
 
-                for i in range(nperm):
-                    p_indices = permute_indices(indices, rstate)
-                    assert all(pind.shape == ind.shape
-                               for pind, ind in zip(indices, p_indices))
-                    pscore = compute_scores(X, p_indices)
-                    assert pscore.shape == scores.shape
-                    null_scores.append(pscore)
+                p_labels = np.array(
+                    [group_labels(permute_indices(indices, rstate), X.shape[0])
+                     for _ in range(nperm)])
+                # score a block of permutations at once
+                for start in range(0, nperm, self.PermutationBlock):
+                    block = p_labels[start:start + self.PermutationBlock]
+                    pscores = compute_scores(X, block)
+                    assert pscores.shape == (len(block),) + scores.shape
+                    null_scores.extend(pscores)
                     if progress_advance is not None:
-                        progress_advance()
+                        for _ in block:
+                            progress_advance()
 
             return scores, null_scores, warning
 
@@ -1328,6 +1338,38 @@ class Test_f_oneway(unittest.TestCase):
         np.testing.assert_almost_equal(P1, P)
 
 
+class Test_scores(unittest.TestCase):
+    def test_missing_values(self):
+        X = np.random.RandomState(0).normal(size=(12, 5))
+        X[0, 1] = X[[3, 9], 3] = np.nan
+        labels = np.array([0, 1, 2] * 4)
+        two = np.where(labels == 2, 1, labels)
+        a, b = X[two == 0], X[two == 1]
+
+        # t-test and ANOVA are undefined for features with missing values
+        T, P = scipy.stats.ttest_ind(a, b)
+        np.testing.assert_almost_equal(score_ttest_t_labels(X, two), T)
+        np.testing.assert_almost_equal(score_ttest_p_labels(X, two), P)
+        self.assertTrue(np.isnan(score_ttest_t_labels(X, two)[[1, 3]]).all())
+        F, P = f_oneway(*[X[labels == g] for g in range(3)])
+        np.testing.assert_almost_equal(score_anova_f_labels(X, labels), F)
+        np.testing.assert_almost_equal(score_anova_p_labels(X, labels), P)
+        # permuted labelings score the same as one at a time
+        perm = np.array([labels, labels[::-1]])
+        np.testing.assert_almost_equal(
+            score_anova_f_labels(X, perm),
+            [score_anova_f_labels(X, row) for row in perm])
+
+        # the fold change and signal to noise ignore missing values
+        fc = np.nanmean(a, axis=0) / np.nanmean(b, axis=0)
+        fc[fc < 0] = np.nan
+        np.testing.assert_almost_equal(score_fold_change(a, b)[0], fc)
+        s2n = ((np.nanmean(a, axis=0) - np.nanmean(b, axis=0)) /
+               (np.nanstd(a, axis=0, ddof=1) + np.nanstd(b, axis=0, ddof=1)))
+        np.testing.assert_almost_equal(
+            score_signal_to_noise_labels(X, two), s2n)
+
+
 def test_main(argv=sys.argv):
     from AnyQt.QtWidgets import QApplication
     app = QApplication(argv)
@@ -290,9 +290,7 @@ def multimap_inverse(multimap):
 
 
 def ppidb_synonym_mapping(ppidb, taxid):
-    keys = ppidb.ids(taxid)
-    mapping = {key: ppidb.synonyms(key) for key in keys}
-    return multimap_inverse(mapping)
+    return multimap_inverse(ppidb.synonyms_many(ppidb.ids(taxid)))
 
 
 def taxonomy_match(query_taxids, target_taxids):
@@ -374,6 +372,7 @@ from collections import defaultdict
 from itertools import count
 
 import numpy
+import scipy.sparse
 
 
 def extract_network(ppidb, query, geneinfo, include_neighborhood=True,
@@ -414,58 +413,31 @@ def extract_network(ppidb, query, geneinfo, include_neighborhood=True,
             # Need to report multiple mappings
             return entries[0][1]
 
-    # Add query nodes.
-    for key, query_name in query.items():
+    # The query nodes are first, followed by their neighbours
+    ids, adjacency = ppidb.network(
+        query=list(query), hops=1 if include_neighborhood else 0,
+        min_score=min_score)
+    synonyms = ppidb.synonyms_many(ids)
+    for key in ids:
         nodeid = nodeids[key]
-        synonyms = ppidb.synonyms(key)
-        entry = gi_info(synonyms)
-        graph.add_node(
-            nodeid,
-            key=key,
-            synonyms=synonyms,
-            query_name=query_name,
-            symbol=entry.symbol if entry is not None else ""
-        )
-
-    if include_neighborhood:
-        # extend the set of nodes in the network with immediate neighborers
-        edges_iter = (edge for key in query for edge in ppidb.edges(key))
-        for id1, id2, score in edges_iter:
-            if min_score is None or score >= min_score:
-                nodeid1 = nodeids[id1]
-                nodeid2 = nodeids[id2]
-                if nodeid1 not in graph:
-                    synonyms1 = ppidb.synonyms(id1)
-                    entry1 = gi_info(synonyms1)
-                    symbol1 = entry1.symbol if entry1 is not None else ""
-                    graph.add_node(
-                        nodeid1, key=id1, synonyms=synonyms1,
-                        symbol=symbol1
-                    )
-
-                if nodeid2 not in graph:
-                    synonyms2 = ppidb.synonyms(id2)
-                    entry2 = gi_info(synonyms2)
-                    symbol2 = entry2.symbol if entry2 is not None else ""
-                    graph.add_node(
-                        nodeid2, key=id2, synonyms=synonyms2,
-                        symbol=symbol2
-                    )
+        entry = gi_info(synonyms[key])
+        attrs = dict(key=key, synonyms=synonyms[key],
+                     symbol=entry.symbol if entry is not None else "")
+        if key in query:
+            attrs["query_name"] = query[key]
+        graph.add_node(nodeid, **attrs)
 
     # add edges between nodes
-    for i, id1 in enumerate(nodeids.keys()):
-        if progress is not None:
-            progress(100.0 * i / len(nodeids))
-
-        for _, id2, score in ppidb.edges(id1):
-            if id2 in nodeids and (min_score is None or score >= min_score):
-                nodeid1 = nodeids[id1]
-                nodeid2 = nodeids[id2]
-                assert nodeid1 in graph and nodeid2 in graph
-                if score is not None and report_weights:
-                    graph.add_edge(nodeid1, nodeid2, weight=score)
-                else:
-                    graph.add_edge(nodeid1, nodeid2)
+    adjacency = scipy.sparse.triu(adjacency).tocoo()
+    for i, (row, col, score) in enumerate(
+            zip(adjacency.row, adjacency.col, adjacency.data.tolist())):
+        if progress is not None and i % 1000 == 0:
+            progress(100.0 * i / adjacency.nnz)
+        if report_weights:
+            graph.add_edge(nodeids[ids[row]], nodeids[ids[col]],
+                           weight=score)
+        else:
+            graph.add_edge(nodeids[ids[row]], nodeids[ids[col]])
 
     nodedomain = Orange.data.Domain(
         [], [],
@@ -634,10 +634,15 @@ class OWSetEnrichment(widget.OWWidget):
             match.umatch = memoize(match.umatch)
             return match
 
+        def umatch_names(matcher, names):
+            names = list(names)
+            matches, _ = matcher.umatch_many(names)
+            return [matcher.targets[m] for m in matches if m >= 0]
+
         def map_unames():
             matcher = namematcher.result()
-            query = list(filter(None, map(matcher.umatch, querynames)))
-            reference = list(filter(None, map(matcher.umatch, ref_set.result())))
+            query = umatch_names(matcher, querynames)
+            reference = umatch_names(matcher, ref_set.result())
             return query, reference
 
         if self._nogenematching():
@@ -678,7 +683,7 @@ class OWSetEnrichment(widget.OWWidget):
             info("Running enrichment")
             p = 0
             for i, gset in enumerate(gscollections):
-                genes = set(filter(None, map(match.umatch, gset.genes)))
+                genes = set(umatch_names(match, gset.genes))
                 enr = set_enrichment(genes, reference, query)
                 results.append((gset, enr))
 
@@ -5,6 +5,7 @@ import gzip
 from server_update import *
 from server_update.tests.test_STRING import StringTest
 from orangecontrib.bio import ppi, taxonomy
+from orangecontrib.bio.utils import parallel
 from urllib.request import build_opener
 
 DOMAIN = 'PPI'
@@ -26,6 +27,7 @@ def get_version():
 version = get_version()
 version_id = 'dbversion:{}'.format(version)
 force = False  # force update
+n_jobs = int(os.environ.get("STRING_UPDATE_JOBS", "4"))  # parallel builds
 
 taxids = ppi.STRING.common_taxids()
 desc = "STRING Protein interactions for {name} (Creative Commons Attribution 3.0 License)"
@@ -37,52 +39,57 @@ desc = "STRING Protein interactions for {name} (Creative Commons Attribution 3.0
 exclude = ['272634', '5476']
 taxids = [idtax for idtax in taxids if idtax not in exclude]
 
-for taxid in taxids:
-    dbfilename = ppi.STRING.default_db_filename(taxid)
-    basename = os.path.basename(dbfilename)
 
-    TITLE = desc.format(name=taxonomy.name(taxid))
-    TAGS = ["protein interaction", "STRING"]
-    VERSION = ppi.STRING.VERSION
+def string_db_filename(taxid):
+    return ppi.STRING.default_db_filename(taxid)
 
-    if not force and version_id in sf_server.info("PPI", basename)["tags"]:
-        continue
 
-    ppi.STRING.init_db(version, taxid, dbfilename=dbfilename, cache_dir=downloads)
+def string_detailed_db_filename(taxid):
+    return sf_local.localpath(
+        ppi.STRINGDetailed.DOMAIN,
+        ppi.STRINGDetailed.FILENAME_DETAILED.format(taxid=taxid)
+    )
 
-    gzfile = gzip.GzipFile(os.path.join(temp_path, basename), "wb")
-    shutil.copyfileobj(open(dbfilename, "rb"), gzfile)
-    gzfile.close()
 
-    create_info_file(os.path.join(temp_path, basename), title=TITLE, tags=TAGS, version=VERSION,
-                     compression='gz', uncompressed=file_size_bytes(dbfilename), dbversion=version_id)
+def build(args):
+    # Build a single organism's database (in a worker process)
+    cls, filename, taxid = args
+    cls.init_db(version, taxid, dbfilename=filename(taxid), cache_dir=downloads)
+    return taxid
 
 
-desc_detailed = "STRING Protein interactions for {name} (Creative Commons Attribution-Noncommercial-Share Alike 3.0 License)"
+def update(cls, filename, desc):
+    pending = [taxid for taxid in taxids
+               if force or version_id not in
+               sf_server.info("PPI", os.path.basename(filename(taxid)))["tags"]]
 
+    # the databases are independent, build them in parallel
+    parallel.parallel_map(build, [(cls, filename, taxid) for taxid in pending],
+                          n_jobs=n_jobs)
 
-for taxid in taxids:
-    print(taxid)
-    dbfilename = sf_local.localpath(
-        ppi.STRINGDetailed.DOMAIN,
-        ppi.STRINGDetailed.FILENAME_DETAILED.format(taxid=taxid)
-    )
-    basename = os.path.basename(dbfilename)
+    for taxid in pending:
+        dbfilename = filename(taxid)
+        basename = os.path.basename(dbfilename)
 
-    TITLE = desc_detailed.format(name=taxonomy.name(taxid))
-    TAGS = ["protein interaction", "STRING"]
-    VERSION = ppi.STRING.VERSION
+        TITLE = desc.format(name=taxonomy.name(taxid))
+        TAGS = ["protein interaction", "STRING"]
+        VERSION = ppi.STRING.VERSION
 
-    if not force and version_id in sf_server.info("PPI", basename)["tags"]:
-        continue
+        gzfile = gzip.GzipFile(os.path.join(temp_path, basename), "wb")  # gzip the database
+        shutil.copyfileobj(open(dbfilename, "rb"), gzfile)
+        gzfile.close()
+
+        create_info_file(os.path.join(temp_path, basename), title=TITLE, tags=TAGS, version=VERSION,
+                         compression='gz', uncompressed=file_size_bytes(dbfilename), dbversion=version_id)
+
+
+update(ppi.STRING, string_db_filename, desc)
+
+
+desc_detailed = "STRING Protein interactions for {name} (Creative Commons Attribution-Noncommercial-Share Alike 3.0 License)"
 
-    ppi.STRINGDetailed.init_db(version, taxid, dbfilename=dbfilename, cache_dir=downloads)
-    gzfile = gzip.GzipFile(os.path.join(temp_path, basename), "wb")  # gzip the database
-    shutil.copyfileobj(open(dbfilename, "rb"), gzfile)
-    gzfile.close()
 
-    create_info_file(os.path.join(temp_path, basename), title=TITLE, tags=TAGS, version=VERSION,
-                     compression='gz', uncompressed=file_size_bytes(dbfilename), dbversion=version_id)
+update(ppi.STRINGDetailed, string_detailed_db_filename, desc_detailed)
 
 
 helper = SyncHelper(DOMAIN, StringTest)